@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import glob
+import json
+import time
+import shlex
+import argparse
+import threading
+import subprocess
+from functools import partial
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'util'))
+from scheduler import Stage, Scheduler
+import settings
+import metrics
+import plan
+
+'''
+Batch of projects: the runs of amplicon_pipeline.py of a manifest, at the
+same time within one CPU and memory budget.
+
+python3 amplicon_batch.py -m projects.txt -o batch -t 32 -M 64
+
+The manifest has one project per line: its configuration file (or the folder
+that has its config.txt), then key=value changes of its parameters (as in
+--set) and memory=<GB>, the memory the project needs. Relative paths are from
+the folder of the manifest; empty lines and lines that start with # are
+skipped:
+
+  projects/lake_2024/config.txt
+  projects/soil_07    threads=8 memory=4
+  projects/soil_08    threads=8 sintax_cutoff=0.9
+
+Every configuration is read once (settings.py). A project takes its threads
+from the CPU budget (-t) and its memory from the memory budget (-M, when it
+is given): the one of the manifest, or the peak of its last run
+(metrics_*.json of its output_path), or --project_memory. The projects start
+in the order of the manifest as soon as they fit (scheduler.py).
+
+The projects that use the same database, the same programs and the same
+store of databases (database_cache, --database_cache for the ones without
+one) share them: the first one checks the programs (which caches their
+versions, tools.py) and builds the artifacts of the store once
+(amplicon_pipeline.py --prepare), and the others start after it. Every
+project runs in its own process, with its output in <output>/<project>.out,
+so a project that fails doesn't stop the others; the results are written to
+<output>/batch.json and the exit status is 1 if a project failed.
+'''
+
+PIPELINE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'amplicon_pipeline.py')
+CONFIG_NAME = 'config.txt'
+GB = 1024 * 1024 * 1024
+
+class Project:
+
+    def __init__(self, name, config_file, changes, memory = None):
+        self.name = name
+        self.config_file = config_file
+        self.changes = changes
+        self.memory = memory
+        self.settings = None
+        self.result = {'name': name, 'config': config_file, 'status': 'pending'}
+
+    def get_group(self):
+        # Projects with the same group share the checks of the programs and the database of the store
+        values = self.settings
+        database_fasta = os.path.join(values.get('database_path'), values.get('database_fasta'))
+        database_cache = values.get('database_cache')
+        return (values.get_path('bin_path'), values.get('platform_type').lower(), values.get('approach_type').lower(),
+                os.path.abspath(database_cache) if database_cache and database_cache.lower() != 'no' else None,
+                os.path.abspath(database_fasta), values.get('database_type').lower(), values.get('database_bin'),
+                values.get('sintax_program').lower())
+
+def read_manifest(file):
+    projects = []
+    names = set()
+    path = os.path.dirname(os.path.abspath(file))
+    with open(file, 'r', encoding = 'utf-8') as fr:
+        for number, line in enumerate(fr, 1):
+            fields = shlex.split(line, comments = True)
+            if not fields:
+                continue
+
+            # Name of the project: its folder (the one of its configuration), unique in the batch
+            config_file = os.path.normpath(os.path.join(path, fields[0]))
+            if os.path.isfile(config_file):
+                name = os.path.basename(os.path.dirname(config_file))
+            else:
+                name = os.path.basename(config_file)
+                config_file = os.path.join(config_file, CONFIG_NAME)
+
+            try:
+                changes = settings.parse_changes(fields[1:])
+                memory = changes.pop('memory', None)
+                memory = float(memory) * GB if memory is not None else None
+            except ValueError as e:
+                raise ValueError("Line %s of '%s': %s" % (number, file, e))
+
+            base_name = name
+            n = 2
+            while name in names:
+                name = '%s_%s' % (base_name, n)
+                n += 1
+            names.add(name)
+
+            projects.append(Project(name, config_file, changes, memory))
+    fr.close()
+
+    return projects
+
+def get_last_memory(output_path):
+    # Peak memory of the last run of a project (the largest program of its stages), None without one
+    files = sorted(glob.glob(os.path.join(output_path, 'metrics_*.json')))
+    if not files:
+        return None
+    rows, _ = plan.read_rows(files[-1:])
+    values = [row['max_rss_mb'] for row in rows if row.get('max_rss_mb')]
+    return max(values) * metrics.MB if values else None
+
+class Batch:
+
+    def __init__(self, output_path, resume = False):
+        self.output_path = output_path
+        self.resume = resume
+        self.lock = threading.Lock()
+        self.start = time.time()
+
+    def show(self, message):
+        with self.lock:
+            print('%s %s' % (time.strftime('%Y-%m-%d %H:%M:%S'), message))
+            sys.stdout.flush()
+
+    def run_pipeline(self, project, threads, options, out_file):
+        command = [sys.executable, PIPELINE, '-c', project.config_file] + options
+        for key, value in sorted(dict(project.changes, threads = threads).items()):
+            command += ['--set', '%s=%s' % (key, value)]
+
+        start = time.time()
+        with open(out_file, 'wb') as fw:
+            p = subprocess.Popen(command, stdout = fw, stderr = subprocess.STDOUT, stdin = subprocess.DEVNULL)
+            rusage = metrics.wait_process(p)
+        fw.close()
+
+        return p.returncode, time.time() - start, metrics.get_usage_row(rusage).get('max_rss_mb')
+
+    def prepare(self, project, threads):
+        out_file = os.path.join(self.output_path, '%s.prepare.out' % project.name)
+        self.show("Preparing programs and database: %s" % project.name)
+        returncode, seconds, _ = self.run_pipeline(project, threads, ['--prepare'], out_file)
+        # The projects of the group run anyway (each one prepares what is missing)
+        project.result['prepare'] = {'status': 'ok' if returncode == 0 else 'failed', 'wall_seconds': seconds, 'output': out_file}
+        if returncode != 0:
+            self.show("[WARNING] Preparation failed (see %s), the projects of its group prepare their own" % out_file)
+
+    def run(self, project, threads):
+        out_file = os.path.join(self.output_path, '%s.out' % project.name)
+        self.show("Started: %s (%s threads)" % (project.name, threads))
+        project.result['status'] = 'running'
+        returncode, seconds, max_rss_mb = self.run_pipeline(project, threads, ['--resume'] if self.resume else [], out_file)
+
+        project.result.update({'status': 'ok' if returncode == 0 else 'failed',
+                               'exit_code': returncode,
+                               'threads': threads,
+                               'wall_seconds': seconds,
+                               'max_rss_mb': max_rss_mb,
+                               'output': out_file,
+                               'output_path': project.settings.get_path('output_path')})
+        self.show("%s: %s (%s, max RSS %.0f MB)%s" % ('Finished' if returncode == 0 else 'Failed', project.name, plan.format_seconds(seconds), max_rss_mb or 0,
+                                                      '' if returncode == 0 else ', see %s' % out_file))
+
+    def run_stage(self, stage):
+        # A project never stops the batch: its failure is in its result
+        action = stage.actions[0]
+        project = action.args[0]
+        try:
+            action(stage.threads)
+        except Exception as e:
+            project.result.update({'status': 'failed', 'error': str(e)})
+            self.show("Failed: %s (%s)" % (project.name, e))
+
+def main(args):
+    parser = argparse.ArgumentParser(description = "Runs the projects of a manifest at the same time, sharing the programs and the databases", epilog = "Thank you!")
+    parser.add_argument("-m", "--manifest", metavar = "FILE", required = True, help = "Projects: a configuration file (or its folder) per line, with key=value changes and memory=<GB>")
+    parser.add_argument("-o", "--output", metavar = "PATH", default = "batch", help = "Folder of the outputs of the projects and batch.json (default: batch)")
+    parser.add_argument("-t", "--threads", type = int, default = os.cpu_count() or 1, help = "Threads of all the projects together (default: all the CPUs)")
+    parser.add_argument("-M", "--memory", type = float, metavar = "GB", help = "Memory of all the projects together (default: no limit)")
+    parser.add_argument("--project_memory", type = float, default = 1.0, metavar = "GB", help = "Memory of a project without memory=<GB> or an earlier run (default: 1)")
+    parser.add_argument("--database_cache", metavar = "PATH", help = "Store of databases of the projects without parameter database_cache")
+    parser.add_argument("--resume", action = "store_true", help = "Resume the projects (amplicon_pipeline.py --resume)")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.manifest):
+        print("[WARNING] File '%s' doesn't exist" % args.manifest)
+        sys.exit(1)
+    try:
+        projects = read_manifest(args.manifest)
+    except ValueError as e:
+        print("[WARNING] %s" % e)
+        sys.exit(1)
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+
+    batch = Batch(os.path.abspath(args.output), resume = args.resume)
+    graph = Scheduler(args.threads, runner = batch.run_stage, memory_budget = args.memory * GB if args.memory else None)
+
+    groups = {}
+    outputs = {}
+    for priority, project in enumerate(projects):
+        if not os.path.isfile(project.config_file):
+            project.result.update({'status': 'failed', 'error': "File '%s' doesn't exist" % project.config_file})
+            continue
+
+        project.settings = settings.Settings(project.config_file, changes = project.changes)
+        if args.database_cache and project.settings.get('database_cache').lower() in ['', 'no']:
+            project.changes['database_cache'] = os.path.abspath(args.database_cache)
+            project.settings.set('database_cache', project.changes['database_cache'])
+
+        try:
+            threads = project.settings.get_int('threads', args.threads)
+        except ValueError as e:
+            project.result.update({'status': 'failed', 'error': str(e)})
+            continue
+
+        output_path = project.settings.get_path('output_path')
+        if output_path in outputs:
+            project.result.update({'status': 'failed', 'error': "Parameter output_path '%s' is the one of '%s'" % (output_path, outputs[output_path])})
+            continue
+        if output_path:
+            outputs[output_path] = project.name
+
+        if project.memory is None:
+            project.memory = (output_path and get_last_memory(output_path)) or args.project_memory * GB
+
+        # The first project of a group prepares what the group shares
+        group = project.get_group()
+        inputs = []
+        if group not in groups:
+            groups[group] = 'prepare:%s' % project.name
+            graph.add(Stage(name = groups[group], actions = [partial(batch.prepare, project)], outputs = [groups[group]],
+                            threads = threads, priority = 1))
+        inputs.append(groups[group])
+
+        graph.add(Stage(name = project.name, actions = [partial(batch.run, project)], inputs = inputs,
+                        threads = threads, memory = project.memory, priority = -priority))
+
+    batch.show("Projects: %s | groups that share programs and database: %s | CPU budget: %s threads | memory budget: %s" % (len(projects), len(groups), graph.cpu_budget,
+                                                                                                                              '%.1f GB' % args.memory if args.memory else 'no limit'))
+    for project in projects:
+        if project.result['status'] == 'failed':
+            batch.show("Failed: %s (%s)" % (project.name, project.result['error']))
+
+    graph.run()
+
+    results = [project.result for project in projects]
+    report = {'manifest': os.path.abspath(args.manifest),
+              'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+              'wall_seconds': time.time() - batch.start,
+              'projects': results}
+    with open(os.path.join(batch.output_path, 'batch.json'), 'w', encoding = 'utf-8') as fw:
+        json.dump(report, fw, indent = 1)
+    fw.close()
+
+    print("")
+    print("%-30s %-8s %8s %10s %14s" % ('Project', 'Status', 'Threads', 'Wall', 'Max RSS (MB)'))
+    for result in results:
+        print("%-30s %-8s %8s %10s %14.0f" % (result['name'], result['status'], result.get('threads', '-'),
+                                               plan.format_seconds(result['wall_seconds']) if 'wall_seconds' in result else '-', result.get('max_rss_mb') or 0))
+    n_failed = len([result for result in results if result['status'] != 'ok'])
+    print("\nProjects: %s | failed: %s | elapsed: %s | results: %s" % (len(results), n_failed, plan.format_seconds(time.time() - batch.start), os.path.join(batch.output_path, 'batch.json')))
+
+    if n_failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -4,19 +4,43 @@ import os
 import re
 import sys
 import time
-import random
-import zipfile
+import shutil
+import importlib.util
 import argparse
 import traceback
-import subprocess
-import configparser
-from Bio import SeqIO
+import threading
+import atexit
+from functools import partial
+from collections import deque
 from colorama import init
 init()
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), 'util'))
+from scheduler import Stage, Scheduler
+from checkpoint import CheckpointStore
+from batch_queue import BatchQueue
+import fastx
+import seqindex
+import pool
+import shards
+import denoise
+import metrics
+import logger
+import plan
+import progress
+import tools
+import settings
+import dbstore
+import subsample
+from map import map_sequences
+
 def menu(args):
     parser = argparse.ArgumentParser(description = opipe.PIPELINE, epilog = "Thank you!")
     parser.add_argument("-c", "--config_file", metavar = "FILE", required = True, help = "Configuration file")
+    parser.add_argument("--resume", action = "store_true", help = "Skip the stages whose inputs, parameters and program version didn't change since the last run")
+    parser.add_argument("--set", action = "append", default = [], metavar = "KEY=VALUE", help = "Value of a parameter instead of the one of the configuration file (can be repeated, e.g. --set threads=8)")
+    parser.add_argument("--prepare", action = "store_true", help = "Only check the parameters and programs and prepare the database of the store (database_cache), without running the stages")
+    parser.add_argument("--plan", nargs = "*", metavar = "METRICS", help = "Show the stages with their commands, disk usage and runtime estimates without running them; the estimates are calibrated with the metrics of earlier runs (files or folders, default: those of output_path)")
     parser.add_argument("--version", action = "version", version = "%s %s" % ('%(prog)s', opipe.VERSION))
     args = parser.parse_args()
 
@@ -28,11 +52,19 @@ def menu(args):
         _file = os.path.join(_path, os.path.basename(args.config_file))
         opipe.SETTINGS_FILE = _file
         opipe.SETTINGS_FILE_NAME = os.path.basename(_file)
+        opipe.RESUME = args.resume
+        opipe.PLAN = args.plan
+        opipe.PREPARE = args.prepare
+        try:
+            opipe.SETTINGS_CHANGES = settings.parse_changes(args.set)
+        except ValueError as e:
+            opipe.show_print("[WARNING] Option --set: %s" % e, showdate = False, font = opipe.YELLOW)
+            exit(1)
 
         opipe.read_keys()
     else:
         opipe.show_print("File '%s' doesn't exist" % args.config_file, showdate = False, font = opipe.YELLOW)
-        exit()
+        exit(1)
 
 class Pipeline:
 
@@ -41,13 +73,61 @@ class Pipeline:
         self.ROOT = os.path.dirname(os.path.realpath(__file__))
         self.PIPELINE = "Pipeline for analysis of 16s rRNA amplicons, using ASVs (Amplicon Sequence Variant) or OTUs (Operational Taxonomic Unit)"
 
-        # Config file
+        # Config file, read once (settings.py), and the values of --set
         self.SETTINGS_FILE = None
         self.SETTINGS_FILE_NAME = None
+        self.SETTINGS = None
+        self.SETTINGS_CHANGES = {}
+
+        # Only prepare the database of the store (--prepare, used by amplicon_batch.py)
+        self.PREPARE = False
 
         # Log
         self.LOG_NAME = "log_%s_%s.log" % (os.path.splitext(os.path.basename(__file__))[0], time.strftime('%Y%m%d'))
         self.LOG_FILE = None
+        self.LOG_LOCK = threading.Lock()
+        self.LOGGER = None
+
+        # Output of the programs: in the main log, in a file per stage and program, or only the last lines when it fails
+        self.TOOL_OUTPUT_LOG = 'log'
+        self.TOOL_OUTPUT_FILE = 'file'
+        self.TOOL_OUTPUT_NONE = 'none'
+        self.TOOL_OUTPUT_PATH = 'logs'
+        self.TOOL_OUTPUT_TAIL = 20
+        self.TOOL_OUTPUT_BATCH = 1000
+        self.TOOL_OUTPUT = {}
+
+        # Per-thread state (threads budget and log buffer of the sample being processed)
+        self.LOCAL = threading.local()
+
+        # Checkpoints
+        self.RESUME = False
+        self.CHECKPOINT_NAME = 'checkpoints.json'
+        self.CHECKPOINTS = None
+
+        # Plan (--plan): the stages are shown with their commands and estimates instead of running them
+        self.PLAN = None
+        self.PLAN_FASTQC = []
+        self.PLAN_DATABASE = {}
+
+        # Resources used by every stage and program of the run
+        self.METRICS_NAME = "metrics_%s" % time.strftime('%Y%m%d_%H%M%S')
+        self.METRICS = None
+
+        # Progress of the running stages, written to output_path/status.json
+        self.STATUS_NAME = "status.json"
+        self.PROGRESS = None
+
+        # Database files used by the stages (prepare_database)
+        self.DATABASE_FILES = None
+        # File of every artifact of the database store, in its folder
+        self.DATABASE_ARTIFACT_FILES = {'sintax_fasta': 'database.fasta',
+                                        'usearch_udb': 'database.udb',
+                                        'sintax_udb': 'database.udb',
+                                        'blast': 'database'}
+
+        # Samples: <part1>_R1_<part2>.fastq or <part1>_R1.fastq, optionally compressed (.gz or .zst)
+        self.SAMPLE_PATTERN = '[_][Rr][1][_]?(\w|[-])*\.([Ff][Aa][Ss][Tt][Qq]|[Ff][Qq])(\.[Gg][Zz]|\.[Zz][Ss][Tt])?$'
 
         # Utilities folder
         self.BIN_PATH = 'bin'
@@ -58,11 +138,34 @@ class Pipeline:
         self.PROGRAM_USEARCH = None
         self.PROGRAM_CUTADAPT = None
         self.PROGRAM_BLASTN = None
+        self.PROGRAM_MAKEBLASTDB = None
         self.PROGRAM_FASTQC = 'fastqc'
         self.PROGRAM_RC = 'reverse_complement.py'
         self.PROGRAM_MAP = 'map.py'
         self.PROGRAM_ABUNDANCE_TABLE_ASV = 'get_abundances_table_asv.py'
         self.PROGRAM_ABUNDANCE_TABLE_OTU = 'get_abundances_table_otu.py'
+        self.PROGRAM_VERSIONS = {}
+
+        # Formats of the abundance tables: extension and Python module needed
+        self.ABUNDANCE_FORMAT_TSV = 'tsv'
+        self.ABUNDANCE_FORMATS = {'tsv': ('.csv', None),
+                                  'biom': ('.biom', 'h5py'),
+                                  'parquet': ('.parquet', 'pyarrow'),
+                                  'feather': ('.feather', 'pyarrow')}
+
+        # Quality checks (FastQC) run in batches in the background
+        self.QC_QUEUE = None
+        self.FASTQC_THREADS = 1
+        self.FASTQC_BATCH_SIZE = 8
+        self.FASTQC_MAX_WAIT = 30
+
+        # Sharded BLAST: threads of every blastn process
+        self.BLAST_THREADS_PER_SHARD = 2
+
+        # Sharded SINTAX: threads of every worker, memory of a worker per byte of the FASTA database (each one loads it)
+        self.SINTAX_THREADS_PER_SHARD = 2
+        self.SINTAX_MEMORY_FACTOR = 3
+        self.USEARCH_MAX_MEMORY = 4 * 1024 * 1024 * 1024
 
         # Key parameters
         self.KEY_APPROACH_TYPE = None
@@ -74,17 +177,33 @@ class Pipeline:
         self.KEY_DATABASE_TYPE = None
         self.KEY_DATABASE_FASTA = None
         self.KEY_DATABASE_BIN = None
+        self.KEY_DATABASE_CACHE = None
+        self.KEY_DATABASE_CACHE_SIZE = None
         self.KEY_THREADS = None
+        self.KEY_PARALLEL_SAMPLES = None
+        self.KEY_SUBSAMPLE_SEED = None
+        self.KEY_VIRTUAL_POOL = None
+        self.KEY_KEEP_INTERMEDIATES = None
+        self.KEY_COMPRESS_INTERMEDIATES = None
+        self.KEY_ABUNDANCE_FORMATS = None
         self.KEY_PYTHON_VERSION = None
         self.KEY_PLATFORM_TYPE = None
+        self.KEY_BIN_PATH = None
+        self.KEY_LOG_FORMAT = None
+        self.KEY_PROGRESS_INTERVAL = None
+        self.KEY_TOOL_OUTPUT = None
 
         self.KEY_FILTER_MAXEE = None
         self.KEY_FILTER_MINLEN = None
         self.KEY_FILTER_MAXLEN = None
         self.KEY_CLUSTER_ID = None
         self.KEY_BLAST_ID = None
+        self.KEY_BLAST_MAX_TARGET_SEQS = None
+        self.KEY_BLAST_MAX_HSPS = None
         self.KEY_HIGH_IDENTITY_ASV = None
         self.KEY_SINTAX_CUTOFF = None
+        self.KEY_SINTAX_PROGRAM = None
+        self.KEY_DENOISE_PROGRAM = None
 
         # Sections
         self.SECTION_PARAMETERS = "PARAMETERS"
@@ -100,17 +219,33 @@ class Pipeline:
         self.PARAMETER_DATABASE_TYPE = "DATABASE_TYPE"
         self.PARAMETER_DATABASE_FASTA = "DATABASE_FASTA"
         self.PARAMETER_DATABASE_BIN = "DATABASE_BIN"
+        self.PARAMETER_DATABASE_CACHE = "DATABASE_CACHE"
+        self.PARAMETER_DATABASE_CACHE_SIZE = "DATABASE_CACHE_SIZE"
         self.PARAMETER_THREADS = "THREADS"
+        self.PARAMETER_PARALLEL_SAMPLES = "PARALLEL_SAMPLES"
+        self.PARAMETER_SUBSAMPLE_SEED = "SUBSAMPLE_SEED"
+        self.PARAMETER_VIRTUAL_POOL = "VIRTUAL_POOL"
+        self.PARAMETER_KEEP_INTERMEDIATES = "KEEP_INTERMEDIATES"
+        self.PARAMETER_COMPRESS_INTERMEDIATES = "COMPRESS_INTERMEDIATES"
+        self.PARAMETER_ABUNDANCE_FORMATS = "ABUNDANCE_FORMATS"
         self.PARAMETER_PYTHON_VERSION = "PYTHON_VERSION"
         self.PARAMETER_PLATFORM_TYPE = "PLATFORM_TYPE"
+        self.PARAMETER_BIN_PATH = "BIN_PATH"
+        self.PARAMETER_LOG_FORMAT = "LOG_FORMAT"
+        self.PARAMETER_PROGRESS_INTERVAL = "PROGRESS_INTERVAL"
+        self.PARAMETER_TOOL_OUTPUT = "TOOL_OUTPUT"
 
         self.PARAMETER_FILTER_MAXEE = "FILTER_MAXEE"
         self.PARAMETER_FILTER_MINLEN = "FILTER_MINLEN"
         self.PARAMETER_FILTER_MAXLEN = "FILTER_MAXLEN"
         self.PARAMETER_CLUSTER_ID = "CLUSTER_IDENTITY"
         self.PARAMETER_BLAST_ID = "BLAST_IDENTITY"
+        self.PARAMETER_BLAST_MAX_TARGET_SEQS = "BLAST_MAX_TARGET_SEQS"
+        self.PARAMETER_BLAST_MAX_HSPS = "BLAST_MAX_HSPS"
         self.PARAMETER_HIGH_IDENTITY_ASV = "HIGH_IDENTITY_ASV"
         self.PARAMETER_SINTAX_CUTOFF = "SINTAX_CUTOFF"
+        self.PARAMETER_SINTAX_PROGRAM = "SINTAX_PROGRAM"
+        self.PARAMETER_DENOISE_PROGRAM = "DENOISE_PROGRAM"
 
         self.APPROACH_TYPE_ASV = "asv"
         self.APPROACH_TYPE_OTU = "otu"
@@ -130,17 +265,12 @@ class Pipeline:
         self.END = '\033[0m'
 
     def read_settings(self, file, section, key):
-        config = configparser.ConfigParser()
-        config.read(file)
-        try:
-            value = config.get(section, key)
-        except Exception as e:
-            value = ""
-        return value
+        if self.SETTINGS is None or self.SETTINGS.file != file or self.SETTINGS.section != section:
+            self.SETTINGS = settings.Settings(file, section, self.SETTINGS_CHANGES)
+        return self.SETTINGS.get(key)
 
     def show_print(self, message, logs = None, showdate = True, font = None):
         msg_print = message
-        msg_write = message
 
         if font is not None:
             msg_print = "%s%s%s" % (font, msg_print, self.END)
@@ -148,15 +278,45 @@ class Pipeline:
         if showdate is True:
             _time = time.strftime('%Y-%m-%d %H:%M:%S')
             msg_print = "%s %s" % (_time, msg_print)
-            msg_write = "%s %s" % (_time, message)
 
         print(msg_print)
         if logs is not None:
+            buffer = getattr(self.LOCAL, 'log_buffer', None)
+            record = (_time if showdate is True else None, message, getattr(self.LOCAL, 'stage', None))
             for log in logs:
                 if log is not None:
-                    with open(log, 'a', encoding = 'utf-8') as f:
-                        f.write("%s\n" % msg_write)
-                        f.close()
+                    if buffer is not None and log == self.LOG_FILE:
+                        # Inside a stage: its lines are buffered and written together when it finishes
+                        buffer.append(record)
+                        continue
+                    self.write_log(log, [record])
+
+    def write_log(self, log, records):
+        # The main log goes through the background writer
+        if not records:
+            return
+        if self.LOGGER is not None and log == self.LOG_FILE:
+            self.LOGGER.log(records)
+            return
+
+        with self.LOG_LOCK:
+            with open(log, 'a', encoding = 'utf-8') as f:
+                f.write("".join([logger.format_record(record) for record in records]))
+                f.close()
+
+    def flush_log_buffer(self):
+        buffer = getattr(self.LOCAL, 'log_buffer', None)
+        self.LOCAL.log_buffer = None
+        if buffer and self.LOG_FILE is not None:
+            self.write_log(self.LOG_FILE, buffer)
+
+    def get_tool_output(self, program):
+        name = os.path.splitext(program)[0].lower()
+        return self.TOOL_OUTPUT.get(name, self.TOOL_OUTPUT.get('*', self.TOOL_OUTPUT_LOG))
+
+    def get_tool_log(self, program):
+        stage = getattr(self.LOCAL, 'stage', None) or 'pipeline'
+        return os.path.join(self.KEY_OUTPUT_PATH, self.TOOL_OUTPUT_PATH, '%s.%s.log' % (stage, os.path.splitext(program)[0]))
 
     def start_time(self):
         return time.time()
@@ -185,14 +345,42 @@ class Pipeline:
         return output
 
     def count_sequences(self, file):
-        n = len([1 for line in open(file, 'r')])
+        return seqindex.count_records(file)
+
+    def index_sequences(self, file):
+        # Build the sidecar index while the file is still in the page cache
+        seqindex.get_index(file)
+
+    def get_threads(self):
+        # Threads of the current sample when samples run in parallel, otherwise all of them
+        threads = getattr(self.LOCAL, 'threads', None)
+        if threads is None:
+            threads = self.KEY_THREADS
+        return threads
+
+    def get_samples(self):
+        samples = []
+        for subdir, dirs, files in os.walk(self.KEY_SAMPLES_PATH):
+            for file in files:
+                if re.search(self.SAMPLE_PATTERN, file):
+                    fastq_r1_file = os.path.join(subdir, file)
+                    fastq_r2_file = file.replace('_R1', '_R2')
+                    fastq_r2_file = os.path.join(subdir, fastq_r2_file)
+                    prefix = file.split('_R1')[0]
+
+                    size = os.path.getsize(fastq_r1_file)
+                    if os.path.isfile(fastq_r2_file):
+                        size += os.path.getsize(fastq_r2_file)
 
-        if file.endswith('.fa'):
-            n = int(n/2)
-        elif file.endswith('.fq'):
-            n = int(n/4)
+                    samples.append({'prefix': prefix,
+                                    'r1': fastq_r1_file,
+                                    'r2': fastq_r2_file,
+                                    'size': size})
 
-        return n
+        # Largest samples first, so that a big sample does not finish last on its own
+        samples.sort(key = lambda sample: sample['size'], reverse = True)
+
+        return samples
 
     def read_keys(self):
         self.show_print("[Checking parameters and programs to use]", showdate = False, font = self.ICYAN)
@@ -205,137 +393,287 @@ class Pipeline:
         self.KEY_DATABASE_TYPE = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_DATABASE_TYPE)
         self.KEY_DATABASE_FASTA = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_DATABASE_FASTA)
         self.KEY_DATABASE_BIN = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_DATABASE_BIN)
+        self.KEY_DATABASE_CACHE = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_DATABASE_CACHE)
+        self.KEY_DATABASE_CACHE_SIZE = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_DATABASE_CACHE_SIZE)
         self.KEY_PRIMERS_FILE = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_PRIMERS_FILE)
         self.KEY_THREADS = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_THREADS)
+        self.KEY_PARALLEL_SAMPLES = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_PARALLEL_SAMPLES)
+        self.KEY_SUBSAMPLE_SEED = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_SUBSAMPLE_SEED)
+        self.KEY_VIRTUAL_POOL = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_VIRTUAL_POOL)
+        self.KEY_KEEP_INTERMEDIATES = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_KEEP_INTERMEDIATES)
+        self.KEY_COMPRESS_INTERMEDIATES = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_COMPRESS_INTERMEDIATES)
+        self.KEY_ABUNDANCE_FORMATS = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_ABUNDANCE_FORMATS)
         self.KEY_PYTHON_VERSION = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_PYTHON_VERSION)
         self.KEY_PLATFORM_TYPE = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_PLATFORM_TYPE)
+        self.KEY_BIN_PATH = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_BIN_PATH)
+        self.KEY_LOG_FORMAT = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_LOG_FORMAT)
+        self.KEY_PROGRESS_INTERVAL = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_PROGRESS_INTERVAL)
+        self.KEY_TOOL_OUTPUT = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_TOOL_OUTPUT)
 
         self.KEY_FILTER_MAXEE = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_FILTER_MAXEE)
         self.KEY_FILTER_MINLEN = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_FILTER_MINLEN)
         self.KEY_FILTER_MAXLEN = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_FILTER_MAXLEN)
         self.KEY_CLUSTER_ID = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_CLUSTER_ID)
         self.KEY_BLAST_ID = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_BLAST_ID)
+        self.KEY_BLAST_MAX_TARGET_SEQS = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_BLAST_MAX_TARGET_SEQS)
+        self.KEY_BLAST_MAX_HSPS = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_BLAST_MAX_HSPS)
         self.KEY_HIGH_IDENTITY_ASV = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_HIGH_IDENTITY_ASV)
         self.KEY_SINTAX_CUTOFF = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_SINTAX_CUTOFF)
+        self.KEY_SINTAX_PROGRAM = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_SINTAX_PROGRAM)
+        self.KEY_DENOISE_PROGRAM = self.read_settings(self.SETTINGS_FILE, self.SECTION_PARAMETERS, self.PARAMETER_DENOISE_PROGRAM)
 
         # Approach type
         if not self.KEY_APPROACH_TYPE:
             self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_APPROACH_TYPE.lower()), showdate = False, font = self.YELLOW)
-            exit()
+            exit(1)
         else:
             self.KEY_APPROACH_TYPE = self.KEY_APPROACH_TYPE.lower()
             if not self.KEY_APPROACH_TYPE in [self.APPROACH_TYPE_ASV, self.APPROACH_TYPE_OTU]:
                 self.show_print("[WARNING] You must specify some value for the '%s' parameter: %s or %s" % (self.PARAMETER_APPROACH_TYPE.lower(), self.APPROACH_TYPE_ASV.upper(), self.APPROACH_TYPE_OTU.upper()), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
+
+        # Format of the log (optional, default: text)
+        if not self.KEY_LOG_FORMAT:
+            self.KEY_LOG_FORMAT = logger.FORMAT_TEXT
+        else:
+            self.KEY_LOG_FORMAT = self.KEY_LOG_FORMAT.lower()
+            if not self.KEY_LOG_FORMAT in logger.FORMATS:
+                self.show_print("[WARNING] Value '%s' of parameter '%s' must be %s or %s" % (self.KEY_LOG_FORMAT, self.PARAMETER_LOG_FORMAT.lower(), logger.FORMAT_TEXT, logger.FORMAT_JSON), showdate = False, font = self.YELLOW)
+                exit(1)
+            if self.KEY_LOG_FORMAT == logger.FORMAT_JSON:
+                self.LOG_NAME = '%s.jsonl' % os.path.splitext(self.LOG_NAME)[0]
+
+        # Output of the programs, <program>:<log|file|none> separated by commas, * for all (optional, default: log)
+        self.TOOL_OUTPUT = {}
+        if self.KEY_TOOL_OUTPUT:
+            for item in self.KEY_TOOL_OUTPUT.split(','):
+                if not item.strip():
+                    continue
+                name, _, level = item.partition(':')
+                name = name.strip().lower()
+                level = level.strip().lower()
+                if not name or not level in [self.TOOL_OUTPUT_LOG, self.TOOL_OUTPUT_FILE, self.TOOL_OUTPUT_NONE]:
+                    self.show_print("[WARNING] Value '%s' of parameter '%s' must be <program>:%s, <program>:%s or <program>:%s" % (item.strip(), self.PARAMETER_TOOL_OUTPUT.lower(), self.TOOL_OUTPUT_LOG, self.TOOL_OUTPUT_FILE, self.TOOL_OUTPUT_NONE), showdate = False, font = self.YELLOW)
+                    exit(1)
+                self.TOOL_OUTPUT[name] = level
+
+        # Seconds between the progress lines of the log, 0 for none (optional, default: 60)
+        if not self.KEY_PROGRESS_INTERVAL:
+            self.KEY_PROGRESS_INTERVAL = 60
+        else:
+            if not self.KEY_PROGRESS_INTERVAL.isdigit():
+                self.show_print("[WARNING] Value '%s' of parameter '%s' is not a non-negative integer" % (self.KEY_PROGRESS_INTERVAL, self.PARAMETER_PROGRESS_INTERVAL.lower()), showdate = False, font = self.YELLOW)
+                exit(1)
+            self.KEY_PROGRESS_INTERVAL = int(self.KEY_PROGRESS_INTERVAL)
 
         # Output path
         if not self.KEY_OUTPUT_PATH:
             self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_OUTPUT_PATH.lower()), showdate = False, font = self.YELLOW)
-            exit()
+            exit(1)
         else:
             if not self.create_directory(self.KEY_OUTPUT_PATH):
                 self.show_print("[WARNING] Could not create '%s' directory (parameter '%s')\n" % (self.KEY_OUTPUT_PATH, self.PARAMETER_OUTPUT_PATH.lower()), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
             else:
                 self.create_directory(self.KEY_OUTPUT_PATH)
                 self.LOG_FILE = os.path.join(self.KEY_OUTPUT_PATH, self.LOG_NAME)
+                self.LOGGER = logger.Logger(self.LOG_FILE, self.KEY_LOG_FORMAT)
+                atexit.register(self.LOGGER.close)
+                if self.TOOL_OUTPUT_FILE in self.TOOL_OUTPUT.values():
+                    self.create_directory(os.path.join(self.KEY_OUTPUT_PATH, self.TOOL_OUTPUT_PATH))
+                self.CHECKPOINTS = CheckpointStore(os.path.join(self.KEY_OUTPUT_PATH, self.CHECKPOINT_NAME))
+                if self.PLAN is None and not self.PREPARE:
+                    self.METRICS = metrics.Metrics(os.path.join(self.KEY_OUTPUT_PATH, self.METRICS_NAME))
 
         # Samples path
         if not self.KEY_SAMPLES_PATH:
             self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_SAMPLES_PATH.lower()), showdate = False, font = self.YELLOW)
-            exit()
+            exit(1)
         else:
             if not self.check_path(self.KEY_SAMPLES_PATH):
                 self.show_print("[WARNING] Path '%s' of parameter '%s' doesn't exist" % (self.KEY_SAMPLES_PATH, self.PARAMETER_SAMPLES_PATH.lower()), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
             else:
                 are_there_files = False
                 for subdir, dirs, files in os.walk(self.KEY_SAMPLES_PATH):
                     for file in files:
-                        if re.search('[_][Rr][1][_]?(\w|[-])*\.([Ff][Aa][Ss][Tt][Qq]|[Ff][Qq])$', file):
+                        if re.search(self.SAMPLE_PATTERN, file):
                             are_there_files = True
                             break
                 if not are_there_files:
-                    self.show_print("[WARNING] Path '%s' doesn't contain any FASTQ file with the format <part1>_R1_<part2>.fastq or <part1>_R1.fastq" % (self.KEY_SAMPLES_PATH), showdate = False, font = self.YELLOW)
-                    exit()
+                    self.show_print("[WARNING] Path '%s' doesn't contain any FASTQ file with the format <part1>_R1_<part2>.fastq or <part1>_R1.fastq (also .fastq.gz or .fastq.zst)" % (self.KEY_SAMPLES_PATH), showdate = False, font = self.YELLOW)
+                    exit(1)
 
         # Database path
         if not self.KEY_DATABASE_PATH:
             self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_DATABASE_PATH.lower()), showdate = False, font = self.YELLOW)
-            exit()
+            exit(1)
         else:
             if not self.check_path(self.KEY_DATABASE_PATH):
                 self.show_print("[WARNING] Path '%s' of parameter '%s' doesn't exist" % (self.KEY_DATABASE_PATH, self.PARAMETER_DATABASE_PATH.lower()), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
 
         # Database type
         if not self.KEY_DATABASE_TYPE:
             self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_DATABASE_TYPE.lower()), showdate = False, font = self.YELLOW)
-            exit()
+            exit(1)
         else:
             self.KEY_DATABASE_TYPE = self.KEY_DATABASE_TYPE.lower()
             if not self.KEY_DATABASE_TYPE in [self.DATABASE_TYPE_SILVA, self.DATABASE_TYPE_RDP, self.DATABASE_TYPE_UNITE]:
                 self.show_print("[WARNING] You must specify some value for the '%s' parameter: %s, %s or %s" % (self.PARAMETER_DATABASE_TYPE.lower(), self.DATABASE_TYPE_SILVA, self.DATABASE_TYPE_RDP, self.DATABASE_TYPE_UNITE), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
 
         # Database fasta file
         if not self.KEY_DATABASE_FASTA:
             self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_DATABASE_FASTA.lower()), showdate = False, font = self.YELLOW)
-            exit()
+            exit(1)
         else:
             _file = os.path.join(self.KEY_DATABASE_PATH, self.KEY_DATABASE_FASTA)
             if not os.path.isfile(_file):
                 self.show_print("[WARNING] File '%s' of parameter '%s' doesn't exist" % (_file, self.PARAMETER_DATABASE_FASTA.lower()), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
 
-        # Database binary file
-        if self.KEY_APPROACH_TYPE == self.APPROACH_TYPE_OTU:
+        # Store of prepared databases (optional, default: no)
+        if not self.KEY_DATABASE_CACHE or self.KEY_DATABASE_CACHE.lower() == 'no':
+            self.KEY_DATABASE_CACHE = None
+        else:
+            if not self.check_path(os.path.dirname(os.path.abspath(self.KEY_DATABASE_CACHE))):
+                self.show_print("[WARNING] Path '%s' of parameter '%s' doesn't exist" % (os.path.dirname(os.path.abspath(self.KEY_DATABASE_CACHE)), self.PARAMETER_DATABASE_CACHE.lower()), showdate = False, font = self.YELLOW)
+                exit(1)
+
+        # Maximum size of the store in GB (optional, default: 20)
+        if not self.KEY_DATABASE_CACHE_SIZE:
+            self.KEY_DATABASE_CACHE_SIZE = 20.0
+        else:
+            if (not re.match('^\d+(?:\.\d+)?$', self.KEY_DATABASE_CACHE_SIZE)) or (float(self.KEY_DATABASE_CACHE_SIZE) == 0):
+                self.show_print("[WARNING] Value '%s' of parameter '%s' is not a positive number" % (self.KEY_DATABASE_CACHE_SIZE, self.PARAMETER_DATABASE_CACHE_SIZE.lower()), showdate = False, font = self.YELLOW)
+                exit(1)
+            self.KEY_DATABASE_CACHE_SIZE = float(self.KEY_DATABASE_CACHE_SIZE)
+
+        # Database binary file (built in the store when it isn't specified)
+        if self.KEY_APPROACH_TYPE == self.APPROACH_TYPE_OTU and not (self.KEY_DATABASE_CACHE and not self.KEY_DATABASE_BIN):
             if not self.KEY_DATABASE_BIN:
                 self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_DATABASE_BIN.lower()), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
             else:
                 _file = os.path.join(self.KEY_DATABASE_PATH, self.KEY_DATABASE_BIN)
                 if not os.path.isfile('%s.nhr' % _file):
                     self.show_print("[WARNING] File '%s.*' of parameter '%s' doesn't exist" % (_file, self.PARAMETER_DATABASE_BIN.lower()), showdate = False, font = self.YELLOW)
-                    exit()
+                    exit(1)
 
         # Primers file
         if not self.KEY_PRIMERS_FILE:
             self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_PRIMERS_FILE.lower()), showdate = False, font = self.YELLOW)
-            exit()
+            exit(1)
         else:
             _file = os.path.join(self.KEY_DATABASE_PATH, self.KEY_PRIMERS_FILE)
             if not os.path.isfile(_file):
                 self.show_print("[WARNING] File '%s' of parameter '%s' doesn't exist" % (_file, self.PARAMETER_PRIMERS_FILE.lower()), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
 
         # Threads
         if not self.KEY_THREADS:
             self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_THREADS.lower()), showdate = False, font = self.YELLOW)
-            exit()
+            exit(1)
         else:
             if (not self.KEY_THREADS.isdigit()) or (int(self.KEY_THREADS) == 0):
                 self.show_print("[WARNING] Value '%s' of parameter '%s' is not a positive integer" % (self.KEY_THREADS, self.PARAMETER_THREADS.lower()), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
+
+        # Parallel samples (optional, default: 1)
+        if not self.KEY_PARALLEL_SAMPLES:
+            self.KEY_PARALLEL_SAMPLES = 1
+        else:
+            if (not self.KEY_PARALLEL_SAMPLES.isdigit()) or (int(self.KEY_PARALLEL_SAMPLES) == 0):
+                self.show_print("[WARNING] Value '%s' of parameter '%s' is not a positive integer" % (self.KEY_PARALLEL_SAMPLES, self.PARAMETER_PARALLEL_SAMPLES.lower()), showdate = False, font = self.YELLOW)
+                exit(1)
+            self.KEY_PARALLEL_SAMPLES = int(self.KEY_PARALLEL_SAMPLES)
+
+        # Seed of the subsample used to verify the primers (optional, default: 1)
+        if not self.KEY_SUBSAMPLE_SEED:
+            self.KEY_SUBSAMPLE_SEED = 1
+        else:
+            if not self.KEY_SUBSAMPLE_SEED.isdigit():
+                self.show_print("[WARNING] Value '%s' of parameter '%s' is not a non-negative integer" % (self.KEY_SUBSAMPLE_SEED, self.PARAMETER_SUBSAMPLE_SEED.lower()), showdate = False, font = self.YELLOW)
+                exit(1)
+            self.KEY_SUBSAMPLE_SEED = int(self.KEY_SUBSAMPLE_SEED)
+
+        # Virtual pool (optional, default: no)
+        if not self.KEY_VIRTUAL_POOL:
+            self.KEY_VIRTUAL_POOL = False
+        else:
+            if not self.KEY_VIRTUAL_POOL.lower() in ['yes', 'no']:
+                self.show_print("[WARNING] Value '%s' of parameter '%s' must be yes or no" % (self.KEY_VIRTUAL_POOL, self.PARAMETER_VIRTUAL_POOL.lower()), showdate = False, font = self.YELLOW)
+                exit(1)
+            self.KEY_VIRTUAL_POOL = self.KEY_VIRTUAL_POOL.lower() == 'yes'
+
+        # Keep the files between the primer removal and the quality filtering (optional, default: no)
+        if not self.KEY_KEEP_INTERMEDIATES:
+            self.KEY_KEEP_INTERMEDIATES = False
+        else:
+            if not self.KEY_KEEP_INTERMEDIATES.lower() in ['yes', 'no']:
+                self.show_print("[WARNING] Value '%s' of parameter '%s' must be yes or no" % (self.KEY_KEEP_INTERMEDIATES, self.PARAMETER_KEEP_INTERMEDIATES.lower()), showdate = False, font = self.YELLOW)
+                exit(1)
+            self.KEY_KEEP_INTERMEDIATES = self.KEY_KEEP_INTERMEDIATES.lower() == 'yes'
+
+        # Compression of the intermediate FASTQ files (optional, default: no)
+        if not self.KEY_COMPRESS_INTERMEDIATES or self.KEY_COMPRESS_INTERMEDIATES.lower() == 'no':
+            self.KEY_COMPRESS_INTERMEDIATES = None
+        else:
+            self.KEY_COMPRESS_INTERMEDIATES = self.KEY_COMPRESS_INTERMEDIATES.lower()
+            if not self.KEY_COMPRESS_INTERMEDIATES in [fastx.COMPRESSION_GZIP, fastx.COMPRESSION_ZSTD]:
+                self.show_print("[WARNING] Value '%s' of parameter '%s' must be no, %s or %s" % (self.KEY_COMPRESS_INTERMEDIATES, self.PARAMETER_COMPRESS_INTERMEDIATES.lower(), fastx.COMPRESSION_GZIP, fastx.COMPRESSION_ZSTD), showdate = False, font = self.YELLOW)
+                exit(1)
+
+        # Formats of the abundance tables (optional, default: tsv)
+        if not self.KEY_ABUNDANCE_FORMATS:
+            self.KEY_ABUNDANCE_FORMATS = [self.ABUNDANCE_FORMAT_TSV]
+        else:
+            self.KEY_ABUNDANCE_FORMATS = [fmt.strip().lower() for fmt in self.KEY_ABUNDANCE_FORMATS.split(',') if fmt.strip()]
+            for fmt in self.KEY_ABUNDANCE_FORMATS:
+                if not fmt in self.ABUNDANCE_FORMATS:
+                    self.show_print("[WARNING] Value '%s' of parameter '%s' must be one or more of: %s" % (fmt, self.PARAMETER_ABUNDANCE_FORMATS.lower(), ', '.join(self.ABUNDANCE_FORMATS)), showdate = False, font = self.YELLOW)
+                    exit(1)
+
+                module = self.ABUNDANCE_FORMATS[fmt][1]
+                if module and importlib.util.find_spec(module) is None:
+                    self.show_print("[WARNING] The format '%s' of parameter '%s' needs the Python module '%s' (pip3 install %s)" % (fmt, self.PARAMETER_ABUNDANCE_FORMATS.lower(), module, module), showdate = False, font = self.YELLOW)
+                    exit(1)
 
         # Platform type
         if not self.KEY_PLATFORM_TYPE:
             self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_PLATFORM_TYPE.lower()), showdate = False, font = self.YELLOW)
-            exit()
+            exit(1)
         else:
             self.KEY_PLATFORM_TYPE = self.KEY_PLATFORM_TYPE.lower()
             if not self.KEY_PLATFORM_TYPE in [self.PLATFORM_TYPE_GNULINUX, self.PLATFORM_TYPE_WINDOWS]:
                 self.show_print("[WARNING] You must specify some value for the '%s' parameter: %s (for GNU/Linux) or %s (for Windows)" % (self.PARAMETER_PLATFORM_TYPE.lower(), self.PLATFORM_TYPE_GNULINUX, self.PLATFORM_TYPE_WINDOWS), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
+
+            if self.KEY_VIRTUAL_POOL and self.KEY_PLATFORM_TYPE == self.PLATFORM_TYPE_WINDOWS:
+                # Named pipes are only available in GNU/Linux
+                self.show_print("[WARNING] Parameter '%s' is ignored in Windows, the pooled files are written" % self.PARAMETER_VIRTUAL_POOL.lower(), showdate = False, font = self.YELLOW)
+                self.KEY_VIRTUAL_POOL = False
+
+            if self.KEY_COMPRESS_INTERMEDIATES and self.KEY_PLATFORM_TYPE == self.PLATFORM_TYPE_WINDOWS:
+                self.show_print("[WARNING] Parameter '%s' is ignored in Windows, the intermediate files are not compressed" % self.PARAMETER_COMPRESS_INTERMEDIATES.lower(), showdate = False, font = self.YELLOW)
+                self.KEY_COMPRESS_INTERMEDIATES = None
+
+            if self.KEY_PLATFORM_TYPE == self.PLATFORM_TYPE_WINDOWS:
+                for sample in self.get_samples():
+                    if fastx.get_compression(sample['r1']) == fastx.COMPRESSION_ZSTD:
+                        # vsearch only reads them through a named pipe
+                        self.show_print("[WARNING] Samples compressed with zstd (%s) are only supported in GNU/Linux" % sample['r1'], showdate = False, font = self.YELLOW)
+                        exit(1)
 
         # Python version
         if not self.KEY_PYTHON_VERSION:
             self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_PYTHON_VERSION.lower()), showdate = False, font = self.YELLOW)
-            exit()
+            exit(1)
         else:
             if not self.KEY_PYTHON_VERSION.lower() in ['python', 'python3']:
                 self.show_print("[WARNING] You must specify some value for the '%s' parameter: python3 (for Python 3.x in GNU/Linux) or python (for Python3.x in Windows)" % (self.PARAMETER_PYTHON_VERSION.lower()), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
             else:
                 if self.KEY_PLATFORM_TYPE == self.PLATFORM_TYPE_GNULINUX and self.KEY_PYTHON_VERSION == 'python':
                     self.show_print("[WARNING] You are using a GNU/Linux platform, and you specified the parameter '%s' as '%s', you may have problems, we recommend using '%s'" % (self.PARAMETER_PYTHON_VERSION.lower(), self.KEY_PYTHON_VERSION, 'python3'), showdate = False, font = self.YELLOW)
@@ -343,73 +681,116 @@ class Pipeline:
         # Filtering (maxee)
         if not self.KEY_FILTER_MAXEE:
             self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_FILTER_MAXEE.lower()), showdate = False, font = self.YELLOW)
-            exit()
+            exit(1)
         else:
             if (not re.match('^\d+(?:\.\d+)?$', self.KEY_FILTER_MAXEE)) or (float(self.KEY_FILTER_MAXEE) == 0):
                 self.show_print("[WARNING] Value '%s' of parameter '%s' is not a positive number" % (self.KEY_FILTER_MAXEE, self.PARAMETER_FILTER_MAXEE.lower()), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
 
         # Filtering (minlen)
         if not self.KEY_FILTER_MINLEN:
             self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_FILTER_MINLEN.lower()), showdate = False, font = self.YELLOW)
-            exit()
+            exit(1)
         else:
             if (not self.KEY_FILTER_MINLEN.isdigit()) or (int(self.KEY_FILTER_MINLEN) == 0):
                 self.show_print("[WARNING] Value '%s' of parameter '%s' is not a positive integer" % (self.KEY_FILTER_MINLEN, self.PARAMETER_FILTER_MINLEN.lower()), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
 
         # Filtering (maxlen)
         if self.KEY_FILTER_MAXLEN:
             if (not self.KEY_FILTER_MAXLEN.isdigit()) or (int(self.KEY_FILTER_MAXLEN) == 0):
                 self.show_print("[WARNING] Value '%s' of parameter '%s' is not a positive integer" % (self.KEY_FILTER_MAXLEN, self.PARAMETER_FILTER_MAXLEN.lower()), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
 
             if int(self.KEY_FILTER_MINLEN) > int(self.KEY_FILTER_MAXLEN):
                 self.show_print("[WARNING] '%s' (%s) can't be greater than '%s' (%s)" % (self.PARAMETER_FILTER_MINLEN.lower(), self.KEY_FILTER_MINLEN, self.PARAMETER_FILTER_MAXLEN.lower(), self.KEY_FILTER_MAXLEN), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
 
         if self.KEY_APPROACH_TYPE == self.APPROACH_TYPE_OTU:
             # Clustering (identity)
             if not self.KEY_CLUSTER_ID:
                 self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_CLUSTER_ID.lower()), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
             else:
                 if (not re.match('^\d+(?:\.\d+)?$', self.KEY_CLUSTER_ID)) or (float(self.KEY_CLUSTER_ID) == 0):
                     self.show_print("[WARNING] Value '%s' of parameter '%s' is not a positive number" % (self.KEY_CLUSTER_ID, self.PARAMETER_CLUSTER_ID.lower()), showdate = False, font = self.YELLOW)
-                    exit()
+                    exit(1)
                 else:
                     self.KEY_CLUSTER_ID = float(self.KEY_CLUSTER_ID) / 100
 
             # BLAST (identity)
             if not self.KEY_BLAST_ID:
                 self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_BLAST_ID.lower()), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
             else:
                 if (not re.match('^\d+(?:\.\d+)?$', self.KEY_BLAST_ID)) or (float(self.KEY_BLAST_ID) == 0):
                     self.show_print("[WARNING] Value '%s' of parameter '%s' is not a positive number" % (self.KEY_BLAST_ID, self.PARAMETER_BLAST_ID.lower()), showdate = False, font = self.YELLOW)
-                    exit()
+                    exit(1)
+
+            # BLAST (hits kept per OTU, optional, default: no limit). blastn applies -max_target_seqs during the search,
+            # so a limit can change the first hit, the one the taxonomy uses
+            if not self.KEY_BLAST_MAX_TARGET_SEQS:
+                self.KEY_BLAST_MAX_TARGET_SEQS = None
+            else:
+                if (not self.KEY_BLAST_MAX_TARGET_SEQS.isdigit()) or (int(self.KEY_BLAST_MAX_TARGET_SEQS) == 0):
+                    self.show_print("[WARNING] Value '%s' of parameter '%s' is not a positive integer" % (self.KEY_BLAST_MAX_TARGET_SEQS, self.PARAMETER_BLAST_MAX_TARGET_SEQS.lower()), showdate = False, font = self.YELLOW)
+                    exit(1)
+                self.KEY_BLAST_MAX_TARGET_SEQS = int(self.KEY_BLAST_MAX_TARGET_SEQS)
+
+            if not self.KEY_BLAST_MAX_HSPS:
+                self.KEY_BLAST_MAX_HSPS = None
+            else:
+                if (not self.KEY_BLAST_MAX_HSPS.isdigit()) or (int(self.KEY_BLAST_MAX_HSPS) == 0):
+                    self.show_print("[WARNING] Value '%s' of parameter '%s' is not a positive integer" % (self.KEY_BLAST_MAX_HSPS, self.PARAMETER_BLAST_MAX_HSPS.lower()), showdate = False, font = self.YELLOW)
+                    exit(1)
+                self.KEY_BLAST_MAX_HSPS = int(self.KEY_BLAST_MAX_HSPS)
         elif self.KEY_APPROACH_TYPE == self.APPROACH_TYPE_ASV:
             # High identity to count ASVs
             if not self.KEY_HIGH_IDENTITY_ASV:
                 self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_HIGH_IDENTITY_ASV.lower()), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
             else:
                 if (not re.match('^\d+(?:\.\d+)?$', self.KEY_HIGH_IDENTITY_ASV)) or (float(self.KEY_HIGH_IDENTITY_ASV) == 0):
                     self.show_print("[WARNING] Value '%s' of parameter '%s' is not a positive number" % (self.KEY_HIGH_IDENTITY_ASV, self.PARAMETER_HIGH_IDENTITY_ASV.lower()), showdate = False, font = self.YELLOW)
-                    exit()
+                    exit(1)
                 else:
                     self.KEY_HIGH_IDENTITY_ASV = float(self.KEY_HIGH_IDENTITY_ASV) / 100
 
             # For taxonomic assignment
             if not self.KEY_SINTAX_CUTOFF:
                 self.show_print("[WARNING] Value of parameter '%s' not specified" % (self.PARAMETER_SINTAX_CUTOFF.lower()), showdate = False, font = self.YELLOW)
-                exit()
+                exit(1)
             else:
                 if (not re.match('^\d+(?:\.\d+)?$', self.KEY_SINTAX_CUTOFF)) or (float(self.KEY_SINTAX_CUTOFF) == 0):
                     self.show_print("[WARNING] Value '%s' of parameter '%s' is not a positive number" % (self.KEY_SINTAX_CUTOFF, self.PARAMETER_SINTAX_CUTOFF.lower()), showdate = False, font = self.YELLOW)
-                    exit()
+                    exit(1)
 
-        self.BIN_PATH = os.path.join(self.ROOT, self.BIN_PATH)
+            # Program of the taxonomic assignment (optional, default: usearch)
+            if not self.KEY_SINTAX_PROGRAM:
+                self.KEY_SINTAX_PROGRAM = 'usearch'
+            else:
+                self.KEY_SINTAX_PROGRAM = self.KEY_SINTAX_PROGRAM.lower()
+                if not self.KEY_SINTAX_PROGRAM in ['usearch', 'vsearch']:
+                    self.show_print("[WARNING] Value '%s' of parameter '%s' must be usearch or vsearch" % (self.KEY_SINTAX_PROGRAM, self.PARAMETER_SINTAX_PROGRAM.lower()), showdate = False, font = self.YELLOW)
+                    exit(1)
+
+            # Program of the denoising: usearch (unoise3) or vsearch (cluster_unoise + uchime3_denovo) (optional, default: usearch)
+            if not self.KEY_DENOISE_PROGRAM:
+                self.KEY_DENOISE_PROGRAM = 'usearch'
+            else:
+                self.KEY_DENOISE_PROGRAM = self.KEY_DENOISE_PROGRAM.lower()
+                if not self.KEY_DENOISE_PROGRAM in ['usearch', 'vsearch']:
+                    self.show_print("[WARNING] Value '%s' of parameter '%s' must be usearch or vsearch" % (self.KEY_DENOISE_PROGRAM, self.PARAMETER_DENOISE_PROGRAM.lower()), showdate = False, font = self.YELLOW)
+                    exit(1)
+
+        # Folder of the programs (optional, default: bin of the pipeline), with the same layout: <platform_type>/ and common/FastQC/
+        if self.KEY_BIN_PATH:
+            if not self.check_path(os.path.join(self.KEY_BIN_PATH, self.KEY_PLATFORM_TYPE)):
+                self.show_print("[WARNING] Path '%s' of parameter '%s' doesn't exist" % (os.path.join(self.KEY_BIN_PATH, self.KEY_PLATFORM_TYPE), self.PARAMETER_BIN_PATH.lower()), showdate = False, font = self.YELLOW)
+                exit(1)
+            self.BIN_PATH = os.path.abspath(self.KEY_BIN_PATH)
+        else:
+            self.BIN_PATH = os.path.join(self.ROOT, self.BIN_PATH)
         self.BIN_PATH = os.path.join(self.BIN_PATH, self.KEY_PLATFORM_TYPE)
 
         self.UTIL_PATH = os.path.join(self.ROOT, self.UTIL_PATH)
@@ -419,11 +800,13 @@ class Pipeline:
             self.PROGRAM_USEARCH = 'usearch'
             self.PROGRAM_CUTADAPT = 'cutadapt'
             self.PROGRAM_BLASTN = 'blastn'
+            self.PROGRAM_MAKEBLASTDB = 'makeblastdb'
         elif self.KEY_PLATFORM_TYPE == self.PLATFORM_TYPE_WINDOWS:
             self.PROGRAM_VSEARCH = 'vsearch.exe'
             self.PROGRAM_USEARCH = 'usearch.exe'
             self.PROGRAM_CUTADAPT = 'cutadapt.exe'
             self.PROGRAM_BLASTN = 'blastn.exe'
+            self.PROGRAM_MAKEBLASTDB = 'makeblastdb.exe'
 
         prog_vsearch = os.path.join(self.BIN_PATH, self.PROGRAM_VSEARCH)
         prog_usearch = os.path.join(self.BIN_PATH, self.PROGRAM_USEARCH)
@@ -433,74 +816,67 @@ class Pipeline:
         fastqc_path = os.path.join(os.path.dirname(self.BIN_PATH), 'common', 'FastQC')
         prog_fastqc = os.path.join(fastqc_path, self.PROGRAM_FASTQC)
 
-        # Unzip
+        # Unzip (once per release of the bundles, see tools.py)
         bin_zip_common = os.path.join(os.path.dirname(self.BIN_PATH), 'common.zip')
         bin_zip_gnulinux = os.path.join(os.path.dirname(self.BIN_PATH), 'gnulinux.zip')
         bin_zip_win = os.path.join(os.path.dirname(self.BIN_PATH), 'win.zip')
         bin_unzip = os.path.dirname(self.BIN_PATH)
 
         # Common
-        if self.check_path(bin_zip_common):
-            with zipfile.ZipFile(bin_zip_common, 'r') as fzip:
-                fzip.extractall(bin_unzip)
-            os.remove(bin_zip_common)
+        tools.check_bundle(bin_zip_common, bin_unzip)
 
         if self.KEY_PLATFORM_TYPE == self.PLATFORM_TYPE_WINDOWS:
             # Windows
-            if self.check_path(bin_zip_win):
-                with zipfile.ZipFile(bin_zip_win, 'r') as fzip:
-                    fzip.extractall(bin_unzip)
-                os.remove(bin_zip_win)
+            tools.check_bundle(bin_zip_win, bin_unzip)
 
         if self.KEY_PLATFORM_TYPE == self.PLATFORM_TYPE_GNULINUX:
             # GNU/Linux
-            if self.check_path(bin_zip_gnulinux):
-                with zipfile.ZipFile(bin_zip_gnulinux, 'r') as fzip:
-                    fzip.extractall(bin_unzip)
-                os.remove(bin_zip_gnulinux)
+            tools.check_bundle(bin_zip_gnulinux, bin_unzip)
 
             os.chmod(prog_vsearch, int('755', base = 8))
             os.chmod(prog_usearch, int('755', base = 8))
             os.chmod(prog_fastqc, int('755', base = 8))
             os.chmod(prog_blastn, int('755', base = 8))
 
-        self.check_version('%s --version' % prog_vsearch, self.PROGRAM_VSEARCH)
-        self.check_version('%s --version' % prog_usearch, self.PROGRAM_USEARCH)
+        # Versions of the programs: the command and the files it runs (probed at the same time, cached by tools.py)
+        probes = {self.PROGRAM_VSEARCH: ('%s --version' % prog_vsearch, [prog_vsearch]),
+                  self.PROGRAM_USEARCH: ('%s --version' % prog_usearch, [prog_usearch])}
 
         if self.KEY_APPROACH_TYPE == self.APPROACH_TYPE_OTU:
-            self.check_version('%s -version' % prog_blastn, self.PROGRAM_BLASTN)
+            probes[self.PROGRAM_BLASTN] = ('%s -version' % prog_blastn, [prog_blastn])
+
+            if self.KEY_DATABASE_CACHE and not self.KEY_DATABASE_BIN:
+                probes[self.PROGRAM_MAKEBLASTDB] = ('%s -version' % self.get_makeblastdb(), [self.get_makeblastdb()])
 
         if self.KEY_PLATFORM_TYPE == self.PLATFORM_TYPE_GNULINUX:
             # For Cutadapt
-            self.check_version('%s --version' % self.PROGRAM_CUTADAPT, self.PROGRAM_CUTADAPT)
+            probes[self.PROGRAM_CUTADAPT] = ('%s --version' % self.PROGRAM_CUTADAPT, [self.PROGRAM_CUTADAPT])
 
             # For FastQC
-            self.check_version('%s --version' % prog_fastqc, self.PROGRAM_FASTQC)
+            probes[self.PROGRAM_FASTQC] = ('%s --version' % prog_fastqc, [prog_fastqc])
         elif self.KEY_PLATFORM_TYPE == self.PLATFORM_TYPE_WINDOWS:
             # For Cutadapt
-            self.check_version('%s --version' % prog_cutadapt, self.PROGRAM_CUTADAPT)
+            probes[self.PROGRAM_CUTADAPT] = ('%s --version' % prog_cutadapt, [prog_cutadapt])
 
             # For FastQC
             jar1_path = os.path.join(fastqc_path, 'sam-1.103.jar')
             jar2_path = os.path.join(fastqc_path, 'jbzip2-0.9.jar')
             program_path_fqc = 'java -Xmx250m -Dfastqc.show_version=true -Djava.awt.headless=true -classpath %s;%s;%s uk.ac.babraham.FastQC.FastQCApplication' % (fastqc_path, jar1_path, jar2_path)
-            self.check_version(program_path_fqc, self.PROGRAM_FASTQC)
+            probes[self.PROGRAM_FASTQC] = (program_path_fqc, [prog_fastqc, jar1_path, jar2_path])
 
-        self.show_print("Ok", showdate = False, font = self.IGREEN)
+        self.check_versions(probes)
 
-    def check_version(self, cmd, program):
-        p = subprocess.Popen(cmd, shell = True, stdin = None, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-        (checkStdout, checkStderr) = p.communicate()
-        checkStdout = checkStdout.decode('utf-8').strip()
-        checkStderr = checkStderr.decode('utf-8').strip()
+        self.show_print("Ok", showdate = False, font = self.IGREEN)
 
-        if not checkStdout:
-            self.show_print("[Check %s version]" % (program), showdate = False, font = self.ICYAN)
-            self.show_print("There are problems with the '%s' program, check your installation" % program, showdate = False, font = self.YELLOW)
-            exit()
-        # else:
-        #     self.show_print("[Check %s version]" % (program), showdate = False, font = self.ICYAN)
-        #     self.show_print("%s" % checkStdout, showdate = False, font = self.IGREEN)
+    def check_versions(self, probes):
+        outputs = tools.probe_versions(probes)
+        for program in probes:
+            if not outputs.get(program):
+                self.show_print("[Check %s version]" % (program), showdate = False, font = self.ICYAN)
+                self.show_print("There are problems with the '%s' program, check your installation" % program, showdate = False, font = self.YELLOW)
+                exit(1)
+            else:
+                self.PROGRAM_VERSIONS[program] = outputs[program].splitlines()[0].strip()
 
     def get_cmd_information(self, command):
         self.show_print("Command information:", [self.LOG_FILE])
@@ -509,6 +885,12 @@ class Pipeline:
         self.show_print("", [self.LOG_FILE])
 
     def run_program(self, program, command, success_words = None, **kwargs):
+        # Planning: the command is only recorded
+        commands = getattr(self.LOCAL, 'plan', None)
+        if commands is not None:
+            commands.append(" ".join(command))
+            return ''
+
         _extra_info = kwargs.get('extra_info') if kwargs.get('extra_info') else ''
 
         self.show_print("---------------------------------------------------------------------------------", [self.LOG_FILE], font = self.IGREEN)
@@ -518,19 +900,43 @@ class Pipeline:
         start = self.start_time()
 
         _command = " ".join(command)
+
+        # Progress of the program while it runs (vsearch, usearch and cutadapt only show it in a terminal)
+        stage = getattr(self.LOCAL, 'stage', None)
+        tracker = None
+        if self.PROGRESS is not None and stage is not None:
+            tracker = kwargs.get('tracker')
+            parser = progress.get_parser(program)
+            if tracker is None and parser is not None:
+                tracker = progress.Tracker(program, parser, progress.estimate_records(kwargs.get('input_file')))
+            if tracker is not None:
+                self.PROGRESS.start_program(stage, tracker)
+        terminal = tracker is not None and tracker.terminal and self.KEY_PLATFORM_TYPE == self.PLATFORM_TYPE_GNULINUX
+
         try:
             self.show_print("Running...", [self.LOG_FILE])
-            p = subprocess.Popen(_command, shell = True, stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+            p, lines = progress.start_process(_command, terminal = terminal)
         except Exception as e:
             self.show_print("Error %s while executing command %s" % (e, _command), [self.LOG_FILE], font = self.YELLOW)
 
+        # Long outputs go to their own file (or only the last lines are kept) when the program is set so
+        level = self.get_tool_output(program)
+        tool_log = None
+        if level == self.TOOL_OUTPUT_FILE and self.LOGGER is not None:
+            tool_log = self.get_tool_log(program)
+            self.show_print("Output of %s: %s" % (program, tool_log), [self.LOG_FILE])
+        arr_last = deque(maxlen = self.TOOL_OUTPUT_TAIL)
+        arr_pending = []
+
         successful = False
         output_run = ''
-        for line in iter(p.stdout.readline, b''):
+        for line, is_line in lines:
             _line = line.decode('ISO-8859-1').rstrip()
             # _line = line.decode('utf-8').rstrip()
+            if tracker is not None:
+                tracker.feed(_line)
 
-            if _line.startswith(success_words) or success_words in _line:
+            if success_words is not None and (_line.startswith(success_words) or success_words in _line):
                 successful = True
 
                 if program == self.PROGRAM_RC:
@@ -538,7 +944,26 @@ class Pipeline:
                     primer_rev_rc = primer_rev_rc[1]
                     output_run = primer_rev_rc
 
-            self.show_print(_line, [self.LOG_FILE])
+            if not is_line:
+                # Updates of the progress ('\r'), not kept
+                continue
+
+            if level == self.TOOL_OUTPUT_LOG:
+                self.show_print(_line, [self.LOG_FILE])
+            else:
+                arr_last.append(_line)
+                if tool_log is not None:
+                    arr_pending.append(_line)
+                    if len(arr_pending) >= self.TOOL_OUTPUT_BATCH:
+                        self.LOGGER.write(tool_log, arr_pending)
+                        arr_pending = []
+        rusage = metrics.wait_process(p)
+        if tracker is not None:
+            self.PROGRESS.finish_program(stage, tracker)
+
+        if tool_log is not None:
+            self.LOGGER.write(tool_log, arr_pending)
+            self.LOGGER.close_file(tool_log)
 
         arr_exception = []
         if self.KEY_APPROACH_TYPE == self.APPROACH_TYPE_OTU:
@@ -547,35 +972,20 @@ class Pipeline:
             arr_exception = [self.PROGRAM_ABUNDANCE_TABLE_ASV]
 
         if program in arr_exception:
-            successful = True
+            # No words to look for, the exit status tells
+            successful = p.returncode == 0
+
+        if self.METRICS is not None:
+            self.METRICS.add_program(stage or program, program, start, time.time() - start, rusage, 'ok' if successful else 'failed', self.get_threads())
 
         if not successful:
+            for _line in arr_last:
+                self.show_print(_line, [self.LOG_FILE])
             err_msg = "ERROR executing %s!\nCheck the command: %s" % (program, _command)
             self.show_print(err_msg, [self.LOG_FILE], font = self.YELLOW)
             self.show_print(self.finish_time(start, "Interrupted after"), [self.LOG_FILE], font = self.YELLOW)
             self.show_print("", [self.LOG_FILE])
             sys.exit(1)
-        else:
-            if program == self.PROGRAM_FASTQC and self.KEY_PLATFORM_TYPE == self.PLATFORM_TYPE_WINDOWS:
-                input_path = os.path.dirname(command[1])
-                input_file = os.path.basename(command[1])
-
-                if input_path != self.KEY_OUTPUT_PATH:
-                    _prefix, _ = os.path.splitext(input_file)
-
-                    zip_file = '%s_fastqc.zip' % _prefix
-                    html_file = '%s_fastqc.html' % _prefix
-
-                    out_zip_file = os.path.join(self.KEY_OUTPUT_PATH, zip_file)
-                    if os.path.isfile(out_zip_file):
-                        os.remove(out_zip_file)
-
-                    out_html_file = os.path.join(self.KEY_OUTPUT_PATH, html_file)
-                    if os.path.isfile(out_html_file):
-                        os.remove(out_html_file)
-
-                    os.rename(os.path.join(input_path, zip_file), out_zip_file)
-                    os.rename(os.path.join(input_path, html_file), out_html_file)
 
         self.show_print(self.finish_time(start, "Elapsed time"), [self.LOG_FILE])
         self.show_print("", [self.LOG_FILE])
@@ -587,13 +997,13 @@ class Pipeline:
 
         primer_fwd = ''
         primer_rev = ''
-        for index, record in enumerate(SeqIO.parse(primers_file, 'fasta')):
+        for index, (_, sequence) in enumerate(fastx.read_fasta(primers_file)):
             if index == 0:
                 # forward-primer
-                primer_fwd = record.seq
+                primer_fwd = sequence.decode('ascii')
             elif index == 1:
                 # reverse-primer
-                primer_rev = record.seq
+                primer_rev = sequence.decode('ascii')
 
         arr_cmd = ['%s %s' % (self.KEY_PYTHON_VERSION, os.path.join(self.UTIL_PATH, self.PROGRAM_RC)),
                    '%s' % primer_rev]
@@ -614,7 +1024,7 @@ class Pipeline:
                 arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_VSEARCH),
                            '--fastq_mergepairs %s' % params['r1'],
                            '--reverse %s' % params['r2'],
-                           '--threads %s' % self.KEY_THREADS,
+                           '--threads %s' % self.get_threads(),
                            '--fastqout %s' % params['output'],
                            '--fastq_eeout']
 
@@ -648,7 +1058,7 @@ class Pipeline:
             elif step == 'cluster_size':
                 arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_VSEARCH),
                            '--cluster_size %s' % params['input'],
-                           '--threads %s' % self.KEY_THREADS,
+                           '--threads %s' % self.get_threads(),
                            '--id %s' % params['id'],
                            '--strand %s' % params['strand'],
                            '--sizein',
@@ -670,7 +1080,7 @@ class Pipeline:
             elif step == 'uchime_ref':
                 arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_VSEARCH),
                            '--uchime_ref %s' % params['input'],
-                           '--threads %s' % self.KEY_THREADS,
+                           '--threads %s' % self.get_threads(),
                            '--db %s' % params['db'],
                            '--sizein',
                            '--sizeout',
@@ -681,7 +1091,7 @@ class Pipeline:
             elif step == 'cluster_size_otu_table':
                 arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_VSEARCH),
                            '--cluster_size %s' % params['input'],
-                           '--threads %s' % self.KEY_THREADS,
+                           '--threads %s' % self.get_threads(),
                            '--id %s' % params['id'],
                            '--strand %s' % params['strand'],
                            '--sizein',
@@ -699,7 +1109,7 @@ class Pipeline:
                 arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_VSEARCH),
                            '--fastq_mergepairs %s' % params['r1'],
                            '--reverse %s' % params['r2'],
-                           '--threads %s' % self.KEY_THREADS,
+                           '--threads %s' % self.get_threads(),
                            '--fastqout %s' % params['output'],
                            '--relabel %s' % params['relabel'],
                            '--fastq_eeout']
@@ -734,30 +1144,57 @@ class Pipeline:
             elif step == 'usearch_global':
                 arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_VSEARCH),
                            '--usearch_global %s' % params['input'],
-                           '--threads %s' % self.KEY_THREADS,
+                           '--threads %s' % self.get_threads(),
                            '--db %s' % params['db'],
                            '--id %s' % params['id'],
                            '--otutabout %s' % params['output']]
 
                 words = 'Writing OTU table'
+            elif step == 'sintax':
+                arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_VSEARCH),
+                           '--sintax %s' % params['input'],
+                           '--threads %s' % self.get_threads(),
+                           '--db %s' % params['db'],
+                           '--tabbedout %s' % params['output'],
+                           '--strand %s' % params['strand'],
+                           '--sintax_cutoff %s' % params['sintax_cutoff']]
+
+                words = 'Classified'
+            elif step == 'cluster_unoise':
+                arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_VSEARCH),
+                           '--cluster_unoise %s' % params['input'],
+                           '--threads %s' % self.get_threads(),
+                           '--minsize %s' % params['minsize'],
+                           '--unoise_alpha %s' % params['unoise_alpha'],
+                           '--sizein',
+                           '--sizeout',
+                           '--fasta_width %s' % params['fasta_width'],
+                           '--uc %s' % params['uc'],
+                           '--centroids %s' % params['centroids']]
+
+                words = 'Clustering 100%'
+            elif step == 'uchime3_denovo':
+                arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_VSEARCH),
+                           '--uchime3_denovo %s' % params['input'],
+                           '--sizein',
+                           '--fasta_width %s' % params['fasta_width'],
+                           '--relabel %s' % params['relabel'],
+                           '--uchimeout %s' % params['uchimeout'],
+                           '--nonchimeras %s' % params['nonchimeras']]
+
+                words = 'Detecting chimeras 100%'
 
         self.run_program(program = self.PROGRAM_VSEARCH,
                          command = arr_cmd,
                          success_words = words,
-                         extra_info = extra_info)
+                         extra_info = extra_info,
+                         input_file = params.get('input', params.get('r1')))
 
     def run_usearch(self, params, step = None, extra_info = None):
         arr_cmd = []
         words = ''
         if self.KEY_APPROACH_TYPE == self.APPROACH_TYPE_OTU:
-            if step == 'fastx_subsample':
-                arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_USEARCH),
-                           '-fastx_subsample %s' % params['input'],
-                           '-sample_size %s' % params['sample_size'],
-                           '-fastqout %s' % params['output']]
-
-                words = '100.0% Sampling'
-            elif step == 'search_oligodb':
+            if step == 'search_oligodb':
                 arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_USEARCH),
                            '-search_oligodb %s' % params['input'],
                            '-db %s' % params['db'],
@@ -774,13 +1211,6 @@ class Pipeline:
                            '-relabel %s' % params['relabel']]
 
                 words = 'Totals:'
-            elif step == 'fastx_subsample':
-                arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_USEARCH),
-                           '-fastx_subsample %s' % params['input'],
-                           '-sample_size %s' % params['sample_size'],
-                           '-fastqout %s' % params['output']]
-
-                words = '100.0% Sampling'
             elif step == 'search_oligodb':
                 arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_USEARCH),
                            '-search_oligodb %s' % params['input'],
@@ -801,6 +1231,7 @@ class Pipeline:
                 arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_USEARCH),
                            '-sintax %s' % params['input'],
                            '-db %s' % params['db'],
+                           '-threads %s' % self.get_threads(),
                            '-tabbedout %s' % params['output'],
                            '-strand %s' % params['strand'],
                            '-sintax_cutoff %s' % params['sintax_cutoff']]
@@ -810,7 +1241,8 @@ class Pipeline:
         self.run_program(program = self.PROGRAM_USEARCH,
                          command = arr_cmd,
                          success_words = words,
-                         extra_info = extra_info)
+                         extra_info = extra_info,
+                         input_file = params.get('input', params.get('r1')))
 
     def run_cutadapt(self, params, step = None, extra_info = None):
         if self.KEY_PLATFORM_TYPE == self.PLATFORM_TYPE_GNULINUX:
@@ -840,31 +1272,286 @@ class Pipeline:
         self.run_program(program = self.PROGRAM_CUTADAPT,
                          command = arr_cmd,
                          success_words = words,
-                         extra_info = extra_info)
+                         extra_info = extra_info,
+                         input_file = params.get('input', params.get('r1')))
 
     def run_map(self, params, extra_info = None):
-        arr_cmd = ['%s %s' % (self.KEY_PYTHON_VERSION, os.path.join(self.UTIL_PATH, self.PROGRAM_MAP)),
-                   '%s' % params['fasta1'],
-                   '%s' % params['uc'],
-                   '%s' % params['fasta2'],
-                   '%s' % params['output']]
+        # In-process: fasta1 (one file or the list of per-sample files) and the uc file are streamed
+        _extra_info = extra_info if extra_info else ''
 
-        primer_rev_rc = self.run_program(program = self.PROGRAM_MAP,
-                                         command = arr_cmd,
-                                         extra_info = extra_info)
+        self.show_print("---------------------------------------------------------------------------------", [self.LOG_FILE], font = self.IGREEN)
+        self.show_print("[Run %s] %s" % (self.PROGRAM_MAP, _extra_info), [self.LOG_FILE], font = self.BIGREEN)
+        self.show_print("---------------------------------------------------------------------------------", [self.LOG_FILE], font = self.IGREEN)
+        start = self.start_time()
 
-    def run_blastn(self, params, extra_info = None):
+        n_sequences = map_sequences(params['fasta1'], params['uc'], params['fasta2'], params['output'])
+
+        self.show_print("  Output file: %s" % params['output'], [self.LOG_FILE])
+        self.show_print("  Number of sequences: %s" % n_sequences, [self.LOG_FILE])
+        self.show_print(self.finish_time(start, "Elapsed time"), [self.LOG_FILE])
+        self.show_print("", [self.LOG_FILE])
+
+        return n_sequences
+
+    def run_shards(self, program, query, output, worker, threads_per_worker = 1, memory_per_worker = None, ordered = False, key = '', extra_info = None):
+        # worker(shard, threads) runs the program of one shard; the shards run at the same time and are merged in order
+        _extra_info = extra_info if extra_info else ''
+        workers, threads = shards.get_workers(self.get_threads(), threads_per_worker, memory_per_worker)
+        if getattr(self.LOCAL, 'plan', None) is not None:
+            # Planning: the command of the first shard
+            worker(shards.Shard(0, '%s.shards' % output), threads)
+            return
+
+        sharded = shards.ShardRun(query, output, key = key, ordered = ordered,
+                                  get_digest = self.CHECKPOINTS.file_digest if self.CHECKPOINTS is not None else None)
+
+        stage = getattr(self.LOCAL, 'stage', None)
+        arr_buffers = {}
+        def run_shard(shard):
+            self.LOCAL.threads = threads
+            self.LOCAL.stage = stage
+            self.LOCAL.log_buffer = arr_buffers.setdefault(shard.index, [])
+            if self.PROGRESS is not None:
+                self.PROGRESS.set_parts(stage, sharded.state['shards'], len(sharded.state['done']))
+            worker(shard, threads)
+
+        self.show_print("---------------------------------------------------------------------------------", [self.LOG_FILE], font = self.IGREEN)
+        self.show_print("[Run %s in shards] %s" % (program, _extra_info), [self.LOG_FILE], font = self.BIGREEN)
+        self.show_print("---------------------------------------------------------------------------------", [self.LOG_FILE], font = self.IGREEN)
+        start = self.start_time()
+
+        try:
+            pending = sharded.run(run_shard, workers, resume = self.RESUME)
+        finally:
+            # The output of each shard, one after the other
+            buffer = getattr(self.LOCAL, 'log_buffer', None)
+            for index in sorted(arr_buffers):
+                if buffer is not None:
+                    buffer.extend(arr_buffers[index])
+                elif self.LOG_FILE is not None:
+                    self.write_log(self.LOG_FILE, arr_buffers[index])
+
+        n_shards = sharded.state['shards']
+        sharded.cleanup()
+
+        self.show_print("  Shards: %s (%s reused from a previous run)" % (n_shards, n_shards - len(pending)), [self.LOG_FILE])
+        self.show_print("  Workers: %s x %s threads" % (workers, threads), [self.LOG_FILE])
+        self.show_print("  Output file: %s" % output, [self.LOG_FILE])
+        self.show_print(self.finish_time(start, "Elapsed time"), [self.LOG_FILE])
+        self.show_print("", [self.LOG_FILE])
+
+    def get_blastn_command(self, params, query, out, threads):
         arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_BLASTN),
                    '-db %s' % params['db'],
-                   '-query %s' % params['query'],
+                   '-query %s' % query,
                    '-perc_identity %s' % params['perc_identity'],
-                   '-qcov_hsp_perc %s' % params['qcov_hsp_perc'],
-                   '-outfmt "%s"' % params['outfmt'],
-                   '-out %s' % params['out']]
+                   '-qcov_hsp_perc %s' % params['qcov_hsp_perc']]
+        # Limits only when they are set (without them the hits are those of blastn by default)
+        if params['max_target_seqs'] is not None:
+            arr_cmd.append('-max_target_seqs %s' % params['max_target_seqs'])
+        if params['max_hsps'] is not None:
+            arr_cmd.append('-max_hsps %s' % params['max_hsps'])
+        arr_cmd.extend(['-num_threads %s' % threads,
+                        '-outfmt "%s"' % params['outfmt'],
+                        '-out %s' % out])
+        return arr_cmd
 
-        self.run_program(program = self.PROGRAM_BLASTN,
-                         command = arr_cmd,
-                         extra_info = extra_info)
+    def run_blastn(self, params, extra_info = None):
+        # The OTUs are split in shards, blastn runs on several of them at the same time
+        def worker(shard, threads):
+            arr_cmd = self.get_blastn_command(params, shard.query, shard.tmp_output, threads)
+            self.run_program(program = self.PROGRAM_BLASTN,
+                             command = arr_cmd,
+                             extra_info = '%s (shard %s)' % (extra_info, shard.index + 1),
+                             tracker = progress.OutputTracker(self.PROGRAM_BLASTN, shard.query, shard.tmp_output))
+
+        # Same command and blastn version: the finished shards of a stopped run are reused
+        key = '%s %s' % (self.PROGRAM_VERSIONS.get(self.PROGRAM_BLASTN, ''), ' '.join(self.get_blastn_command(params, '', '', 0)))
+
+        self.run_shards(self.PROGRAM_BLASTN, params['query'], params['out'], worker,
+                        threads_per_worker = self.BLAST_THREADS_PER_SHARD,
+                        key = key,
+                        extra_info = extra_info)
+
+    def run_denoise(self, params, extra_info = None):
+        # ASVs (Zotu<n>) and the report of every unique sequence (unoise3.txt), with usearch or vsearch
+        if self.KEY_DENOISE_PROGRAM == 'usearch':
+            self.run_usearch(params, step = 'unoise3', extra_info = extra_info)
+            return
+
+        output_centroids = '%s.unoise.fa' % params['output']
+        output_uc = '%s.unoise.uc' % params['output']
+        output_uchime = '%s.uchime.txt' % params['output']
+
+        _params = {'input': params['input'],
+                   'minsize': params['minsize'],
+                   'unoise_alpha': params['unoise_alpha'],
+                   'fasta_width': '0',
+                   'uc': output_uc,
+                   'centroids': output_centroids}
+
+        self.run_vsearch(_params, step = 'cluster_unoise', extra_info = '%s (denoising)' % extra_info)
+
+        _params = {'input': output_centroids,
+                   'fasta_width': '0',
+                   'relabel': 'Zotu',
+                   'uchimeout': output_uchime,
+                   'nonchimeras': params['output']}
+
+        self.run_vsearch(_params, step = 'uchime3_denovo', extra_info = '%s (chimera filtering)' % extra_info)
+        if getattr(self.LOCAL, 'plan', None) is not None:
+            return
+
+        n_amplicons, n_zotus = denoise.write_tabbedout(output_uc, output_uchime, params['tabbedout'])
+        self.show_print("  Amplicons: %s, ASVs (without chimeras): %s" % (n_amplicons, n_zotus), [self.LOG_FILE])
+        self.show_print("", [self.LOG_FILE])
+
+        for _file in [output_centroids, output_uc, output_uchime]:
+            os.remove(_file)
+
+    def run_sintax(self, params, extra_info = None):
+        # The ASVs are split in shards, SINTAX (usearch or vsearch) runs on several of them at the same time
+        if self.KEY_SINTAX_PROGRAM == 'vsearch':
+            program = self.PROGRAM_VSEARCH
+            action = self.run_vsearch
+        else:
+            program = self.PROGRAM_USEARCH
+            action = self.run_usearch
+
+        def worker(shard, threads):
+            _params = dict(params, input = shard.query, output = shard.tmp_output)
+            action(_params, step = 'sintax', extra_info = '%s (shard %s)' % (extra_info, shard.index + 1))
+
+        # Every worker loads the whole database (a UDB index as it is, a FASTA is indexed): as many as fit in the available memory
+        memory = os.path.getsize(params['db']) if os.path.isfile(params['db']) else 0
+        if not params['db'].lower().endswith('.udb'):
+            memory *= self.SINTAX_MEMORY_FACTOR
+        if program == self.PROGRAM_USEARCH and memory > self.USEARCH_MAX_MEMORY:
+            self.show_print("[WARNING] The database may not fit in the 4 GB of the 32-bit usearch, use '%s = vsearch'" % self.PARAMETER_SINTAX_PROGRAM.lower(), [self.LOG_FILE], font = self.YELLOW)
+
+        # Same database, parameters and program version: the finished shards of a stopped run are reused
+        key = '%s %s %s %s %s' % (program, self.PROGRAM_VERSIONS.get(program, ''), params['db'], params['strand'], params['sintax_cutoff'])
+
+        self.run_shards(program, params['input'], params['output'], worker,
+                        threads_per_worker = self.SINTAX_THREADS_PER_SHARD,
+                        memory_per_worker = memory,
+                        ordered = True,
+                        key = key,
+                        extra_info = extra_info)
+
+    def get_abundance_files(self, name):
+        # One file for every format of the abundance table
+        return [os.path.join(self.KEY_OUTPUT_PATH, '%s%s' % (name, self.ABUNDANCE_FORMATS[fmt][0])) for fmt in self.KEY_ABUNDANCE_FORMATS]
+
+    def get_makeblastdb(self):
+        # makeblastdb next to blastn, or the one in the PATH
+        program = os.path.join(self.BIN_PATH, self.PROGRAM_MAKEBLASTDB)
+        if os.path.isfile(program):
+            return program
+        return self.PROGRAM_MAKEBLASTDB
+
+    def is_sintax_fasta(self, fasta_file):
+        # The database is already formatted for SINTAX (<id>;tax=d:...)
+        for header, _ in fastx.read_fasta(fasta_file):
+            return b';tax=' in header
+        return False
+
+    def build_database_artifact(self, entry, name, database_fasta):
+        build_path = entry.get_build_path(name)
+        file_name = self.DATABASE_ARTIFACT_FILES[name]
+        info = 'Prepare database (%s)' % name
+
+        if name == 'sintax_fasta':
+            # multiprocessing is only needed here
+            from rename_database import edit_database_fasta
+            start = self.start_time()
+            _, n_read, n_written = edit_database_fasta(database_fasta, self.KEY_DATABASE_TYPE, os.path.join(build_path, file_name), threads = int(self.KEY_THREADS))
+            self.show_print("  %s: %s of %s sequences formatted for SINTAX" % (info, n_written, n_read), [self.LOG_FILE])
+            self.show_print(self.finish_time(start, "Elapsed time"), [self.LOG_FILE])
+            self.show_print("", [self.LOG_FILE])
+        elif name == 'usearch_udb':
+            arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_VSEARCH),
+                       '--makeudb_usearch %s' % database_fasta,
+                       '--output %s' % os.path.join(build_path, file_name)]
+            self.run_program(program = self.PROGRAM_VSEARCH, command = arr_cmd, success_words = '100%', extra_info = info)
+        elif name == 'sintax_udb':
+            arr_cmd = ['%s' % os.path.join(self.BIN_PATH, self.PROGRAM_USEARCH),
+                       '-makeudb_sintax %s' % database_fasta,
+                       '-output %s' % os.path.join(build_path, file_name)]
+            self.run_program(program = self.PROGRAM_USEARCH, command = arr_cmd, success_words = '100.0%', extra_info = info)
+        elif name == 'blast':
+            arr_cmd = ['%s' % self.get_makeblastdb(),
+                       '-in %s' % database_fasta,
+                       '-dbtype nucl',
+                       '-out %s' % os.path.join(build_path, file_name)]
+            self.run_program(program = self.PROGRAM_MAKEBLASTDB, command = arr_cmd, success_words = 'Adding sequences from FASTA', extra_info = info)
+
+        return entry.add_artifact(name, build_path, file_name, info = {'source': database_fasta})
+
+    def plan_database_artifact(self, entry, name, database_fasta):
+        # Planning: the file the artifact would have, built from database_fasta
+        artifact = os.path.join(entry.path, name, self.DATABASE_ARTIFACT_FILES[name])
+        self.PLAN_DATABASE[artifact] = database_fasta
+        self.show_print("  %s: %s (to build)" % (name, artifact), [self.LOG_FILE])
+        return artifact
+
+    def prepare_database(self):
+        # Files of the database used by the stages: the configured ones, or the prepared ones of the store
+        database_fasta = os.path.join(self.KEY_DATABASE_PATH, self.KEY_DATABASE_FASTA)
+        database_bin = os.path.join(self.KEY_DATABASE_PATH, self.KEY_DATABASE_BIN) if self.KEY_DATABASE_BIN else None
+        files = {'uchime_ref': database_fasta,
+                 'blast': database_bin,
+                 'sintax': database_fasta}
+
+        if not self.KEY_DATABASE_CACHE:
+            return files
+
+        self.show_print("---------------------------------------------------------------------------------", [self.LOG_FILE], font = self.IGREEN)
+        self.show_print("[Prepare database]", [self.LOG_FILE], font = self.BIGREEN)
+        self.show_print("---------------------------------------------------------------------------------", [self.LOG_FILE], font = self.IGREEN)
+        start = self.start_time()
+
+        # Planning only looks up the entry, the store isn't changed
+        store = dbstore.DatabaseStore(self.KEY_DATABASE_CACHE, max_size = self.KEY_DATABASE_CACHE_SIZE * dbstore.GB, read_only = self.PLAN is not None)
+        entry = store.get_entry(database_fasta, self.KEY_DATABASE_TYPE)
+        self.show_print("  Store entry: %s" % entry.path, [self.LOG_FILE])
+
+        if self.KEY_APPROACH_TYPE == self.APPROACH_TYPE_OTU:
+            artifacts = [('usearch_udb', 'uchime_ref', database_fasta)]
+            if not database_bin:
+                artifacts.append(('blast', 'blast', database_fasta))
+        elif self.KEY_APPROACH_TYPE == self.APPROACH_TYPE_ASV:
+            sintax_fasta = database_fasta
+            if not self.is_sintax_fasta(database_fasta):
+                sintax_fasta = entry.get_artifact('sintax_fasta')
+                if sintax_fasta is None:
+                    build = self.plan_database_artifact if self.PLAN is not None else self.build_database_artifact
+                    sintax_fasta = build(entry, 'sintax_fasta', database_fasta)
+            files['sintax'] = sintax_fasta
+
+            # vsearch reads the FASTA, the UDB index is only for usearch
+            artifacts = []
+            if self.KEY_SINTAX_PROGRAM == 'usearch':
+                artifacts.append(('sintax_udb', 'sintax', sintax_fasta))
+
+        for name, use, source in artifacts:
+            artifact = entry.get_artifact(name)
+            if artifact is None and self.PLAN is not None:
+                artifact = self.plan_database_artifact(entry, name, source)
+            elif artifact is None:
+                artifact = self.build_database_artifact(entry, name, source)
+            else:
+                self.show_print("  %s: %s (reused)" % (name, artifact), [self.LOG_FILE])
+            files[use] = artifact
+
+        if self.PLAN is None:
+            for name in store.evict(keep = entry):
+                self.show_print("  Evicted from the store: %s" % name, [self.LOG_FILE])
+
+        self.show_print(self.finish_time(start, "Elapsed time"), [self.LOG_FILE])
+        self.show_print("", [self.LOG_FILE])
+
+        return files
 
     def run_get_abundances_table(self, params, extra_info = None):
         arr_cmd = []
@@ -875,44 +1562,42 @@ class Pipeline:
             arr_cmd = ['%s %s' % (self.KEY_PYTHON_VERSION, os.path.join(self.UTIL_PATH, _program)),
                        '%s' % params['db_type'],
                        '%s' % params['blast_file'],
-                       '%s' % params['otutab_file'],
-                       '%s' % params['output']]
+                       '%s' % params['otutab_file']]
         elif self.KEY_APPROACH_TYPE == self.APPROACH_TYPE_ASV:
             _program = self.PROGRAM_ABUNDANCE_TABLE_ASV
 
             arr_cmd = ['%s %s' % (self.KEY_PYTHON_VERSION, os.path.join(self.UTIL_PATH, _program)),
                        '%s' % params['asv_taxonomy'],
-                       '%s' % params['asv_counts'],
-                       '%s' % params['output']]
+                       '%s' % params['asv_counts']]
+
+        arr_cmd.extend(params['output'])
 
         primer_rev_rc = self.run_program(program = _program,
                                          command = arr_cmd,
                                          extra_info = extra_info)
 
-    def run_merge_all(self, output_file, prefix = None):
+    def run_merge_all(self, files, output_file):
         self.show_print("---------------------------------------------------------------------------------", [self.LOG_FILE], font = self.IGREEN)
         self.show_print("[Merge all samples]", [self.LOG_FILE], font = self.BIGREEN)
         self.show_print("---------------------------------------------------------------------------------", [self.LOG_FILE], font = self.IGREEN)
         start = self.start_time()
 
-        with open(output_file, 'w') as fw:
-            for subdir, dirs, files in os.walk(self.KEY_OUTPUT_PATH):
-                for file in files:
-                    if self.KEY_APPROACH_TYPE == self.APPROACH_TYPE_OTU:
-                        if file.endswith('.filtered.fa') and not file.startswith(prefix):
-                            with open(os.path.join(subdir, file), 'r') as fr:
-                                for line in fr:
-                                    fw.write(line)
-                            fr.close()
-                    elif self.KEY_APPROACH_TYPE == self.APPROACH_TYPE_ASV:
-                        if file.endswith('.merged.fq'):
-                            with open(os.path.join(subdir, file), 'r') as fr:
-                                for line in fr:
-                                    fw.write(line)
-                            fr.close()
-        fw.close()
+        if self.KEY_VIRTUAL_POOL:
+            # The files are streamed to each program that reads the pool, nothing is written here
+            n_sequences = sum([self.count_sequences(file) for file in files])
+
+            self.show_print("  Virtual pool of %s files (streamed through named pipes)" % len(files), [self.LOG_FILE])
+            self.show_print("  Number of sequences: %s" % n_sequences, [self.LOG_FILE])
+            self.show_print(self.finish_time(start, "Elapsed time"), [self.LOG_FILE])
+            self.show_print("", [self.LOG_FILE])
+
+            return n_sequences
+
+        pool.concat_files(files, output_file, self.get_threads())
 
-        n_sequences = self.count_sequences(output_file)
+        # The index of the pooled file comes from the indexes of the samples (only for uncompressed files)
+        seqindex.concat_indexes(files, output_file)
+        n_sequences = sum([self.count_sequences(file) for file in files])
 
         self.show_print("  Output file: %s" % output_file, [self.LOG_FILE])
         self.show_print("  Number of sequences: %s" % n_sequences, [self.LOG_FILE])
@@ -921,17 +1606,137 @@ class Pipeline:
 
         return n_sequences
 
+    def get_pool_input(self, pooled_file, name):
+        # Path read by the program of the stage: the pooled file or its own named pipe
+        if self.KEY_VIRTUAL_POOL:
+            return '%s.%s.fifo' % (pooled_file, name)
+        return pooled_file
+
+    def get_pool_action(self, action, files, pool_input):
+        if self.KEY_VIRTUAL_POOL:
+            return partial(self.run_with_pipes, action, [[files, pool_input]], [])
+        return action
+
+    def get_intermediate_file(self, file):
+        if self.KEY_COMPRESS_INTERMEDIATES:
+            return '%s.%s' % (file, self.KEY_COMPRESS_INTERMEDIATES)
+        return file
+
+    def get_program_input(self, file):
+        # vsearch reads gzip but not zstd files, these go through a named pipe
+        if fastx.get_compression(file) == fastx.COMPRESSION_ZSTD:
+            return os.path.join(self.KEY_OUTPUT_PATH, '%s.fifo' % os.path.basename(file))
+        return file
+
+    def get_program_output(self, file):
+        # vsearch doesn't compress what it writes, it writes into a named pipe that is compressed on its way to disk
+        if fastx.get_compression(file) is not None:
+            return '%s.fifo' % file
+        return file
+
+    def get_pipes_action(self, action, inputs = [], outputs = []):
+        # inputs and outputs: pairs of [file, path used by the program]
+        feeds = [[[file], path] for file, path in inputs if path != file]
+        compressions = [[path, file] for file, path in outputs if path != file]
+        if feeds or compressions:
+            return partial(self.run_with_pipes, action, feeds, compressions)
+        return action
+
+    def run_with_pipes(self, action, feeds, compressions):
+        threads = self.get_threads()
+        arr_pipes = [pool.PoolFeeder(files, fifo) for files, fifo in feeds]
+        arr_pipes += [pool.PipeCompressor(fifo, file, threads) for fifo, file in compressions]
+        try:
+            action()
+        finally:
+            arr_errors = [pipe.close() for pipe in arr_pipes]
+
+        for pipe, error in zip(arr_pipes, arr_errors):
+            if error is not None:
+                raise RuntimeError("Named pipe '%s' failed: %s" % (pipe.fifo, error))
+
+    def is_streaming(self):
+        # Named pipes are only available in GNU/Linux
+        return not self.KEY_KEEP_INTERMEDIATES and self.KEY_PLATFORM_TYPE == self.PLATFORM_TYPE_GNULINUX
+
+    def get_stream_file(self, file):
+        if self.is_streaming():
+            return '%s.fifo' % file
+        return file
+
+    def release_fifos(self, fifos):
+        # Open and close both ends, so no program stays blocked waiting for the other one
+        for fifo in fifos:
+            try:
+                fd = os.open(fifo, os.O_RDWR | os.O_NONBLOCK)
+                os.close(fd)
+            except OSError:
+                pass
+
+    def run_streamed(self, actions, fifos):
+        # Run the programs at the same time, each one reading the named pipe written by the previous one
+        for fifo in fifos:
+            if os.path.exists(fifo):
+                os.remove(fifo)
+            os.mkfifo(fifo)
+
+        threads = self.get_threads()
+        stage = getattr(self.LOCAL, 'stage', None)
+        arr_buffers = [[] for action in actions]
+        arr_errors = [None for action in actions]
+
+        def run(index, action):
+            self.LOCAL.threads = threads
+            self.LOCAL.stage = stage
+            self.LOCAL.log_buffer = arr_buffers[index]
+            try:
+                action()
+            except BaseException as e:
+                arr_errors[index] = e
+
+        arr_threads = []
+        for index, action in enumerate(actions):
+            thread = threading.Thread(target = run, args = (index, action), daemon = True)
+            thread.start()
+            arr_threads.append(thread)
+
+        try:
+            while any([thread.is_alive() for thread in arr_threads]):
+                for thread in arr_threads:
+                    thread.join(1)
+                if any([error is not None for error in arr_errors]):
+                    self.release_fifos(fifos)
+        finally:
+            for fifo in fifos:
+                if os.path.exists(fifo):
+                    os.remove(fifo)
+
+            # The output of each program, one after the other
+            buffer = getattr(self.LOCAL, 'log_buffer', None)
+            for lines in arr_buffers:
+                if buffer is not None:
+                    buffer.extend(lines)
+                elif self.LOG_FILE is not None:
+                    self.write_log(self.LOG_FILE, lines)
+
+        for error in arr_errors:
+            if error is not None:
+                raise error
+
     def rename_head(self, file, from_text, to_text):
-        with open(file, 'r') as fr:
-            data_fr = fr.readlines()
-        fr.close()
-        with open(file, 'w') as fw:
-            for line in data_fr:
-                line = line.replace(from_text, to_text)
-                fw.write(line)
+        from_text = from_text.encode('ascii')
+        to_text = to_text.encode('ascii')
+
+        tmp_file = '%s.tmp' % file
+        fmt = fastx.guess_format(file)
+        with seqindex.IndexingWriter(tmp_file, fmt = fmt) as fw:
+            for record in fastx.read(file, fmt):
+                fw.write((record[0].replace(from_text, to_text),) + record[1:])
         fw.close()
+        os.replace(seqindex.get_index_file(tmp_file), seqindex.get_index_file(file))
+        os.replace(tmp_file, file)
 
-        return int(len(data_fr)/4)
+        return fw.count
 
     def run_fastqc(self, params, extra_info = None):
         fastqc_path = os.path.join(os.path.dirname(self.BIN_PATH), 'common', 'FastQC')
@@ -940,17 +1745,19 @@ class Pipeline:
             jar1_path = os.path.join(fastqc_path, 'sam-1.103.jar')
             jar2_path = os.path.join(fastqc_path, 'jbzip2-0.9.jar')
 
-            program_path_fqc = 'java -Xmx250m -classpath %s;%s;%s uk.ac.babraham.FastQC.FastQCApplication' % (fastqc_path, jar1_path, jar2_path)
+            # One JVM for the whole batch (250 MB per thread, as the fastqc wrapper does)
+            program_path_fqc = 'java -Xmx%sm -Dfastqc.threads=%s -Dfastqc.output_dir=%s -classpath %s;%s;%s uk.ac.babraham.FastQC.FastQCApplication' % (250 * int(params['threads']), params['threads'], self.KEY_OUTPUT_PATH, fastqc_path, jar1_path, jar2_path)
 
             arr_cmd = ['%s' % program_path_fqc,
-                       '%s' % params['input']]
+                       '%s' % ' '.join(params['input'])]
         elif self.KEY_PLATFORM_TYPE == self.PLATFORM_TYPE_GNULINUX:
             program_path_fqc = os.path.join(fastqc_path, self.PROGRAM_FASTQC)
 
             arr_cmd = ['%s' % program_path_fqc,
                        '-f %s' % 'fastq',
+                       '-t %s' % params['threads'],
                        '-o %s' % self.KEY_OUTPUT_PATH,
-                       '%s' % params['input']]
+                       '%s' % ' '.join(params['input'])]
 
         words = 'Analysis complete'
 
@@ -959,160 +1766,480 @@ class Pipeline:
                          success_words = words,
                          extra_info = extra_info)
 
-    def subsample_fq(self, params, nsequences):
+    def run_fastqc_batch(self, files):
+        self.LOCAL.log_buffer = []
+        self.LOCAL.stage = 'fastqc'
+        try:
+            params = {'input': files,
+                      'threads': min(len(files), self.FASTQC_THREADS)}
+
+            info = 'Checking the quality of the reads (%s files)' % len(files)
+            self.run_fastqc(params, extra_info = info)
+
+            # 'Analysis complete' is printed once per file
+            missing = []
+            for file in files:
+                _prefix = os.path.basename(file)
+                for extension in ['.gz', '.fastq', '.fq']:
+                    if _prefix.endswith(extension):
+                        _prefix = _prefix[:-len(extension)]
+                html_file = os.path.join(self.KEY_OUTPUT_PATH, '%s_fastqc.html' % _prefix)
+                if not os.path.isfile(html_file):
+                    missing.append(file)
+
+            if missing:
+                raise RuntimeError("FastQC didn't write a report for: %s" % ', '.join(missing))
+        finally:
+            self.flush_log_buffer()
+
+    def start_fastqc(self):
+        # QC runs beside the scheduler, so it only takes a quarter of the threads
+        self.FASTQC_THREADS = max(1, int(self.KEY_THREADS) // 4)
+        self.QC_QUEUE = BatchQueue(self.run_fastqc_batch, batch_size = max(self.FASTQC_BATCH_SIZE, self.FASTQC_THREADS), max_wait = self.FASTQC_MAX_WAIT)
+
+    def submit_fastqc(self, file):
+        if self.PLAN is not None:
+            self.PLAN_FASTQC.append(file)
+            return
+        if fastx.get_compression(file) == fastx.COMPRESSION_ZSTD:
+            self.show_print("[WARNING] FastQC doesn't read zstd files, there won't be a report for %s" % file, [self.LOG_FILE], font = self.YELLOW)
+            return
+        self.QC_QUEUE.submit(file)
+
+    def drain_fastqc(self):
+        self.show_print("Waiting for the quality checks (FastQC) to finish...", [self.LOG_FILE])
+        failures = self.QC_QUEUE.drain()
+
+        for files, e in failures:
+            self.show_print("[WARNING] FastQC failed for %s file(s): %s" % (len(files), ', '.join(files)), [self.LOG_FILE], font = self.YELLOW)
+            if not isinstance(e, SystemExit):
+                self.show_print("  %s" % e, [self.LOG_FILE], font = self.YELLOW)
+
+        if not failures:
+            self.show_print("Ok", [self.LOG_FILE])
+        self.show_print("", [self.LOG_FILE])
+
+    def subsample_fq(self, params, extra_info = None):
+        _extra_info = extra_info if extra_info else ''
+
         self.show_print("---------------------------------------------------------------------------------", [self.LOG_FILE], font = self.IGREEN)
-        self.show_print("[Extraction of a subsample of 1000 reads]", [self.LOG_FILE], font = self.BIGREEN)
+        self.show_print("[Extraction of a subsample of %s reads] %s" % (params['sample_size'], _extra_info), [self.LOG_FILE], font = self.BIGREEN)
         self.show_print("---------------------------------------------------------------------------------", [self.LOG_FILE], font = self.IGREEN)
         start = self.start_time()
 
-        subsample_index = random.sample(range(1, nsequences + 1), int(params['sample_size']))
-        subsample_index.sort()
-
-        records = []
-        for index, record in enumerate(SeqIO.parse(params['input'], 'fastq'), start = 1):
-            if index in subsample_index:
-                records.append(record)
-        SeqIO.write(records, params['output'], 'fastq')
+        # One pass over the input files, reproducible with the same seed
+        n_sequences = subsample.subsample_files(params['input'], params['output'], int(params['sample_size']),
+                                                seed = params['seed'],
+                                                mode = params['mode'],
+                                                fmt = fastx.FORMAT_FASTQ)
 
+        self.show_print("  Input files: %s" % len(params['input']), [self.LOG_FILE])
+        self.show_print("  Seed: %s (%s)" % (params['seed'], params['mode']), [self.LOG_FILE])
+        self.show_print("  Number of sequences: %s" % n_sequences, [self.LOG_FILE])
         self.show_print("  Output file: %s" % params['output'], [self.LOG_FILE])
         self.show_print(self.finish_time(start, "Elapsed time"), [self.LOG_FILE])
         self.show_print("", [self.LOG_FILE])
 
-    def run_pipeline_otu(self):
-        primer_fwd, primer_rev_rc = self.run_get_primers()
+    def show_count(self, message, file):
+        self.show_print("%s: %s" % (message, self.count_sequences(file)), [self.LOG_FILE])
+        self.show_print("", [self.LOG_FILE])
 
-        for subdir, dirs, files in os.walk(self.KEY_SAMPLES_PATH):
-            for file in files:
-                if re.search('[_][Rr][1][_]?(\w|[-])*\.([Ff][Aa][Ss][Tt][Qq]|[Ff][Qq])$', file):
-                    fastq_r1_file = os.path.join(subdir, file)
-                    fastq_r2_file = file.replace('_R1', '_R2')
-                    fastq_r2_file = os.path.join(subdir, fastq_r2_file)
-                    prefix = file.split('_R1')[0]
+    def show_file(self, message, file, font = None):
+        self.show_print("%s: %s" % (message, file), [self.LOG_FILE], font = font)
+        self.show_print("", [self.LOG_FILE])
+
+    def get_stage_fingerprint(self, stage):
+        programs = {'run_vsearch': self.PROGRAM_VSEARCH,
+                    'run_usearch': self.PROGRAM_USEARCH,
+                    'run_cutadapt': self.PROGRAM_CUTADAPT,
+                    'run_blastn': self.PROGRAM_BLASTN,
+                    'run_sintax': self.PROGRAM_VSEARCH if self.KEY_SINTAX_PROGRAM == 'vsearch' else self.PROGRAM_USEARCH,
+                    'run_denoise': self.PROGRAM_VSEARCH if self.KEY_DENOISE_PROGRAM == 'vsearch' else self.PROGRAM_USEARCH}
+
+        def describe(action):
+            function = getattr(action, 'func', action)
+            name = getattr(function, '__name__', str(function))
+            args = []
+            for arg in getattr(action, 'args', []):
+                if isinstance(arg, partial):
+                    arg = describe(arg)
+                elif isinstance(arg, list):
+                    arg = [describe(item) if isinstance(item, partial) else item for item in arg]
+                args.append(arg)
+            keywords = dict(getattr(action, 'keywords', {}))
+            keywords.pop('extra_info', None)
+
+            if name in programs:
+                version = self.PROGRAM_VERSIONS.get(programs[name], '')
+            else:
+                version = self.VERSION
+
+            return [name, args, keywords, version]
+
+        arr_actions = [describe(action) for action in stage.actions]
+
+        return self.CHECKPOINTS.fingerprint(stage.name, arr_actions, stage.inputs)
+
+    def record_stage(self, stage, start, usage, status):
+        if self.METRICS is None:
+            return
+
+        self.METRICS.add_stage(stage.name, start, time.time() - start, status,
+                               threads = stage.threads,
+                               inputs = stage.inputs,
+                               outputs = stage.outputs,
+                               thread_usage = metrics.get_usage_delta(usage, metrics.get_thread_usage()))
+        try:
+            self.METRICS.save()
+        except OSError as e:
+            # The metrics never fail a stage
+            self.show_print("[WARNING] Could not write the metrics (%s): %s" % (self.METRICS.json_file, e), [self.LOG_FILE], font = self.YELLOW)
+
+    def run_stage(self, stage):
+        self.LOCAL.threads = stage.threads
+        self.LOCAL.log_buffer = []
+        self.LOCAL.stage = stage.name
+        start = self.start_time()
+        usage = metrics.get_thread_usage()
+        status = 'failed'
+        if self.PROGRESS is not None:
+            self.PROGRESS.start_stage(stage.name, stage.threads)
+        try:
+            fingerprint = None
+            if self.CHECKPOINTS is not None:
+                fingerprint = self.get_stage_fingerprint(stage)
+
+                if self.RESUME and self.CHECKPOINTS.is_current(stage.name, fingerprint, stage.outputs):
+                    self.show_print("[Skip %s] Inputs, parameters and program version didn't change" % stage.name, [self.LOG_FILE], font = self.ICYAN)
+                    status = 'skipped'
+                    return
+
+                self.CHECKPOINTS.forget(stage.name)
+
+            stage.run()
+            status = 'ok'
+
+            if fingerprint is not None:
+                self.CHECKPOINTS.record(stage.name, fingerprint, stage.outputs)
+        finally:
+            if self.PROGRESS is not None:
+                self.PROGRESS.finish_stage(stage.name, status)
+            self.record_stage(stage, start, usage, status)
+            self.flush_log_buffer()
+            self.LOCAL.threads = None
+            self.LOCAL.stage = None
+
+    def get_sample_threads(self, samples):
+        # Threads for the multi-threaded steps of one sample
+        n_samples = max(1, min(self.KEY_PARALLEL_SAMPLES, len(samples)))
+        return max(1, int(self.KEY_THREADS) // n_samples)
+
+    def report_progress(self, lines):
+        for line in lines:
+            self.show_print(line, [self.LOG_FILE], font = self.ICYAN)
+
+    def run_stages(self, graph):
+        self.show_print("Running %s stages (CPU budget: %s threads)" % (len(graph.stages), graph.cpu_budget), [self.LOG_FILE])
+
+        # The progress of the run weighs every stage by its estimated work with one thread (plan.py)
+        rows, _ = plan.read_rows([self.KEY_OUTPUT_PATH])
+        weights = dict([(stage.name, max(1.0, seconds * stage.threads)) for stage, _, _, _, seconds in self.estimate_stages(graph, plan.Model(rows))])
+        self.PROGRESS = progress.Progress(os.path.join(self.KEY_OUTPUT_PATH, self.STATUS_NAME), weights,
+                                          report = self.report_progress, report_interval = self.KEY_PROGRESS_INTERVAL)
+        self.PROGRESS.run()
+        self.show_print("Progress of the run: %s" % self.PROGRESS.file, [self.LOG_FILE])
+        self.show_print("", [self.LOG_FILE])
+
+        graph.run()
+
+    def get_plan_commands(self, action, commands):
+        # Commands of an action, without running it (Python work is shown by its name)
+        function = getattr(action, 'func', action)
+        name = getattr(function, '__name__', str(function))
+        if name == 'run_with_pipes':
+            self.get_plan_commands(action.args[0], commands)
+        elif name == 'run_streamed':
+            for item in action.args[0]:
+                self.get_plan_commands(item, commands)
+        elif name in ['run_vsearch', 'run_usearch', 'run_cutadapt', 'run_blastn', 'run_denoise', 'run_sintax', 'run_get_abundances_table']:
+            action()
+        elif name not in ['show_count', 'show_file', 'submit_fastqc', 'index_sequences']:
+            commands.append('(%s)' % name)
+
+    def get_plan_bytes(self, file, sizes):
+        # Predicted size of a file of the run, or its size on disk
+        if file in sizes:
+            return sizes[file]
+        if file in self.PLAN_DATABASE:
+            return metrics.get_files_size([self.PLAN_DATABASE[file]])
+        return metrics.get_files_size([file])
+
+    def estimate_stages(self, graph, model):
+        # Bytes read and written and time of every stage, after the ones that write its inputs
+        sizes = {}
+        estimates = []
+        for stage in graph.get_order():
+            step = metrics.get_sample_step(stage.name)[1]
+            input_bytes = sum([self.get_plan_bytes(file, sizes) for file in stage.inputs])
+            expansion_in = plan.get_expansion(stage.inputs)
+            output_bytes = model.get_output_bytes(step, input_bytes, expansion_in, plan.get_expansion(stage.outputs))
+            for file in stage.outputs:
+                sizes[file] = output_bytes / len(stage.outputs)
+            seconds = model.get_seconds(step, input_bytes, stage.threads, expansion_in)
+            estimates.append((stage, step, input_bytes, output_bytes, seconds))
+        return estimates
+
+    def plan_stages(self, graph):
+        # The artifacts of the store that aren't built yet are built before the stages
+        graph.check(existing = self.PLAN_DATABASE)
+        rows, files = plan.read_rows([self.KEY_OUTPUT_PATH] + self.PLAN)
+        model = plan.Model(rows)
+
+        self.show_print("Plan of %s stages (CPU budget: %s threads)" % (len(graph.stages), graph.cpu_budget), [self.LOG_FILE])
+        self.show_print("Model: %s stages of %s metrics files, defaults for the other steps" % (len(rows), len(files)), [self.LOG_FILE])
+        self.show_print("", [self.LOG_FILE])
+
+        seconds = {}
+        rerun = set()
+        total_outputs = 0
+        existing_outputs = 0
+        max_transient = 0
+        default_steps = set()
+        for stage, step, input_bytes, output_bytes, stage_seconds in self.estimate_stages(graph, model):
+            existing_outputs += metrics.get_files_size(stage.outputs)
+            total_outputs += output_bytes if stage.outputs else 0
+            max_transient = max(max_transient, input_bytes * plan.TRANSIENT.get(step, 0))
+            if not model.is_calibrated(step):
+                default_steps.add(step)
+
+            # With --resume, the stages that didn't change (and don't read files that will be written again) are skipped
+            skipped = False
+            if self.RESUME and self.CHECKPOINTS is not None and not rerun.intersection(stage.inputs):
+                skipped = self.CHECKPOINTS.is_current(stage.name, self.get_stage_fingerprint(stage), stage.outputs)
+            if not skipped:
+                rerun.update(stage.outputs)
+            seconds[stage.name] = 0.0 if skipped else stage_seconds
+
+            commands = []
+            self.LOCAL.threads = stage.threads
+            self.LOCAL.plan = commands
+            try:
+                for action in stage.actions:
+                    self.get_plan_commands(action, commands)
+            finally:
+                self.LOCAL.plan = None
+                self.LOCAL.threads = None
+
+            self.show_print("[%s]%s threads: %s | input: %s | output: %s | time: %s" % (stage.name, ' (skipped, --resume)' if skipped else '', stage.threads,
+                                                                                     plan.format_bytes(input_bytes), plan.format_bytes(output_bytes),
+                                                                                     plan.format_seconds(seconds[stage.name])), [self.LOG_FILE], font = self.ICYAN)
+            for command in commands:
+                self.show_print("  %s" % command, [self.LOG_FILE])
+
+        fastqc_bytes = len(self.PLAN_FASTQC) * plan.FASTQC_BYTES
+        database_bytes = metrics.get_files_size(self.PLAN_DATABASE.values())
+        peak_bytes = total_outputs + max_transient + fastqc_bytes
+        free_bytes = shutil.disk_usage(self.KEY_OUTPUT_PATH).free + existing_outputs
+
+        self.show_print("", [self.LOG_FILE])
+        self.show_print("Quality checks (FastQC): %s files, %s" % (len(self.PLAN_FASTQC), plan.format_bytes(fastqc_bytes)), [self.LOG_FILE])
+        if self.PLAN_DATABASE:
+            self.show_print("Database artifacts to build: %s, about %s (%s)" % (len(self.PLAN_DATABASE), plan.format_bytes(database_bytes), self.KEY_DATABASE_CACHE), [self.LOG_FILE])
+        self.show_print("Peak disk usage in '%s': %s (free: %s)" % (self.KEY_OUTPUT_PATH, plan.format_bytes(peak_bytes), plan.format_bytes(free_bytes)), [self.LOG_FILE])
+        self.show_print("Estimated time: %s (%s of stages)" % (plan.format_seconds(plan.simulate(graph, seconds)), plan.format_seconds(sum(seconds.values()))), [self.LOG_FILE])
+        if default_steps:
+            self.show_print("Steps without earlier metrics (default model): %s" % ', '.join(sorted(default_steps)), [self.LOG_FILE])
+        self.show_print("", [self.LOG_FILE])
 
-                    #################################################################################
-                    # [Rawdata] Checking the quality of the reads
-                    #################################################################################
+        if peak_bytes > free_bytes:
+            self.show_print("[WARNING] The predicted peak disk usage (%s) doesn't fit in the free space of '%s' (%s)" % (plan.format_bytes(peak_bytes), self.KEY_OUTPUT_PATH, plan.format_bytes(free_bytes)), [self.LOG_FILE], font = self.YELLOW)
+            sys.exit(1)
 
-                    info = '%s: Checking the quality of the reads [R1]' % prefix
-                    params = {'input': fastq_r1_file}
-                    self.run_fastqc(params, extra_info = info)
+    def add_sample_stages_otu(self, graph, sample, threads, primer_fwd, primer_rev_rc):
+        fastq_r1_file = sample['r1']
+        fastq_r2_file = sample['r2']
+        prefix = sample['prefix']
 
-                    info = '%s: Checking the quality of the reads [R2]' % prefix
-                    params = {'input': fastq_r2_file}
-                    self.run_fastqc(params, extra_info = info)
+        # Largest samples first; side branches (primer checks) only fill the spare threads
+        priority = sample['size']
+        side_priority = -1
 
-                    #################################################################################
-                    # Merge paired-end sequence reads into one sequence
-                    #################################################################################
+        #################################################################################
+        # [Rawdata] Checking the quality of the reads (background queue)
+        #################################################################################
 
-                    output_merged = '%s.merged.fq' % prefix
-                    output_merged = os.path.join(self.KEY_OUTPUT_PATH, output_merged)
-                    info = '%s: Merge paired-end sequence reads' % prefix
+        self.submit_fastqc(fastq_r1_file)
+        self.submit_fastqc(fastq_r2_file)
 
-                    params = {'r1': fastq_r1_file,
-                              'r2': fastq_r2_file,
-                              'output': output_merged}
+        #################################################################################
+        # Merge paired-end sequence reads into one sequence
+        #################################################################################
 
-                    self.run_vsearch(params, step = 'fastq_mergepairs', extra_info = info)
+        output_merged = self.get_intermediate_file('%s.merged.fq' % prefix)
+        output_merged = os.path.join(self.KEY_OUTPUT_PATH, output_merged)
+        info = '%s: Merge paired-end sequence reads' % prefix
 
-                    #################################################################################
-                    # [Merged] Checking the quality of the reads
-                    #################################################################################
+        params = {'r1': self.get_program_input(fastq_r1_file),
+                  'r2': self.get_program_input(fastq_r2_file),
+                  'output': self.get_program_output(output_merged)}
 
-                    info = '%s: Checking the quality of the reads' % prefix
-                    params = {'input': output_merged}
-                    self.run_fastqc(params, extra_info = info)
+        action_merge = self.get_pipes_action(partial(self.run_vsearch, params, step = 'fastq_mergepairs', extra_info = info),
+                                             inputs = [[fastq_r1_file, params['r1']], [fastq_r2_file, params['r2']]],
+                                             outputs = [[output_merged, params['output']]])
 
-                    #################################################################################
-                    # Verification of the primers
-                    # Extraction of a subsample of 1000 reads
-                    #################################################################################
+        graph.add(Stage(name = '%s.fastq_mergepairs' % prefix,
+                        actions = [action_merge,
+                                   partial(self.submit_fastqc, output_merged)],
+                        inputs = [fastq_r1_file, fastq_r2_file],
+                        outputs = [output_merged],
+                        threads = threads,
+                        priority = priority))
 
-                    output_subset = '%s.merged_subset_1000.fq' % prefix
-                    output_subset = os.path.join(self.KEY_OUTPUT_PATH, output_subset)
-                    info = '%s: Extraction of a subsample of 1000 reads' % prefix
+        #################################################################################
+        # Verification of the primers
+        # Extraction of a subsample of 1000 reads
+        #################################################################################
 
-                    params = {'input': output_merged,
-                              'sample_size': '1000',
-                              'output': output_subset}
+        output_subset = '%s.merged_subset_1000.fq' % prefix
+        output_subset = os.path.join(self.KEY_OUTPUT_PATH, output_subset)
+        info = '%s: Extraction of a subsample of 1000 reads' % prefix
 
-                    self.run_usearch(params, step = 'fastx_subsample', extra_info = info)
+        params = {'input': [output_merged],
+                  'sample_size': '1000',
+                  'seed': self.KEY_SUBSAMPLE_SEED,
+                  'mode': subsample.MODE_PROPORTIONAL,
+                  'output': output_subset}
 
-                    #################################################################################
-                    # Verification of the position of the primers
-                    #################################################################################
+        graph.add(Stage(name = '%s.subsample' % prefix,
+                        actions = partial(self.subsample_fq, params, extra_info = info),
+                        inputs = [output_merged],
+                        outputs = [output_subset],
+                        priority = side_priority))
 
-                    primers_file = os.path.join(self.KEY_DATABASE_PATH, self.KEY_PRIMERS_FILE)
-                    output_oligodb = '%s.merged_primer_hits.txt' % prefix
-                    output_oligodb = os.path.join(self.KEY_OUTPUT_PATH, output_oligodb)
-                    info = '%s: Verification of the position of the primers' % prefix
+        #################################################################################
+        # Verification of the position of the primers
+        #################################################################################
 
-                    params = {'input': output_subset,
-                              'db': primers_file,
-                              'strand': 'both',
-                              'userfields': 'query+qlo+qhi+qstrand',
-                              'output': output_oligodb}
+        primers_file = os.path.join(self.KEY_DATABASE_PATH, self.KEY_PRIMERS_FILE)
+        output_oligodb = '%s.merged_primer_hits.txt' % prefix
+        output_oligodb = os.path.join(self.KEY_OUTPUT_PATH, output_oligodb)
+        info = '%s: Verification of the position of the primers' % prefix
 
-                    self.run_usearch(params, step = 'search_oligodb', extra_info = info)
+        params = {'input': output_subset,
+                  'db': primers_file,
+                  'strand': 'both',
+                  'userfields': 'query+qlo+qhi+qstrand',
+                  'output': output_oligodb}
+
+        graph.add(Stage(name = '%s.search_oligodb' % prefix,
+                        actions = partial(self.run_usearch, params, step = 'search_oligodb', extra_info = info),
+                        inputs = [output_subset, primers_file],
+                        outputs = [output_oligodb],
+                        priority = side_priority))
+
+        #################################################################################
+        # Removal of the forward-primer (5')
+        #################################################################################
+
+        output_trimmed_pfwd = self.get_intermediate_file('%s.trimmed_pfwd.fq' % prefix)
+        output_trimmed_pfwd = os.path.join(self.KEY_OUTPUT_PATH, output_trimmed_pfwd)
+        info = '%s: Removal of the forward-primer (5\')' % prefix
 
-                    #################################################################################
-                    # Removal of the forward-primer (5')
-                    #################################################################################
+        stream_trimmed_pfwd = self.get_stream_file(output_trimmed_pfwd)
+
+        params = {'input': output_merged,
+                  'f_primer': primer_fwd,
+                  'output': stream_trimmed_pfwd}
+
+        action_forward = partial(self.run_cutadapt, params, step = 'forward', extra_info = info)
+        if not self.is_streaming():
+            graph.add(Stage(name = '%s.cutadapt_forward' % prefix,
+                            actions = action_forward,
+                            inputs = [output_merged],
+                            outputs = [output_trimmed_pfwd],
+                            priority = priority))
+
+        #################################################################################
+        # Removal of the reverse-primer (3')
+        #################################################################################
 
-                    output_trimmed_pfwd = '%s.trimmed_pfwd.fq' % prefix
-                    output_trimmed_pfwd = os.path.join(self.KEY_OUTPUT_PATH, output_trimmed_pfwd)
-                    info = '%s: Removal of the forward-primer (5\')' % prefix
+        output_trimmed_prev = self.get_intermediate_file('%s.trimmed_prev.fq' % prefix)
+        output_trimmed_prev = os.path.join(self.KEY_OUTPUT_PATH, output_trimmed_prev)
+        info = '%s: Removal of the reverse-primer (3\')' % prefix
 
-                    params = {'input': output_merged,
-                              'f_primer': primer_fwd,
-                              'output': output_trimmed_pfwd}
+        stream_trimmed_prev = self.get_stream_file(output_trimmed_prev)
 
-                    self.run_cutadapt(params, step = 'forward', extra_info = info)
+        params = {'input': stream_trimmed_pfwd,
+                  'r_primer_rc': primer_rev_rc,
+                  'output': stream_trimmed_prev}
 
-                    #################################################################################
-                    # Removal of the reverse-primer (3')
-                    #################################################################################
+        action_reverse = partial(self.run_cutadapt, params, step = 'reverse', extra_info = info)
+        if not self.is_streaming():
+            graph.add(Stage(name = '%s.cutadapt_reverse' % prefix,
+                            actions = action_reverse,
+                            inputs = [output_trimmed_pfwd],
+                            outputs = [output_trimmed_prev],
+                            priority = priority))
 
-                    output_trimmed_prev = '%s.trimmed_prev.fq' % prefix
-                    output_trimmed_prev = os.path.join(self.KEY_OUTPUT_PATH, output_trimmed_prev)
-                    info = '%s: Removal of the reverse-primer (3\')' % prefix
+        #################################################################################
+        # Quality filtering
+        #################################################################################
 
-                    params = {'input': output_trimmed_pfwd,
-                              'r_primer_rc': primer_rev_rc,
-                              'output': output_trimmed_prev}
+        output_filter_fq = self.get_intermediate_file('%s.filtered.fq' % prefix)
+        output_filter_fq = os.path.join(self.KEY_OUTPUT_PATH, output_filter_fq)
+        output_filter_fa = '%s.filtered.fa' % prefix
+        output_filter_fa = os.path.join(self.KEY_OUTPUT_PATH, output_filter_fa)
+        info = '%s: Quality filtering' % prefix
 
-                    self.run_cutadapt(params, step = 'reverse', extra_info = info)
+        params = {'input': stream_trimmed_prev,
+                  'fastq_maxee': self.KEY_FILTER_MAXEE, # 0.5
+                  'fastq_minlen': self.KEY_FILTER_MINLEN, # 300
+                  'fasta_width': '0',
+                  'fastqout': self.get_program_output(output_filter_fq),
+                  'fastaout': output_filter_fa,
+                  'relabel': '%s.' % prefix}
 
-                    #################################################################################
-                    # Quality filtering
-                    #################################################################################
+        if self.KEY_FILTER_MAXLEN:
+            params.update({'fastq_maxlen': self.KEY_FILTER_MAXLEN})
 
-                    output_filter_fq = '%s.filtered.fq' % prefix
-                    output_filter_fq = os.path.join(self.KEY_OUTPUT_PATH, output_filter_fq)
-                    output_filter_fa = '%s.filtered.fa' % prefix
-                    output_filter_fa = os.path.join(self.KEY_OUTPUT_PATH, output_filter_fa)
-                    info = '%s: Quality filtering' % prefix
+        action_filter = self.get_pipes_action(partial(self.run_vsearch, params, step = 'fastq_filter', extra_info = info),
+                                              outputs = [[output_filter_fq, params['fastqout']]])
+        if self.is_streaming():
+            # Primer removal and quality filtering at the same time, connected through named pipes
+            graph.add(Stage(name = '%s.trim_filter' % prefix,
+                            actions = [partial(self.run_streamed, [action_forward, action_reverse, action_filter], [stream_trimmed_pfwd, stream_trimmed_prev]),
+                                       partial(self.submit_fastqc, output_filter_fq),
+                                       partial(self.index_sequences, output_filter_fa)],
+                            inputs = [output_merged],
+                            outputs = [output_filter_fq, output_filter_fa],
+                            threads = 3,
+                            priority = priority))
+        else:
+            graph.add(Stage(name = '%s.fastq_filter' % prefix,
+                            actions = [action_filter,
+                                       partial(self.submit_fastqc, output_filter_fq),
+                                       partial(self.index_sequences, output_filter_fa)],
+                            inputs = [output_trimmed_prev],
+                            outputs = [output_filter_fq, output_filter_fa],
+                            priority = priority))
 
-                    params = {'input': output_trimmed_prev,
-                              'fastq_maxee': self.KEY_FILTER_MAXEE, # 0.5
-                              'fastq_minlen': self.KEY_FILTER_MINLEN, # 300
-                              'fasta_width': '0',
-                              'fastqout': output_filter_fq,
-                              'fastaout': output_filter_fa,
-                              'relabel': '%s.' % prefix}
+        return output_filter_fa
 
-                    if self.KEY_FILTER_MAXLEN:
-                        params.update({'fastq_maxlen': self.KEY_FILTER_MAXLEN})
+    def run_pipeline_otu(self):
+        primer_fwd, primer_rev_rc = self.run_get_primers()
+        self.DATABASE_FILES = self.prepare_database()
+        self.start_fastqc()
 
-                    self.run_vsearch(params, step = 'fastq_filter', extra_info = info)
+        graph = Scheduler(self.KEY_THREADS, runner = self.run_stage)
+        threads = int(self.KEY_THREADS)
 
-                    #################################################################################
-                    # [Filtered] Checking the quality of the reads
-                    #################################################################################
+        samples = self.get_samples()
+        sample_threads = self.get_sample_threads(samples)
 
-                    info = '%s: Checking the quality of the reads' % prefix
-                    params = {'input': output_filter_fq}
-                    self.run_fastqc(params, extra_info = info)
+        arr_filtered = []
+        for sample in samples:
+            output_filter_fa = self.add_sample_stages_otu(graph, sample, sample_threads, primer_fwd, primer_rev_rc)
+            arr_filtered.append(output_filter_fa)
 
         #################################################################################
         # Merge all samples
@@ -1122,7 +2249,11 @@ class Pipeline:
         all_fasta_file = '%s.fa' % prefix
         all_fasta_file = os.path.join(self.KEY_OUTPUT_PATH, all_fasta_file)
 
-        self.run_merge_all(all_fasta_file, prefix)
+        graph.add(Stage(name = 'merge_all',
+                        actions = partial(self.run_merge_all, arr_filtered, all_fasta_file),
+                        inputs = arr_filtered,
+                        outputs = [] if self.KEY_VIRTUAL_POOL else [all_fasta_file]))
+        pooled_inputs = arr_filtered if self.KEY_VIRTUAL_POOL else [all_fasta_file]
 
         #################################################################################
         # Dereplicate across samples and remove singletons
@@ -1134,16 +2265,17 @@ class Pipeline:
         output_dereplicated_all_uc = os.path.join(self.KEY_OUTPUT_PATH, output_dereplicated_all_uc)
         info = 'Dereplicate across samples and remove singletons'
 
-        params = {'input': all_fasta_file,
+        params = {'input': self.get_pool_input(all_fasta_file, 'derep_fulllength_all'),
                   'minuniquesize': '2',
                   'fasta_width': '0',
                   'uc': output_dereplicated_all_uc,
                   'output': output_dereplicated_all}
 
-        self.run_vsearch(params, step = 'derep_fulllength_all', extra_info = info)
-
-        self.show_print("Unique non-singleton sequences: %s" % self.count_sequences(output_dereplicated_all), [self.LOG_FILE])
-        self.show_print("", [self.LOG_FILE])
+        graph.add(Stage(name = 'derep_fulllength_all',
+                        actions = [self.get_pool_action(partial(self.run_vsearch, params, step = 'derep_fulllength_all', extra_info = info), arr_filtered, params['input']),
+                                   partial(self.show_count, "Unique non-singleton sequences", output_dereplicated_all)],
+                        inputs = pooled_inputs,
+                        outputs = [output_dereplicated_all, output_dereplicated_all_uc]))
 
         #################################################################################
         # Precluster at 97% before chimera detection
@@ -1162,10 +2294,12 @@ class Pipeline:
                   'uc': output_preclustered_all_uc,
                   'centroids': output_preclustered_all}
 
-        self.run_vsearch(params, step = 'cluster_size', extra_info = info)
-
-        self.show_print("Unique sequences after preclustering: %s" % self.count_sequences(output_preclustered_all), [self.LOG_FILE])
-        self.show_print("", [self.LOG_FILE])
+        graph.add(Stage(name = 'cluster_size',
+                        actions = [partial(self.run_vsearch, params, step = 'cluster_size', extra_info = info),
+                                   partial(self.show_count, "Unique sequences after preclustering", output_preclustered_all)],
+                        inputs = [output_dereplicated_all],
+                        outputs = [output_preclustered_all, output_preclustered_all_uc],
+                        threads = threads))
 
         #################################################################################
         # De novo chimera detection
@@ -1179,16 +2313,17 @@ class Pipeline:
                   'fasta_width': '0',
                   'nonchimeras': output_nonchimeras_dn}
 
-        self.run_vsearch(params, step = 'uchime_denovo', extra_info = info)
-
-        self.show_print("Unique sequences after de novo chimera detection: %s" % self.count_sequences(output_nonchimeras_dn), [self.LOG_FILE])
-        self.show_print("", [self.LOG_FILE])
+        graph.add(Stage(name = 'uchime_denovo',
+                        actions = [partial(self.run_vsearch, params, step = 'uchime_denovo', extra_info = info),
+                                   partial(self.show_count, "Unique sequences after de novo chimera detection", output_nonchimeras_dn)],
+                        inputs = [output_preclustered_all],
+                        outputs = [output_nonchimeras_dn]))
 
         #################################################################################
         # Reference chimera detection
         #################################################################################
 
-        database_fasta = os.path.join(self.KEY_DATABASE_PATH, self.KEY_DATABASE_FASTA)
+        database_fasta = self.DATABASE_FILES['uchime_ref']
         output_nonchimeras_ref = '%s.ref.nonchimeras.fa' % prefix
         output_nonchimeras_ref = os.path.join(self.KEY_OUTPUT_PATH, output_nonchimeras_ref)
         info = 'Reference chimera detection'
@@ -1199,10 +2334,12 @@ class Pipeline:
                   'fasta_width': '0',
                   'nonchimeras': output_nonchimeras_ref}
 
-        self.run_vsearch(params, step = 'uchime_ref', extra_info = info)
-
-        self.show_print("Unique sequences after reference-based chimera detection: %s" % self.count_sequences(output_nonchimeras_ref), [self.LOG_FILE])
-        self.show_print("", [self.LOG_FILE])
+        graph.add(Stage(name = 'uchime_ref',
+                        actions = [partial(self.run_vsearch, params, step = 'uchime_ref', extra_info = info),
+                                   partial(self.show_count, "Unique sequences after reference-based chimera detection", output_nonchimeras_ref)],
+                        inputs = [output_nonchimeras_dn, database_fasta],
+                        outputs = [output_nonchimeras_ref],
+                        threads = threads))
 
         #################################################################################
         # Extract all non-chimeric, non-singleton sequences, dereplicated
@@ -1217,10 +2354,11 @@ class Pipeline:
                   'fasta2': output_nonchimeras_ref,
                   'output': output_map_1}
 
-        self.run_map(params, extra_info = info)
-
-        self.show_print("Unique non-chimeric, non-singleton sequences: %s" % self.count_sequences(output_map_1), [self.LOG_FILE])
-        self.show_print("", [self.LOG_FILE])
+        graph.add(Stage(name = 'map_dereplicated',
+                        actions = [partial(self.run_map, params, extra_info = info),
+                                   partial(self.show_count, "Unique non-chimeric, non-singleton sequences", output_map_1)],
+                        inputs = [output_dereplicated_all, output_preclustered_all_uc, output_nonchimeras_ref],
+                        outputs = [output_map_1]))
 
         #################################################################################
         # Extract all non-chimeric, non-singleton sequences in each sample
@@ -1230,15 +2368,17 @@ class Pipeline:
         output_map_2 = os.path.join(self.KEY_OUTPUT_PATH, output_map_2)
         info = 'Extract all non-chimeric, non-singleton sequences in each sample'
 
-        params = {'fasta1': all_fasta_file,
+        # With the virtual pool the per-sample files are read one after the other
+        params = {'fasta1': arr_filtered if self.KEY_VIRTUAL_POOL else all_fasta_file,
                   'uc': output_dereplicated_all_uc,
                   'fasta2': output_map_1,
                   'output': output_map_2}
 
-        self.run_map(params, extra_info = info)
-
-        self.show_print("Sum of unique non-chimeric, non-singleton sequences in each sample: %s" % self.count_sequences(output_map_1), [self.LOG_FILE])
-        self.show_print("", [self.LOG_FILE])
+        graph.add(Stage(name = 'map_samples',
+                        actions = [partial(self.run_map, params, extra_info = info),
+                                   partial(self.show_count, "Sum of unique non-chimeric, non-singleton sequences in each sample", output_map_1)],
+                        inputs = pooled_inputs + [output_dereplicated_all_uc, output_map_1],
+                        outputs = [output_map_2]))
 
         #################################################################################
         # Cluster at 97% and relabel with OTU_n, generate OTU table
@@ -1264,16 +2404,18 @@ class Pipeline:
                   'otutabout': output_cluster_otutab,
                   'biomout': output_cluster_biom}
 
-        self.run_vsearch(params, step = 'cluster_size_otu_table', extra_info = info)
-
-        self.show_print("Number of OTUs: %s" % self.count_sequences(output_cluster_fa), [self.LOG_FILE])
-        self.show_print("", [self.LOG_FILE])
+        graph.add(Stage(name = 'cluster_size_otu_table',
+                        actions = [partial(self.run_vsearch, params, step = 'cluster_size_otu_table', extra_info = info),
+                                   partial(self.show_count, "Number of OTUs", output_cluster_fa)],
+                        inputs = [output_map_2],
+                        outputs = [output_cluster_fa, output_cluster_uc, output_cluster_otutab, output_cluster_biom],
+                        threads = threads))
 
         #################################################################################
         # Identification of OTUs using BLAST
         #################################################################################
 
-        database_bin = os.path.join(self.KEY_DATABASE_PATH, self.KEY_DATABASE_BIN)
+        database_bin = self.DATABASE_FILES['blast']
         output_blastn = 'taxonomy.blast'
         output_blastn = os.path.join(self.KEY_OUTPUT_PATH, output_blastn)
         info = 'Identification of OTUs using BLAST'
@@ -1282,94 +2424,124 @@ class Pipeline:
                   'query': output_cluster_fa,
                   'perc_identity': self.KEY_BLAST_ID, # 97.0
                   'qcov_hsp_perc': '90.0',
+                  'max_target_seqs': self.KEY_BLAST_MAX_TARGET_SEQS, # None: no limit
+                  'max_hsps': self.KEY_BLAST_MAX_HSPS, # None: no limit
                   'outfmt': '6 qseqid sseqid stitle pident length mismatch gapopen qstart qend sstart send evalue bitscore qcovhsp qcovs',
                   'out': output_blastn}
 
-        self.run_blastn(params, extra_info = info)
-
-        self.show_print("Blast file: %s" % output_blastn, [self.LOG_FILE])
-        self.show_print("", [self.LOG_FILE])
+        graph.add(Stage(name = 'blastn',
+                        actions = [partial(self.run_blastn, params, extra_info = info),
+                                   partial(self.show_file, "Blast file", output_blastn)],
+                        inputs = [output_cluster_fa],
+                        outputs = [output_blastn],
+                        threads = int(self.KEY_THREADS)))
 
         #################################################################################
         # Get table of abundances of OTUs with taxonomy
         #################################################################################
 
-        output_abundances_table = 'abundance_table_otu.csv'
-        output_abundances_table = os.path.join(self.KEY_OUTPUT_PATH, output_abundances_table)
+        output_abundances_tables = self.get_abundance_files('abundance_table_otu')
         info = 'Get table of abundances of OTUs with taxonomy'
 
         params = {'db_type': self.KEY_DATABASE_TYPE,
                   'blast_file': output_blastn,
                   'otutab_file': output_cluster_otutab,
-                  'output': output_abundances_table}
+                  'output': output_abundances_tables}
 
-        self.run_get_abundances_table(params, extra_info = info)
+        graph.add(Stage(name = 'abundances_table',
+                        actions = [partial(self.run_get_abundances_table, params, extra_info = info)] +
+                                  [partial(self.show_file, "Abundance file", output_file, font = self.IGREEN) for output_file in output_abundances_tables],
+                        inputs = [output_blastn, output_cluster_otutab],
+                        outputs = output_abundances_tables))
 
-        self.show_print("Abundance file: %s" % output_abundances_table, [self.LOG_FILE], font = opipe.IGREEN)
-        self.show_print("", [self.LOG_FILE])
+        if self.PLAN is not None:
+            self.plan_stages(graph)
+            return
 
-    def run_pipeline_asv(self):
-        primer_fwd, primer_rev_rc = self.run_get_primers()
+        self.run_stages(graph)
+        self.drain_fastqc()
 
-        for subdir, dirs, files in os.walk(self.KEY_SAMPLES_PATH):
-            for file in files:
-                if re.search('[_][Rr][1][_]?(\w|[-])*\.([Ff][Aa][Ss][Tt][Qq]|[Ff][Qq])$', file):
-                    fastq_r1_file = os.path.join(subdir, file)
-                    fastq_r2_file = file.replace('_R1', '_R2')
-                    fastq_r2_file = os.path.join(subdir, fastq_r2_file)
-                    prefix = file.split('_R1')[0]
+    def add_sample_stages_asv(self, graph, sample, threads):
+        fastq_r1_file = sample['r1']
+        fastq_r2_file = sample['r2']
+        prefix = sample['prefix']
 
-                    #################################################################################
-                    # [Rawdata] Checking the quality of the reads
-                    #################################################################################
+        # Largest samples first
+        priority = sample['size']
 
-                    info = '%s: Checking the quality of the reads [R1]' % prefix
-                    params = {'input': fastq_r1_file}
-                    self.run_fastqc(params, extra_info = info)
+        #################################################################################
+        # [Rawdata] Checking the quality of the reads (background queue)
+        #################################################################################
 
-                    info = '%s: Checking the quality of the reads [R2]' % prefix
-                    params = {'input': fastq_r2_file}
-                    self.run_fastqc(params, extra_info = info)
+        self.submit_fastqc(fastq_r1_file)
+        self.submit_fastqc(fastq_r2_file)
 
-                    #################################################################################
-                    # Merge paired-end sequence reads into one sequence
-                    #################################################################################
+        #################################################################################
+        # Merge paired-end sequence reads into one sequence
+        #################################################################################
 
-                    output_merged = '%s.merged.fq' % prefix
-                    output_merged = os.path.join(self.KEY_OUTPUT_PATH, output_merged)
-                    info = '%s: Merge paired-end sequence reads' % prefix
+        output_merged = self.get_intermediate_file('%s.merged.fq' % prefix)
+        output_merged = os.path.join(self.KEY_OUTPUT_PATH, output_merged)
+        info = '%s: Merge paired-end sequence reads' % prefix
 
-                    params = {'r1': fastq_r1_file,
-                              'r2': fastq_r2_file,
-                              'output': output_merged,
-                              'relabel': '%s.' % prefix}
+        params = {'r1': self.get_program_input(fastq_r1_file),
+                  'r2': self.get_program_input(fastq_r2_file),
+                  'output': self.get_program_output(output_merged),
+                  'relabel': '%s.' % prefix}
 
-                    self.run_vsearch(params, step = 'fastq_mergepairs', extra_info = info)
+        action_merge = self.get_pipes_action(partial(self.run_vsearch, params, step = 'fastq_mergepairs', extra_info = info),
+                                             inputs = [[fastq_r1_file, params['r1']], [fastq_r2_file, params['r2']]],
+                                             outputs = [[output_merged, params['output']]])
 
-                    #################################################################################
-                    # [Merged] Checking the quality of the reads
-                    #################################################################################
+        graph.add(Stage(name = '%s.fastq_mergepairs' % prefix,
+                        actions = [action_merge,
+                                   partial(self.submit_fastqc, output_merged),
+                                   partial(self.index_sequences, output_merged)],
+                        inputs = [fastq_r1_file, fastq_r2_file],
+                        outputs = [output_merged],
+                        threads = threads,
+                        priority = priority))
 
-                    info = '%s: Checking the quality of the reads' % prefix
-                    params = {'input': output_merged}
-                    self.run_fastqc(params, extra_info = info)
+        return output_merged
 
-        #################################################################################
-        # Merge all samples into one fastq file
-        #################################################################################
+    def run_pipeline_asv(self):
+        primer_fwd, primer_rev_rc = self.run_get_primers()
+        self.DATABASE_FILES = self.prepare_database()
+        self.start_fastqc()
 
-        output_merged = 'all_samples_merged.fq'
-        output_merged = os.path.join(self.KEY_OUTPUT_PATH, output_merged)
+        graph = Scheduler(self.KEY_THREADS, runner = self.run_stage)
+        threads = int(self.KEY_THREADS)
+        side_priority = -1
 
-        n_seqs = self.run_merge_all(output_merged)
+        samples = self.get_samples()
+        sample_threads = self.get_sample_threads(samples)
+
+        arr_merged = []
+        for sample in samples:
+            output_merged = self.add_sample_stages_asv(graph, sample, sample_threads)
+            arr_merged.append(output_merged)
 
         #################################################################################
-        # [Merged] Checking the quality of the reads
+        # Merge all samples into one fastq file
         #################################################################################
 
-        info = '[Merged] Checking the quality of the reads'
-        params = {'input': output_merged}
-        self.run_fastqc(params, extra_info = info)
+        output_merged = self.get_intermediate_file('all_samples_merged.fq')
+        output_merged = os.path.join(self.KEY_OUTPUT_PATH, output_merged)
+
+        if self.KEY_VIRTUAL_POOL:
+            # The samples were already checked one by one by FastQC
+            graph.add(Stage(name = 'merge_all',
+                            actions = partial(self.run_merge_all, arr_merged, output_merged),
+                            inputs = arr_merged,
+                            outputs = []))
+            pooled_inputs = arr_merged
+        else:
+            graph.add(Stage(name = 'merge_all',
+                            actions = [partial(self.run_merge_all, arr_merged, output_merged),
+                                       partial(self.submit_fastqc, output_merged)],
+                            inputs = arr_merged,
+                            outputs = [output_merged]))
+            pooled_inputs = [output_merged]
 
         #################################################################################
         # Verification of the primers
@@ -1379,11 +2551,18 @@ class Pipeline:
         output_subset = 'subset_1000_samples_merged.fq'
         output_subset = os.path.join(self.KEY_OUTPUT_PATH, output_subset)
 
-        params = {'input': output_merged,
+        # Sampled straight from the per-sample files, every read with the same chance
+        params = {'input': arr_merged,
                   'sample_size': '1000',
+                  'seed': self.KEY_SUBSAMPLE_SEED,
+                  'mode': subsample.MODE_PROPORTIONAL,
                   'output': output_subset}
 
-        self.subsample_fq(params, n_seqs)
+        graph.add(Stage(name = 'subsample',
+                        actions = partial(self.subsample_fq, params),
+                        inputs = arr_merged,
+                        outputs = [output_subset],
+                        priority = side_priority))
 
         #################################################################################
         # Verification of the position of the primers
@@ -1400,66 +2579,93 @@ class Pipeline:
                   'userfields': 'query+qlo+qhi+qstrand',
                   'output': output_oligodb}
 
-        self.run_usearch(params, step = 'search_oligodb', extra_info = info)
+        graph.add(Stage(name = 'search_oligodb',
+                        actions = partial(self.run_usearch, params, step = 'search_oligodb', extra_info = info),
+                        inputs = [output_subset, primers_file],
+                        outputs = [output_oligodb],
+                        priority = side_priority))
 
         #################################################################################
         # Removal of the forward-primer (5')
         #################################################################################
 
-        output_trimmed_pfwd = 'all_samples_trimmed_pfwd.fq'
+        output_trimmed_pfwd = self.get_intermediate_file('all_samples_trimmed_pfwd.fq')
         output_trimmed_pfwd = os.path.join(self.KEY_OUTPUT_PATH, output_trimmed_pfwd)
         info = 'Removal of the forward-primer (5\')'
 
-        params = {'input': output_merged,
+        stream_trimmed_pfwd = self.get_stream_file(output_trimmed_pfwd)
+        pool_input = self.get_pool_input(output_merged, 'cutadapt_forward')
+
+        params = {'input': pool_input,
                   'f_primer': primer_fwd,
-                  'output': output_trimmed_pfwd}
+                  'output': stream_trimmed_pfwd}
 
-        self.run_cutadapt(params, step = 'forward', extra_info = info)
+        action_forward = partial(self.run_cutadapt, params, step = 'forward', extra_info = info)
+        if not self.is_streaming():
+            graph.add(Stage(name = 'cutadapt_forward',
+                            actions = self.get_pool_action(action_forward, arr_merged, pool_input),
+                            inputs = pooled_inputs,
+                            outputs = [output_trimmed_pfwd]))
 
         #################################################################################
         # Removal of the reverse-primer (3')
         #################################################################################
 
-        output_trimmed_prev = 'all_samples_trimmed_prev.fq'
+        output_trimmed_prev = self.get_intermediate_file('all_samples_trimmed_prev.fq')
         output_trimmed_prev = os.path.join(self.KEY_OUTPUT_PATH, output_trimmed_prev)
         info = 'Removal of the reverse-primer (3\')'
 
-        params = {'input': output_trimmed_pfwd,
+        stream_trimmed_prev = self.get_stream_file(output_trimmed_prev)
+
+        params = {'input': stream_trimmed_pfwd,
                   'r_primer_rc': primer_rev_rc,
-                  'output': output_trimmed_prev}
+                  'output': stream_trimmed_prev}
 
-        self.run_cutadapt(params, step = 'reverse', extra_info = info)
+        action_reverse = partial(self.run_cutadapt, params, step = 'reverse', extra_info = info)
+        if not self.is_streaming():
+            graph.add(Stage(name = 'cutadapt_reverse',
+                            actions = action_reverse,
+                            inputs = [output_trimmed_pfwd],
+                            outputs = [output_trimmed_prev]))
 
         #################################################################################
         # Quality filtering
         #################################################################################
 
-        output_filter_fq = 'all_samples_filtered.fq'
+        output_filter_fq = self.get_intermediate_file('all_samples_filtered.fq')
         output_filter_fq = os.path.join(self.KEY_OUTPUT_PATH, output_filter_fq)
         output_filter_fa = 'all_samples_filtered.fa'
         output_filter_fa = os.path.join(self.KEY_OUTPUT_PATH, output_filter_fa)
         info = 'Quality filtering'
 
-        params = {'input': output_trimmed_prev,
+        params = {'input': stream_trimmed_prev,
                   'fastq_maxee': self.KEY_FILTER_MAXEE, # 0.5
                   'fastq_minlen': self.KEY_FILTER_MINLEN, # 300
                   'fasta_width': '0',
                   'fastq_qmax': '45',
-                  'fastqout': output_filter_fq,
+                  'fastqout': self.get_program_output(output_filter_fq),
                   'fastaout': output_filter_fa}
 
         if self.KEY_FILTER_MAXLEN:
             params.update({'fastq_maxlen': self.KEY_FILTER_MAXLEN})
 
-        self.run_vsearch(params, step = 'fastq_filter', extra_info = info)
-
-        #################################################################################
-        # [Filtered] Checking the quality of the reads
-        #################################################################################
-
-        info = '[Filtered] Checking the quality of the reads'
-        params = {'input': output_filter_fq}
-        self.run_fastqc(params, extra_info = info)
+        action_filter = self.get_pipes_action(partial(self.run_vsearch, params, step = 'fastq_filter', extra_info = info),
+                                              outputs = [[output_filter_fq, params['fastqout']]])
+        if self.is_streaming():
+            # Primer removal and quality filtering at the same time, connected through named pipes
+            action_streamed = partial(self.run_streamed, [action_forward, action_reverse, action_filter], [stream_trimmed_pfwd, stream_trimmed_prev])
+            graph.add(Stage(name = 'trim_filter',
+                            actions = [self.get_pool_action(action_streamed, arr_merged, pool_input),
+                                       partial(self.submit_fastqc, output_filter_fq)],
+                            inputs = pooled_inputs,
+                            outputs = [output_filter_fq, output_filter_fa],
+                            threads = 3))
+        else:
+            graph.add(Stage(name = 'fastq_filter',
+                            actions = [action_filter,
+                                       partial(self.submit_fastqc, output_filter_fq)],
+                            inputs = [output_trimmed_prev],
+                            outputs = [output_filter_fq, output_filter_fa]))
 
         #################################################################################
         # Dereplicate reads
@@ -1477,7 +2683,10 @@ class Pipeline:
                   'uc': output_fulllength_uc,
                   'output': output_fulllength}
 
-        self.run_vsearch(params, step = 'derep_fulllength', extra_info = info)
+        graph.add(Stage(name = 'derep_fulllength',
+                        actions = partial(self.run_vsearch, params, step = 'derep_fulllength', extra_info = info),
+                        inputs = [output_filter_fa],
+                        outputs = [output_fulllength, output_fulllength_uc]))
 
         #################################################################################
         # Generating ASVs
@@ -1491,17 +2700,22 @@ class Pipeline:
         info = 'Generating ASVs'
 
         params = {'input': output_fulllength,
+                  'minsize': '8', # Defaults of unoise3 (vsearch)
+                  'unoise_alpha': '2.0',
                   'tabbedout': output_unoise3_txt,
                   'output': output_unoise3}
 
-        self.run_usearch(params, step = 'unoise3', extra_info = info)
+        graph.add(Stage(name = 'unoise3',
+                        actions = [partial(self.run_denoise, params, extra_info = info),
+                                   partial(self.rename_head, output_unoise3, 'Zotu', 'ASV_')],
+                        inputs = [output_fulllength],
+                        outputs = [output_unoise3, output_unoise3_txt],
+                        threads = threads if self.KEY_DENOISE_PROGRAM == 'vsearch' else 1)) # usearch uses one thread
 
         #################################################################################
         # Generating a count table
         #################################################################################
 
-        self.rename_head(output_unoise3, 'Zotu', 'ASV_')
-
         output_asvtab = 'ASV_counts.txt'
         output_asvtab = os.path.join(self.KEY_OUTPUT_PATH, output_asvtab)
         info = 'Generating a count table'
@@ -1511,14 +2725,18 @@ class Pipeline:
                   'id': self.KEY_HIGH_IDENTITY_ASV, # 0.99
                   'output': output_asvtab}
 
-        self.run_vsearch(params, step = 'usearch_global', extra_info = info)
+        graph.add(Stage(name = 'usearch_global',
+                        actions = partial(self.run_vsearch, params, step = 'usearch_global', extra_info = info),
+                        inputs = [output_filter_fa, output_unoise3],
+                        outputs = [output_asvtab],
+                        threads = threads))
 
         #################################################################################
         # Assigning taxonomy
         #################################################################################
 
         # Already disregards the chimeras
-        database_fasta = os.path.join(self.KEY_DATABASE_PATH, self.KEY_DATABASE_FASTA)
+        database_fasta = self.DATABASE_FILES['sintax']
         output_sintax = 'ASV_taxonomy.txt'
         output_sintax = os.path.join(self.KEY_OUTPUT_PATH, output_sintax)
         info = 'Assigning taxonomy'
@@ -1529,30 +2747,51 @@ class Pipeline:
                   'sintax_cutoff': self.KEY_SINTAX_CUTOFF, # '0.8'
                   'output': output_sintax}
 
-        self.run_usearch(params, step = 'sintax', extra_info = info)
+        graph.add(Stage(name = 'sintax',
+                        actions = partial(self.run_sintax, params, extra_info = info),
+                        inputs = [output_unoise3, database_fasta],
+                        outputs = [output_sintax],
+                        threads = int(self.KEY_THREADS)))
 
         #################################################################################
         # Get table of abundances of ASVs with taxonomy
         #################################################################################
 
-        output_abundances_table = 'abundance_table_asv.csv'
-        output_abundances_table = os.path.join(self.KEY_OUTPUT_PATH, output_abundances_table)
+        output_abundances_tables = self.get_abundance_files('abundance_table_asv')
         info = 'Get table of abundances of ASVs with taxonomy'
 
         params = {'asv_taxonomy': output_sintax,
                   'asv_counts': output_asvtab,
-                  'output': output_abundances_table}
+                  'output': output_abundances_tables}
 
-        self.run_get_abundances_table(params, extra_info = info)
+        graph.add(Stage(name = 'abundances_table',
+                        actions = [partial(self.run_get_abundances_table, params, extra_info = info)] +
+                                  [partial(self.show_file, "Abundance file", output_file, font = self.IGREEN) for output_file in output_abundances_tables],
+                        inputs = [output_sintax, output_asvtab],
+                        outputs = output_abundances_tables))
 
-        self.show_print("Abundance file: %s" % output_abundances_table, [self.LOG_FILE], font = opipe.IGREEN)
-        self.show_print("", [self.LOG_FILE])
+        if self.PLAN is not None:
+            self.plan_stages(graph)
+            return
+
+        self.run_stages(graph)
+        self.drain_fastqc()
 
 def main(args):
+    status = 'failed'
     try:
         menu(args)
         start = opipe.start_time()
 
+        if opipe.PREPARE:
+            if opipe.KEY_DATABASE_CACHE:
+                opipe.prepare_database()
+            else:
+                opipe.show_print("No store of databases (parameter '%s'), nothing to prepare" % opipe.PARAMETER_DATABASE_CACHE.lower(), [opipe.LOG_FILE])
+            opipe.show_print("Done!", [opipe.LOG_FILE])
+            status = 'finished'
+            return
+
         opipe.show_print("#################################################################################", [opipe.LOG_FILE], font = opipe.BIGREEN)
         opipe.show_print("###################################### RUN ######################################", [opipe.LOG_FILE], font = opipe.BIGREEN)
         opipe.show_print("#################################################################################", [opipe.LOG_FILE], font = opipe.BIGREEN)
@@ -1561,13 +2800,24 @@ def main(args):
             opipe.run_pipeline_otu()
         elif opipe.KEY_APPROACH_TYPE == opipe.APPROACH_TYPE_ASV:
             opipe.run_pipeline_asv()
+        status = 'finished'
 
+        if opipe.METRICS is not None:
+            opipe.show_print("Resources of the stages: %s" % opipe.METRICS.json_file, [opipe.LOG_FILE])
         opipe.show_print(opipe.finish_time(start, "Elapsed time [Total]"), [opipe.LOG_FILE])
         opipe.show_print("Done!", [opipe.LOG_FILE])
     except Exception as e:
         opipe.show_print("\n%s" % traceback.format_exc(), [opipe.LOG_FILE], font = opipe.RED)
         opipe.show_print(opipe.finish_time(start, "Elapsed time [Total]"), [opipe.LOG_FILE])
         opipe.show_print("Done!", [opipe.LOG_FILE])
+    finally:
+        if opipe.PROGRESS is not None:
+            opipe.PROGRESS.close(status)
+        if opipe.LOGGER is not None:
+            opipe.LOGGER.close()
+
+    if status != 'finished':
+        sys.exit(1)
 
 if __name__ == '__main__':
     opipe = Pipeline()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'util'))
+import abundance
+import get_abundances_table_otu
+import get_abundances_table_asv
+
+'''
+Benchmark of the abundance tables (util/get_abundances_table_otu.py and
+util/get_abundances_table_asv.py) against the previous scripts.
+
+python3 bench_abundances.py                      # 150k OTUs x 800 samples
+python3 bench_abundances.py -o 20000 -s 96 -m asv
+python3 bench_abundances.py -f tsv,biom,parquet,feather --skip-legacy
+
+The synthetic OTU table has sparse counts; the lineages (silva titles in the
+BLAST table, SINTAX strings in the taxonomy table) are drawn from a set of
+distinct lineages of 1 to 7 ranks, and some OTUs have no hit. Each
+implementation runs in its own process, so the peak memory (max RSS) of each
+one is measured on its own. With more formats (-f), the size of every file
+and the time to load it back (abundance.load_table, sparse) are shown.
+'''
+
+RANK_PREFIXES = ['d', 'p', 'c', 'o', 'f', 'g', 's']
+
+def create_lineages(n_lineages, rnd):
+    lineages = []
+    for index in range(n_lineages):
+        n_ranks = rnd.integers(1, 8)
+        lineages.append(['%s_name_%d' % (RANK_PREFIXES[rank], index % (10 ** (rank + 1))) for rank in range(n_ranks)])
+
+    return lineages
+
+def create_dataset(path, n_otus, n_samples, n_lineages, hit_share = 0.9, hits = 3, seed = 1):
+    rnd = np.random.default_rng(seed)
+    lineages = create_lineages(n_lineages, rnd)
+
+    otu_ids = ['Otu%d' % (index + 1) for index in range(n_otus)]
+    counts = rnd.poisson(0.3, size = (n_otus, n_samples)).astype(np.uint32)
+    df = pd.DataFrame(counts, columns = ['S%d' % (index + 1) for index in range(n_samples)])
+    df.insert(loc = 0, column = '#OTU ID', value = otu_ids)
+    otu_file = os.path.join(path, 'otus.txt')
+    df.to_csv(otu_file, sep = '\t', index = False)
+
+    blast_file = os.path.join(path, 'otus.blast')
+    sintax_file = os.path.join(path, 'asvs.sintax')
+    with open(blast_file, 'w') as fb, open(sintax_file, 'w') as fs:
+        for otu_id in otu_ids:
+            if rnd.random() >= hit_share:
+                continue
+            ranks = lineages[rnd.integers(n_lineages)]
+            for hit in range(hits):
+                subject_id = 'AB%06d.1.1500' % rnd.integers(1000000)
+                fb.write('%s;size=%d\t%s\t%s %s;\t99.0\n' % (otu_id, rnd.integers(1, 1000), subject_id, subject_id, ';'.join(ranks)))
+            sintax = ','.join(['%s:%s' % (RANK_PREFIXES[rank], name) for rank, name in enumerate(ranks)])
+            fs.write('%s\t%s\t+\t%s\n' % (otu_id, sintax, sintax))
+    fb.close()
+    fs.close()
+
+    return otu_file, blast_file, sintax_file
+
+# What util/get_abundances_table_*.py did before: iterrows over both tables and if/elif ladders
+def legacy_level(n_levels):
+    level = ''
+    if n_levels == 7:
+        level = 'Species'
+    elif n_levels == 6:
+        level = 'Genus'
+    elif n_levels == 5:
+        level = 'Family'
+    elif n_levels == 4:
+        level = 'Order'
+    elif n_levels == 3:
+        level = 'Class'
+    elif n_levels == 2:
+        level = 'Phylum'
+    elif n_levels == 1:
+        level = 'Domain'
+    return level
+
+def legacy_split(lineage, input_type):
+    if input_type == 'silva':
+        return lineage.split(';')
+    elif input_type == 'unite':
+        return lineage.replace('k__', '').replace('p__', '').replace('c__', '').replace('o__', '').replace('f__', '').replace('g__', '').replace('s__', '').split(';')
+    return lineage.replace('d:', '').replace('p:', '').replace('c:', '').replace('o:', '').replace('f:', '').replace('g:', '').replace('s:', '').replace('_', ' ').replace("\"", '').split(',')
+
+def legacy_read_blast(file):
+    df = pd.read_csv(filepath_or_buffer = file, sep = '\t', header = None, usecols = [0, 1, 2])
+    df = df.where(pd.notnull(df), '')
+
+    OTUs = {}
+    for idx, row in df.iterrows():
+        otu_id = row[0].split(';')[0].strip()
+        lineage = row[2].replace(row[1], '').strip()
+        if otu_id not in OTUs:
+            OTUs.update({otu_id: lineage})
+
+    return OTUs
+
+def legacy_read_sintax(file):
+    df = pd.read_csv(filepath_or_buffer = file, sep = '\t', header = None, usecols = [0, 3])
+    df = df.where(pd.notnull(df), '')
+
+    ASVs = {}
+    for idx, row in df.iterrows():
+        if row[0] not in ASVs:
+            ASVs.update({row[0]: row[3].strip()})
+
+    return ASVs
+
+def legacy_table(file, dict_otus, output_file, input_type):
+    df = pd.read_csv(filepath_or_buffer = file, sep = '\t', header = 0)
+    df = df.where(pd.notnull(df), '')
+
+    columns = [[] for _ in range(9)]
+    for idx, row in df.iterrows():
+        otu_id = row['#OTU ID']
+        if otu_id in dict_otus:
+            lineage = dict_otus[otu_id]
+            lineage_split = legacy_split(lineage, input_type)
+            level = legacy_level(len(lineage_split))
+            lineage_split += [''] * (7 - len(lineage_split))
+        else:
+            lineage = ''
+            lineage_split = [''] * 7
+            level = 'Unknown'
+
+        for index, value in enumerate([lineage] + lineage_split[:7] + [level]):
+            columns[index].append(value)
+
+    for index, column in enumerate(['Lineage', 'Domain', 'Phylum', 'Class', 'Order', 'Family', 'Genus', 'Species', 'Level']):
+        df.insert(loc = index + 1, column = column, value = columns[index])
+    if input_type == 'sintax':
+        df.rename(columns = {'#OTU ID': '#ASV ID'}, inplace = True)
+
+    df.to_csv(output_file, sep = '\t', encoding = 'utf-8', index = False)
+
+def run_version(name, mode, otu_file, taxonomy_file, output_files):
+    output_files = output_files.split(',')
+    output_file = output_files[0]
+    if name == 'legacy':
+        if mode == 'otu':
+            legacy_table(otu_file, legacy_read_blast(taxonomy_file), output_file, 'silva')
+        else:
+            legacy_table(otu_file, legacy_read_sintax(taxonomy_file), output_file, 'sintax')
+    else:
+        if mode == 'otu':
+            get_abundances_table_otu.main(['', 'silva', taxonomy_file, otu_file] + output_files)
+        else:
+            get_abundances_table_asv.main(['', taxonomy_file, otu_file] + output_files)
+
+def run_child(name, mode, otu_file, taxonomy_file, output_files):
+    # Max RSS and time of one implementation in its own process
+    command = [sys.executable, os.path.realpath(__file__), '--run', name, mode, otu_file, taxonomy_file, ','.join(output_files)]
+    start = time.time()
+    p = subprocess.Popen(command)
+    _, status, rusage = os.wait4(p.pid, 0)
+    seconds = time.time() - start
+    if status != 0:
+        raise RuntimeError("Benchmark '%s' failed" % name)
+
+    return seconds, rusage.ru_maxrss / 1024.0
+
+def same_files(file1, file2):
+    with open(file1, 'rb') as f1, open(file2, 'rb') as f2:
+        for line1, line2 in zip(f1, f2):
+            if line1 != line2:
+                return False
+        same = f1.read(1) == f2.read(1)
+    f1.close()
+    f2.close()
+
+    return same
+
+def main(args):
+    if len(args) > 1 and args[1] == '--run':
+        run_version(*args[2:7])
+        return
+
+    parser = argparse.ArgumentParser(description = "Benchmark of the abundance tables against the previous scripts")
+    parser.add_argument("-o", "--otus", type = int, default = 150000, help = "Number of OTUs/ASVs (default: 150000)")
+    parser.add_argument("-s", "--samples", type = int, default = 800, help = "Number of samples (default: 800)")
+    parser.add_argument("-l", "--lineages", type = int, default = 5000, help = "Number of distinct lineages (default: 5000)")
+    parser.add_argument("-m", "--mode", choices = ['otu', 'asv', 'both'], default = 'both', help = "Table to build (default: both)")
+    parser.add_argument("-f", "--formats", default = abundance.FORMAT_TSV, help = "Output formats of the new version, comma-separated: %s (default: tsv)" % ', '.join(abundance.FORMATS))
+    parser.add_argument("--skip-legacy", action = 'store_true', help = "Do not run the previous scripts")
+    args = parser.parse_args()
+
+    tmp_path = tempfile.mkdtemp(prefix = 'bench_abundances_')
+    print("Creating %s OTUs x %s samples in %s" % (args.otus, args.samples, tmp_path))
+    otu_file, blast_file, sintax_file = create_dataset(tmp_path, args.otus, args.samples, args.lineages)
+
+    formats = [fmt.strip() for fmt in args.formats.split(',')]
+    if abundance.FORMAT_TSV in formats:
+        # The TSV comes first, it is the one compared with the previous version
+        formats.remove(abundance.FORMAT_TSV)
+        formats.insert(0, abundance.FORMAT_TSV)
+
+    modes = ['otu', 'asv'] if args.mode == 'both' else [args.mode]
+    versions = ['engine'] if args.skip_legacy else ['legacy', 'engine']
+    print("%-6s %-10s %12s %16s" % ('Table', 'Version', 'Seconds', 'Max RSS (MB)'))
+    for mode in modes:
+        taxonomy_file = blast_file if mode == 'otu' else sintax_file
+        outputs = {}
+        for name in versions:
+            output_files = [os.path.join(tmp_path, 'abundance_%s_%s.txt' % (mode, name))]
+            if name == 'engine':
+                output_files = [os.path.join(tmp_path, 'abundance_%s_%s%s' % (mode, name, abundance.EXTENSIONS[fmt])) for fmt in formats]
+            seconds, max_rss = run_child(name, mode, otu_file, taxonomy_file, output_files)
+            outputs[name] = output_files
+            print("%-6s %-10s %12.2f %16.1f" % (mode, name, seconds, max_rss))
+        if len(outputs) > 1 and formats[0] == abundance.FORMAT_TSV:
+            print("%-6s Same output: %s" % (mode, 'yes' if same_files(outputs['legacy'][0], outputs['engine'][0]) else 'no'))
+
+        if len(formats) > 1:
+            print("%-6s %-10s %12s %16s" % ('', 'Format', 'Size (MB)', 'Load (s)'))
+            for fmt, output_file in zip(formats, outputs['engine']):
+                start = time.time()
+                abundance.load_table(output_file)
+                print("%-6s %-10s %12.1f %16.2f" % ('', fmt, os.path.getsize(output_file) / 1024.0 / 1024.0, time.time() - start))
+
+    for _file in os.listdir(tmp_path):
+        os.remove(os.path.join(tmp_path, _file))
+    os.rmdir(tmp_path)
+
+if __name__ == '__main__':
+    main(sys.argv)
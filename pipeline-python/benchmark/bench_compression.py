@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'util'))
+sys.path.insert(0, os.path.dirname(os.path.realpath(__file__)))
+import fastx
+import pool
+from bench_fastx import create_fastq
+
+'''
+Benchmark of the compression of the intermediate FASTQ files.
+
+python3 bench_compression.py                    # 2M synthetic reads of 250 bp, 4 threads
+python3 bench_compression.py -t 16 -i my_reads.fq
+
+For every compression (none, gz, zst) it measures what the pipeline does
+with an intermediate file: a program writes it through a named pipe
+(pool.PipeCompressor), then it is read back (count of records) and pooled
+with another copy of itself (pool.concat_files). The disk column is the
+size written for the file, so the trade-off between wall-clock time and
+disk I/O (or scratch space) can be compared.
+'''
+
+COMPRESSIONS = [None, fastx.COMPRESSION_GZIP, fastx.COMPRESSION_ZSTD]
+
+def timeit(function):
+    start = time.time()
+    result = function()
+    return time.time() - start, result
+
+def write_through_pipe(file, output_file, threads):
+    fifo = '%s.fifo' % output_file
+    compressor = pool.PipeCompressor(fifo, output_file, threads)
+    # A plain copy plays the part of vsearch writing its output
+    with open(file, 'rb') as fr:
+        with open(fifo, 'wb') as fw:
+            pool.copy_fd(fr.fileno(), fw.fileno(), os.path.getsize(file))
+        fw.close()
+    fr.close()
+    error = compressor.close()
+    if error is not None:
+        raise error
+    return os.path.getsize(output_file)
+
+def main(args):
+    parser = argparse.ArgumentParser(description = "Benchmark of the compression of the intermediate FASTQ files")
+    parser.add_argument("-i", "--input", metavar = "FILE", help = "Uncompressed FASTQ file (by default a synthetic file is created)")
+    parser.add_argument("-n", "--reads", type = int, default = 2000000, help = "Number of synthetic reads (default: 2000000)")
+    parser.add_argument("-l", "--length", type = int, default = 250, help = "Length of the synthetic reads (default: 250)")
+    parser.add_argument("-t", "--threads", type = int, default = 4, help = "Threads of the compressors (default: 4)")
+    args = parser.parse_args()
+
+    tmp_path = tempfile.mkdtemp(prefix = 'bench_compression_')
+    file = args.input
+    if file is None:
+        file = os.path.join(tmp_path, 'reads.fq')
+        print("Creating %s reads of %s bp in %s" % (args.reads, args.length, file))
+        create_fastq(file, args.reads, args.length)
+
+    size = os.path.getsize(file) / 1024.0 / 1024.0
+    print("Input: %.1f MB | threads: %s | pigz: %s" % (size, args.threads, 'yes' if fastx.shutil.which('pigz') else 'no'))
+    print("%-6s %10s %10s %10s %10s %10s %10s" % ('', 'Write (s)', 'Read (s)', 'Pool (s)', 'Total (s)', 'Disk (MB)', 'Ratio'))
+
+    created = []
+    for compression in COMPRESSIONS:
+        name = 'none' if compression is None else compression
+        output_file = os.path.join(tmp_path, 'merged.fq')
+        pooled_file = os.path.join(tmp_path, 'pooled.fq')
+        if compression is not None:
+            output_file = '%s.%s' % (output_file, compression)
+            pooled_file = '%s.%s' % (pooled_file, compression)
+        created.extend([output_file, pooled_file])
+
+        try:
+            write_seconds, written = timeit(lambda: write_through_pipe(file, output_file, args.threads))
+            read_seconds, n = timeit(lambda: fastx.count_records(output_file))
+            pool_seconds, _ = timeit(lambda: pool.concat_files([output_file, output_file], pooled_file, args.threads))
+        except (OSError, IOError) as e:
+            print("%-6s %s" % (name, e))
+            continue
+
+        disk = (written + os.path.getsize(pooled_file)) / 1024.0 / 1024.0
+        total = write_seconds + read_seconds + pool_seconds
+        print("%-6s %10.2f %10.2f %10.2f %10.2f %10.1f %10.2f" % (name, write_seconds, read_seconds, pool_seconds, total, disk, size / (written / 1024.0 / 1024.0)))
+
+    for _file in created + [os.path.join(tmp_path, 'reads.fq')]:
+        if os.path.isfile(_file):
+            os.remove(_file)
+    os.rmdir(tmp_path)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'util'))
+import fastx
+import denoise
+
+'''
+Benchmark of the denoising backends of the ASVs: usearch -unoise3 against
+vsearch --cluster_unoise + --uchime3_denovo.
+
+python3 bench_denoise.py                                 # 2000 amplicons, synthetic reads, 4 threads
+python3 bench_denoise.py -i all_samples_dereplicated.fa -t 16 -r concordance.txt
+
+The synthetic input is a dereplicated FASTA (;size=) with true amplicons of
+random abundances, reads with one or two errors of every amplicon and
+chimeras of two amplicons. Every program runs in its own process, so the
+time and the peak memory (max RSS) of each one are measured on their own.
+The concordance report compares the ASVs of both backends (denoise.py) and,
+with the synthetic input, the true amplicons found by each one.
+'''
+
+BIN_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'bin', 'gnulinux')
+
+def mutate(sequence, n_errors, rnd):
+    sequence = bytearray(sequence)
+    for position in rnd.sample(range(len(sequence)), n_errors):
+        sequence[position] = rnd.choice([base for base in b'ACGT' if base != sequence[position]])
+    return bytes(sequence)
+
+def create_dereplicated(file, n_amplicons, length, seed = 1):
+    # Returns the sequences of the true amplicons
+    rnd = random.Random(seed)
+    amplicons = [bytes([rnd.choice(b'ACGT') for _ in range(length)]) for _ in range(n_amplicons)]
+    sizes = [max(8, int(rnd.lognormvariate(6, 1.5))) for _ in range(n_amplicons)]
+
+    uniques = {}
+    for amplicon, size in zip(amplicons, sizes):
+        uniques[amplicon] = uniques.get(amplicon, 0) + size
+        # Errors: less abundant neighbours of the amplicon
+        for _ in range(rnd.randint(0, 10)):
+            variant = mutate(amplicon, rnd.randint(1, 2), rnd)
+            uniques[variant] = uniques.get(variant, 0) + max(1, int(size * rnd.uniform(0.001, 0.03)))
+
+    for _ in range(n_amplicons // 10):
+        # Chimeras of two amplicons, less abundant than both parents
+        index1, index2 = rnd.sample(range(n_amplicons), 2)
+        cut = rnd.randint(length // 4, 3 * length // 4)
+        chimera = amplicons[index1][:cut] + amplicons[index2][cut:]
+        uniques[chimera] = uniques.get(chimera, 0) + max(8, min(sizes[index1], sizes[index2]) // 4)
+
+    records = sorted(uniques.items(), key = lambda item: item[1], reverse = True)
+    with fastx.Writer(file) as fw:
+        for index, (sequence, size) in enumerate(records):
+            fw.write((b'Uniq%d;size=%d' % (index + 1, size), sequence))
+    fw.close()
+
+    return set(amplicons)
+
+def run_command(command):
+    # Seconds and max RSS (MB) of a program
+    start = time.time()
+    p = subprocess.Popen(command, stdout = subprocess.DEVNULL, stderr = subprocess.DEVNULL)
+    _, status, rusage = os.wait4(p.pid, 0)
+    if status != 0:
+        raise RuntimeError("Command failed: %s" % ' '.join(command))
+
+    return time.time() - start, rusage.ru_maxrss / 1024.0
+
+def run_usearch(usearch, input_file, output_file, tabbedout):
+    return run_command([usearch, '-unoise3', input_file, '-zotus', output_file, '-tabbedout', tabbedout])
+
+def run_vsearch(vsearch, input_file, output_file, tabbedout, threads):
+    centroids = '%s.unoise.fa' % output_file
+    uc = '%s.unoise.uc' % output_file
+    uchimeout = '%s.uchime.txt' % output_file
+
+    seconds1, max_rss1 = run_command([vsearch, '--cluster_unoise', input_file, '--threads', str(threads),
+                                      '--minsize', '8', '--unoise_alpha', '2.0', '--sizein', '--sizeout',
+                                      '--fasta_width', '0', '--uc', uc, '--centroids', centroids])
+    seconds2, max_rss2 = run_command([vsearch, '--uchime3_denovo', centroids, '--sizein', '--fasta_width', '0',
+                                      '--relabel', 'Zotu', '--uchimeout', uchimeout, '--nonchimeras', output_file])
+    denoise.write_tabbedout(uc, uchimeout, tabbedout)
+
+    return seconds1 + seconds2, max(max_rss1, max_rss2)
+
+def main(args):
+    parser = argparse.ArgumentParser(description = "Benchmark of the denoising backends (usearch unoise3 and vsearch)")
+    parser.add_argument("-i", "--input", metavar = "FILE", help = "Dereplicated FASTA file with ;size= (by default a synthetic file is created)")
+    parser.add_argument("-a", "--amplicons", type = int, default = 2000, help = "Number of synthetic amplicons (default: 2000)")
+    parser.add_argument("-l", "--length", type = int, default = 250, help = "Length of the synthetic amplicons (default: 250)")
+    parser.add_argument("-t", "--threads", type = int, default = 4, help = "Threads of vsearch (default: 4)")
+    parser.add_argument("-r", "--report", metavar = "FILE", help = "Write the concordance report to this file")
+    parser.add_argument("--usearch", default = os.path.join(BIN_PATH, 'usearch'), help = "usearch program (default: bin/gnulinux/usearch)")
+    parser.add_argument("--vsearch", default = os.path.join(BIN_PATH, 'vsearch'), help = "vsearch program (default: bin/gnulinux/vsearch)")
+    args = parser.parse_args()
+
+    for program in [args.usearch, args.vsearch]:
+        if shutil.which(program) is None:
+            print("Program '%s' not found" % program)
+            return
+
+    tmp_path = tempfile.mkdtemp(prefix = 'bench_denoise_')
+    file = args.input
+    truth = None
+    if file is None:
+        file = os.path.join(tmp_path, 'dereplicated.fa')
+        print("Creating %s amplicons of %s bp in %s" % (args.amplicons, args.length, file))
+        truth = create_dereplicated(file, args.amplicons, args.length)
+
+    n_uniques = fastx.count_records(file)
+    print("Input: %s unique sequences | vsearch threads: %s" % (n_uniques, args.threads))
+    print("%-10s %10s %16s %10s" % ('Backend', 'Seconds', 'Max RSS (MB)', 'ASVs'))
+
+    outputs = {}
+    for name in ['usearch', 'vsearch']:
+        output_file = os.path.join(tmp_path, 'ASVs_%s.fa' % name)
+        tabbedout = os.path.join(tmp_path, 'unoise3_%s.txt' % name)
+        if name == 'usearch':
+            seconds, max_rss = run_usearch(args.usearch, file, output_file, tabbedout)
+        else:
+            seconds, max_rss = run_vsearch(args.vsearch, file, output_file, tabbedout, args.threads)
+        outputs[name] = output_file
+        print("%-10s %10.2f %16.1f %10s" % (name, seconds, max_rss, fastx.count_records(output_file)))
+
+    result = denoise.compare_asvs(outputs['usearch'], outputs['vsearch'], file)
+    lines = denoise.format_report(result, 'usearch', 'vsearch')
+    if truth is not None:
+        for name in ['usearch', 'vsearch']:
+            found = denoise.read_sequences(outputs[name]) & truth
+            lines.append('True amplicons found by %s: %s of %s' % (name, len(found), len(truth)))
+
+    print("")
+    for line in lines:
+        print(line)
+
+    if args.report:
+        with open(args.report, 'w', encoding = 'utf-8') as fw:
+            fw.write('Input: %s (%s unique sequences)\n' % (args.input or 'synthetic', n_uniques))
+            fw.write(''.join(['%s\n' % line for line in lines]))
+        fw.close()
+
+    shutil.rmtree(tmp_path, ignore_errors = True)
+
+if __name__ == '__main__':
+    main(sys.argv)
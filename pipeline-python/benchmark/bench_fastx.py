@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import importlib.util
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'util'))
+import fastx
+
+'''
+Benchmark of util/fastx.py against Bio.SeqIO.
+
+python3 bench_fastx.py                     # 10M synthetic reads of 250 bp
+python3 bench_fastx.py -n 1000000 -l 300
+python3 bench_fastx.py -i my_reads.fq      # An existing FASTQ file
+'''
+
+def create_fastq(file, n_reads, length, seed = 1):
+    rnd = random.Random(seed)
+    bases = b'ACGT'
+    quals = bytes(range(ord('5'), ord('J') + 1))
+
+    # A pool of reads is enough to keep the generator from dominating the time
+    pool = []
+    for _ in range(1000):
+        sequence = bytes([bases[rnd.randrange(4)] for _ in range(length)])
+        quality = bytes([quals[rnd.randrange(len(quals))] for _ in range(length)])
+        pool.append((sequence, quality))
+
+    with fastx.Writer(file, fmt = fastx.FORMAT_FASTQ) as fw:
+        for index in range(n_reads):
+            sequence, quality = pool[index % len(pool)]
+            fw.write((b'read%d;sample=S%d' % (index, index % 96), sequence, quality))
+    fw.close()
+
+def timeit(function):
+    start = time.time()
+    result = function()
+    return time.time() - start, result
+
+def bench_fastx_read(file):
+    n = 0
+    for record in fastx.read_fastq(file):
+        n += 1
+    return n
+
+def bench_fastx_copy(file, output):
+    with fastx.Writer(output, fmt = fastx.FORMAT_FASTQ) as fw:
+        fw.write_all(fastx.read_fastq(file))
+    fw.close()
+    return fw.count
+
+def bench_fastx_count(file):
+    return fastx.count_records(file)
+
+def bench_seqio_read(file):
+    from Bio import SeqIO
+    n = 0
+    for record in SeqIO.parse(file, 'fastq'):
+        n += 1
+    return n
+
+def bench_seqio_copy(file, output):
+    from Bio import SeqIO
+    return SeqIO.write(SeqIO.parse(file, 'fastq'), output, 'fastq')
+
+def bench_lines_count(file):
+    # What count_sequences did before: every line through str
+    n = len([1 for line in open(file, 'r')])
+    return int(n/4)
+
+def main(args):
+    parser = argparse.ArgumentParser(description = "Benchmark of util/fastx.py against Bio.SeqIO")
+    parser.add_argument("-i", "--input", metavar = "FILE", help = "FASTQ file (by default a synthetic file is created)")
+    parser.add_argument("-n", "--reads", type = int, default = 10000000, help = "Number of synthetic reads (default: 10000000)")
+    parser.add_argument("-l", "--length", type = int, default = 250, help = "Length of the synthetic reads (default: 250)")
+    parser.add_argument("--skip-seqio", action = "store_true", help = "Don't run the Bio.SeqIO benchmarks")
+    args = parser.parse_args()
+
+    tmp_path = tempfile.mkdtemp(prefix = 'bench_fastx_')
+    file = args.input
+    if file is None:
+        file = os.path.join(tmp_path, 'reads.fq')
+        print("Creating %s reads of %s bp in %s" % (args.reads, args.length, file))
+        create_fastq(file, args.reads, args.length)
+
+    output = os.path.join(tmp_path, 'copy.fq')
+    size = os.path.getsize(file) / 1024.0 / 1024.0
+
+    benchmarks = [('fastx: count_records', lambda: bench_fastx_count(file)),
+                  ('str lines: count', lambda: bench_lines_count(file)),
+                  ('fastx: read', lambda: bench_fastx_read(file)),
+                  ('fastx: read + write', lambda: bench_fastx_copy(file, output))]
+
+    if not args.skip_seqio:
+        if importlib.util.find_spec('Bio') is not None:
+            benchmarks.extend([('SeqIO: read', lambda: bench_seqio_read(file)),
+                               ('SeqIO: read + write', lambda: bench_seqio_copy(file, output))])
+        else:
+            print("Biopython is not installed, skipping the SeqIO benchmarks")
+
+    print("%-24s %12s %12s %12s" % ('Benchmark', 'Seconds', 'Reads', 'MB/s'))
+    for name, function in benchmarks:
+        seconds, n = timeit(function)
+        print("%-24s %12.2f %12s %12.1f" % (name, seconds, n, size / seconds if seconds else 0))
+
+    for _file in [output, os.path.join(tmp_path, 'reads.fq')]:
+        if os.path.isfile(_file):
+            os.remove(_file)
+    os.rmdir(tmp_path)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'util'))
+import fastx
+from map import map_sequences
+
+'''
+Benchmark of util/map.py (in-process engine) against the previous script.
+
+python3 bench_map.py                     # 50M synthetic reads in all.fa
+python3 bench_map.py -n 5000000 -u 100000
+
+The synthetic all.fa has reads drawn from a set of unique sequences; the uc
+file maps every read to the first read of its unique sequence (like
+--derep_fulllength) and fasta2 keeps a share of the uniques (like the
+non-chimeric sequences). Each implementation runs in its own process, so
+the peak memory (max RSS) of each one is measured on its own.
+'''
+
+def create_dataset(path, n_reads, n_uniques, accepted_share, length = 250, seed = 1):
+    rnd = random.Random(seed)
+    bases = b'ACGT'
+    uniques = [bytes([bases[rnd.randrange(4)] for _ in range(length)]) for _ in range(n_uniques)]
+
+    fasta1 = os.path.join(path, 'all.fa')
+    uc_file = os.path.join(path, 'all.dereplicated.uc')
+    fasta2 = os.path.join(path, 'all.nonchimeras.dereplicated.fa')
+
+    centroids = {}
+    with fastx.Writer(fasta1, fmt = fastx.FORMAT_FASTA) as fw, open(uc_file, 'wb') as fu:
+        for index in range(n_reads):
+            unique = rnd.randrange(n_uniques)
+            label = b'S%d.%d' % (index % 96, index)
+            fw.write((label, uniques[unique]))
+
+            centroid = centroids.get(unique)
+            if centroid is None:
+                centroids[unique] = label
+                fu.write(b'S\t%d\t%d\t*\t*\t*\t*\t*\t%s\t*\n' % (unique, length, label))
+            else:
+                fu.write(b'H\t%d\t%d\t100.0\t+\t0\t0\t=\t%s\t%s\n' % (unique, length, label, centroid))
+    fw.close()
+    fu.close()
+
+    with fastx.Writer(fasta2, fmt = fastx.FORMAT_FASTA) as fw:
+        for unique, label in centroids.items():
+            if rnd.random() < accepted_share:
+                fw.write((b'%s;size=2' % label, uniques[unique]))
+    fw.close()
+
+    return fasta1, uc_file, fasta2
+
+# What util/map.py did before: str lines, and every rejected id was inserted into the dictionary
+def legacy_read_fasta2_file(fasta_file):
+    heads = {}
+    with open(fasta_file, 'r') as fr:
+        for line in fr:
+            line = line.strip()
+            if line.startswith('>'):
+                _id = str(line).replace('>', '').split(';')[0]
+                heads.update({_id: 1})
+    fr.close()
+
+    return heads
+
+def legacy_read_uc_file(uc_file, dictionary):
+    with open(uc_file, 'r') as fr:
+        for line in fr:
+            line = line.strip().split('\t')
+
+            hit_type = line[0].split(';')[0]
+            query_seq = line[8].split(';')[0]
+            target_seq = line[9].split(';')[0]
+
+            if hit_type == 'H' and target_seq in dictionary:
+                dictionary.update({query_seq: 1})
+    fr.close()
+
+    return dictionary
+
+def legacy_read_fasta1_file(fasta_file, dictionary, output_fasta):
+    with open(fasta_file, 'r') as fr, open(output_fasta, 'w') as fw:
+        save_seq = False
+        for line in fr:
+            line = line.strip()
+            if line.startswith('>'):
+                _id = line.replace('>', '').split(';')[0]
+                if _id in dictionary:
+                    sequence_id = '%s\n' % line
+                    fw.write(sequence_id)
+                    save_seq = True
+                else:
+                    dictionary.update({_id: None})
+                    save_seq = False
+            else:
+                if save_seq:
+                    sequence = '%s\n' % str(line)
+                    fw.write(sequence)
+    fr.close()
+    fw.close()
+
+def legacy_map(fasta1, uc_file, fasta2, output_file):
+    dict_heads = legacy_read_fasta2_file(fasta2)
+    legacy_read_uc_file(uc_file, dict_heads)
+    legacy_read_fasta1_file(fasta1, dict_heads, output_file)
+
+def run_child(name, fasta1, uc_file, fasta2, output_file):
+    # Max RSS and time of one implementation in its own process
+    command = [sys.executable, os.path.realpath(__file__), '--run', name, fasta1, uc_file, fasta2, output_file]
+    start = time.time()
+    p = subprocess.Popen(command)
+    _, status, rusage = os.wait4(p.pid, 0)
+    seconds = time.time() - start
+    if status != 0:
+        raise RuntimeError("Benchmark '%s' failed" % name)
+
+    return seconds, rusage.ru_maxrss / 1024.0
+
+def main(args):
+    if len(args) > 1 and args[1] == '--run':
+        name, fasta1, uc_file, fasta2, output_file = args[2:7]
+        if name == 'legacy':
+            legacy_map(fasta1, uc_file, fasta2, output_file)
+        else:
+            map_sequences(fasta1, uc_file, fasta2, output_file)
+        return
+
+    parser = argparse.ArgumentParser(description = "Benchmark of util/map.py against the previous script")
+    parser.add_argument("-n", "--reads", type = int, default = 50000000, help = "Number of synthetic reads in all.fa (default: 50000000)")
+    parser.add_argument("-u", "--uniques", type = int, default = 1000000, help = "Number of unique sequences (default: 1000000)")
+    parser.add_argument("-a", "--accepted", type = float, default = 0.5, help = "Share of the uniques that are accepted (default: 0.5)")
+    args = parser.parse_args()
+
+    tmp_path = tempfile.mkdtemp(prefix = 'bench_map_')
+    print("Creating %s reads (%s unique sequences) in %s" % (args.reads, args.uniques, tmp_path))
+    fasta1, uc_file, fasta2 = create_dataset(tmp_path, args.reads, args.uniques, args.accepted)
+
+    outputs = {}
+    print("%-10s %12s %16s %12s" % ('Version', 'Seconds', 'Max RSS (MB)', 'Sequences'))
+    for name in ['legacy', 'engine']:
+        output_file = os.path.join(tmp_path, 'out_%s.fa' % name)
+        seconds, max_rss = run_child(name, fasta1, uc_file, fasta2, output_file)
+        outputs[name] = output_file
+        print("%-10s %12.2f %16.1f %12s" % (name, seconds, max_rss, fastx.count_records(output_file)))
+
+    same = list(fastx.read_fasta(outputs['legacy'])) == list(fastx.read_fasta(outputs['engine']))
+    print("Same output: %s" % ('yes' if same else 'no'))
+
+    for _file in os.listdir(tmp_path):
+        os.remove(os.path.join(tmp_path, _file))
+    os.rmdir(tmp_path)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'util'))
+import metrics
+import stub_tools
+
+'''
+End-to-end benchmark of amplicon_pipeline.py: synthetic datasets of several
+sizes, both approaches (OTU and ASV), the time and peak memory of every step,
+and a comparison against a stored baseline.
+
+python3 bench_pipeline.py -o bench --stubs --save-baseline baseline.json   # 10k and 100k read pairs, stand-in programs
+python3 bench_pipeline.py -o bench --stubs --baseline baseline.json        # exit status 1 if a step regressed
+python3 bench_pipeline.py -o bench -s 10000,1000000,10000000 -t 16         # the real programs in bin/
+
+The datasets come from make_dataset.py and are kept in <output>/data_<reads>
+for the next runs. Every run has its own config.txt and output folder
+(<output>/<approach>_<reads>); its totals are measured with wait4 (the
+pipeline and every process it waited for) and its steps are read from the
+metrics_*.json of the run (metrics.py). With --stubs the programs are the
+stand-ins of stub_tools.py (parameter bin_path), so the numbers are those of
+the Python stages, the files and the scheduling, not of vsearch or BLAST.
+
+A step regresses when it takes more than the tolerance over its baseline
+and at least --min_seconds more; the peak memory of the runs the same way.
+'''
+
+PIPELINE = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'amplicon_pipeline.py')
+MAKE_DATASET = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'make_dataset.py')
+
+APPROACHES = ['otu', 'asv']
+SCALES = [10000, 100000]
+
+def write_config(file, approach, dataset_path, output_path, bin_path, cache_path, threads, python = 'python3'):
+    values = [('approach_type', approach),
+              ('samples_path', dataset_path),
+              ('database_path', dataset_path),
+              ('output_path', output_path),
+              ('database_type', 'silva' if approach == 'otu' else 'rdp'),
+              ('database_fasta', 'reference_silva.fa' if approach == 'otu' else 'reference_sintax.fa'),
+              ('database_bin', ''),
+              ('database_cache', cache_path),
+              ('primers_file', 'primers.fa'),
+              ('threads', threads),
+              ('filter_maxee', '1.0'),
+              ('filter_minlen', '300'),
+              ('cluster_identity', '97'),
+              ('blast_identity', '97'),
+              ('high_identity_asv', '99'),
+              ('sintax_cutoff', '0.8'),
+              ('python_version', python),
+              ('platform_type', 'gnulinux'),
+              ('bin_path', bin_path or '')]
+
+    with open(file, 'w', encoding = 'utf-8') as fw:
+        fw.write('[PARAMETERS]\n')
+        fw.write(''.join(['%s = %s\n' % (key, value) for key, value in values]))
+    fw.close()
+
+def run_pipeline(config_file, log_file, env):
+    # Seconds and max RSS (MB) of the pipeline and the processes it waited for
+    start = time.time()
+    with open(log_file, 'wb') as fw:
+        p = subprocess.Popen([sys.executable, PIPELINE, '-c', config_file], stdout = fw, stderr = subprocess.STDOUT, env = env)
+        rusage = metrics.wait_process(p)
+    fw.close()
+
+    return time.time() - start, metrics.get_usage_row(rusage).get('max_rss_mb')
+
+def read_steps(output_path):
+    # Steps of the last metrics file of the run (metrics.summarize)
+    files = sorted(glob.glob(os.path.join(output_path, 'metrics_*.json')))
+    if not files:
+        return {}
+
+    with open(files[-1], 'r', encoding = 'utf-8') as fr:
+        rows = json.load(fr)
+    fr.close()
+
+    return dict(metrics.summarize(rows))
+
+def run_benchmark(approach, n_reads, dataset_path, args, bin_path, env):
+    output_path = os.path.join(args.output, '%s_%s' % (approach, n_reads))
+    if os.path.isdir(output_path):
+        shutil.rmtree(output_path)
+    os.makedirs(output_path)
+
+    config_file = os.path.join(output_path, 'config.txt')
+    write_config(config_file, approach, dataset_path, output_path, bin_path, os.path.join(args.output, 'dbstore'), args.threads, 'python3')
+    seconds, max_rss = run_pipeline(config_file, os.path.join(output_path, 'stdout.txt'), env)
+
+    tables = glob.glob(os.path.join(output_path, 'abundance_table_%s.*' % approach))
+    result = {'approach': approach,
+              'reads': n_reads,
+              'samples': args.samples,
+              'threads': args.threads,
+              'status': 'ok' if tables else 'failed',
+              'wall_seconds': seconds,
+              'max_rss_mb': max_rss,
+              'steps': read_steps(output_path)}
+
+    if not args.keep:
+        for file in glob.glob(os.path.join(output_path, '*')):
+            if os.path.isdir(file):
+                shutil.rmtree(file)
+            elif not os.path.basename(file).startswith(('log_', 'metrics_', 'abundance_table_', 'stdout')):
+                os.remove(file)
+
+    return result
+
+def compare(results, baseline, tolerance, min_seconds):
+    # Lines of the report and the number of regressions
+    runs = dict([((run['approach'], run['reads']), run) for run in baseline['runs']])
+
+    lines = []
+    n_regressions = 0
+    for result in results:
+        old = runs.get((result['approach'], result['reads']))
+        if old is None or result['status'] != 'ok' or old['status'] != 'ok':
+            continue
+
+        values = [('total', 'wall_seconds', result['wall_seconds'], old['wall_seconds'], min_seconds),
+                  ('total', 'max_rss_mb', result['max_rss_mb'], old['max_rss_mb'], 0)]
+        for step, step_values in result['steps'].items():
+            if step in old['steps']:
+                values.append((step, 'wall_seconds', step_values['wall_seconds'], old['steps'][step]['wall_seconds'], min_seconds))
+
+        for step, field, new_value, old_value, min_delta in values:
+            if new_value is None or old_value is None:
+                continue
+            regression = new_value > old_value * (1 + tolerance) and new_value - old_value >= min_delta
+            if regression:
+                n_regressions += 1
+            if regression or step == 'total':
+                lines.append('%-4s %10s %-28s %-13s %10.2f %10.2f %+8.1f%% %s' % (result['approach'], result['reads'], step, field, old_value, new_value,
+                                                                                (new_value / old_value - 1) * 100 if old_value else 0,
+                                                                                'REGRESSION' if regression else ''))
+
+    return lines, n_regressions
+
+def main(args):
+    parser = argparse.ArgumentParser(description = "End-to-end benchmark of the pipeline with synthetic datasets")
+    parser.add_argument("-o", "--output", metavar = "PATH", required = True, help = "Folder of the datasets and the runs")
+    parser.add_argument("-s", "--scales", default = ','.join([str(scale) for scale in SCALES]), help = "Read pairs of the datasets, comma-separated (default: 10000,100000)")
+    parser.add_argument("-a", "--approaches", default = ','.join(APPROACHES), help = "Approaches, comma-separated (default: otu,asv)")
+    parser.add_argument("-n", "--samples", type = int, default = 4, help = "Samples of every dataset (default: 4)")
+    parser.add_argument("-t", "--threads", type = int, default = 4, help = "Parameter threads of the runs (default: 4)")
+    parser.add_argument("-z", "--compression", choices = ['gz', 'zst'], help = "Compression of the FASTQ files of the datasets (default: none)")
+    parser.add_argument("--stubs", action = "store_true", help = "Run with the stand-in programs of stub_tools.py")
+    parser.add_argument("--bin_path", metavar = "PATH", help = "Folder of the programs (parameter bin_path, default: bin of the pipeline)")
+    parser.add_argument("--baseline", metavar = "FILE", help = "Compare against this baseline (exit status 1 if a step regressed)")
+    parser.add_argument("--save-baseline", dest = "save_baseline", metavar = "FILE", help = "Write the results to this file as the new baseline")
+    parser.add_argument("--tolerance", type = float, default = 0.25, help = "Allowed slowdown or growth over the baseline (default: 0.25)")
+    parser.add_argument("--min_seconds", type = float, default = 1.0, help = "Smallest slowdown of a step counted as a regression (default: 1.0)")
+    parser.add_argument("--keep", action = "store_true", help = "Keep all the outputs of the runs")
+    parser.add_argument("--seed", type = int, default = 1, help = "Random seed of the datasets (default: 1)")
+    args = parser.parse_args()
+
+    scales = [int(scale) for scale in args.scales.split(',') if scale.strip()]
+    approaches = [approach.strip().lower() for approach in args.approaches.split(',') if approach.strip()]
+    if not os.path.isdir(args.output):
+        os.makedirs(args.output)
+    args.output = os.path.abspath(args.output)
+
+    # The scripts of util run with 'python3': the one of the benchmark
+    env = dict(os.environ)
+    env['PATH'] = '%s%s%s' % (os.path.dirname(sys.executable), os.pathsep, env.get('PATH', ''))
+    bin_path = os.path.abspath(args.bin_path) if args.bin_path else None
+    if args.stubs:
+        bin_path = os.path.join(args.output, 'bin_stub')
+        stub_tools.install(bin_path)
+        # cutadapt is taken from the PATH in GNU/Linux
+        env['PATH'] = '%s%s%s' % (os.path.join(bin_path, 'gnulinux'), os.pathsep, env.get('PATH', ''))
+
+    results = []
+    print("%-4s %10s %-8s %12s %14s" % ('Run', 'Reads', 'Status', 'Wall (s)', 'Max RSS (MB)'))
+    for n_reads in scales:
+        dataset_path = os.path.join(args.output, 'data_%s' % n_reads)
+        if not os.path.isfile(os.path.join(dataset_path, 'dataset.json')):
+            # In its own process: a fork of a big benchmark would start with its max RSS
+            command = [sys.executable, MAKE_DATASET, '-o', dataset_path, '-s', str(args.samples), '-n', str(n_reads), '--seed', str(args.seed)]
+            if args.compression:
+                command += ['-z', args.compression]
+            subprocess.check_call(command, stdout = subprocess.DEVNULL)
+
+        for approach in approaches:
+            result = run_benchmark(approach, n_reads, dataset_path, args, bin_path, env)
+            results.append(result)
+            print("%-4s %10s %-8s %12.1f %14.1f" % (approach, n_reads, result['status'], result['wall_seconds'], result['max_rss_mb'] or 0))
+            for step, values in sorted(result['steps'].items(), key = lambda item: item[1]['wall_seconds'], reverse = True):
+                print("     %-35s %12.1f %14.1f" % (step, values['wall_seconds'], values['max_rss_mb']))
+
+    report = {'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'stubs': args.stubs, 'runs': results}
+    with open(os.path.join(args.output, 'results.json'), 'w', encoding = 'utf-8') as fw:
+        json.dump(report, fw, indent = 1)
+    fw.close()
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding = 'utf-8') as fw:
+            json.dump(report, fw, indent = 1)
+        fw.close()
+        print("\nBaseline: %s" % args.save_baseline)
+
+    n_failed = len([result for result in results if result['status'] != 'ok'])
+    n_regressions = 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding = 'utf-8') as fr:
+            baseline = json.load(fr)
+        fr.close()
+        if baseline.get('stubs') != args.stubs:
+            print("\n[WARNING] The baseline was measured %s the stand-in programs" % ('with' if baseline.get('stubs') else 'without'))
+
+        lines, n_regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+        print("\n%-4s %10s %-28s %-13s %10s %10s %9s" % ('Run', 'Reads', 'Step', 'Value', 'Baseline', 'Now', 'Change'))
+        for line in lines:
+            print(line)
+        print("\nRegressions: %s" % n_regressions)
+
+    if n_failed:
+        print("\nFailed runs: %s (see <output>/<approach>_<reads>/log_*.log)" % n_failed)
+    if n_failed or n_regressions:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+import bench_pipeline
+import stub_tools
+
+'''
+Startup time of amplicon_pipeline.py: the time to import it and to read the
+configuration and check the programs (read_keys), from a new process every
+time, with the cache of the versions empty (cold) and filled (warm).
+
+python3 bench_startup.py --stubs            # stand-in programs of stub_tools.py
+python3 bench_startup.py -n 10 --bin_path bin
+
+The probes of the versions are also run one after the other, as they were
+before tools.py, and all at the same time without the cache, so the three
+ways can be compared with the same programs. The times are the medians of
+the runs.
+'''
+
+PIPELINE_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Runs in a new process: import, read_keys and the probes it made
+CHILD = '''
+import os, sys, json, time
+start = time.time()
+sys.path.insert(0, %(pipeline_path)r)
+import amplicon_pipeline
+import tools
+import_seconds = time.time() - start
+
+probes = {}
+probe_versions = tools.probe_versions
+def record_probes(values, *args, **kwargs):
+    probes.update(values)
+    return probe_versions(values, *args, **kwargs)
+tools.probe_versions = record_probes
+
+amplicon_pipeline.opipe = amplicon_pipeline.Pipeline()
+sys.argv = ['amplicon_pipeline.py', '-c', %(config_file)r]
+start = time.time()
+amplicon_pipeline.menu(sys.argv)
+read_keys_seconds = time.time() - start
+if amplicon_pipeline.opipe.LOGGER is not None:
+    amplicon_pipeline.opipe.LOGGER.close()
+
+result = {'import_seconds': import_seconds, 'read_keys_seconds': read_keys_seconds, 'probes': len(probes)}
+if %(compare)r:
+    start = time.time()
+    for command, _ in probes.values():
+        tools.run_probe(command)
+    result['sequential_seconds'] = time.time() - start
+    start = time.time()
+    probe_versions(probes, cache_path = None)
+    result['concurrent_seconds'] = time.time() - start
+sys.stdout.write('\\n' + json.dumps(result) + '\\n')
+'''
+
+def run_child(config_file, cache_path, env, compare = False):
+    env = dict(env)
+    env['XDG_CACHE_HOME'] = cache_path
+    code = CHILD % {'pipeline_path': PIPELINE_PATH, 'config_file': config_file, 'compare': compare}
+    output = subprocess.check_output([sys.executable, '-c', code], env = env, cwd = PIPELINE_PATH)
+    lines = output.decode('utf-8').strip().splitlines()
+    if not lines or not lines[-1].startswith('{'):
+        # read_keys stopped at a warning
+        raise RuntimeError('The pipeline did not start:\n%s' % '\n'.join(lines))
+    return json.loads(lines[-1])
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2] if values else 0.0
+
+def main(args):
+    parser = argparse.ArgumentParser(description = "Startup time of the pipeline (imports and checks of the programs)")
+    parser.add_argument("-o", "--output", metavar = "PATH", help = "Folder of the runs (default: a temporary folder)")
+    parser.add_argument("-n", "--runs", type = int, default = 5, help = "Runs of every case (default: 5)")
+    parser.add_argument("-a", "--approach", choices = bench_pipeline.APPROACHES, default = 'otu', help = "Approach of the configuration (default: otu)")
+    parser.add_argument("--stubs", action = "store_true", help = "Run with the stand-in programs of stub_tools.py")
+    parser.add_argument("--bin_path", metavar = "PATH", help = "Folder of the programs (parameter bin_path, default: bin of the pipeline)")
+    args = parser.parse_args()
+
+    output_path = os.path.abspath(args.output) if args.output else tempfile.mkdtemp(prefix = 'bench_startup_')
+    if not os.path.isdir(output_path):
+        os.makedirs(output_path)
+
+    env = dict(os.environ)
+    env['PATH'] = '%s%s%s' % (os.path.dirname(sys.executable), os.pathsep, env.get('PATH', ''))
+    bin_path = os.path.abspath(args.bin_path) if args.bin_path else None
+    if args.stubs:
+        bin_path = os.path.join(output_path, 'bin_stub')
+        stub_tools.install(bin_path)
+        env['PATH'] = '%s%s%s' % (os.path.join(bin_path, 'gnulinux'), os.pathsep, env.get('PATH', ''))
+
+    # read_keys only checks that the files exist
+    data_path = os.path.join(output_path, 'data')
+    if not os.path.isdir(data_path):
+        os.makedirs(data_path)
+    files = {'sample1_R1.fastq': '@read1\nACGT\n+\nIIII\n',
+             'sample1_R2.fastq': '@read1\nACGT\n+\nIIII\n',
+             'reference_silva.fa': '>seq1\nACGT\n',
+             'reference_sintax.fa': '>seq1\nACGT\n',
+             'primers.fa': '>forward\nACGT\n>reverse\nACGT\n'}
+    for name, content in files.items():
+        with open(os.path.join(data_path, name), 'w', encoding = 'utf-8') as fw:
+            fw.write(content)
+        fw.close()
+
+    config_file = os.path.join(output_path, 'config.txt')
+    bench_pipeline.write_config(config_file, args.approach, data_path, os.path.join(output_path, 'output'), bin_path, os.path.join(output_path, 'database_cache'), 1)
+
+    cases = {'cold': [], 'warm': []}
+    warm_cache = os.path.join(output_path, 'cache_warm')
+    run_child(config_file, warm_cache, env)
+    for i in range(args.runs):
+        cold_cache = os.path.join(output_path, 'cache_cold')
+        shutil.rmtree(cold_cache, ignore_errors = True)
+        cases['cold'].append(run_child(config_file, cold_cache, env, compare = True))
+        cases['warm'].append(run_child(config_file, warm_cache, env))
+
+    cold = cases['cold']
+    print("Runs: %s | programs probed: %s | CPUs: %s" % (args.runs, cold[0]['probes'], os.cpu_count()))
+    print("%-40s %10s" % ('Case', 'Median (s)'))
+    print("%-40s %10.3f" % ('import amplicon_pipeline', median([row['import_seconds'] for row in cold + cases['warm']])))
+    print("%-40s %10.3f" % ('read_keys, cache of the versions empty', median([row['read_keys_seconds'] for row in cold])))
+    print("%-40s %10.3f" % ('read_keys, cache of the versions filled', median([row['read_keys_seconds'] for row in cases['warm']])))
+    print("%-40s %10.3f" % ('probes one after the other (before)', median([row['sequential_seconds'] for row in cold])))
+    print("%-40s %10.3f" % ('probes at the same time, no cache', median([row['concurrent_seconds'] for row in cold])))
+
+    with open(os.path.join(output_path, 'results_startup.json'), 'w', encoding = 'utf-8') as fw:
+        json.dump(cases, fw, indent = 1)
+    fw.close()
+
+    if not args.output:
+        shutil.rmtree(output_path, ignore_errors = True)
+
+if __name__ == '__main__':
+    main(sys.argv)
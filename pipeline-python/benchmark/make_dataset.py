@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import random
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'util'))
+import fastx
+
+'''
+Synthetic paired-end amplicon datasets (16S-like) for the benchmarks.
+
+python3 make_dataset.py -o dataset                       # 4 samples, 100000 read pairs in total
+python3 make_dataset.py -o dataset -s 12 -n 10000000 -z zst
+
+The taxa are variants of a few genera (species of the same genus are about
+98.5% identical, so some of them fall in the same 97% OTU). Every sample has
+its own subset of the taxa with log-normal abundances and a share of chimeras
+of two taxa. The amplicon is the forward primer, the region of the taxon and
+the reverse-complement of the reverse primer (the degenerate bases of the
+primers are resolved at random); R1 and R2 are its two ends, with an error
+model of Illumina (the quality falls along the read, more in R2, and every
+base is wrong with the probability of its quality).
+
+Written to the output folder:
+- <sample>_R1.fastq[.gz|.zst] and <sample>_R2.fastq[.gz|.zst]
+- primers.fa: forward and reverse primers (341F and 806R)
+- reference_silva.fa: the regions of the taxa with SILVA headers (OTUs)
+- reference_sintax.fa: the same with SINTAX headers (ASVs)
+- dataset.json: the parameters and the reads of every taxon in every sample
+'''
+
+PRIMER_FWD = b'CCTACGGGRSGCAGCAG'
+PRIMER_REV = b'GGACTACHVGGGTWTCTAAT'
+
+BASES = np.frombuffer(b'ACGT', dtype = np.uint8)
+CODES = dict([(base, code) for code, base in enumerate(b'ACGT')])
+IUPAC = {ord('R'): b'AG', ord('Y'): b'CT', ord('S'): b'CG', ord('W'): b'AT', ord('K'): b'GT', ord('M'): b'AC',
+         ord('B'): b'CGT', ord('D'): b'AGT', ord('H'): b'ACT', ord('V'): b'ACG', ord('N'): b'ACGT'}
+
+# Quality along the read: start, end and noise (Phred)
+QUALITY_R1 = (37, 28, 3)
+QUALITY_R2 = (35, 22, 4)
+QUALITY_MIN = 2
+QUALITY_MAX = 41
+
+# Differences between genera and between the species of a genus
+GENUS_DIVERGENCE = 0.2
+SPECIES_DIVERGENCE = 0.015
+SPECIES_PER_GENUS = 3
+
+# Taxa present in each sample, chimeric templates and read pairs written at a time
+TAXA_PER_SAMPLE = 0.7
+CHIMERAS_PER_TAXON = 0.1
+BATCH_SIZE = 50000
+
+def reverse_complement(sequence):
+    return sequence.translate(bytes.maketrans(b'ACGTRYSWKMBDHVN', b'TGCAYRSWMKVHDBN'))[::-1]
+
+def resolve(primer, rnd):
+    # One of the sequences of a degenerate primer
+    return bytes([rnd.choice(IUPAC[base]) if base in IUPAC else base for base in primer])
+
+def mutate(codes, rate, rnd):
+    codes = codes.copy()
+    positions = np.flatnonzero(rnd.random(len(codes)) < rate)
+    codes[positions] = (codes[positions] + rnd.integers(1, 4, size = len(positions))) % 4
+    return codes
+
+def to_codes(sequence):
+    return np.array([CODES[base] for base in sequence], dtype = np.uint8)
+
+def create_taxa(n_taxa, length, rnd):
+    # Sequences (codes) and lineages of the taxa; the regions differ a little in length
+    root = rnd.integers(0, 4, size = length + 20).astype(np.uint8)
+    n_genera = max(1, (n_taxa + SPECIES_PER_GENUS - 1) // SPECIES_PER_GENUS)
+
+    taxa = []
+    for genus in range(n_genera):
+        genus_codes = mutate(root, GENUS_DIVERGENCE, rnd)
+        for species in range(SPECIES_PER_GENUS):
+            if len(taxa) == n_taxa:
+                break
+            codes = mutate(genus_codes, SPECIES_DIVERGENCE, rnd)[:length + int(rnd.integers(-10, 11))]
+            ranks = ['Bacteria',
+                     'Phylum_%s' % (genus // 8 + 1),
+                     'Class_%s' % (genus // 6 + 1),
+                     'Order_%s' % (genus // 4 + 1),
+                     'Family_%s' % (genus // 2 + 1),
+                     'Genus_%s' % (genus + 1),
+                     'Genus_%s species_%s' % (genus + 1, species + 1)]
+            taxa.append({'id': 'REF%s' % (len(taxa) + 1), 'codes': codes, 'ranks': ranks})
+
+    return taxa
+
+def write_references(path, taxa):
+    files = {'silva': os.path.join(path, 'reference_silva.fa'),
+             'sintax': os.path.join(path, 'reference_sintax.fa')}
+
+    prefixes = ['d', 'p', 'c', 'o', 'f', 'g', 's']
+    with fastx.Writer(files['silva']) as fw_silva, fastx.Writer(files['sintax']) as fw_sintax:
+        for taxon in taxa:
+            sequence = BASES[taxon['codes']].tobytes()
+            header = '%s.1.%s %s' % (taxon['id'], len(sequence), ';'.join(taxon['ranks']))
+            fw_silva.write((header.encode('ascii'), sequence))
+
+            lineage = ','.join(['%s:%s' % (prefix, rank.replace(' ', '_')) for prefix, rank in zip(prefixes, taxon['ranks'])])
+            fw_sintax.write((('%s;tax=%s;' % (taxon['id'], lineage)).encode('ascii'), sequence))
+    fw_silva.close()
+    fw_sintax.close()
+
+    return files
+
+def get_quality_profile(read_length, quality):
+    start, end, _ = quality
+    return np.linspace(start, end, read_length)
+
+def create_templates(taxa, n_chimeras, read_length, rnd, prnd):
+    # R1 and R2 of every template (codes): the taxa first, then the chimeras of two of them
+    templates = []
+    names = []
+    for taxon in taxa:
+        templates.append(taxon['codes'])
+        names.append(taxon['id'])
+    for index in range(n_chimeras):
+        index1, index2 = rnd.choice(len(taxa), size = 2, replace = False)
+        codes1 = taxa[index1]['codes']
+        codes2 = taxa[index2]['codes']
+        cut = int(rnd.integers(len(codes1) // 4, 3 * len(codes1) // 4))
+        templates.append(np.concatenate([codes1[:cut], codes2[cut:]]))
+        names.append('chimera_%s_%s' % (taxa[index1]['id'], taxa[index2]['id']))
+
+    reads1 = np.zeros((len(templates), read_length), dtype = np.uint8)
+    reads2 = np.zeros((len(templates), read_length), dtype = np.uint8)
+    for index, codes in enumerate(templates):
+        amplicon = resolve(PRIMER_FWD, prnd) + BASES[codes].tobytes() + reverse_complement(resolve(PRIMER_REV, prnd))
+        amplicon = amplicon + b'A' * max(0, read_length - len(amplicon))
+        reads1[index] = to_codes(amplicon[:read_length])
+        reads2[index] = to_codes(reverse_complement(amplicon)[:read_length])
+
+    return reads1, reads2, names
+
+def add_errors(codes, profile, quality, rnd):
+    # Quality of every base and a substitution with the probability of that quality
+    _, _, noise = quality
+    phred = np.rint(profile + rnd.normal(0, noise, size = codes.shape))
+    phred = np.clip(phred, QUALITY_MIN, QUALITY_MAX).astype(np.uint8)
+    errors = rnd.random(codes.shape) < np.power(10.0, -phred.astype(np.float64) / 10.0)
+
+    codes = codes.copy()
+    codes[errors] = (codes[errors] + rnd.integers(1, 4, size = int(errors.sum()))) % 4
+
+    return BASES[codes], phred + 33
+
+def write_sample(files, name, n_reads, weights, reads1, reads2, read_length, rnd):
+    # Read pairs of a sample, in batches; returns the reads of every template
+    profile1 = get_quality_profile(read_length, QUALITY_R1)
+    profile2 = get_quality_profile(read_length, QUALITY_R2)
+
+    counts = np.zeros(len(weights), dtype = np.int64)
+    written = 0
+    with fastx.open_file(files[0], 'w') as fw1, fastx.open_file(files[1], 'w') as fw2:
+        while written < n_reads:
+            size = min(BATCH_SIZE, n_reads - written)
+            chosen = rnd.choice(len(weights), size = size, p = weights)
+            counts += np.bincount(chosen, minlength = len(weights))
+
+            sequences1, qualities1 = add_errors(reads1[chosen], profile1, QUALITY_R1, rnd)
+            sequences2, qualities2 = add_errors(reads2[chosen], profile2, QUALITY_R2, rnd)
+
+            chunk1 = []
+            chunk2 = []
+            for index in range(size):
+                header = b'%s:1:000000000-A0000:1:%d:%d:%d' % (name, 1101 + (written + index) // 1000000, (written + index) % 1000000, index % 25000)
+                chunk1.append(b'@%s 1:N:0:1\n%s\n+\n%s\n' % (header, sequences1[index].tobytes(), qualities1[index].tobytes()))
+                chunk2.append(b'@%s 2:N:0:1\n%s\n+\n%s\n' % (header, sequences2[index].tobytes(), qualities2[index].tobytes()))
+            fw1.write(b''.join(chunk1))
+            fw2.write(b''.join(chunk2))
+            written += size
+    fw1.close()
+    fw2.close()
+
+    return counts
+
+def create_dataset(path, n_samples = 4, n_reads = 100000, n_taxa = 60, read_length = 250, region_length = 420, chimera_rate = 0.03, compression = None, seed = 1):
+    # n_reads: read pairs of all the samples; returns the description of the dataset (dataset.json)
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    rnd = np.random.default_rng(seed)
+    prnd = random.Random(seed)
+
+    taxa = create_taxa(n_taxa, region_length, rnd)
+    references = write_references(path, taxa)
+
+    primers_file = os.path.join(path, 'primers.fa')
+    with fastx.Writer(primers_file) as fw:
+        fw.write((b'341F', PRIMER_FWD))
+        fw.write((b'806R', PRIMER_REV))
+    fw.close()
+
+    n_chimeras = max(1, int(n_taxa * CHIMERAS_PER_TAXON))
+    reads1, reads2, names = create_templates(taxa, n_chimeras, read_length, rnd, prnd)
+
+    extension = '.fastq' if compression is None else '.fastq.%s' % compression
+    samples = []
+    for index in range(n_samples):
+        name = 'sample%02d' % (index + 1)
+        n_sample_reads = n_reads // n_samples + (1 if index < n_reads % n_samples else 0)
+
+        # Taxa of the sample with log-normal abundances, chimeras with chimera_rate of the reads
+        present = rnd.random(n_taxa) < TAXA_PER_SAMPLE
+        present[int(rnd.integers(0, n_taxa))] = True
+        weights = np.zeros(len(names))
+        weights[:n_taxa] = np.where(present, rnd.lognormal(0, 1.5, size = n_taxa), 0)
+        weights[:n_taxa] *= (1 - chimera_rate) / weights[:n_taxa].sum()
+        weights[n_taxa:] = chimera_rate / n_chimeras
+
+        files = [os.path.join(path, '%s_R1%s' % (name, extension)), os.path.join(path, '%s_R2%s' % (name, extension))]
+        counts = write_sample(files, name.encode('ascii'), n_sample_reads, weights, reads1, reads2, read_length, rnd)
+        samples.append({'name': name,
+                        'r1': files[0],
+                        'r2': files[1],
+                        'reads': n_sample_reads,
+                        'counts': dict([(names[i], int(count)) for i, count in enumerate(counts) if count])})
+
+    dataset = {'samples': samples,
+               'primers': primers_file,
+               'references': references,
+               'parameters': {'n_samples': n_samples,
+                              'n_reads': n_reads,
+                              'n_taxa': n_taxa,
+                              'read_length': read_length,
+                              'region_length': region_length,
+                              'chimera_rate': chimera_rate,
+                              'compression': compression,
+                              'seed': seed}}
+
+    with open(os.path.join(path, 'dataset.json'), 'w', encoding = 'utf-8') as fw:
+        json.dump(dataset, fw, indent = 1)
+    fw.close()
+
+    return dataset
+
+def main(args):
+    parser = argparse.ArgumentParser(description = "Synthetic paired-end amplicon dataset (16S-like) for the benchmarks")
+    parser.add_argument("-o", "--output", metavar = "PATH", required = True, help = "Output folder")
+    parser.add_argument("-s", "--samples", type = int, default = 4, help = "Number of samples (default: 4)")
+    parser.add_argument("-n", "--reads", type = int, default = 100000, help = "Read pairs of all the samples (default: 100000)")
+    parser.add_argument("-t", "--taxa", type = int, default = 60, help = "Number of taxa (default: 60)")
+    parser.add_argument("-l", "--read_length", type = int, default = 250, help = "Length of R1 and R2 (default: 250)")
+    parser.add_argument("-r", "--region_length", type = int, default = 420, help = "Length of the region between the primers (default: 420)")
+    parser.add_argument("-c", "--chimeras", type = float, default = 0.03, help = "Share of chimeric reads (default: 0.03)")
+    parser.add_argument("-z", "--compression", choices = ['gz', 'zst'], help = "Compression of the FASTQ files (default: none)")
+    parser.add_argument("--seed", type = int, default = 1, help = "Random seed (default: 1)")
+    args = parser.parse_args()
+
+    if 2 * args.read_length < args.region_length + len(PRIMER_FWD) + len(PRIMER_REV) + 20:
+        print("The reads don't overlap: 2 x %s bp for an amplicon of %s bp" % (args.read_length, args.region_length + len(PRIMER_FWD) + len(PRIMER_REV)))
+        return
+
+    dataset = create_dataset(args.output, args.samples, args.reads, args.taxa, args.read_length, args.region_length, args.chimeras, args.compression, args.seed)
+    for sample in dataset['samples']:
+        print("%s: %s read pairs, %s templates" % (sample['name'], sample['reads'], len(sample['counts'])))
+    print("Dataset: %s" % os.path.join(args.output, 'dataset.json'))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,815 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import time
+import shutil
+import zipfile
+import itertools
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'util'))
+import fastx
+
+'''
+Stand-ins of the external programs of the pipeline, so the Python stages
+can be benchmarked (and the pipeline run end to end) without them.
+
+python3 stub_tools.py install bin_stub      # bin_stub/gnulinux/{vsearch,usearch,cutadapt,blastn,makeblastdb}
+                                            # and bin_stub/common/FastQC/fastqc (parameter bin_path)
+python3 stub_tools.py vsearch --version
+
+Every stub reads and writes the same files as the program, in the same
+formats (FASTA/FASTQ, uc, otutab, sintax, BLAST tabular), and prints the
+words the pipeline looks for, but with simple algorithms and one thread:
+the read pairs are merged at an exact seed of the overlap, the primers are
+found with regular expressions, the identity of two sequences is counted
+base by base against the candidates that share a block of 1/8 of the
+sequence, and a chimera is a sequence whose two ends come from two
+different, more abundant parents. Their times are not those of the
+programs; what they measure is everything around them.
+
+As the programs do, the clustering of vsearch shows its percentage and
+cutadapt its reads when the output is a terminal, as updates that end with
+'\\r' (see util/progress.py).
+
+makeblastdb writes the FASTA as <db>.nsq (and empty .nhr/.nin), which is
+what the blastn stub reads, so the OTUs need a prepared database
+(database_cache) instead of a real database_bin.
+'''
+
+PROGRAMS = ['vsearch', 'usearch', 'cutadapt', 'blastn', 'makeblastdb']
+
+VERSIONS = {'vsearch': 'vsearch v2.28.1_linux_x86_64 (stub)',
+            'usearch': 'usearch v11.0.667_i86linux32 (stub)',
+            'cutadapt': '4.9',
+            'blastn': 'blastn: 2.16.0+ (stub)',
+            'makeblastdb': 'makeblastdb: 2.16.0+ (stub)',
+            'fastqc': 'FastQC v0.12.1 (stub)'}
+
+# Options without a value
+FLAGS = set(['--sizein', '--sizeout', '--fastq_eeout', '--eeout', '--discard-untrimmed', '--version', '-version'])
+
+IUPAC = {'R': 'AG', 'Y': 'CT', 'S': 'CG', 'W': 'AT', 'K': 'GT', 'M': 'AC',
+         'B': 'CGT', 'D': 'AGT', 'H': 'ACT', 'V': 'ACG', 'N': 'ACGT'}
+
+COMPLEMENT = bytes.maketrans(b'ACGTRYSWKMBDHVN', b'TGCAYRSWMKVHDBN')
+
+SIZE_PATTERN = re.compile(rb';size=(\d+);?')
+SAMPLE_PATTERN = re.compile(rb'(?:^|;)sample=([^;]+)')
+
+# Probability of error of every quality (Phred + 33)
+ERRORS = [10 ** (-max(0, q - 33) / 10.0) for q in range(256)]
+
+N_BLOCKS = 8
+SEED_LENGTH = 12
+CHIMERA_END = 40
+
+# Seconds between the updates of the progress
+PROGRESS_INTERVAL = 0.5
+
+class Progress:
+
+    # Updates of the progress, only in a terminal (vsearch: '<task> <percent>%', cutadapt: '<reads> reads @ ...')
+
+    def __init__(self):
+        self.show = sys.stdout.isatty()
+        self.start = time.time()
+        self.last = 0
+
+    def update(self, message):
+        if self.show and time.time() - self.last >= PROGRESS_INTERVAL:
+            self.last = time.time()
+            sys.stdout.write('\r%s' % message)
+            sys.stdout.flush()
+
+    def percent(self, task, done, total):
+        self.update('%s %d%%' % (task, done * 100 // max(1, total)))
+
+    def reads(self, n_reads):
+        seconds = time.time() - self.start
+        self.update('[----=8-----] %s %13s reads  @ %8.1f µs/read' % (time.strftime('%H:%M:%S', time.gmtime(seconds)), '{:,}'.format(n_reads), seconds * 1e6 / max(1, n_reads)))
+
+    def close(self):
+        if self.show and self.last:
+            sys.stdout.write('\r')
+
+def parse_args(args):
+    # Options with their values, and the positional arguments
+    options = {}
+    positional = []
+    index = 0
+    while index < len(args):
+        arg = args[index]
+        if arg.startswith('-') and len(arg) > 1:
+            if arg in FLAGS or index + 1 == len(args) or (args[index + 1].startswith('-') and len(args[index + 1]) > 1):
+                options[arg.lstrip('-')] = True
+            else:
+                options[arg.lstrip('-')] = args[index + 1]
+                index += 1
+        else:
+            positional.append(arg)
+        index += 1
+
+    return options, positional
+
+def read_records(path):
+    # Records of a FASTA or FASTQ file; the format comes from the first byte (the file may be a named pipe)
+    with fastx.open_file(path) as fr:
+        first = fr.readline()
+        lines = itertools.chain([first], fr)
+        if first[:1] == b'@':
+            for record in fastx.parse_fastq(lines, path):
+                yield record
+        elif first[:1] == b'>':
+            for record in fastx.parse_fasta(lines):
+                yield record
+    fr.close()
+
+def write_record(fw, record):
+    if len(record) == 3:
+        fw.write(fastx.format_fastq(*record))
+    else:
+        fw.write(fastx.format_fasta(record[0], record[1]))
+
+def reverse_complement(sequence):
+    return sequence.translate(COMPLEMENT)[::-1]
+
+def get_size(header):
+    size = SIZE_PATTERN.search(header)
+    return int(size.group(1)) if size else 1
+
+def strip_size(header):
+    return SIZE_PATTERN.sub(b';', header).rstrip(b';')
+
+def with_size(label, size):
+    return b'%s;size=%d' % (strip_size(label), size)
+
+def get_sample(header):
+    # sample=<name>, or the label up to the first period
+    sample = SAMPLE_PATTERN.search(header)
+    if sample:
+        return sample.group(1)
+    return header.split(b';', 1)[0].split(b'.', 1)[0]
+
+def get_label(header):
+    return header.split(None, 1)[0] if header.strip() else header
+
+def get_primer_pattern(primer):
+    return re.compile(''.join(['[%s]' % IUPAC[base] if base in IUPAC else base for base in primer.upper()]).encode('ascii'))
+
+def count_mismatches(sequence1, sequence2):
+    return sum([1 for base1, base2 in zip(sequence1, sequence2) if base1 != base2]) + abs(len(sequence1) - len(sequence2))
+
+def get_identity(sequence1, sequence2):
+    return 1.0 - count_mismatches(sequence1, sequence2) / float(max(1, len(sequence1), len(sequence2)))
+
+def get_blocks(sequence):
+    size = max(1, len(sequence) // N_BLOCKS)
+    return [(index, sequence[index * size:(index + 1) * size]) for index in range(N_BLOCKS)]
+
+class Targets:
+    '''Sequences found by an exact match or by a shared block'''
+
+    def __init__(self):
+        self.sequences = []
+        self.exact = {}
+        self.blocks = {}
+
+    def add(self, sequence):
+        index = len(self.sequences)
+        self.sequences.append(sequence)
+        self.exact.setdefault(sequence, index)
+        for block in get_blocks(sequence):
+            self.blocks.setdefault(block, []).append(index)
+        return index
+
+    def search(self, sequence):
+        # (index, mismatches) of the candidates, the closest first
+        if sequence in self.exact:
+            return [(self.exact[sequence], 0)]
+
+        candidates = set()
+        for block in get_blocks(sequence):
+            candidates.update(self.blocks.get(block, []))
+        hits = [(index, count_mismatches(sequence, self.sequences[index])) for index in candidates]
+
+        return sorted(hits, key = lambda hit: (hit[1], hit[0]))
+
+class Parents:
+    '''Ends of the accepted sequences, to find the chimeras'''
+
+    def __init__(self):
+        self.starts = {}
+        self.ends = {}
+
+    def add(self, index, sequence):
+        self.starts.setdefault(sequence[:CHIMERA_END], set()).add(index)
+        self.ends.setdefault(sequence[-CHIMERA_END:], set()).add(index)
+
+    def is_chimera(self, sequence):
+        starts = self.starts.get(sequence[:CHIMERA_END], set())
+        ends = self.ends.get(sequence[-CHIMERA_END:], set())
+        return bool(starts) and bool(ends) and not (starts & ends)
+
+def read_uniques(path):
+    # Records sorted by abundance (;size=), as the programs of clustering do
+    records = []
+    for record in read_records(path):
+        records.append((record[0], record[1], get_size(record[0])))
+    records.sort(key = lambda record: -record[2])
+    return records
+
+def write_uc_centroid(fw, cluster, sequence, label):
+    fw.write(b'S\t%d\t%d\t*\t*\t*\t*\t*\t%s\t*\n' % (cluster, len(sequence), label))
+
+def write_uc_hit(fw, cluster, sequence, identity, label, target):
+    fw.write(b'H\t%d\t%d\t%.1f\t+\t0\t0\t*\t%s\t%s\n' % (cluster, len(sequence), identity * 100, label, target))
+
+def write_otutab(file, rows, samples):
+    # rows: [(label, {sample: count})]
+    samples = sorted(samples)
+    with open(file, 'wb') as fw:
+        fw.write(b'#OTU ID\t%s\n' % b'\t'.join(samples))
+        for label, counts in rows:
+            fw.write(b'%s\t%s\n' % (label, b'\t'.join([b'%d' % counts.get(sample, 0) for sample in samples])))
+    fw.close()
+
+def merge_pair(record1, record2):
+    # Merged read, or None: the start of the reverse-complement of R2 is looked for in the end of R1
+    header, sequence1, quality1 = record1
+    sequence2 = reverse_complement(record2[1])
+    quality2 = record2[2][::-1]
+
+    for offset in range(0, 3 * SEED_LENGTH, SEED_LENGTH):
+        position = sequence1.find(sequence2[offset:offset + SEED_LENGTH], len(sequence1) // 2)
+        if position < 0 or position < offset:
+            continue
+        start = position - offset
+        overlap = min(len(sequence1) - start, len(sequence2))
+        if count_mismatches(sequence1[start:start + overlap], sequence2[:overlap]) > max(3, overlap // 10):
+            return None
+
+        # The base of the better quality in the overlap
+        bases = bytearray()
+        qualities = bytearray()
+        for base1, q1, base2, q2 in zip(sequence1[start:], quality1[start:], sequence2, quality2):
+            bases.append(base1 if q1 >= q2 else base2)
+            qualities.append(max(q1, q2))
+
+        return (header, sequence1[:start] + bytes(bases) + sequence2[overlap:], quality1[:start] + bytes(qualities) + quality2[overlap:])
+
+    return None
+
+def run_mergepairs(r1_file, r2_file, output, relabel):
+    n_pairs = 0
+    n_merged = 0
+    with fastx.open_file(output, 'w') as fw:
+        for record1, record2 in zip(read_records(r1_file), read_records(r2_file)):
+            n_pairs += 1
+            merged = merge_pair(record1, record2)
+            if merged is None:
+                continue
+            n_merged += 1
+            header = b'%s%d' % (relabel, n_merged) if relabel else get_label(merged[0])
+            write_record(fw, (header, merged[1], merged[2]))
+    fw.close()
+
+    print('Merging reads 100%')
+    print('%10d  Pairs' % n_pairs)
+    print('%10d  Merged (%.1f%%)' % (n_merged, n_merged * 100.0 / max(1, n_pairs)))
+    print('%10d  Not merged' % (n_pairs - n_merged))
+
+def run_fastq_filter(options):
+    maxee = float(options.get('fastq_maxee', 1.0))
+    minlen = int(options.get('fastq_minlen', 1))
+    maxlen = int(options['fastq_maxlen']) if 'fastq_maxlen' in options else None
+    relabel = options.get('relabel', '').encode('ascii')
+
+    n_reads = 0
+    n_kept = 0
+    fw_fastq = fastx.open_file(options['fastqout'], 'w') if 'fastqout' in options else None
+    fw_fasta = fastx.open_file(options['fastaout'], 'w') if 'fastaout' in options else None
+    for header, sequence, quality in read_records(options['fastq_filter']):
+        n_reads += 1
+        if len(sequence) < minlen or (maxlen is not None and len(sequence) > maxlen):
+            continue
+        if sum([ERRORS[q] for q in quality]) > maxee:
+            continue
+        n_kept += 1
+        label = b'%s%d' % (relabel, n_kept) if relabel else header
+        if fw_fastq is not None:
+            fw_fastq.write(fastx.format_fastq(label, sequence, quality))
+        if fw_fasta is not None:
+            fw_fasta.write(fastx.format_fasta(label, sequence))
+    for fw in [fw_fastq, fw_fasta]:
+        if fw is not None:
+            fw.close()
+
+    print('Reading input file 100%')
+    print('%s sequences kept (of which 0 truncated), %s sequences discarded.' % (n_kept, n_reads - n_kept))
+
+def run_derep_fulllength(options):
+    minuniquesize = int(options.get('minuniquesize', 1))
+    sizein = 'sizein' in options
+
+    uniques = {}
+    order = []
+    with open(options['uc'], 'wb') if 'uc' in options else open(os.devnull, 'wb') as fw_uc:
+        for record in read_records(options['derep_fulllength']):
+            label = get_label(record[0])
+            sequence = record[1].upper()
+            size = get_size(record[0]) if sizein else 1
+            unique = uniques.get(sequence)
+            if unique is None:
+                uniques[sequence] = [label, size, len(order)]
+                order.append(sequence)
+                write_uc_centroid(fw_uc, uniques[sequence][2], sequence, label)
+            else:
+                unique[1] += size
+                write_uc_hit(fw_uc, unique[2], sequence, 1.0, label, unique[0])
+    fw_uc.close()
+
+    order.sort(key = lambda sequence: -uniques[sequence][1])
+    n_written = 0
+    with fastx.open_file(options['output'], 'w') as fw:
+        for sequence in order:
+            label, size, _ = uniques[sequence]
+            if size < minuniquesize:
+                continue
+            n_written += 1
+            fw.write(fastx.format_fasta(with_size(label, size) if 'sizeout' in options else strip_size(label), sequence))
+    fw.close()
+
+    print('%s unique sequences, %s written' % (len(order), n_written))
+    print('Writing FASTA output file 100%')
+
+def run_cluster_size(options):
+    identity = float(options.get('id', 0.97))
+    relabel = options.get('relabel', '').encode('ascii') if 'relabel' in options else None
+
+    centroids = Targets()
+    clusters = []
+    progress = Progress()
+    with open(options['uc'], 'wb') if 'uc' in options else open(os.devnull, 'wb') as fw_uc:
+        uniques = read_uniques(options['cluster_size'])
+        for n_done, (header, sequence, size) in enumerate(uniques):
+            progress.percent('Clustering', n_done, len(uniques))
+            sequence = sequence.upper()
+            label = get_label(header)
+            hits = [hit for hit in centroids.search(sequence) if 1.0 - hit[1] / float(max(1, len(sequence))) >= identity]
+            if hits:
+                index = hits[0][0]
+                cluster = clusters[index]
+                cluster['size'] += size
+                cluster['counts'][get_sample(label)] = cluster['counts'].get(get_sample(label), 0) + size
+                write_uc_hit(fw_uc, index, sequence, get_identity(sequence, centroids.sequences[index]), label, cluster['label'])
+            else:
+                index = centroids.add(sequence)
+                clusters.append({'label': label, 'size': size, 'counts': {get_sample(label): size}})
+                write_uc_centroid(fw_uc, index, sequence, label)
+    fw_uc.close()
+
+    rows = []
+    samples = set()
+    with fastx.open_file(options['centroids'], 'w') as fw:
+        for index, cluster in enumerate(clusters):
+            label = b'%s%d' % (relabel, index + 1) if relabel is not None else strip_size(cluster['label'])
+            fw.write(fastx.format_fasta(with_size(label, cluster['size']) if 'sizeout' in options else label, centroids.sequences[index]))
+            rows.append((label, cluster['counts']))
+            samples.update(cluster['counts'].keys())
+    fw.close()
+
+    if 'otutabout' in options:
+        write_otutab(options['otutabout'], rows, samples)
+    if 'biomout' in options:
+        with open(options['biomout'], 'w', encoding = 'utf-8') as fw:
+            fw.write('{"id": null, "format": "Biological Observation Matrix 1.0.0", "type": "OTU table", "shape": [%s, %s]}\n' % (len(rows), len(samples)))
+        fw.close()
+
+    progress.close()
+    print('Clusters: %s' % len(clusters))
+    print('Clustering 100%')
+
+def find_chimeras(records, parents, abskew = 2.0):
+    # Flags of the records (sorted by abundance) with two different, more abundant parents
+    flags = []
+    sizes = []
+    for header, sequence, size in records:
+        sequence = sequence.upper()
+        chimera = parents.is_chimera(sequence)
+        if chimera and abskew:
+            # The parents must be abskew times more abundant (denovo)
+            chimera = any([sizes[index] >= abskew * size for index in parents.starts.get(sequence[:CHIMERA_END], [])])
+        flags.append(chimera)
+        if not chimera:
+            parents.add(len(sizes), sequence)
+        sizes.append(size)
+
+    return flags
+
+def run_uchime(options, mode):
+    if mode == 'ref':
+        parents = Parents()
+        for index, (_, sequence) in enumerate(read_records(options['db'])):
+            parents.add(-index - 1, sequence.upper())
+        records = [(header, sequence, get_size(header)) for header, sequence in read_records(options['uchime_ref'])]
+        flags = [parents.is_chimera(sequence.upper()) for _, sequence, _ in records]
+    else:
+        records = read_uniques(options['uchime_denovo' if mode == 'denovo' else 'uchime3_denovo'])
+        flags = find_chimeras(records, Parents(), 16.0 if mode == 'uchime3' else 2.0)
+
+    relabel = options.get('relabel', '').encode('ascii') if 'relabel' in options else None
+    fw_uchime = open(options['uchimeout'], 'wb') if 'uchimeout' in options else None
+    n_chimeras = 0
+    n_written = 0
+    with fastx.open_file(options['nonchimeras'], 'w') as fw:
+        for (header, sequence, size), chimera in zip(records, flags):
+            label = get_label(header)
+            if fw_uchime is not None:
+                fw_uchime.write(b'%.4f\t%s\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t*\t%s\n' % (1.0 if chimera else 0.0, label, b'Y' if chimera else b'N'))
+            if chimera:
+                n_chimeras += 1
+                continue
+            n_written += 1
+            if relabel is not None:
+                label = b'%s%d' % (relabel, n_written)
+                if 'sizeout' in options:
+                    label = with_size(label, size)
+            fw.write(fastx.format_fasta(label, sequence))
+    fw.close()
+    if fw_uchime is not None:
+        fw_uchime.close()
+
+    print('Found %s chimeras and %s non-chimeras' % (n_chimeras, n_written))
+    print('Detecting chimeras 100%')
+
+def denoise(records, minsize, alpha):
+    # UNOISE: a sequence joins the amplicon that is 2^(alpha d + 1) times more abundant, d mismatches away
+    centroids = Targets()
+    amplicons = []
+    members = []
+    for header, sequence, size in records:
+        if size < minsize:
+            continue
+        sequence = sequence.upper()
+        target = None
+        for index, mismatches in centroids.search(sequence):
+            if size <= amplicons[index][2] / 2.0 ** (alpha * mismatches + 1):
+                target = index
+                break
+        if target is None:
+            centroids.add(sequence)
+            amplicons.append([get_label(header), sequence, size])
+            members.append((get_label(header), sequence, None))
+        else:
+            members.append((get_label(header), sequence, target))
+
+    return amplicons, members
+
+def run_cluster_unoise(options):
+    records = read_uniques(options['cluster_unoise'])
+    amplicons, members = denoise(records, int(options.get('minsize', 8)), float(options.get('unoise_alpha', 2.0)))
+
+    with open(options['uc'], 'wb') if 'uc' in options else open(os.devnull, 'wb') as fw_uc:
+        for label, sequence, target in members:
+            if target is None:
+                write_uc_centroid(fw_uc, [amplicon[0] for amplicon in amplicons].index(label), sequence, label)
+            else:
+                write_uc_hit(fw_uc, target, sequence, get_identity(sequence, amplicons[target][1]), label, amplicons[target][0])
+    fw_uc.close()
+
+    with fastx.open_file(options['centroids'], 'w') as fw:
+        for label, sequence, size in amplicons:
+            fw.write(fastx.format_fasta(with_size(label, size) if 'sizeout' in options else strip_size(label), sequence))
+    fw.close()
+
+    print('Clusters: %s' % len(amplicons))
+    print('Clustering 100%')
+
+def run_unoise3(options):
+    records = read_uniques(options['unoise3'])
+    amplicons, members = denoise(records, int(options.get('minsize', 8)), float(options.get('unoise_alpha', 2.0)))
+    flags = find_chimeras(amplicons, Parents(), 16.0)
+
+    with open(options['tabbedout'], 'wb') if 'tabbedout' in options else open(os.devnull, 'wb') as fw_tab:
+        for label, sequence, target in members:
+            if target is None:
+                fw_tab.write(b'%s\tdenoise\tamp%d\n' % (label, len([member for member in members[:members.index((label, sequence, target)) + 1] if member[2] is None])))
+            else:
+                fw_tab.write(b'%s\tdenoise\tbad\ttop=%s\n' % (label, amplicons[target][0]))
+        n_zotus = 0
+        with fastx.open_file(options['zotus'], 'w') as fw:
+            for (label, sequence, size), chimera in zip(amplicons, flags):
+                fw_tab.write(b'%s\tchfilter\t%s\n' % (label, b'chimera' if chimera else b'zotu'))
+                if not chimera:
+                    n_zotus += 1
+                    fw.write(fastx.format_fasta(b'Zotu%d' % n_zotus, sequence))
+        fw.close()
+    fw_tab.close()
+
+    print('%s amplicons, %s zotus' % (len(amplicons), n_zotus))
+    print('Writing zotus')
+
+def run_usearch_global(options):
+    identity = float(options.get('id', 0.97))
+    targets = Targets()
+    labels = []
+    for header, sequence in read_records(options['db']):
+        targets.add(sequence.upper())
+        labels.append(strip_size(get_label(header)))
+
+    counts = [{} for label in labels]
+    samples = set()
+    n_reads = 0
+    n_matched = 0
+    for record in read_records(options['usearch_global']):
+        n_reads += 1
+        sequence = record[1].upper()
+        hits = [hit for hit in targets.search(sequence) if 1.0 - hit[1] / float(max(1, len(sequence))) >= identity]
+        if not hits:
+            continue
+        n_matched += 1
+        sample = get_sample(get_label(record[0]))
+        samples.add(sample)
+        counts[hits[0][0]][sample] = counts[hits[0][0]].get(sample, 0) + 1
+
+    if 'otutabout' in options:
+        write_otutab(options['otutabout'], list(zip(labels, counts)), samples)
+
+    print('Matching unique query sequences: %s of %s (%.2f%%)' % (n_matched, n_reads, n_matched * 100.0 / max(1, n_reads)))
+    print('Writing OTU table (classic) 100%')
+
+def read_taxonomy_db(path):
+    targets = Targets()
+    taxonomies = []
+    for header, sequence in read_records(path):
+        targets.add(sequence.upper())
+        taxonomy = header.split(b'tax=', 1)[1].rstrip(b';') if b'tax=' in header else b''
+        taxonomies.append(taxonomy.split(b','))
+    return targets, taxonomies
+
+def run_sintax(options, program):
+    cutoff = float(options.get('sintax_cutoff', 0.8))
+    targets, taxonomies = read_taxonomy_db(options['db'])
+
+    n_queries = 0
+    n_classified = 0
+    with open(options['tabbedout'], 'wb') as fw:
+        for record in read_records(options['sintax']):
+            n_queries += 1
+            sequence = record[1].upper()
+            label = get_label(record[0])
+            hits = targets.search(sequence)
+            if not hits:
+                fw.write(b'%s\t\t+\t\n' % label)
+                continue
+            n_classified += 1
+
+            # The confidence falls with the rank and with the distance to the closest reference
+            index, mismatches = hits[0]
+            distance = mismatches / float(max(1, len(sequence)))
+            ranks = taxonomies[index]
+            confidences = [max(0.0, 1.0 - distance * (rank + 1) * 4) for rank in range(len(ranks))]
+            fw.write(b'%s\t%s\t+\t%s\n' % (label,
+                                           b','.join([b'%s(%.4f)' % (rank, confidence) for rank, confidence in zip(ranks, confidences)]),
+                                           b','.join([rank for rank, confidence in zip(ranks, confidences) if confidence >= cutoff])))
+    fw.close()
+
+    if program == 'usearch':
+        print('100.0% Processing')
+    else:
+        print('Classified %s of %s sequences (%.2f%%)' % (n_classified, n_queries, n_classified * 100.0 / max(1, n_queries)))
+
+def run_search_oligodb(options):
+    primers = []
+    for header, sequence in read_records(options['db']):
+        primers.append((get_primer_pattern(sequence.decode('ascii')), b'+'))
+        primers.append((get_primer_pattern(reverse_complement(sequence).decode('ascii')), b'-'))
+
+    n_matched = 0
+    with open(options['userout'], 'wb') as fw:
+        for record in read_records(options['search_oligodb']):
+            for pattern, strand in primers:
+                match = pattern.search(record[1].upper())
+                if match:
+                    n_matched += 1
+                    fw.write(b'%s\t%d\t%d\t%s\n' % (get_label(record[0]), match.start() + 1, match.end(), strand))
+    fw.close()
+
+    print('100.0%% Searching, %s matched' % n_matched)
+
+def run_makeudb(source, output, program):
+    shutil.copyfile(source, output)
+    print('100.0% Buffers' if program == 'usearch' else 'Writing UDB file 100%')
+
+def vsearch(args):
+    options, positional = parse_args(args)
+    if 'version' in options:
+        print(VERSIONS['vsearch'])
+    elif 'fastq_mergepairs' in options:
+        run_mergepairs(options['fastq_mergepairs'], options['reverse'], options['fastqout'], options.get('relabel', '').encode('ascii'))
+        print('Statistics of merged reads')
+    elif 'fastq_filter' in options:
+        run_fastq_filter(options)
+    elif 'derep_fulllength' in options:
+        run_derep_fulllength(options)
+    elif 'cluster_size' in options:
+        run_cluster_size(options)
+    elif 'cluster_unoise' in options:
+        run_cluster_unoise(options)
+    elif 'uchime_denovo' in options:
+        run_uchime(options, 'denovo')
+    elif 'uchime3_denovo' in options:
+        run_uchime(options, 'uchime3')
+    elif 'uchime_ref' in options:
+        run_uchime(options, 'ref')
+    elif 'usearch_global' in options:
+        run_usearch_global(options)
+    elif 'sintax' in options:
+        run_sintax(options, 'vsearch')
+    elif 'makeudb_usearch' in options:
+        run_makeudb(options['makeudb_usearch'], options['output'], 'vsearch')
+    else:
+        sys.exit("vsearch (stub): command not supported: %s" % ' '.join(args))
+
+def usearch(args):
+    options, positional = parse_args(args)
+    if 'version' in options:
+        print(VERSIONS['usearch'])
+    elif 'fastq_mergepairs' in options:
+        # Automatic R2 filename
+        r1_file = options['fastq_mergepairs']
+        relabel = options.get('relabel', '')
+        if relabel == '@':
+            relabel = '%s.' % os.path.basename(r1_file).split('_R1')[0]
+        run_mergepairs(r1_file, r1_file.replace('_R1', '_R2'), options['fastqout'], relabel.encode('ascii'))
+        print('Totals:')
+    elif 'search_oligodb' in options:
+        run_search_oligodb(options)
+    elif 'unoise3' in options:
+        run_unoise3(options)
+    elif 'sintax' in options:
+        run_sintax(options, 'usearch')
+    elif 'makeudb_sintax' in options:
+        run_makeudb(options['makeudb_sintax'], options['output'], 'usearch')
+    else:
+        sys.exit("usearch (stub): command not supported: %s" % ' '.join(args))
+
+def cutadapt(args):
+    options, positional = parse_args(args)
+    if 'version' in options:
+        print(VERSIONS['cutadapt'])
+        return
+
+    # -g: 5' adapter (removed with what comes before it), -a: 3' adapter (removed with what comes after it)
+    if 'g' in options:
+        pattern = get_primer_pattern(options['g'])
+    else:
+        pattern = get_primer_pattern(options['a'])
+
+    n_reads = 0
+    n_written = 0
+    progress = Progress()
+    with fastx.open_file(options['o'], 'w') as fw:
+        for record in read_records(positional[-1]):
+            n_reads += 1
+            progress.reads(n_reads)
+            match = pattern.search(record[1].upper())
+            if match is None:
+                if 'discard-untrimmed' in options:
+                    continue
+                write_record(fw, record)
+            else:
+                start, end = (match.end(), None) if 'g' in options else (0, match.start())
+                write_record(fw, tuple([record[0]] + [field[start:end] for field in record[1:]]))
+            n_written += 1
+    fw.close()
+    progress.close()
+
+    print('=== Summary ===')
+    print('Total reads processed: %s' % n_reads)
+    print('Reads written (passing filters): %s (%.1f%%)' % (n_written, n_written * 100.0 / max(1, n_reads)))
+    print('=== Adapter 1 ===')
+    print('Overview of removed sequences')
+
+def makeblastdb(args):
+    options, positional = parse_args(args)
+    if 'version' in options:
+        print(VERSIONS['makeblastdb'])
+        return
+
+    shutil.copyfile(options['in'], '%s.nsq' % options['out'])
+    for extension in ['.nhr', '.nin']:
+        open('%s%s' % (options['out'], extension), 'wb').close()
+    print('Adding sequences from FASTA; added %s sequences' % fastx.count_records(options['in'], fastx.FORMAT_FASTA))
+
+def blastn(args):
+    options, positional = parse_args(args)
+    if 'version' in options:
+        print(VERSIONS['blastn'])
+        return
+
+    db_file = '%s.nsq' % options['db']
+    if not os.path.isfile(db_file):
+        sys.exit("blastn (stub): '%s' was not written by the makeblastdb stub" % db_file)
+
+    targets = Targets()
+    titles = []
+    for header, sequence in read_records(db_file):
+        targets.add(sequence.upper())
+        titles.append(header)
+
+    perc_identity = float(options.get('perc_identity', 0))
+    max_target_seqs = int(options.get('max_target_seqs', 500))
+    fields = options.get('outfmt', '6').split()[1:] or ['qseqid', 'sseqid', 'pident', 'length', 'mismatch', 'gapopen', 'qstart', 'qend', 'sstart', 'send', 'evalue', 'bitscore']
+
+    with open(options['out'], 'wb') as fw:
+        for record in read_records(options['query']):
+            sequence = record[1].upper()
+            hits = 0
+            for index, mismatches in targets.search(sequence):
+                length = max(len(sequence), len(targets.sequences[index]))
+                pident = 100.0 * (1.0 - mismatches / float(max(1, length)))
+                if pident < perc_identity or hits == max_target_seqs:
+                    break
+                hits += 1
+                values = {'qseqid': get_label(record[0]),
+                          'sseqid': get_label(titles[index]),
+                          'stitle': titles[index],
+                          'pident': b'%.3f' % pident,
+                          'length': b'%d' % length,
+                          'mismatch': b'%d' % mismatches,
+                          'gapopen': b'0',
+                          'qstart': b'1',
+                          'qend': b'%d' % len(sequence),
+                          'sstart': b'1',
+                          'send': b'%d' % len(targets.sequences[index]),
+                          'evalue': b'0.0',
+                          'bitscore': b'%d' % int(1.8 * (length - mismatches)),
+                          'qcovhsp': b'100',
+                          'qcovs': b'100'}
+                fw.write(b'%s\n' % b'\t'.join([values.get(field, b'*') for field in fields]))
+    fw.close()
+
+def fastqc(args):
+    options, positional = parse_args(args)
+    if 'version' in options:
+        print(VERSIONS['fastqc'])
+        return
+
+    for file in positional:
+        # The reads are read, as FastQC does, and a small report is written
+        n_reads = fastx.count_records(file, fastx.FORMAT_FASTQ)
+        prefix = os.path.basename(file)
+        for extension in ['.gz', '.fastq', '.fq']:
+            if prefix.endswith(extension):
+                prefix = prefix[:-len(extension)]
+        report = os.path.join(options.get('o', os.path.dirname(file)), '%s_fastqc' % prefix)
+        with open('%s.html' % report, 'w', encoding = 'utf-8') as fw:
+            fw.write('<html><body>FastQC (stub): %s, %s reads</body></html>\n' % (os.path.basename(file), n_reads))
+        fw.close()
+        with zipfile.ZipFile('%s.zip' % report, 'w') as fzip:
+            fzip.writestr('%s/summary.txt' % os.path.basename(report), 'PASS\tBasic Statistics\t%s\n' % os.path.basename(file))
+        print('Analysis complete for %s' % os.path.basename(file))
+
+def install(path, python = None):
+    # Wrappers with the names of the programs, in the layout of bin/ (parameter bin_path)
+    python = python or sys.executable
+    script = os.path.realpath(__file__)
+
+    programs = {}
+    for platform in ['gnulinux']:
+        for program in PROGRAMS:
+            programs[program] = os.path.join(path, platform, program)
+    programs['fastqc'] = os.path.join(path, 'common', 'FastQC', 'fastqc')
+
+    for program, file in programs.items():
+        if not os.path.isdir(os.path.dirname(file)):
+            os.makedirs(os.path.dirname(file))
+        with open(file, 'w', encoding = 'utf-8') as fw:
+            fw.write('#!/bin/sh\nexec "%s" "%s" %s "$@"\n' % (python, script, program))
+        fw.close()
+        os.chmod(file, int('755', base = 8))
+
+    return programs
+
+TOOLS = {'vsearch': vsearch,
+         'usearch': usearch,
+         'cutadapt': cutadapt,
+         'blastn': blastn,
+         'makeblastdb': makeblastdb,
+         'fastqc': fastqc}
+
+def main(args):
+    if len(args) <= 2 or (args[1] != 'install' and args[1] not in TOOLS):
+        message = 'Use:\n  python3 stub_tools.py install <path>\n  python3 stub_tools.py <%s> [arguments]\n' % '|'.join(sorted(TOOLS))
+        print(message)
+    elif args[1] == 'install':
+        for program, file in sorted(install(args[2]).items()):
+            print('%s: %s' % (program, file))
+    else:
+        TOOLS[args[1]](args[2:])
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import glob
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+import amplicon_pipeline
+from scheduler import Stage, Scheduler
+import metrics
+
+'''
+Metrics of stages that finish at the same time (run_stage saves them when
+every stage finishes).
+
+python3 -m unittest discover -s tests
+'''
+
+class TestConcurrentStages(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix = 'test_metrics_')
+        self.pipeline = amplicon_pipeline.Pipeline()
+        self.pipeline.METRICS = metrics.Metrics(os.path.join(self.path, 'metrics'))
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors = True)
+
+    def test_stages_save_metrics(self):
+        n_stages = 200
+        graph = Scheduler(16, runner = self.pipeline.run_stage)
+        for i in range(n_stages):
+            graph.add(Stage(name = 'stage_%s' % i, actions = [lambda: None]))
+        graph.run()
+
+        with open(self.pipeline.METRICS.json_file, 'r', encoding = 'utf-8') as fr:
+            rows = json.load(fr)
+        fr.close()
+        self.assertEqual(len([row for row in rows if row['kind'] == 'stage' and row['status'] == 'ok']), n_stages)
+        self.assertEqual(glob.glob('%s.tmp*' % self.pipeline.METRICS.json_file), [])
+
+if __name__ == '__main__':
+    unittest.main()
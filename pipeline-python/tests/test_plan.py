@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+PIPELINE_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(PIPELINE_PATH, 'benchmark'))
+import bench_pipeline
+import stub_tools
+
+'''
+Plan (--plan) of a run whose store of databases doesn't have the artifacts
+yet: the stages are shown with the artifacts to build and the store isn't
+changed. The programs are the stand-ins of benchmark/stub_tools.py.
+
+python3 -m unittest discover -s tests
+'''
+
+FILES = {'sample1_R1.fastq': '@read1\nACGT\n+\nIIII\n',
+         'sample1_R2.fastq': '@read1\nACGT\n+\nIIII\n',
+         'reference_silva.fa': '>seq1\nACGT\n',
+         'reference_sintax.fa': '>seq1;tax=d:Bacteria\nACGT\n',
+         'primers.fa': '>forward\nACGT\n>reverse\nACGT\n'}
+
+class TestPlanEmptyStore(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix = 'test_plan_')
+        self.data_path = os.path.join(self.path, 'data')
+        os.makedirs(self.data_path)
+        for name, content in FILES.items():
+            with open(os.path.join(self.data_path, name), 'w', encoding = 'utf-8') as fw:
+                fw.write(content)
+            fw.close()
+
+        self.bin_path = os.path.join(self.path, 'bin_stub')
+        stub_tools.install(self.bin_path)
+        self.env = dict(os.environ)
+        self.env['PATH'] = '%s%s%s%s%s' % (os.path.join(self.bin_path, 'gnulinux'), os.pathsep, os.path.dirname(sys.executable), os.pathsep, self.env.get('PATH', ''))
+        self.env['XDG_CACHE_HOME'] = os.path.join(self.path, 'cache')
+        self.store_path = os.path.join(self.path, 'database_cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors = True)
+
+    def plan(self, approach):
+        config_file = os.path.join(self.path, 'config_%s.txt' % approach)
+        bench_pipeline.write_config(config_file, approach, self.data_path, os.path.join(self.path, approach), self.bin_path, self.store_path, 2)
+        p = subprocess.run([sys.executable, bench_pipeline.PIPELINE, '-c', config_file, '--plan'], stdout = subprocess.PIPE, stderr = subprocess.STDOUT,
+                           stdin = subprocess.DEVNULL, env = self.env, cwd = PIPELINE_PATH)
+        return p.returncode, p.stdout.decode('utf-8', 'replace')
+
+    def test_otu(self):
+        returncode, output = self.plan('otu')
+        self.assertEqual(returncode, 0, output)
+        self.assertNotIn('Traceback', output)
+        self.assertIn('Database artifacts to build: 2', output)
+        self.assertFalse(os.path.exists(self.store_path))
+
+    def test_asv(self):
+        returncode, output = self.plan('asv')
+        self.assertEqual(returncode, 0, output)
+        self.assertNotIn('Traceback', output)
+        self.assertFalse(os.path.exists(self.store_path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'util'))
+import pool
+
+'''
+Pooled files when the kernel-side copies don't copy anything.
+
+python3 -m unittest discover -s tests
+'''
+
+class TestConcatFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix = 'test_pool_')
+        self.files = []
+        for name, record in [('sample1.fa', '>read1\nACGT\n'), ('sample2.fa', '>read2\nGGCC\n')]:
+            file = os.path.join(self.path, name)
+            with open(file, 'w', encoding = 'utf-8') as fw:
+                fw.write(record * 1000)
+            fw.close()
+            self.files.append(file)
+        self.expected = b''.join([open(file, 'rb').read() for file in self.files])
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors = True)
+
+    def concat(self):
+        output_file = os.path.join(self.path, 'all.fa')
+        total = pool.concat_files(self.files, output_file)
+        with open(output_file, 'rb') as fr:
+            data = fr.read()
+        fr.close()
+        return total, data
+
+    def test_copy_file_range_copies_nothing(self):
+        with mock.patch.object(os, 'copy_file_range', return_value = 0, create = True):
+            total, data = self.concat()
+        self.assertEqual(total, len(self.expected))
+        self.assertEqual(data, self.expected)
+
+    def test_kernel_copies_copy_nothing(self):
+        with mock.patch.object(os, 'copy_file_range', return_value = 0, create = True), \
+             mock.patch.object(os, 'sendfile', return_value = 0, create = True):
+            total, data = self.concat()
+        self.assertEqual(total, len(self.expected))
+        self.assertEqual(data, self.expected)
+
+    def test_short_copy_raises(self):
+        with mock.patch.object(pool, 'copy_fd', return_value = 10):
+            self.assertRaises(IOError, self.concat)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'util'))
+import fastx
+import seqindex
+import shards
+
+'''
+Shards of a query cut by the offsets of its sidecar index, or by reading its
+records when the index doesn't have an offset for every shard.
+
+python3 -m unittest discover -s tests
+'''
+
+class TestSplit(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp(prefix = 'test_shards_')
+        self.query_file = os.path.join(self.path, 'otus.fa')
+        with open(self.query_file, 'w', encoding = 'utf-8') as fw:
+            for i in range(50):
+                fw.write('>otu%s\nACGTACGTACGGCC\n' % i)
+        fw.close()
+        self.run = shards.ShardRun(self.query_file, os.path.join(self.path, 'otus.out'))
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors = True)
+
+    def split(self, n_shards):
+        with mock.patch.object(fastx, 'read_fasta', wraps = fastx.read_fasta) as read_fasta:
+            self.run.prepare(n_shards, resume = False, min_records = 1)
+        contents = [open(shard.query, 'rb').read() for shard in self.run.get_shards()]
+        self.assertEqual(b''.join(contents), open(self.query_file, 'rb').read())
+        self.assertTrue(all([content.startswith(b'>') for content in contents]))
+        return contents, read_fasta.called
+
+    def test_offsets(self):
+        seqindex.build_index(self.query_file, step = 4)
+        contents, parsed = self.split(3)
+        self.assertEqual(len(contents), shards.get_n_shards(50, 3, 1))
+        self.assertFalse(parsed)
+
+    def test_few_offsets(self):
+        seqindex.build_index(self.query_file, step = 10)
+        contents, parsed = self.split(3)
+        self.assertEqual(len(contents), shards.get_n_shards(50, 3, 1))
+        self.assertTrue(parsed)
+
+if __name__ == '__main__':
+    unittest.main()
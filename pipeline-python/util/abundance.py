@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import datetime
+import numpy as np
+import pandas as pd
+import lineage
+
+'''
+Output formats of the abundance tables of OTUs and ASVs.
+
+python3 abundance.py abundance_table_otu.csv abundance_table_otu.biom
+
+- tsv: the dense table (id, Lineage, ranks, Level and one column per sample).
+- biom: BIOM 2.1 (HDF5), the sparse matrix both by observation and by sample,
+  with the taxonomy as observation metadata (needs h5py).
+- parquet/feather: a long table with one row per non-zero count (Observation,
+  id, Lineage, ranks, Level, Sample, Count). The taxonomy and the samples are
+  dictionary-encoded, so each string is stored once (needs pyarrow). An OTU
+  without counts has a single row with an empty Sample.
+
+The writers take the table in chunks (lineage.add_taxonomy) and the format
+comes from the extension of the file. load_table reads any of them back as a
+sparse Table (CSR arrays), the dense matrix is never built.
+'''
+
+FORMAT_TSV = 'tsv'
+FORMAT_BIOM = 'biom'
+FORMAT_PARQUET = 'parquet'
+FORMAT_FEATHER = 'feather'
+FORMATS = [FORMAT_TSV, FORMAT_BIOM, FORMAT_PARQUET, FORMAT_FEATHER]
+
+EXTENSIONS = {FORMAT_TSV: '.csv',
+              FORMAT_BIOM: '.biom',
+              FORMAT_PARQUET: '.parquet',
+              FORMAT_FEATHER: '.feather'}
+
+# Python modules needed by each format
+MODULES = {FORMAT_BIOM: 'h5py',
+           FORMAT_PARQUET: 'pyarrow',
+           FORMAT_FEATHER: 'pyarrow'}
+
+BIOM_TYPE = 'OTU table'
+ARROW_COMPRESSION = 'zstd'
+CHUNK_SIZE = lineage.CHUNK_SIZE
+
+def get_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    for fmt, _extension in EXTENSIONS.items():
+        if extension == _extension:
+            return fmt
+    return FORMAT_TSV
+
+def import_module(fmt):
+    try:
+        return __import__(MODULES[fmt])
+    except ImportError:
+        raise ImportError("The %s format needs the %s module (pip3 install %s)" % (fmt, MODULES[fmt], MODULES[fmt]))
+
+def split_chunk(df):
+    # Text columns (id and taxonomy) and the counts
+    n_text = len(lineage.TAXONOMY_COLUMNS) + 1
+    return df.iloc[:, :n_text], df.iloc[:, n_text:].to_numpy()
+
+class TsvWriter:
+
+    def __init__(self, path, columns):
+        self.fw = open(path, 'w', encoding = 'utf-8', newline = '')
+        self.fw.write(pd.DataFrame(columns = columns).to_csv(sep = '\t', index = False, lineterminator = '\n'))
+
+    def write(self, df):
+        # pandas writes the text columns (quoting), the counts are formatted as a whole row
+        text, counts = split_chunk(df)
+        texts = text.to_csv(sep = '\t', header = False, index = False, lineterminator = '\n').splitlines()
+        if counts.shape[1] == 0:
+            lines = texts
+        else:
+            row_format = '\t'.join(['%d'] * counts.shape[1])
+            lines = ['%s\t%s' % (text, row_format % tuple(row)) for text, row in zip(texts, counts.tolist())]
+        if lines:
+            self.fw.write('\n'.join(lines))
+            self.fw.write('\n')
+
+    def close(self):
+        self.fw.close()
+
+class BiomWriter:
+
+    def __init__(self, path, samples):
+        h5py = import_module(FORMAT_BIOM)
+        self.h5 = h5py.File(path, 'w')
+        self.n_samples = len(samples)
+        self.n_observations = 0
+        self.nnz = 0
+        self.sample_nnz = np.zeros(self.n_samples, dtype = np.int64)
+
+        strings = h5py.string_dtype()
+        self.h5.attrs['id'] = os.path.basename(path)
+        self.h5.attrs['type'] = BIOM_TYPE
+        self.h5.attrs['format-url'] = 'http://biom-format.org'
+        self.h5.attrs['format-version'] = np.array([2, 1], dtype = np.int32)
+        self.h5.attrs['generated-by'] = 'amplicon_pipeline'
+        self.h5.attrs['creation-date'] = datetime.datetime.now().isoformat()
+
+        for axis in ['observation', 'sample']:
+            for group in ['matrix', 'metadata', 'group-metadata']:
+                self.h5.create_group('%s/%s' % (axis, group))
+
+        self.datasets = {}
+        for name, dtype, shape in [('observation/ids', strings, (0,)),
+                                   ('observation/matrix/data', np.float64, (0,)),
+                                   ('observation/matrix/indices', np.int32, (0,)),
+                                   ('observation/matrix/indptr', np.int32, (0,)),
+                                   ('observation/metadata/taxonomy', strings, (0, len(lineage.RANKS))),
+                                   ('observation/metadata/lineage', strings, (0,)),
+                                   ('observation/metadata/level', strings, (0,))]:
+            self.datasets[name] = self.h5.create_dataset(name, shape = shape, maxshape = (None,) + shape[1:], dtype = dtype, chunks = True, compression = 'gzip')
+        self.append('observation/matrix/indptr', np.zeros(1, dtype = np.int32))
+        self.h5.create_dataset('sample/ids', data = np.array(samples, dtype = object), dtype = strings)
+
+    def append(self, name, values):
+        dataset = self.datasets[name]
+        size = dataset.shape[0]
+        dataset.resize(size + len(values), axis = 0)
+        dataset[size:] = values
+
+    def write(self, df):
+        text, counts = split_chunk(df)
+        rows, columns = np.nonzero(counts)
+        indptr = self.nnz + np.cumsum(np.count_nonzero(counts, axis = 1))
+
+        self.append('observation/ids', text.iloc[:, 0].to_numpy(dtype = object))
+        self.append('observation/matrix/data', counts[rows, columns])
+        self.append('observation/matrix/indices', columns.astype(np.int32))
+        self.append('observation/matrix/indptr', indptr.astype(np.int32))
+        self.append('observation/metadata/taxonomy', text[lineage.RANKS].to_numpy(dtype = object))
+        self.append('observation/metadata/lineage', text['Lineage'].to_numpy(dtype = object))
+        self.append('observation/metadata/level', text['Level'].to_numpy(dtype = object))
+
+        self.n_observations += counts.shape[0]
+        self.nnz += len(rows)
+        self.sample_nnz += np.bincount(columns, minlength = self.n_samples)
+
+    def write_samples(self):
+        # The matrix by sample (CSC) is filled from the matrix by observation, a block at a time
+        indptr = np.zeros(self.n_samples + 1, dtype = np.int64)
+        indptr[1:] = np.cumsum(self.sample_nnz)
+        next_free = indptr[:-1].copy()
+        sample_indices = np.empty(self.nnz, dtype = np.int32)
+        sample_data = np.empty(self.nnz, dtype = lineage.COUNT_DTYPE)
+
+        observation_indptr = self.datasets['observation/matrix/indptr'][:]
+        for start in range(0, self.n_observations, CHUNK_SIZE):
+            end = min(start + CHUNK_SIZE, self.n_observations)
+            first, last = observation_indptr[start], observation_indptr[end]
+            columns = self.datasets['observation/matrix/indices'][first:last]
+            data = self.datasets['observation/matrix/data'][first:last]
+            rows = np.repeat(np.arange(start, end, dtype = np.int32), np.diff(observation_indptr[start:end + 1]))
+
+            order = np.argsort(columns, kind = 'stable')
+            columns = columns[order]
+            rank = np.arange(len(columns)) - np.searchsorted(columns, columns, side = 'left')
+            positions = next_free[columns] + rank
+            sample_indices[positions] = rows[order]
+            sample_data[positions] = data[order]
+            next_free += np.bincount(columns, minlength = self.n_samples)
+
+        # HDF5 converts the counts to float64 (the type of the BIOM matrix) while writing
+        self.h5.create_dataset('sample/matrix/data', data = sample_data, dtype = np.float64, compression = 'gzip')
+        self.h5.create_dataset('sample/matrix/indices', data = sample_indices, compression = 'gzip')
+        self.h5.create_dataset('sample/matrix/indptr', data = indptr.astype(np.int32), compression = 'gzip')
+
+    def close(self):
+        self.write_samples()
+        self.h5.attrs['shape'] = np.array([self.n_observations, self.n_samples], dtype = np.int32)
+        self.h5.attrs['nnz'] = self.nnz
+        self.h5.close()
+
+class ArrowWriter:
+
+    def __init__(self, path, columns, fmt = FORMAT_PARQUET):
+        pa = import_module(fmt)
+        import pyarrow.parquet
+        self.pa = pa
+        self.samples = list(columns[len(lineage.TAXONOMY_COLUMNS) + 1:])
+        self.id_column = columns[0]
+        self.n_observations = 0
+
+        dictionary = pa.dictionary(pa.int32(), pa.string())
+        fields = [pa.field('Observation', pa.uint32()), pa.field(self.id_column, pa.string())]
+        fields += [pa.field(column, dictionary) for column in lineage.TAXONOMY_COLUMNS]
+        fields += [pa.field('Sample', dictionary), pa.field('Count', pa.uint32())]
+        metadata = {'samples': json.dumps(self.samples), 'id_column': self.id_column}
+        self.schema = pa.schema(fields, metadata = metadata)
+        self.sample_dictionary = pa.array(self.samples, type = pa.string())
+
+        if fmt == FORMAT_FEATHER:
+            options = pa.ipc.IpcWriteOptions(compression = ARROW_COMPRESSION)
+            self.writer = pa.ipc.new_file(path, self.schema, options = options)
+        else:
+            self.writer = pyarrow.parquet.ParquetWriter(path, self.schema, compression = ARROW_COMPRESSION)
+
+    def write(self, df):
+        pa = self.pa
+        text, counts = split_chunk(df)
+        rows, columns = np.nonzero(counts)
+        values = counts[rows, columns]
+
+        empty = np.flatnonzero(~counts.any(axis = 1))
+        if len(empty) > 0:
+            # One row without Sample for every OTU without counts
+            rows = np.concatenate([rows, empty])
+            columns = np.concatenate([columns, np.full(len(empty), -1)])
+            values = np.concatenate([values, np.zeros(len(empty), dtype = values.dtype)])
+            order = np.argsort(rows, kind = 'stable')
+            rows, columns, values = rows[order], columns[order], values[order]
+
+        arrays = [pa.array(rows + self.n_observations, type = pa.uint32()),
+                  pa.array(text.iloc[:, 0].to_numpy(dtype = object)[rows], type = pa.string())]
+        for column in lineage.TAXONOMY_COLUMNS:
+            values_column = text[column]
+            if not isinstance(values_column.dtype, pd.CategoricalDtype):
+                values_column = values_column.astype('category')
+            codes = values_column.cat.codes.to_numpy().astype(np.int32)[rows]
+            categories = pa.array(values_column.cat.categories.to_numpy(dtype = object), type = pa.string())
+            arrays.append(pa.DictionaryArray.from_arrays(pa.array(codes, type = pa.int32()), categories))
+        sample_codes = pa.array(columns.astype(np.int32), type = pa.int32(), mask = columns < 0)
+        arrays.append(pa.DictionaryArray.from_arrays(sample_codes, self.sample_dictionary))
+        arrays.append(pa.array(values, type = pa.uint32()))
+
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema = self.schema))
+        self.n_observations += counts.shape[0]
+
+    def close(self):
+        self.writer.close()
+
+class TableWriter:
+    '''Writes the chunks of a table to one or more files (the format comes from the extension)'''
+
+    def __init__(self, output_files, columns):
+        if isinstance(output_files, str):
+            output_files = [output_files]
+
+        self.writers = []
+        for output_file in output_files:
+            fmt = get_format(output_file)
+            if fmt == FORMAT_BIOM:
+                self.writers.append(BiomWriter(output_file, columns[len(lineage.TAXONOMY_COLUMNS) + 1:]))
+            elif fmt in [FORMAT_PARQUET, FORMAT_FEATHER]:
+                self.writers.append(ArrowWriter(output_file, columns, fmt))
+            else:
+                self.writers.append(TsvWriter(output_file, columns))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, df):
+        for writer in self.writers:
+            writer.write(df)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+        self.writers = []
+
+class Table:
+    '''Sparse abundance table: CSR arrays (by observation) and the taxonomy of every observation'''
+
+    def __init__(self, ids, samples, metadata, data, indices, indptr, id_column = '#OTU ID'):
+        self.ids = ids
+        self.samples = samples
+        self.metadata = metadata
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.id_column = id_column
+
+    @property
+    def shape(self):
+        return len(self.ids), len(self.samples)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def sample_totals(self):
+        return np.bincount(self.indices, weights = self.data, minlength = len(self.samples)).astype(lineage.COUNT_DTYPE)
+
+    def to_scipy(self):
+        from scipy import sparse
+        return sparse.csr_matrix((self.data, self.indices, self.indptr), shape = self.shape)
+
+    def to_dataframe(self):
+        # pandas sparse columns, one sample at a time
+        df = self.metadata.copy()
+        df.insert(loc = 0, column = self.id_column, value = self.ids)
+        rows = np.repeat(np.arange(len(self.ids)), np.diff(self.indptr))
+        order = np.argsort(self.indices, kind = 'stable')
+        bounds = np.searchsorted(self.indices[order], np.arange(len(self.samples) + 1))
+        columns = {}
+        for index, sample in enumerate(self.samples):
+            column = np.zeros(len(self.ids), dtype = lineage.COUNT_DTYPE)
+            selected = order[bounds[index]:bounds[index + 1]]
+            column[rows[selected]] = self.data[selected]
+            columns[sample] = pd.arrays.SparseArray(column, fill_value = 0)
+
+        return pd.concat([df, pd.DataFrame(columns, index = df.index)], axis = 1)
+
+    def iter_dense(self, chunk_size = CHUNK_SIZE):
+        # Dense chunks in the layout of the writers
+        for start in range(0, len(self.ids), chunk_size):
+            end = min(start + chunk_size, len(self.ids))
+            counts = np.zeros((end - start, len(self.samples)), dtype = lineage.COUNT_DTYPE)
+            first, last = self.indptr[start], self.indptr[end]
+            rows = np.repeat(np.arange(end - start), np.diff(self.indptr[start:end + 1]))
+            counts[rows, self.indices[first:last]] = self.data[first:last]
+
+            df = self.metadata.iloc[start:end].reset_index(drop = True)
+            df.insert(loc = 0, column = self.id_column, value = self.ids[start:end])
+            yield pd.concat([df, pd.DataFrame(counts, columns = self.samples)], axis = 1)
+
+def get_metadata(df):
+    metadata = df.reindex(columns = lineage.TAXONOMY_COLUMNS).fillna('')
+    for column in lineage.TAXONOMY_COLUMNS:
+        metadata[column] = metadata[column].astype('category')
+    return metadata.reset_index(drop = True)
+
+def load_tsv(path):
+    columns = lineage.read_count_columns(path)
+    n_text = len([column for column in columns if column in lineage.TAXONOMY_COLUMNS]) + 1
+    dtype = dict([(column, str) for column in columns[:n_text]] + [(column, lineage.COUNT_DTYPE) for column in columns[n_text:]])
+
+    ids, texts, data, indices, indptr = [], [], [], [], [np.zeros(1, dtype = np.int64)]
+    nnz = 0
+    for df in pd.read_csv(filepath_or_buffer = path, sep = '\t', header = 0, dtype = dtype, keep_default_na = False, chunksize = CHUNK_SIZE):
+        counts = df.iloc[:, n_text:].to_numpy()
+        rows, _columns = np.nonzero(counts)
+        ids.append(df.iloc[:, 0].to_numpy(dtype = object))
+        texts.append(df.iloc[:, 1:n_text])
+        data.append(counts[rows, _columns])
+        indices.append(_columns.astype(np.int32))
+        indptr.append(nnz + np.cumsum(np.count_nonzero(counts, axis = 1)))
+        nnz += len(rows)
+
+    text = pd.concat(texts) if texts else pd.DataFrame(columns = columns[1:n_text])
+    return Table(ids = np.concatenate(ids) if ids else np.array([], dtype = object),
+                 samples = columns[n_text:],
+                 metadata = get_metadata(text),
+                 data = np.concatenate(data) if data else np.array([], dtype = lineage.COUNT_DTYPE),
+                 indices = np.concatenate(indices) if indices else np.array([], dtype = np.int32),
+                 indptr = np.concatenate(indptr),
+                 id_column = columns[0])
+
+def load_biom(path):
+    h5py = import_module(FORMAT_BIOM)
+    with h5py.File(path, 'r') as h5:
+        ids = h5['observation/ids'].asstr()[:]
+        metadata = {}
+        group = h5['observation/metadata']
+        if 'taxonomy' in group:
+            taxonomy = group['taxonomy'].asstr()[:]
+            for index, rank in enumerate(lineage.RANKS):
+                metadata[rank] = taxonomy[:, index] if taxonomy.ndim == 2 and taxonomy.shape[1] > index else ''
+        for name, column in [('lineage', 'Lineage'), ('level', 'Level')]:
+            if name in group:
+                metadata[column] = group[name].asstr()[:]
+
+        table = Table(ids = np.asarray(ids, dtype = object),
+                      samples = list(h5['sample/ids'].asstr()[:]),
+                      metadata = get_metadata(pd.DataFrame(metadata, index = range(len(ids)))),
+                      data = h5['observation/matrix/data'][:].astype(lineage.COUNT_DTYPE),
+                      indices = h5['observation/matrix/indices'][:],
+                      indptr = h5['observation/matrix/indptr'][:])
+    h5.close()
+
+    return table
+
+def load_arrow(path, fmt = FORMAT_PARQUET):
+    pa = import_module(fmt)
+    if fmt == FORMAT_FEATHER:
+        with pa.memory_map(path, 'r') as source:
+            arrow_table = pa.ipc.open_file(source).read_all()
+    else:
+        import pyarrow.parquet
+        arrow_table = pyarrow.parquet.read_table(path)
+
+    metadata = arrow_table.schema.metadata or {}
+    samples = json.loads(metadata.get(b'samples', b'[]').decode('utf-8'))
+    id_column = metadata.get(b'id_column', b'#OTU ID').decode('utf-8')
+    positions = dict([(sample, index) for index, sample in enumerate(samples)])
+
+    observations = arrow_table.column('Observation').to_numpy()
+    n_observations = int(observations.max()) + 1 if len(observations) > 0 else 0
+
+    # The Sample dictionary of every chunk is mapped to the positions of the samples
+    columns = []
+    for chunk in arrow_table.column('Sample').chunks:
+        mapping = np.array([positions[sample] for sample in chunk.dictionary.to_pylist()] + [-1], dtype = np.int32)
+        codes = chunk.indices.fill_null(-1).to_numpy(zero_copy_only = False)
+        columns.append(mapping[codes])
+    columns = np.concatenate(columns) if columns else np.array([], dtype = np.int32)
+    counts = arrow_table.column('Count').to_numpy()
+    valid = columns >= 0
+
+    indptr = np.zeros(n_observations + 1, dtype = np.int64)
+    indptr[1:] = np.cumsum(np.bincount(observations[valid], minlength = n_observations))
+
+    first = np.searchsorted(observations, np.arange(n_observations))
+    first_rows = arrow_table.select([id_column] + lineage.TAXONOMY_COLUMNS).take(pa.array(first))
+    df = first_rows.to_pandas()
+
+    return Table(ids = df[id_column].to_numpy(dtype = object),
+                 samples = samples,
+                 metadata = get_metadata(df),
+                 data = counts[valid].astype(lineage.COUNT_DTYPE),
+                 indices = columns[valid],
+                 indptr = indptr,
+                 id_column = id_column)
+
+def load_table(path):
+    fmt = get_format(path)
+    if fmt == FORMAT_BIOM:
+        return load_biom(path)
+    elif fmt in [FORMAT_PARQUET, FORMAT_FEATHER]:
+        return load_arrow(path, fmt)
+    return load_tsv(path)
+
+def write_table(table, output_files, chunk_size = CHUNK_SIZE):
+    columns = [table.id_column] + lineage.TAXONOMY_COLUMNS + list(table.samples)
+    with TableWriter(output_files, columns) as writer:
+        for df in table.iter_dense(chunk_size):
+            writer.write(df)
+
+def main(args):
+    if len(args) <= 2:
+        message = 'Use:\n  python3 abundance.py <TABLE> <OUTPUT_FILE> [<OUTPUT_FILE> ...]\n  Formats: %s (from the extension)\n' % ', '.join(['%s (%s)' % (fmt, EXTENSIONS[fmt]) for fmt in FORMATS])
+        print(message)
+    else:
+        table = load_table(args[1])
+        write_table(table, args[2:])
+        print('%s observations x %s samples (%s non-zero counts) written to %s' % (table.shape[0], table.shape[1], table.nnz, ', '.join(args[2:])))
+
+if __name__ == '__main__':
+    main(sys.argv)
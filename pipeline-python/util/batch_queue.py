@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import queue
+import threading
+
+'''
+Background queue that groups the submitted items into batches.
+
+A batch is handed to run_batch when it reaches batch_size items, when no new
+item arrived for max_wait seconds, or when the queue is drained. Failures are
+collected instead of raised, so the caller decides what to do with them.
+'''
+
+class BatchQueue:
+
+    STOP = object()
+
+    def __init__(self, run_batch, batch_size = 8, max_wait = 30):
+        self.run_batch = run_batch
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait = max_wait
+        self.failures = []
+
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target = self.worker, daemon = True)
+        self.thread.start()
+
+    def submit(self, item):
+        self.queue.put(item)
+
+    def worker(self):
+        batch = []
+        while True:
+            try:
+                item = self.queue.get(timeout = self.max_wait if batch else None)
+            except queue.Empty:
+                self.flush(batch)
+                batch = []
+                continue
+
+            if item is self.STOP:
+                self.flush(batch)
+                return
+
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = []
+
+    def flush(self, batch):
+        if not batch:
+            return
+
+        try:
+            self.run_batch(list(batch))
+        except BaseException as e:
+            self.failures.append((list(batch), e))
+
+    def drain(self):
+        self.queue.put(self.STOP)
+        self.thread.join()
+
+        return self.failures
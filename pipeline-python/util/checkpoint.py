@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+import threading
+from files import write_json, get_checksum
+
+'''
+Content-addressed checkpoints of the pipeline stages.
+
+For every finished stage we keep a fingerprint of its inputs (file digests),
+parameters and program version, plus the digests of its outputs. A stage is
+up to date when its fingerprint didn't change and its outputs are still the
+files it wrote.
+'''
+
+class CheckpointStore:
+
+    def __init__(self, file):
+        self.file = file
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.digests = {}
+
+        if os.path.isfile(file):
+            try:
+                with open(file, 'r', encoding = 'utf-8') as fr:
+                    data = json.load(fr)
+                fr.close()
+                self.stages = data.get('stages', {})
+                self.digests = data.get('digests', {})
+            except ValueError:
+                # A damaged checkpoint file only means that everything runs again
+                self.stages = {}
+                self.digests = {}
+
+    def save(self):
+        write_json({'stages': self.stages, 'digests': self.digests}, self.file)
+
+    def file_digest(self, path):
+        if not os.path.isfile(path):
+            return None
+
+        stat = os.stat(path)
+        with self.lock:
+            cached = self.digests.get(path)
+        if cached is not None and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime_ns:
+            return cached['digest']
+
+        digest = get_checksum(path)
+
+        with self.lock:
+            self.digests[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'digest': digest}
+
+        return digest
+
+    def fingerprint(self, name, actions, inputs):
+        material = {'name': name,
+                    'actions': actions,
+                    'inputs': [[path, self.file_digest(path)] for path in inputs]}
+        material = json.dumps(material, sort_keys = True, default = str)
+
+        return hashlib.blake2b(material.encode('utf-8'), digest_size = 20).hexdigest()
+
+    def is_current(self, name, fingerprint, outputs):
+        with self.lock:
+            record = self.stages.get(name)
+        if record is None or record['fingerprint'] != fingerprint:
+            return False
+
+        for path in outputs:
+            digest = self.file_digest(path)
+            if digest is None or digest != record['outputs'].get(path):
+                return False
+
+        return True
+
+    def record(self, name, fingerprint, outputs):
+        arr_outputs = {}
+        for path in outputs:
+            arr_outputs[path] = self.file_digest(path)
+
+        with self.lock:
+            self.stages[name] = {'fingerprint': fingerprint, 'outputs': arr_outputs}
+            self.save()
+
+    def forget(self, name):
+        with self.lock:
+            if name in self.stages:
+                del self.stages[name]
+                self.save()
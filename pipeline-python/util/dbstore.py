@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import shutil
+from files import write_json, read_json, get_checksum
+
+'''
+Store of prepared reference databases.
+
+python3 dbstore.py <STORE_PATH>              # list the entries
+python3 dbstore.py <STORE_PATH> evict <GB>   # evict down to a size
+
+Every entry is keyed by a checksum of the content of the source FASTA, the
+database type and the version of the store, so a new release of a database
+(or a change of how the artifacts are built) gets its own entry. The derived
+artifacts (SINTAX FASTA, UDB indexes, BLAST binaries) are built once into a
+temporary folder of the entry and moved into place, so a run that stops half
+way or two runs that build the same artifact never leave a broken one. The
+checksum of a source is remembered by size and modification time, a run only
+reads the manifest of its entry.
+
+The least recently used entries are evicted when the store is larger than its
+maximum size; entries of an older version of the store go first. A read-only
+store (the plan of a run) only looks up its entries, it writes nothing.
+'''
+
+STORE_VERSION = 1
+MANIFEST = 'manifest.json'
+CHECKSUMS = 'checksums.json'
+GB = 1024 * 1024 * 1024
+
+def get_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    total = 0
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:
+                pass
+    return total
+
+class Entry:
+
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    def get_artifact(self, name):
+        # Path of a built artifact (file or prefix), None if it isn't built
+        artifact = self.manifest['artifacts'].get(name)
+        if artifact is None:
+            return None
+
+        path = os.path.join(self.path, artifact['path'])
+        if not os.path.isdir(os.path.join(self.path, name)):
+            return None
+        return path
+
+    def get_build_path(self, name):
+        # Temporary folder where an artifact is built
+        build_path = os.path.join(self.path, '%s.build.%s' % (name, os.getpid()))
+        if os.path.isdir(build_path):
+            shutil.rmtree(build_path)
+        os.makedirs(build_path)
+        return build_path
+
+    def add_artifact(self, name, build_path, file_name, info = None):
+        # Move the built folder into place (another run may have finished it first)
+        final_path = os.path.join(self.path, name)
+        try:
+            os.rename(build_path, final_path)
+        except OSError:
+            shutil.rmtree(build_path, ignore_errors = True)
+
+        manifest = read_json(os.path.join(self.path, MANIFEST), self.manifest)
+        manifest['artifacts'][name] = {'path': os.path.join(name, file_name),
+                                       'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                                       'info': info or {}}
+        write_json(manifest, os.path.join(self.path, MANIFEST))
+        self.manifest = manifest
+
+        return self.get_artifact(name)
+
+    def touch(self):
+        self.manifest['last_used'] = time.time()
+        write_json(self.manifest, os.path.join(self.path, MANIFEST))
+
+class DatabaseStore:
+
+    def __init__(self, path, max_size = None, read_only = False):
+        self.path = path
+        self.max_size = max_size
+        self.read_only = read_only
+        if not os.path.isdir(path) and not read_only:
+            os.makedirs(path)
+
+    def get_checksum(self, fasta_file):
+        # Content checksum of the source, remembered by size and modification time
+        fasta_file = os.path.realpath(fasta_file)
+        stat = os.stat(fasta_file)
+        checksums_file = os.path.join(self.path, CHECKSUMS)
+        checksums = read_json(checksums_file, {})
+
+        cached = checksums.get(fasta_file)
+        if cached is not None and cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime_ns:
+            return cached['checksum']
+
+        checksum = get_checksum(fasta_file)
+        if self.read_only:
+            return checksum
+
+        checksums = read_json(checksums_file, {})
+        checksums[fasta_file] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'checksum': checksum}
+        write_json(checksums, checksums_file)
+
+        return checksum
+
+    def get_entry(self, fasta_file, db_type):
+        checksum = self.get_checksum(fasta_file)
+        name = '%s_%s_v%s' % (db_type, checksum[:16], STORE_VERSION)
+        path = os.path.join(self.path, name)
+        if not os.path.isdir(path) and not self.read_only:
+            os.makedirs(path)
+
+        manifest = read_json(os.path.join(path, MANIFEST))
+        if manifest is None:
+            manifest = {'version': STORE_VERSION,
+                        'db_type': db_type,
+                        'checksum': checksum,
+                        'source': os.path.realpath(fasta_file),
+                        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                        'artifacts': {}}
+
+        entry = Entry(path, manifest)
+        if not self.read_only:
+            entry.touch()
+
+        return entry
+
+    def get_entries(self):
+        entries = []
+        for name in sorted(os.listdir(self.path)):
+            path = os.path.join(self.path, name)
+            manifest = read_json(os.path.join(path, MANIFEST))
+            if os.path.isdir(path) and manifest is not None:
+                entries.append(Entry(path, manifest))
+        return entries
+
+    def evict(self, keep = None, max_size = None):
+        # Least recently used entries first, older versions of the store before anything else
+        if max_size is None:
+            max_size = self.max_size
+        if max_size is None:
+            return []
+
+        entries = [(entry, get_size(entry.path)) for entry in self.get_entries()]
+        total = sum([size for _, size in entries])
+        entries.sort(key = lambda item: (item[0].manifest.get('version') == STORE_VERSION, item[0].manifest.get('last_used', 0)))
+
+        evicted = []
+        for entry, size in entries:
+            if total <= max_size:
+                break
+            if keep is not None and entry.path == keep.path:
+                continue
+            shutil.rmtree(entry.path, ignore_errors = True)
+            total -= size
+            evicted.append(entry.name)
+
+        return evicted
+
+def main(args):
+    if len(args) <= 1:
+        message = 'Use:\n  python3 dbstore.py <STORE_PATH> [evict <GB>]\n'
+        print(message)
+    else:
+        store = DatabaseStore(args[1])
+        if len(args) > 3 and args[2] == 'evict':
+            for name in store.evict(max_size = float(args[3]) * GB):
+                print('Evicted %s' % name)
+        else:
+            for entry in store.get_entries():
+                last_used = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.manifest.get('last_used', 0)))
+                print('%s\t%.2f GB\tlast used %s\t%s' % (entry.name, get_size(entry.path) / float(GB), last_used, entry.manifest.get('source')))
+                for name in sorted(entry.manifest['artifacts']):
+                    print('  %s: %s' % (name, entry.manifest['artifacts'][name]['path']))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import fastx
+
+'''
+Denoising with vsearch and concordance of two sets of ASVs.
+
+python3 denoise.py ASVs_usearch.fa ASVs_vsearch.fa [all_samples_dereplicated.fa]
+
+vsearch denoises with --cluster_unoise (the UNOISE algorithm, multithreaded)
+and removes the chimeras with --uchime3_denovo, which usearch -unoise3 does
+in one command. write_tabbedout writes the unoise3.txt of usearch from the
+clusters (--uc) and the report of the chimeras (--uchimeout): one line per
+unique sequence of the denoising (amp, or bad with the amplicon it was merged
+into) and one per amplicon of the chimera filter (zotu or chimera).
+
+compare_asvs is the concordance of two sets of ASVs by their sequences: the
+ASVs of both, the ones found by only one of them and, with the dereplicated
+reads, the share of the reads whose sequence is an ASV of each set.
+'''
+
+SIZE_PATTERN = re.compile(rb';size=(\d+)')
+
+def write_tabbedout(uc_file, uchimeout_file, output_file):
+    n_amplicons = 0
+    n_zotus = 0
+    with open(output_file, 'w', encoding = 'utf-8') as fw:
+        with open(uc_file, 'r', encoding = 'utf-8') as fr:
+            for line in fr:
+                fields = line.rstrip('\n').split('\t')
+                if fields[0] == 'S':
+                    n_amplicons += 1
+                    fw.write('%s\tdenoise\tamp%s\n' % (fields[8], n_amplicons))
+                elif fields[0] == 'H':
+                    fw.write('%s\tdenoise\tbad\ttop=%s\n' % (fields[8], fields[9]))
+        fr.close()
+
+        with open(uchimeout_file, 'r', encoding = 'utf-8') as fr:
+            for line in fr:
+                fields = line.rstrip('\n').split('\t')
+                if len(fields) < 3:
+                    continue
+                if fields[-1] == 'Y':
+                    fw.write('%s\tchfilter\tchimera\n' % fields[1])
+                else:
+                    n_zotus += 1
+                    fw.write('%s\tchfilter\tzotu\n' % fields[1])
+        fr.close()
+    fw.close()
+
+    return n_amplicons, n_zotus
+
+def read_sequences(fasta_file):
+    return set([sequence.upper() for _, sequence in fastx.read_fasta(fasta_file)])
+
+def get_size(header):
+    size = SIZE_PATTERN.search(header)
+    return int(size.group(1)) if size else 1
+
+def compare_asvs(fasta_file1, fasta_file2, dereplicated_file = None):
+    asvs1 = read_sequences(fasta_file1)
+    asvs2 = read_sequences(fasta_file2)
+    shared = asvs1 & asvs2
+    union = asvs1 | asvs2
+
+    result = {'asvs1': len(asvs1),
+              'asvs2': len(asvs2),
+              'shared': len(shared),
+              'only1': len(asvs1 - asvs2),
+              'only2': len(asvs2 - asvs1),
+              'jaccard': len(shared) / float(len(union)) if union else 1.0}
+
+    if dereplicated_file is not None:
+        # Reads whose sequence is an ASV (the error-corrected reads of an ASV are not counted)
+        reads = {'total': 0, 'reads1': 0, 'reads2': 0, 'shared': 0}
+        for header, sequence in fastx.read_fasta(dereplicated_file):
+            size = get_size(header)
+            sequence = sequence.upper()
+            reads['total'] += size
+            if sequence in asvs1:
+                reads['reads1'] += size
+            if sequence in asvs2:
+                reads['reads2'] += size
+            if sequence in shared:
+                reads['shared'] += size
+        result['reads'] = reads
+
+    return result
+
+def format_report(result, name1 = 'usearch', name2 = 'vsearch'):
+    lines = ['ASVs %s: %s' % (name1, result['asvs1']),
+             'ASVs %s: %s' % (name2, result['asvs2']),
+             'ASVs of both: %s' % result['shared'],
+             'ASVs of %s only: %s' % (name1, result['only1']),
+             'ASVs of %s only: %s' % (name2, result['only2']),
+             'Jaccard index: %.4f' % result['jaccard']]
+
+    reads = result.get('reads')
+    if reads is not None:
+        total = float(max(1, reads['total']))
+        lines += ['Dereplicated reads: %s' % reads['total'],
+                  'Reads of the ASVs of %s: %s (%.2f%%)' % (name1, reads['reads1'], reads['reads1'] * 100 / total),
+                  'Reads of the ASVs of %s: %s (%.2f%%)' % (name2, reads['reads2'], reads['reads2'] * 100 / total),
+                  'Reads of the ASVs of both: %s (%.2f%%)' % (reads['shared'], reads['shared'] * 100 / total)]
+
+    return lines
+
+def main(args):
+    if len(args) < 3:
+        message = 'Use:\n  python3 denoise.py <ASVs_1.fa> <ASVs_2.fa> [dereplicated.fa]\n'
+        print(message)
+    else:
+        dereplicated_file = args[3] if len(args) > 3 else None
+        result = compare_asvs(args[1], args[2], dereplicated_file)
+        for line in format_report(result, os.path.basename(args[1]), os.path.basename(args[2])):
+            print(line)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import io
+import gzip
+import shutil
+import subprocess
+
+'''
+Streaming FASTA/FASTQ readers and writers working on bytes.
+
+Records are plain tuples of bytes: (header, sequence) for FASTA and
+(header, sequence, quality) for FASTQ. The header doesn't include the '>'
+or '@'. FASTA sequences may be wrapped over several lines; FASTQ records
+must use four lines, which is what the sequencers and every program of the
+pipeline write.
+
+Files ending in .gz or .zst are decompressed/compressed on the fly. gzip is
+written with pigz (several threads) when it's installed; zstd uses the
+zstandard module, or the zstd program when the module isn't installed.
+'''
+
+BUFFER_SIZE = 1024 * 1024 * 4
+
+FORMAT_FASTA = 'fasta'
+FORMAT_FASTQ = 'fastq'
+
+FASTA_EXTENSIONS = ('.fa', '.fasta', '.fna', '.fas')
+FASTQ_EXTENSIONS = ('.fq', '.fastq')
+
+COMPRESSION_GZIP = 'gz'
+COMPRESSION_ZSTD = 'zst'
+COMPRESSION_EXTENSIONS = {'.gz': COMPRESSION_GZIP, '.zst': COMPRESSION_ZSTD}
+
+# Speed over size: what is written here is mostly read again a few minutes later
+GZIP_LEVEL = 1
+ZSTD_LEVEL = 3
+
+def get_compression(path):
+    name = path.lower()
+    for extension, compression in COMPRESSION_EXTENSIONS.items():
+        if name.endswith(extension):
+            return compression
+    return None
+
+def strip_compression(path):
+    if get_compression(path) is not None:
+        return path[:path.rindex('.')]
+    return path
+
+class PipeFile:
+    '''File read from (or written to) an external (de)compression program'''
+
+    def __init__(self, command, path, mode = 'r'):
+        self.mode = mode
+        self.output = None
+        if mode == 'r':
+            self.process = subprocess.Popen(command + [path], stdout = subprocess.PIPE, bufsize = BUFFER_SIZE)
+            self.handle = self.process.stdout
+        else:
+            self.output = open(path, 'wb')
+            self.process = subprocess.Popen(command, stdin = subprocess.PIPE, stdout = self.output, bufsize = BUFFER_SIZE)
+            self.handle = self.process.stdin
+
+    def __getattr__(self, name):
+        return getattr(self.handle, name)
+
+    def __iter__(self):
+        return iter(self.handle)
+
+    def close(self):
+        if self.handle is None:
+            return
+
+        stopped = False
+        if self.mode == 'r' and self.process.poll() is None:
+            # Closed before the end of the file
+            self.process.terminate()
+            stopped = True
+        self.handle.close()
+        self.handle = None
+        returncode = self.process.wait()
+        if self.output is not None:
+            self.output.close()
+
+        if returncode != 0 and not stopped:
+            raise IOError("Command '%s' failed with exit code %s" % (' '.join(self.process.args), returncode))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def open_file(path, mode = 'r', threads = 1):
+    compression = get_compression(path)
+    if compression == COMPRESSION_GZIP:
+        if mode == 'w' and shutil.which('pigz'):
+            return PipeFile(['pigz', '-%s' % GZIP_LEVEL, '-p', str(threads), '-c'], path, mode)
+        return gzip.open(path, '%sb' % mode, compresslevel = GZIP_LEVEL)
+    elif compression == COMPRESSION_ZSTD:
+        try:
+            import zstandard
+        except ImportError:
+            if mode == 'r':
+                return PipeFile(['zstd', '-q', '-d', '-c'], path, mode)
+            return PipeFile(['zstd', '-q', '-%s' % ZSTD_LEVEL, '-T%s' % threads, '-c'], path, mode)
+
+        if mode == 'r':
+            return io.BufferedReader(zstandard.open(path, 'rb'), BUFFER_SIZE)
+        return zstandard.open(path, 'wb', cctx = zstandard.ZstdCompressor(level = ZSTD_LEVEL, threads = threads))
+
+    return open(path, '%sb' % mode, buffering = BUFFER_SIZE)
+
+def guess_format(path):
+    name = strip_compression(path).lower()
+    if name.endswith(FASTA_EXTENSIONS):
+        return FORMAT_FASTA
+    elif name.endswith(FASTQ_EXTENSIONS):
+        return FORMAT_FASTQ
+
+    with open_file(path) as fr:
+        first = fr.read(1)
+    fr.close()
+
+    if first == b'>':
+        return FORMAT_FASTA
+    elif first == b'@':
+        return FORMAT_FASTQ
+
+    return None
+
+def parse_fastq(lines, name = None):
+    lines = iter(lines)
+    for header, sequence, _, quality in zip(lines, lines, lines, lines):
+        if header[:1] != b'@':
+            raise ValueError("File '%s' is not a FASTQ file with four lines per record (found: %s)" % (name, header[:50]))
+        yield header[1:].rstrip(), sequence.rstrip(), quality.rstrip()
+
+def parse_fasta(lines):
+    header = None
+    chunks = []
+    for line in lines:
+        if line[:1] == b'>':
+            if header is not None:
+                yield header, b''.join(chunks)
+            header = line[1:].rstrip()
+            chunks = []
+        else:
+            chunks.append(line.rstrip())
+
+    if header is not None:
+        yield header, b''.join(chunks)
+
+def read_fastq(path):
+    with open_file(path) as fr:
+        for record in parse_fastq(fr, path):
+            yield record
+    fr.close()
+
+def read_fasta(path):
+    with open_file(path) as fr:
+        for record in parse_fasta(fr):
+            yield record
+    fr.close()
+
+def read(path, fmt = None):
+    if fmt is None:
+        fmt = guess_format(path)
+
+    if fmt == FORMAT_FASTQ:
+        return read_fastq(path)
+    elif fmt == FORMAT_FASTA:
+        return read_fasta(path)
+
+    raise ValueError("Unknown format of file '%s'" % path)
+
+def format_fasta(header, sequence, width = 0):
+    if width and len(sequence) > width:
+        sequence = b'\n'.join([sequence[i:i + width] for i in range(0, len(sequence), width)])
+    return b'>%s\n%s\n' % (header, sequence)
+
+def format_fastq(header, sequence, quality):
+    return b'@%s\n%s\n+\n%s\n' % (header, sequence, quality)
+
+class Writer:
+
+    def __init__(self, path, fmt = None, width = 0, threads = 1):
+        if fmt is None:
+            fmt = FORMAT_FASTQ if strip_compression(path).lower().endswith(FASTQ_EXTENSIONS) else FORMAT_FASTA
+
+        self.path = path
+        self.fmt = fmt
+        self.width = width
+        self.count = 0
+        self.handle = open_file(path, 'w', threads)
+
+    def format(self, record):
+        if self.fmt == FORMAT_FASTQ:
+            return format_fastq(*record)
+        return format_fasta(record[0], record[1], self.width)
+
+    def write(self, record):
+        self.handle.write(self.format(record))
+        self.count += 1
+
+    def write_all(self, records):
+        for record in records:
+            self.write(record)
+        return self.count
+
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def count_records(path, fmt = None):
+    if fmt is None:
+        fmt = guess_format(path)
+
+    n_lines = 0
+    n_starts = 0
+    first = b''
+    last = b''
+    with open_file(path) as fr:
+        for chunk in iter(lambda: fr.read(BUFFER_SIZE), b''):
+            if not first:
+                first = chunk[:1]
+            elif last == b'\n' and chunk[:1] == b'>':
+                # Header right after the boundary between two chunks
+                n_starts += 1
+            if fmt == FORMAT_FASTA:
+                n_starts += chunk.count(b'\n>')
+            else:
+                n_lines += chunk.count(b'\n')
+            last = chunk[-1:]
+    fr.close()
+
+    if fmt == FORMAT_FASTA:
+        return n_starts + (1 if first == b'>' else 0)
+
+    if last not in (b'', b'\n'):
+        n_lines += 1
+
+    if fmt == FORMAT_FASTQ:
+        return n_lines // 4
+
+    return n_lines
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import json
+import hashlib
+import threading
+
+'''
+Small files of the pipeline: files written atomically (a temporary file of
+the process and thread, moved into place), JSON files, and checksums of the
+content of files (blake2b), used by the store of databases, the checkpoints,
+the indexes, the metrics, the progress, the shards and the bundles of the
+programs.
+'''
+
+BLOCK_SIZE = 1024 * 1024 * 8
+
+def write_file(file, write, newline = None):
+    # write(fw) fills the temporary file, which then replaces file
+    tmp_file = '%s.tmp.%s.%s' % (file, os.getpid(), threading.get_ident())
+    with open(tmp_file, 'w', encoding = 'utf-8', newline = newline) as fw:
+        write(fw)
+    fw.close()
+    os.replace(tmp_file, file)
+
+def write_json(data, file, indent = 1, sort_keys = True):
+    write_file(file, lambda fw: json.dump(data, fw, indent = indent, sort_keys = sort_keys))
+
+def read_json(file, default = None):
+    try:
+        with open(file, 'r', encoding = 'utf-8') as fr:
+            data = json.load(fr)
+        fr.close()
+        return data
+    except (IOError, OSError, ValueError):
+        return default
+
+def get_checksum(file):
+    h = hashlib.blake2b(digest_size = 20)
+    with open(file, 'rb') as fr:
+        for block in iter(lambda: fr.read(BLOCK_SIZE), b''):
+            h.update(block)
+    fr.close()
+    return h.hexdigest()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import numpy as np
+import pandas as pd
+
+'''
+Lineages of the taxonomy databases (silva, rdp, unite) and of SINTAX, shared
+by the abundance tables of OTUs and ASVs.
+
+Every distinct lineage is parsed once (vectorized string operations) and the
+rows of the table only point to the parsed ranks, which are kept as
+categorical columns: each taxonomy string is stored once however many OTUs
+share it. The count tables can be read in chunks, the categories are the
+same in every chunk.
+'''
+
+TYPE_SILVA = 'silva'
+TYPE_RDP = 'rdp'
+TYPE_UNITE = 'unite'
+TYPE_SINTAX = 'sintax'
+
+RANKS = ['Domain', 'Phylum', 'Class', 'Order', 'Family', 'Genus', 'Species']
+LEVELS = dict([(index + 1, rank) for index, rank in enumerate(RANKS)])
+LEVEL_UNKNOWN = 'Unknown'
+TAXONOMY_COLUMNS = ['Lineage'] + RANKS + ['Level']
+
+SEPARATORS = {TYPE_SILVA: ';',
+              TYPE_RDP: ',',
+              TYPE_UNITE: ';',
+              TYPE_SINTAX: ','}
+
+# Prefixes of the ranks removed from the lineages (d:Bacteria,p:... | k__Fungi;p__...)
+PREFIXES = {TYPE_RDP: '[dpcofgs]:',
+            TYPE_UNITE: '[kpcofgs]__',
+            TYPE_SINTAX: '[dpcofgs]:'}
+
+# SINTAX/RDP names use '_' instead of spaces and may be quoted
+TRANSLATE_RDP = str.maketrans({'_': ' ', '"': None})
+
+# Counts of the OTU/ASV tables
+COUNT_DTYPE = np.uint32
+
+# Rows of the count tables read at a time
+CHUNK_SIZE = 10000
+
+def get_otu_ids(queries):
+    return queries.str.split(';', n = 1).str[0].str.strip()
+
+def read_blast_lineages(file, input_type = TYPE_SILVA):
+    # BLAST table (qseqid sseqid stitle): lineage of the first hit of every OTU
+    df = pd.read_csv(filepath_or_buffer = file, sep = '\t', header = None, usecols = [0, 1, 2], dtype = str)
+    df = df.fillna('')
+
+    df[0] = get_otu_ids(df[0])
+    df = df.drop_duplicates(subset = 0, keep = 'first')
+
+    if input_type == TYPE_SILVA:
+        # The title starts with the subject id, the rest is the lineage
+        lineages = [title.replace(subject_id, '').strip() for subject_id, title in zip(df[1], df[2])]
+    elif input_type == TYPE_RDP:
+        lineages = df[1].str.split('tax=', n = 1).str[1].str.strip()
+    elif input_type == TYPE_UNITE:
+        lineages = 'k__' + df[1].str.split('k__', n = 1).str[1].str.strip()
+    else:
+        raise ValueError("Unknown database type '%s'" % input_type)
+
+    return pd.Series(list(lineages), index = df[0].values)
+
+def read_sintax_lineages(file):
+    # SINTAX table: the lineage above the cutoff is the 4th column
+    df = pd.read_csv(filepath_or_buffer = file, sep = '\t', header = None, usecols = [0, 3], dtype = str)
+    df = df.fillna('')
+    df = df.drop_duplicates(subset = 0, keep = 'first')
+
+    return pd.Series(list(df[3].str.strip()), index = df[0].values)
+
+def split_lineages(lineages, input_type = TYPE_SILVA):
+    # Table of the lineage, ranks and level of every distinct lineage (indexed by the lineage)
+    unique = pd.Series(pd.unique(np.asarray(lineages, dtype = object)), dtype = object)
+
+    cleaned = unique
+    if input_type in PREFIXES:
+        cleaned = cleaned.str.replace(PREFIXES[input_type], '', regex = True)
+    if input_type in [TYPE_RDP, TYPE_SINTAX]:
+        cleaned = cleaned.str.translate(TRANSLATE_RDP)
+
+    separator = SEPARATORS[input_type]
+    table = cleaned.str.split(separator, expand = True, regex = False)
+    table = table.reindex(columns = range(len(RANKS))).fillna('')
+    table.columns = RANKS
+    table.insert(loc = 0, column = 'Lineage', value = unique.values)
+
+    n_levels = cleaned.str.count(separator) + 1
+    table['Level'] = n_levels.map(LEVELS).fillna('').values
+    table.index = unique.values
+
+    # The same categories in every chunk of the table ('' and Unknown for the OTUs without lineage)
+    for column in TAXONOMY_COLUMNS:
+        categories = pd.unique(np.concatenate([table[column].values.astype(object), ['', LEVEL_UNKNOWN if column == 'Level' else '']]))
+        table[column] = pd.Categorical(table[column], categories = categories)
+
+    return table
+
+def read_count_columns(file):
+    return list(pd.read_csv(filepath_or_buffer = file, sep = '\t', header = 0, nrows = 0).columns)
+
+def read_counts(file, chunk_size = None):
+    # The counts are read straight into compact integers (an iterator of tables with chunk_size)
+    columns = read_count_columns(file)
+    dtype = dict([(column, COUNT_DTYPE) for column in columns[1:]])
+    dtype[columns[0]] = str
+
+    return pd.read_csv(filepath_or_buffer = file, sep = '\t', header = 0, dtype = dtype, chunksize = chunk_size)
+
+def add_taxonomy(df, lineages, table, id_column = '#OTU ID'):
+    # Lineage, the ranks and Level go after the id column
+    lineage = df[id_column].map(lineages)
+    found = lineage.notna().values
+
+    taxonomy = table.reindex(lineage.values)
+    taxonomy.index = df.index
+    taxonomy = taxonomy.fillna('')
+    taxonomy.loc[~found, 'Level'] = LEVEL_UNKNOWN
+
+    return pd.concat([df.iloc[:, :1], taxonomy, df.iloc[:, 1:]], axis = 1)
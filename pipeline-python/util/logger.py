@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import sys
+import json
+import queue
+import threading
+from metrics import get_sample_step
+
+'''
+Log of the pipeline written by a background thread.
+
+The messages are put in a bounded queue (the threads that log wait when it
+is full) and a single thread writes them to the log, which stays open for
+the whole run and is flushed whenever the queue is empty. Records are
+(time, message, stage); the log is text (<time> <message>) or JSON lines
+with the time, sample, step and message of every record.
+
+The same thread writes the output of the programs that go to their own
+files (one per stage and program) instead of the main log.
+'''
+
+FORMAT_TEXT = 'text'
+FORMAT_JSON = 'json'
+FORMATS = [FORMAT_TEXT, FORMAT_JSON]
+
+MAX_ITEMS = 10000
+
+def format_record(record, fmt = FORMAT_TEXT):
+    _time, message, stage = record
+    if fmt == FORMAT_JSON:
+        sample, step = get_sample_step(stage) if stage else (None, None)
+        return json.dumps({'time': _time, 'sample': sample, 'step': step, 'message': message}, ensure_ascii = False) + '\n'
+
+    if _time is None:
+        return '%s\n' % message
+    return '%s %s\n' % (_time, message)
+
+class Logger:
+
+    STOP = object()
+
+    def __init__(self, file, fmt = FORMAT_TEXT, max_items = MAX_ITEMS):
+        self.file = file
+        self.fmt = fmt
+        self.error = None
+        self.closed = False
+
+        self.queue = queue.Queue(maxsize = max_items)
+        self.handles = {}
+        self.thread = threading.Thread(target = self.worker, daemon = True)
+        self.thread.start()
+
+    def log(self, records):
+        # records: [(time or None, message, stage or None)]
+        if records:
+            self.queue.put(('log', list(records)))
+
+    def write(self, path, lines):
+        # Lines of the output of a program into its own file
+        if lines:
+            self.queue.put(('write', path, list(lines)))
+
+    def close_file(self, path):
+        self.queue.put(('close', path))
+
+    def get_handle(self, path):
+        handle = self.handles.get(path)
+        if handle is None:
+            handle = open(path, 'a', encoding = 'utf-8')
+            self.handles[path] = handle
+        return handle
+
+    def process(self, item):
+        if item[0] == 'log':
+            self.get_handle(self.file).write(''.join([format_record(record, self.fmt) for record in item[1]]))
+        elif item[0] == 'write':
+            self.get_handle(item[1]).write(''.join(['%s\n' % line for line in item[2]]))
+        elif item[0] == 'close':
+            handle = self.handles.pop(item[1], None)
+            if handle is not None:
+                handle.close()
+
+    def worker(self):
+        while True:
+            item = self.queue.get()
+            if item is self.STOP:
+                self.queue.task_done()
+                break
+
+            try:
+                self.process(item)
+                if self.queue.empty():
+                    for handle in self.handles.values():
+                        handle.flush()
+            except (IOError, OSError) as e:
+                if self.error is None:
+                    self.error = e
+                    sys.stderr.write("Log '%s' can't be written: %s\n" % (self.file, e))
+            self.queue.task_done()
+
+        for handle in self.handles.values():
+            handle.close()
+        self.handles = {}
+
+    def flush(self):
+        # Wait until everything in the queue is written
+        self.queue.join()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(self.STOP)
+        self.thread.join()
@@ -1,55 +1,75 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 import sys
+import fastx
 
-def read_fasta2_file(fasta_file):
-    heads = {}
-    with open(fasta_file, 'r') as fr:
-        for line in fr:
-            line = line.strip()
-            if line.startswith('>'):
-                _id = str(line).replace('>', '').split(';')[0]
-                heads.update({_id: 1})
-    fr.close()
+'''
+Extraction of the non-chimeric sequences (adapted from map.pl of the vsearch
+wiki).
 
-    return heads
+python3 map.py <fasta1> <uc> <fasta2> <outfasta>
 
-def read_uc_file(uc_file, dictionary):
-    with open(uc_file, 'r') as fr:
-        for line in fr:
-            line = line.strip().split('\t')
+The identifiers of fasta2 are accepted, plus every query of the uc file that
+hits an accepted target; then the records of fasta1 with an accepted
+identifier are written to outfasta. Only the accepted identifiers are kept
+in memory, fasta1 and the uc file are streamed.
 
-            hit_type = line[0].split(';')[0]
-            query_seq = line[8].split(';')[0]
-            target_seq = line[9].split(';')[0]
+fasta1 may be a list of files, read one after the other (the pipeline
+passes the per-sample files instead of the pooled one).
+'''
 
-            if hit_type == 'H' and target_seq in dictionary:
-                dictionary.update({query_seq: 1})
-    fr.close()
+def get_id(header):
+    return header.split(b';', 1)[0]
+
+def read_fasta2_file(fasta_file):
+    accepted = set()
+    for header, _ in fastx.read_fasta(fasta_file):
+        accepted.add(get_id(header))
 
-    return dictionary
+    return accepted
 
-def read_fasta1_file(fasta_file, dictionary, output_fasta):
-    with open(fasta_file, 'r') as fr, open(output_fasta, 'w') as fw:
-        save_seq = False
+def read_uc_file(uc_file, accepted):
+    with fastx.open_file(uc_file) as fr:
         for line in fr:
-            line = line.strip()
-            if line.startswith('>'):
-                _id = line.replace('>', '').split(';')[0]
-                if _id in dictionary:
-                    sequence_id = '%s\n' % line
-                    fw.write(sequence_id)
-                    save_seq = True
-                else:
-                    dictionary.update({_id: None})
-                    save_seq = False
-            else:
-                if save_seq:
-                    sequence = '%s\n' % str(line)
-                    fw.write(sequence)
+            # Only hits (H) matter, the other records are not split
+            if line[:1] != b'H':
+                continue
+
+            line = line.rstrip(b'\r\n').split(b'\t', 10)
+            if get_id(line[9]) in accepted:
+                accepted.add(get_id(line[8]))
     fr.close()
+
+    return accepted
+
+def read_fasta1_file(fasta_files, accepted, output_fasta):
+    if isinstance(fasta_files, str):
+        fasta_files = [fasta_files]
+
+    # Lines are copied as they are, a record is never rebuilt
+    n_sequences = 0
+    with fastx.open_file(output_fasta, 'w') as fw:
+        for fasta_file in fasta_files:
+            with fastx.open_file(fasta_file) as fr:
+                keep = False
+                for line in fr:
+                    if line[:1] == b'>':
+                        keep = get_id(line[1:].rstrip()) in accepted
+                        if keep:
+                            n_sequences += 1
+                    if keep:
+                        fw.write(line)
+            fr.close()
     fw.close()
 
+    return n_sequences
+
+def map_sequences(fasta_files1, uc_file, fasta_file2, output_file):
+    accepted = read_fasta2_file(fasta_file2)
+    read_uc_file(uc_file, accepted)
+
+    return read_fasta1_file(fasta_files1, accepted, output_file)
+
 def main(args):
     if len(args) <= 4:
         message = 'Four arguments needed: fasta1, uc, fasta2 and outfasta\n'
@@ -60,9 +80,7 @@ def main(args):
         fasta_file2 = args[3]
         output_file = args[4]
 
-        dict_heads = read_fasta2_file(fasta_file2)
-        read_uc_file(uc_file, dict_heads)
-        read_fasta1_file(fasta_file1, dict_heads, output_file)
+        map_sequences(fasta_file1, uc_file, fasta_file2, output_file)
 
 if __name__ == '__main__':
     main(sys.argv)
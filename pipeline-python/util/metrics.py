@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import csv
+import json
+import time
+import threading
+from files import write_file, write_json
+
+try:
+    import resource
+except ImportError:
+    # Windows: only the wall-clock time and the sizes of the files
+    resource = None
+
+'''
+Resource accounting of the stages of a run and of the programs they start.
+
+python3 metrics.py metrics_20240101_120000.json   # summary by step
+
+Every program started by the pipeline is waited with wait4, which gives the
+resources of that process and of the ones it waited for (the shell and the
+program): CPU user and system time, peak memory (max RSS) and the blocks
+read from and written to the disk (the data found in the page cache is not
+counted). Every stage gets one more row with its wall-clock time, the sum
+of its programs, the work done inside Python by the thread of the stage and
+the sizes of its input and output files.
+
+The rows are keyed by sample (the prefix of the stage name, 'all' for the
+stages of the pooled samples) and step, and are written after every stage
+to <name>.json and <name>.csv, so a stopped run keeps what it measured.
+'''
+
+BLOCK_SIZE = 512
+MB = 1024.0 * 1024.0
+
+FIELDS = ['sample', 'step', 'kind', 'program', 'status', 'threads',
+          'wall_seconds', 'user_seconds', 'system_seconds', 'max_rss_mb',
+          'read_bytes', 'write_bytes', 'input_bytes', 'output_bytes', 'started']
+
+def get_sample_step(name):
+    # '<sample>.<step>' for the stages of one sample
+    if name and '.' in name:
+        return tuple(name.split('.', 1))
+    return 'all', name
+
+def get_files_size(files):
+    total = 0
+    for file in files or []:
+        if os.path.isfile(file):
+            total += os.path.getsize(file)
+    return total
+
+def get_exit_code(status):
+    if hasattr(os, 'waitstatus_to_exitcode'):
+        return os.waitstatus_to_exitcode(status)
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+def wait_process(p):
+    # Wait for a subprocess.Popen; its resources, or None where wait4 doesn't exist
+    if not hasattr(os, 'wait4'):
+        p.wait()
+        return None
+
+    try:
+        _, status, rusage = os.wait4(p.pid, 0)
+    except ChildProcessError:
+        # Already waited
+        p.wait()
+        return None
+    p.returncode = get_exit_code(status)
+
+    return rusage
+
+def get_thread_usage():
+    # Resources of the calling thread (GNU/Linux), None elsewhere
+    if resource is None or not hasattr(resource, 'RUSAGE_THREAD'):
+        return None
+    return resource.getrusage(resource.RUSAGE_THREAD)
+
+def get_usage_row(rusage):
+    if rusage is None:
+        return {}
+
+    # ru_maxrss is in KB in GNU/Linux and in bytes in macOS
+    max_rss = rusage.ru_maxrss / 1024.0
+    if sys.platform == 'darwin':
+        max_rss /= 1024.0
+
+    return {'user_seconds': rusage.ru_utime,
+            'system_seconds': rusage.ru_stime,
+            'max_rss_mb': max_rss,
+            'read_bytes': rusage.ru_inblock * BLOCK_SIZE,
+            'write_bytes': rusage.ru_oublock * BLOCK_SIZE}
+
+def get_usage_delta(start, end):
+    if start is None or end is None:
+        return {}
+
+    return {'user_seconds': end.ru_utime - start.ru_utime,
+            'system_seconds': end.ru_stime - start.ru_stime,
+            'read_bytes': (end.ru_inblock - start.ru_inblock) * BLOCK_SIZE,
+            'write_bytes': (end.ru_oublock - start.ru_oublock) * BLOCK_SIZE}
+
+class Metrics:
+
+    def __init__(self, name):
+        self.json_file = '%s.json' % name
+        self.csv_file = '%s.csv' % name
+        self.lock = threading.Lock()
+        # The stages save when they finish, one at a time (an older list of rows never replaces a newer one)
+        self.save_lock = threading.Lock()
+        self.rows = []
+        self.programs = {}
+
+    def add(self, row):
+        row = dict(row)
+        for field in FIELDS:
+            row.setdefault(field, None)
+        with self.lock:
+            self.rows.append(row)
+        return row
+
+    def add_program(self, stage, program, start, seconds, rusage, status, threads = None):
+        sample, step = get_sample_step(stage)
+        row = {'sample': sample,
+               'step': step,
+               'kind': 'program',
+               'program': program,
+               'status': status,
+               'threads': threads,
+               'wall_seconds': seconds,
+               'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start))}
+        row.update(get_usage_row(rusage))
+        row = self.add(row)
+
+        with self.lock:
+            self.programs.setdefault(stage, []).append(row)
+
+    def add_stage(self, stage, start, seconds, status, threads = None, inputs = None, outputs = None, thread_usage = None):
+        # The programs of the stage plus what the thread of the stage did in Python
+        sample, step = get_sample_step(stage)
+        row = {'sample': sample,
+               'step': step,
+               'kind': 'stage',
+               'status': status,
+               'threads': threads,
+               'wall_seconds': seconds,
+               'input_bytes': get_files_size(inputs),
+               'output_bytes': get_files_size(outputs),
+               'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(start))}
+        row.update(thread_usage or {})
+
+        with self.lock:
+            programs = self.programs.pop(stage, [])
+        for field in ['user_seconds', 'system_seconds', 'read_bytes', 'write_bytes']:
+            values = [item[field] for item in programs if item[field] is not None]
+            if values or row.get(field) is not None:
+                row[field] = (row.get(field) or 0) + sum(values)
+        values = [item['max_rss_mb'] for item in programs if item['max_rss_mb'] is not None]
+        if values:
+            row['max_rss_mb'] = max(values)
+
+        self.add(row)
+
+    def save(self):
+        with self.save_lock:
+            with self.lock:
+                rows = list(self.rows)
+
+            write_json(rows, self.json_file, sort_keys = False)
+            write_file(self.csv_file, lambda fw: write_csv(fw, rows), newline = '')
+
+def write_csv(fw, rows):
+    writer = csv.DictWriter(fw, fieldnames = FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+
+def summarize(rows):
+    # Stages by step: count, wall-clock and CPU time, peak memory
+    steps = {}
+    for row in rows:
+        if row['kind'] != 'stage' or row['status'] == 'skipped':
+            continue
+        step = steps.setdefault(row['step'], {'stages': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'max_rss_mb': 0.0, 'input_bytes': 0})
+        step['stages'] += 1
+        step['wall_seconds'] += row['wall_seconds'] or 0
+        step['cpu_seconds'] += (row['user_seconds'] or 0) + (row['system_seconds'] or 0)
+        step['max_rss_mb'] = max(step['max_rss_mb'], row['max_rss_mb'] or 0)
+        step['input_bytes'] += row['input_bytes'] or 0
+
+    return sorted(steps.items(), key = lambda item: item[1]['wall_seconds'], reverse = True)
+
+def main(args):
+    if len(args) <= 1:
+        message = 'Use:\n  python3 metrics.py <metrics.json>\n'
+        print(message)
+    else:
+        with open(args[1], 'r', encoding = 'utf-8') as fr:
+            rows = json.load(fr)
+        fr.close()
+
+        print('%-28s %7s %12s %12s %8s %12s %14s' % ('Step', 'Stages', 'Wall (s)', 'CPU (s)', 'CPU/Wall', 'Max RSS (MB)', 'Input (MB)'))
+        for step, values in summarize(rows):
+            ratio = values['cpu_seconds'] / values['wall_seconds'] if values['wall_seconds'] else 0
+            print('%-28s %7s %12.1f %12.1f %8.2f %12.1f %14.1f' % (step, values['stages'], values['wall_seconds'], values['cpu_seconds'], ratio, values['max_rss_mb'], values['input_bytes'] / MB))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import glob
+import json
+import math
+
+import fastx
+
+'''
+Estimates of a run before it starts (amplicon_pipeline.py --plan): the size
+of the files written by every stage, its time, the peak disk usage and the
+wall-clock time of the whole run.
+
+python3 plan.py output/metrics_20240101_120000.json [...]   # model of every step
+
+Every step has a model: its outputs are its inputs times a ratio (up to a
+maximum for the steps whose output doesn't grow with the input, such as the
+subsample), and its time is k * MB^e of its inputs, with one thread (the time
+is divided by the threads of the stage). The models come from the stages of
+earlier runs (metrics_*.json) when there are any of that step, and from
+DEFAULTS otherwise. The bytes are those of the files on disk, as in the
+metrics; with the defaults, a compressed file counts as its uncompressed size.
+With three or more earlier stages of a step of different sizes the exponent
+is fitted (log-log least squares), otherwise it is the default one. The
+stages that read less than MIN_INPUT_BYTES are left out.
+
+The wall-clock time comes from a simulation of the scheduler (priorities and
+CPU budget) with the times of the stages.
+'''
+
+MB = 1024.0 * 1024.0
+
+# step: (outputs/inputs, seconds per MB with one thread, exponent, maximum output in bytes)
+DEFAULTS = {'fastq_mergepairs': (0.9, 0.4, 1.0, None),
+            'subsample': (1.0, 0.01, 1.0, 1 * MB),
+            'search_oligodb': (0.1, 0.5, 1.0, 1 * MB),
+            'cutadapt_forward': (0.95, 0.3, 1.0, None),
+            'cutadapt_reverse': (0.95, 0.3, 1.0, None),
+            'fastq_filter': (1.3, 0.1, 1.0, None),
+            'trim_filter': (1.3, 0.6, 1.0, None),
+            'merge_all': (1.0, 0.01, 1.0, None),
+            'derep_fulllength_all': (0.5, 0.05, 1.0, None),
+            'derep_fulllength': (0.5, 0.05, 1.0, None),
+            'cluster_size': (0.6, 0.5, 1.2, None),
+            'uchime_denovo': (0.9, 0.5, 1.2, None),
+            'uchime_ref': (0.03, 0.05, 1.0, None),
+            'map_dereplicated': (0.3, 0.05, 1.0, None),
+            'map_samples': (0.5, 0.05, 1.0, None),
+            'cluster_size_otu_table': (0.3, 0.5, 1.2, None),
+            'blastn': (0.5, 20.0, 1.0, None),
+            'unoise3': (0.3, 1.0, 1.3, None),
+            'usearch_global': (0.02, 1.0, 1.0, None),
+            'sintax': (0.01, 0.05, 1.0, None),
+            'abundances_table': (2.0, 0.5, 1.0, None)}
+DEFAULT = (1.0, 0.1, 1.0, None)
+
+# Uncompressed size over compressed size of the FASTA/FASTQ files
+EXPANSION = {fastx.COMPRESSION_GZIP: 4.0,
+             fastx.COMPRESSION_ZSTD: 5.0}
+
+# Temporary files of a stage while it runs, times its inputs (shards, files of the denoising)
+TRANSIENT = {'blastn': 1.0,
+             'sintax': 1.0,
+             'unoise3': 1.0}
+
+# HTML report and zip of FastQC of every file
+FASTQC_BYTES = 700 * 1024
+
+# Smaller stages are mostly the start of the program, they don't calibrate the time per MB
+MIN_INPUT_BYTES = 1 * MB
+MIN_EXPONENT = 0.5
+MAX_EXPONENT = 2.0
+
+def get_expansion(files):
+    # Mean expansion of the files (1.0 if none is compressed)
+    if not files:
+        return 1.0
+    return sum([EXPANSION.get(fastx.get_compression(file), 1.0) for file in files]) / float(len(files))
+
+def read_rows(paths):
+    # Rows of the stages of the metrics files (or of the metrics_*.json of folders)
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, 'metrics_*.json'))))
+        elif os.path.isfile(path):
+            files.append(path)
+
+    rows = []
+    for file in files:
+        try:
+            with open(file, 'r', encoding = 'utf-8') as fr:
+                rows.extend(json.load(fr))
+            fr.close()
+        except (IOError, OSError, ValueError):
+            continue
+
+    return [row for row in rows if row.get('kind') == 'stage' and row.get('status') == 'ok'], files
+
+def fit(points, exponent):
+    # k and e of seconds = k * MB^e; e is fitted with enough points of different sizes
+    sizes = [size for size, _ in points]
+    if len(points) >= 3 and max(sizes) >= 2 * min(sizes):
+        xs = [math.log(size) for size, _ in points]
+        ys = [math.log(max(seconds, 1e-3)) for _, seconds in points]
+        mean_x = sum(xs) / len(xs)
+        mean_y = sum(ys) / len(ys)
+        variance = sum([(x - mean_x) ** 2 for x in xs])
+        if variance > 0:
+            exponent = sum([(x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)]) / variance
+            exponent = min(MAX_EXPONENT, max(MIN_EXPONENT, exponent))
+
+    values = sorted([seconds / size ** exponent for size, seconds in points])
+    return values[len(values) // 2], exponent
+
+class Model:
+
+    def __init__(self, rows = None):
+        self.steps = {}
+        self.calibrate(rows or [])
+
+    def calibrate(self, rows):
+        # Ratio and time of every step from the stages of earlier runs
+        by_step = {}
+        for row in rows:
+            if not row.get('input_bytes') or row['input_bytes'] < MIN_INPUT_BYTES or row.get('wall_seconds') is None:
+                continue
+            by_step.setdefault(row['step'], []).append(row)
+
+        for step, step_rows in by_step.items():
+            _, _, exponent, maximum = DEFAULTS.get(step, DEFAULT)
+            ratio = sum([row['output_bytes'] or 0 for row in step_rows]) / float(sum([row['input_bytes'] for row in step_rows]))
+            # One thread: the time is taken as inversely proportional to the threads
+            points = [(row['input_bytes'] / MB, row['wall_seconds'] * (row.get('threads') or 1)) for row in step_rows]
+            k, exponent = fit(points, exponent)
+            self.steps[step] = {'ratio': ratio, 'k': k, 'exponent': exponent, 'maximum': maximum, 'stages': len(step_rows)}
+
+    def is_calibrated(self, step):
+        return step in self.steps
+
+    def get_step(self, step, expansion = 1.0):
+        # Model of the step and the expansion that applies to it (only the defaults are in uncompressed bytes)
+        if step in self.steps:
+            return self.steps[step], 1.0
+        ratio, k, exponent, maximum = DEFAULTS.get(step, DEFAULT)
+        return {'ratio': ratio, 'k': k, 'exponent': exponent, 'maximum': maximum, 'stages': 0}, expansion
+
+    def get_output_bytes(self, step, input_bytes, expansion_in = 1.0, expansion_out = 1.0):
+        model, expansion = self.get_step(step, expansion_in / expansion_out)
+        output_bytes = input_bytes * model['ratio'] * expansion
+        if model['maximum'] is not None:
+            output_bytes = min(output_bytes, model['maximum'])
+        return output_bytes
+
+    def get_seconds(self, step, input_bytes, threads = 1, expansion_in = 1.0):
+        model, expansion = self.get_step(step, expansion_in)
+        return model['k'] * (input_bytes * expansion / MB) ** model['exponent'] / max(1, threads)
+
+def simulate(graph, seconds):
+    # Wall-clock time of the stages of a Scheduler, started as it does (priority, CPU budget), with their times
+    pending = list(graph.stages)
+    available = set()
+    running = []
+    used = 0
+    now = 0.0
+    while pending or running:
+        ready = [stage for stage in pending if all([input_file in available or input_file not in graph.producers for input_file in stage.inputs])]
+        ready.sort(key = lambda stage: stage.priority, reverse = True)
+        for stage in ready:
+            if running and used + stage.threads > graph.cpu_budget:
+                break
+            pending.remove(stage)
+            used += stage.threads
+            running.append((now + seconds.get(stage.name, 0.0), stage))
+
+        if not running:
+            break
+
+        running.sort(key = lambda item: item[0])
+        now, stage = running.pop(0)
+        used -= stage.threads
+        available.update(stage.outputs)
+
+    return now
+
+def format_bytes(n_bytes):
+    if n_bytes >= 1024 * MB:
+        return '%.1f GB' % (n_bytes / (1024 * MB))
+    return '%.1f MB' % (n_bytes / MB)
+
+def format_seconds(seconds):
+    # More than 24 hours is possible
+    seconds = int(round(seconds))
+    return '%02d:%02d:%02d' % (seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
+def main(args):
+    if len(args) <= 1:
+        message = 'Use:\n  python3 plan.py <metrics.json or folder> [...]\n'
+        print(message)
+    else:
+        rows, files = read_rows(args[1:])
+        model = Model(rows)
+        print('Metrics files: %s | stages: %s' % (len(files), len(rows)))
+        print('%-28s %7s %12s %14s %10s' % ('Step', 'Stages', 'Out/In', 's/MB (1 thr)', 'Exponent'))
+        for step in sorted(set(list(DEFAULTS) + list(model.steps))):
+            values, _ = model.get_step(step)
+            print('%-28s %7s %12.3f %14.3f %10.2f' % (step, values['stages'] or 'default', values['ratio'], values['k'], values['exponent']))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import time
+import threading
+import fastx
+
+'''
+Pooling of the per-sample files of a run.
+
+python3 pool.py all.fa sample1.filtered.fa sample2.filtered.fa
+
+concat_files writes the pooled file with kernel-side copies
+(copy_file_range, then sendfile), so the data never goes through Python.
+PoolFeeder is the virtual pool: the files are streamed into a named pipe
+(FIFO) that the next program reads as if it were the pooled file, which is
+then never written to disk. PipeCompressor goes the other way: a program
+writes into a named pipe and the data is compressed on its way to disk.
+
+Compressed files (.gz, .zst) are copied as they are when the pooled file
+uses the same compression (concatenated gzip members and zstd frames are
+still valid files), otherwise they are decompressed and compressed again.
+The named pipes always carry uncompressed data.
+'''
+
+BLOCK_SIZE = 1024 * 1024 * 8
+
+def copy_fd(fd_in, fd_out, size):
+    # Copy size bytes from the current position of fd_in to fd_out
+    remaining = size
+    for method in ('copy_file_range', 'sendfile'):
+        if not hasattr(os, method):
+            continue
+        try:
+            while remaining > 0:
+                if method == 'copy_file_range':
+                    n = os.copy_file_range(fd_in, fd_out, min(remaining, 1 << 30))
+                else:
+                    n = os.sendfile(fd_out, fd_in, None, min(remaining, 1 << 30))
+                if n == 0:
+                    break
+                remaining -= n
+            if remaining == size and size > 0:
+                # Nothing copied (some file systems return 0 at once): the next method
+                continue
+            return size - remaining
+        except OSError as e:
+            # Not supported between these files (other file system, pipe, old kernel...)
+            if remaining != size:
+                raise e
+
+    while remaining > 0:
+        block = os.read(fd_in, min(remaining, BLOCK_SIZE))
+        if not block:
+            break
+        while block:
+            n = os.write(fd_out, block)
+            block = block[n:]
+            remaining -= n
+
+    return size - remaining
+
+def write_files(files, fd_out):
+    total = 0
+    for file in files:
+        with open(file, 'rb') as fr:
+            size = os.fstat(fr.fileno()).st_size
+            n_bytes = copy_fd(fr.fileno(), fd_out, size)
+        fr.close()
+        if n_bytes < size:
+            raise IOError("Only %s of the %s bytes of '%s' were copied" % (n_bytes, size, file))
+        total += n_bytes
+
+    return total
+
+def write_decompressed(files, handle):
+    total = 0
+    for file in files:
+        with fastx.open_file(file) as fr:
+            for block in iter(lambda: fr.read(BLOCK_SIZE), b''):
+                handle.write(block)
+                total += len(block)
+        fr.close()
+
+    return total
+
+def concat_files(files, output_file, threads = 1):
+    compression = fastx.get_compression(output_file)
+    if all([fastx.get_compression(file) == compression for file in files]):
+        with open(output_file, 'wb') as fw:
+            total = write_files(files, fw.fileno())
+        fw.close()
+    else:
+        with fastx.open_file(output_file, 'w', threads) as fw:
+            total = write_decompressed(files, fw)
+        fw.close()
+
+    return total
+
+def release_fifo(fifo, flags, wait = 0.1):
+    # Open the other end for a moment, so the thread blocked on the pipe can go on
+    try:
+        fd = os.open(fifo, flags | os.O_NONBLOCK)
+    except OSError:
+        return
+    time.sleep(wait)
+    os.close(fd)
+
+class PoolFeeder:
+
+    def __init__(self, files, fifo):
+        self.files = list(files)
+        self.fifo = fifo
+        self.error = None
+        self.written = 0
+
+        if os.path.exists(fifo):
+            os.remove(fifo)
+        os.mkfifo(fifo)
+
+        self.thread = threading.Thread(target = self.feed, daemon = True)
+        self.thread.start()
+
+    def feed(self):
+        try:
+            # Blocks until the reader opens the pipe
+            fd = os.open(self.fifo, os.O_WRONLY)
+            try:
+                if any([fastx.get_compression(file) is not None for file in self.files]):
+                    with open(fd, 'wb', buffering = BLOCK_SIZE, closefd = False) as fw:
+                        self.written = write_decompressed(self.files, fw)
+                else:
+                    self.written = write_files(self.files, fd)
+            finally:
+                os.close(fd)
+        except BaseException as e:
+            self.error = e
+
+    def close(self):
+        while self.thread.is_alive():
+            # The reader never opened the pipe (or stopped reading), release the writer
+            release_fifo(self.fifo, os.O_RDONLY)
+            self.thread.join(0.1)
+
+        if os.path.exists(self.fifo):
+            os.remove(self.fifo)
+
+        return self.error
+
+class PipeCompressor:
+    '''Compresses into output_file what a program writes into the named pipe'''
+
+    def __init__(self, fifo, output_file, threads = 1):
+        self.fifo = fifo
+        self.output_file = output_file
+        self.threads = threads
+        self.error = None
+        self.written = 0
+
+        if os.path.exists(fifo):
+            os.remove(fifo)
+        os.mkfifo(fifo)
+
+        self.thread = threading.Thread(target = self.compress, daemon = True)
+        self.thread.start()
+
+    def compress(self):
+        try:
+            # Blocks until the writer opens the pipe
+            with open(self.fifo, 'rb', buffering = BLOCK_SIZE) as fr:
+                with fastx.open_file(self.output_file, 'w', self.threads) as fw:
+                    for block in iter(lambda: fr.read(BLOCK_SIZE), b''):
+                        fw.write(block)
+                        self.written += len(block)
+                fw.close()
+            fr.close()
+        except BaseException as e:
+            self.error = e
+
+    def close(self):
+        while self.thread.is_alive():
+            # The writer may have never opened the pipe, release the reader
+            release_fifo(self.fifo, os.O_RDWR)
+            self.thread.join(0.1)
+
+        if os.path.exists(self.fifo):
+            os.remove(self.fifo)
+
+        return self.error
+
+def main(args):
+    if len(args) <= 2:
+        message = 'Use:\n  python3 pool.py <OUTPUT_FILE> <FILE> [<FILE> ...]\n'
+        print(message)
+    else:
+        total = concat_files(args[2:], args[1])
+        print('%s bytes written to %s' % (total, args[1]))
+
+if __name__ == '__main__':
+    main(sys.argv)
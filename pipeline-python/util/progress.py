@@ -0,0 +1,456 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import errno
+import threading
+import subprocess
+
+import fastx
+from files import write_json
+from plan import EXPANSION, format_seconds
+from metrics import get_sample_step
+
+try:
+    import pty
+except ImportError:
+    # Windows: the programs write to a pipe, only the lines they print there are parsed
+    pty = None
+
+'''
+Progress of the programs and the stages while they run.
+
+The output of every program is parsed as it comes: the percentages of
+vsearch and usearch, the reads of cutadapt (the percentage comes from the
+reads estimated in its input) and, for blastn, which prints nothing, the
+last query of the output file. vsearch and cutadapt only show their
+progress in a terminal, so in GNU/Linux the programs with a parser run in a
+pseudo-terminal; the updates end with '\\r' and don't go to the log.
+
+The progress of a stage is the mean of its programs (its shards when it has
+several), and the one of the run is that of its stages weighted by their
+estimated work (plan.py). A thread writes the state to a JSON file
+(status.json of the output folder, replaced atomically) every few seconds,
+and reports a line per running stage every progress_interval seconds.
+
+python3 progress.py output/status.json      # state of a run
+'''
+
+STATUS_INTERVAL = 5
+
+# Uncompressed bytes read to estimate the records of a file
+SAMPLE_BYTES = 4 * 1024 * 1024
+
+VSEARCH_PATTERN = re.compile(r'^(?P<task>[A-Za-z].*?)\s+(?P<percent>\d+)%$')
+USEARCH_PATTERN = re.compile(r'^\d+:\d+(?::\d+)?\s+\S+\s+(?P<percent>\d+(?:\.\d+)?)%\s+(?P<task>[^,]+)')
+CUTADAPT_PATTERN = re.compile(r'(?P<reads>\d[\d,]*) reads\s+@')
+SEGMENT_PATTERN = re.compile(b'\r\n|\r|\n')
+
+def parse_vsearch(line):
+    # Reading file ... 45% | Clustering 45%
+    match = VSEARCH_PATTERN.match(line.strip())
+    if match:
+        return {'task': match.group('task'), 'percent': float(match.group('percent'))}
+    return None
+
+def parse_usearch(line):
+    # 00:05 120Mb   45.3% Searching, 12.0% matched
+    match = USEARCH_PATTERN.match(line.strip())
+    if match:
+        return {'task': match.group('task').strip(), 'percent': float(match.group('percent'))}
+    return None
+
+def parse_cutadapt(line):
+    # [----=8-----] 00:00:12     1,234,567 reads  @      9.7 µs/read;   6.19 M reads/minute
+    match = CUTADAPT_PATTERN.search(line)
+    if match:
+        return {'task': 'Processing reads', 'reads': int(match.group('reads').replace(',', ''))}
+    return None
+
+PARSERS = {'vsearch': parse_vsearch,
+           'usearch': parse_usearch,
+           'cutadapt': parse_cutadapt}
+
+def get_parser(program):
+    return PARSERS.get(os.path.splitext(os.path.basename(program))[0].lower())
+
+def estimate_records(path):
+    # Records of a FASTA/FASTQ file from its size and the first SAMPLE_BYTES (None if it isn't a regular file)
+    if not path or not os.path.isfile(path):
+        return None
+
+    compression = fastx.get_compression(path)
+    try:
+        if compression == fastx.COMPRESSION_GZIP:
+            # The compressed bytes of the sample give the expansion of this file
+            with open(path, 'rb') as raw:
+                with gzip.GzipFile(fileobj = raw) as fr:
+                    sample = fr.read(SAMPLE_BYTES)
+                    read_bytes = raw.tell()
+            raw.close()
+        else:
+            with fastx.open_file(path) as fr:
+                sample = fr.read(SAMPLE_BYTES)
+            fr.close()
+            read_bytes = len(sample) / EXPANSION.get(compression, 1.0)
+    except (IOError, OSError, EOFError):
+        return None
+
+    if not sample:
+        return 0
+    if sample[:1] == b'>':
+        n_records = sample.count(b'\n>') + 1
+    else:
+        n_records = max(1, sample.count(b'\n') // 4)
+
+    if len(sample) < SAMPLE_BYTES:
+        # The whole file
+        return n_records
+    return int(os.path.getsize(path) * n_records / read_bytes)
+
+def read_segments(read):
+    # Pieces of the output: (bytes, True) for the lines, (bytes, False) for the updates that end with '\r'
+    pending = b''
+    while True:
+        chunk = read()
+        if not chunk:
+            break
+        pending += chunk
+        start = 0
+        for match in SEGMENT_PATTERN.finditer(pending):
+            if match.group() == b'\r' and match.end() == len(pending):
+                # Maybe the first half of '\r\n'
+                break
+            yield pending[start:match.start()], match.group() != b'\r'
+            start = match.end()
+        pending = pending[start:]
+
+    if pending:
+        yield pending.rstrip(b'\r'), True
+
+def read_terminal(fd):
+    # Reads of the pseudo-terminal, b'' when the program closed it (EIO in GNU/Linux)
+    def read():
+        try:
+            return os.read(fd, 65536)
+        except OSError as e:
+            if e.errno == errno.EIO:
+                return b''
+            raise
+    return read
+
+def start_process(command, terminal = False):
+    # The process and the pieces of its output (stdout and stderr)
+    if terminal and pty is not None:
+        master, slave = pty.openpty()
+        try:
+            p = subprocess.Popen(command, shell = True, stdout = slave, stderr = slave)
+        except Exception:
+            os.close(master)
+            raise
+        finally:
+            os.close(slave)
+
+        def segments():
+            try:
+                for segment in read_segments(read_terminal(master)):
+                    yield segment
+            finally:
+                os.close(master)
+        return p, segments()
+
+    p = subprocess.Popen(command, shell = True, stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+    return p, read_segments(lambda: p.stdout.read1(65536))
+
+class Tracker:
+
+    # Progress of one program from the lines of its output
+
+    terminal = True
+
+    def __init__(self, program, parser, records = None):
+        self.program = program
+        self.parser = parser
+        self.records = records
+        self.start = time.time()
+        self.task = None
+        self.task_start = self.start
+        self.percent = None
+        self.reads = None
+
+    def feed(self, line):
+        values = self.parser(line) if self.parser is not None else None
+        if not values:
+            return
+        if values.get('task') is not None and values['task'] != self.task:
+            self.task = values['task']
+            self.task_start = time.time()
+        if values.get('percent') is not None:
+            self.percent = values['percent']
+        if values.get('reads') is not None:
+            self.reads = values['reads']
+
+    def poll(self):
+        pass
+
+    def get_percent(self):
+        if self.percent is not None:
+            return self.percent
+        if self.reads is not None and self.records:
+            return min(99.0, 100.0 * self.reads / self.records)
+        return None
+
+    def get_reads(self):
+        # Reads done: counted by the program, or its percentage of the records of the input
+        if self.reads is not None:
+            return self.reads
+        if self.percent is not None and self.records:
+            return int(self.records * self.percent / 100.0)
+        return None
+
+    def get_state(self):
+        now = time.time()
+        percent = self.get_percent()
+        reads = self.get_reads()
+        # The percentage of vsearch and usearch is that of the current task
+        elapsed = now - (self.task_start if self.percent is not None else self.start)
+
+        # A task seen only when it ends (100%) has no rate
+        reads_per_second = None
+        eta_seconds = None
+        if reads is not None and elapsed > 0 and (self.percent is None or self.percent < 100):
+            reads_per_second = reads / elapsed
+        if percent is not None and 0 < percent < 100:
+            eta_seconds = elapsed * (100.0 - percent) / percent
+
+        return {'program': self.program,
+                'task': self.task,
+                'percent': percent,
+                'reads': reads,
+                'reads_per_second': reads_per_second,
+                'eta_seconds': eta_seconds,
+                'elapsed_seconds': now - self.start}
+
+class OutputTracker(Tracker):
+
+    # Progress of blastn: the last query of its tabular output (the queries are written in order)
+
+    terminal = False
+
+    def __init__(self, program, query_file, output_file):
+        Tracker.__init__(self, program, None)
+        self.query_file = query_file
+        self.output_file = output_file
+        self.ranks = None
+        self.offset = 0
+        self.task = 'Searching'
+
+    def poll(self):
+        if self.ranks is None:
+            self.ranks = {}
+            for rank, (header, _) in enumerate(fastx.read_fasta(self.query_file)):
+                self.ranks.setdefault(header.split(None, 1)[0] if header.strip() else header, rank)
+            self.records = len(self.ranks)
+
+        if not os.path.isfile(self.output_file):
+            return
+        with open(self.output_file, 'rb') as fr:
+            fr.seek(self.offset)
+            data = fr.read()
+        fr.close()
+
+        end = data.rfind(b'\n')
+        if end < 0:
+            return
+        self.offset += end + 1
+        last = data[:end].rsplit(b'\n', 1)[-1]
+        rank = self.ranks.get(last.split(b'\t', 1)[0])
+        if rank is not None:
+            self.reads = rank + 1
+
+class Progress:
+
+    def __init__(self, file, weights = None, report = None, report_interval = 0, interval = STATUS_INTERVAL):
+        # weights: estimated work of every stage (seconds with one thread); report(lines) every report_interval seconds
+        self.file = file
+        self.weights = dict(weights or {})
+        self.report = report
+        self.report_interval = report_interval
+        self.interval = min(interval, report_interval) if report_interval else interval
+        self.start = time.time()
+        self.status = 'running'
+        self.stages = {}
+        self.finished = {}
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.thread = None
+
+    def run(self):
+        self.thread = threading.Thread(target = self.worker, daemon = True)
+        self.thread.start()
+
+    def worker(self):
+        last_report = time.time()
+        while not self.stop.wait(self.interval):
+            self.write()
+            if self.report is not None and self.report_interval and time.time() - last_report >= self.report_interval:
+                last_report = time.time()
+                self.report(self.get_lines())
+
+    def close(self, status = 'finished'):
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.status = status
+        self.write()
+
+    def start_stage(self, name, threads = 1):
+        with self.lock:
+            self.stages[name] = {'threads': threads, 'start': time.time(), 'parts': None, 'done': 0, 'programs': []}
+
+    def finish_stage(self, name, status):
+        with self.lock:
+            self.stages.pop(name, None)
+            self.finished[name] = status
+
+    def set_parts(self, name, parts, done = 0):
+        # Stages of several programs (shards): the first call sets them
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is not None and stage['parts'] is None:
+                stage['parts'] = parts
+                stage['done'] = done
+
+    def start_program(self, name, tracker):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is not None:
+                stage['programs'].append(tracker)
+
+    def finish_program(self, name, tracker):
+        with self.lock:
+            stage = self.stages.get(name)
+            if stage is not None and tracker in stage['programs']:
+                stage['programs'].remove(tracker)
+                stage['done'] += 1
+
+    def get_stage_state(self, name, stage, now):
+        programs = [tracker.get_state() for tracker in stage['programs']]
+        percents = [program['percent'] for program in programs if program['percent'] is not None]
+        elapsed = now - stage['start']
+
+        percent = None
+        eta_seconds = None
+        if stage['parts']:
+            percent = min(100.0, 100.0 * (stage['done'] + sum(percents) / 100.0) / stage['parts'])
+            if 0 < percent < 100:
+                eta_seconds = elapsed * (100.0 - percent) / percent
+        elif percents:
+            percent = sum(percents) / len(percents)
+            etas = [program['eta_seconds'] for program in programs if program['eta_seconds'] is not None]
+            eta_seconds = max(etas) if etas else None
+
+        rates = [program['reads_per_second'] for program in programs if program['reads_per_second'] is not None]
+        sample, step = get_sample_step(name)
+
+        return {'stage': name,
+                'sample': sample,
+                'step': step,
+                'threads': stage['threads'],
+                'elapsed_seconds': elapsed,
+                'percent': percent,
+                'eta_seconds': eta_seconds,
+                'reads_per_second': sum(rates) if rates else None,
+                'programs': programs}
+
+    def get_state(self):
+        now = time.time()
+        with self.lock:
+            stages = [(name, dict(stage, programs = list(stage['programs']))) for name, stage in self.stages.items()]
+            finished = dict(self.finished)
+
+        for _, stage in stages:
+            for tracker in stage['programs']:
+                try:
+                    tracker.poll()
+                except (IOError, OSError):
+                    pass
+        running = [self.get_stage_state(name, stage, now) for name, stage in stages]
+
+        # Work done: the finished stages and the part of the running ones
+        total = sum(self.weights.values()) if self.weights else 0
+        done = sum([self.weights.get(name, 0) for name in finished])
+        done += sum([self.weights.get(stage['stage'], 0) * (stage['percent'] or 0) / 100.0 for stage in running])
+        elapsed = now - self.start
+        percent = 100.0 * done / total if total > 0 else None
+        if self.status == 'finished':
+            percent = 100.0
+
+        eta_seconds = None
+        if percent is not None and 0 < percent < 100:
+            eta_seconds = elapsed * (100.0 - percent) / percent
+        rates = [stage['reads_per_second'] for stage in running if stage['reads_per_second'] is not None]
+
+        return {'status': self.status,
+                'pid': os.getpid(),
+                'started': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(self.start)),
+                'updated': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now)),
+                'elapsed_seconds': elapsed,
+                'percent': percent,
+                'eta_seconds': eta_seconds,
+                'reads_per_second': sum(rates) if rates else None,
+                'stages': {'total': len(self.weights) or None,
+                           'done': len([status for status in finished.values() if status != 'failed']),
+                           'failed': len([status for status in finished.values() if status == 'failed']),
+                           'running': len(running)},
+                'running': running}
+
+    def write(self):
+        state = self.get_state()
+        try:
+            write_json(state, self.file, sort_keys = False)
+        except (IOError, OSError):
+            pass
+        return state
+
+    def get_lines(self):
+        return format_state(self.get_state())
+
+def format_value(value, fmt):
+    return fmt % value if value is not None else '-'
+
+def format_state(state):
+    # Lines of the run and of every running stage
+    stages = state['stages']
+    lines = ['[Progress] %s of the run | stages: %s done, %s running%s | %s reads/s | ETA %s' % (
+             format_value(state['percent'], '%.1f%%'), stages['done'], stages['running'],
+             ' of %s' % stages['total'] if stages['total'] else '',
+             format_value(state['reads_per_second'], '%.0f'),
+             format_seconds(state['eta_seconds']) if state['eta_seconds'] is not None else '-')]
+    for stage in sorted(state['running'], key = lambda stage: stage['stage']):
+        tasks = ', '.join(['%s %s' % (program['task'] or program['program'], format_value(program['percent'], '%.0f%%')) for program in stage['programs'] if program['task'] or program['percent'] is not None])
+        lines.append('  %s: %s | %s | %s reads/s | ETA %s | running %s' % (
+                     stage['stage'], format_value(stage['percent'], '%.1f%%'), tasks or '-',
+                     format_value(stage['reads_per_second'], '%.0f'),
+                     format_seconds(stage['eta_seconds']) if stage['eta_seconds'] is not None else '-',
+                     format_seconds(stage['elapsed_seconds'])))
+    return lines
+
+def main(args):
+    if len(args) <= 1:
+        message = 'Use:\n  python3 progress.py <status.json>\n'
+        print(message)
+    else:
+        with open(args[1], 'r', encoding = 'utf-8') as fr:
+            state = json.load(fr)
+        fr.close()
+        print('Status: %s (updated %s, pid %s)' % (state['status'], state['updated'], state['pid']))
+        for line in format_state(state):
+            print(line)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -2,90 +2,193 @@
 # -*- coding: utf-8 -*-
 import os
 import sys
-from Bio import SeqIO
-from Bio.Seq import Seq
-from Bio.SeqRecord import SeqRecord
+import argparse
+import multiprocessing
+from collections import deque
+from functools import lru_cache
+import fastx
 
 '''
 python3 rename_database.py silva SILVA_138.1_SSURef_NR99_tax_silva.fasta
 python3 rename_database.py unite uchime_reference_dataset_untrimmed_28.06.2017.fasta
+python3 rename_database.py rdp rdp_16s_v18.fa -d Bacteria -t 8
+
+The headers are rewritten for SINTAX (<id>;tax=d:...,p:...,...,s:...;). The
+database is read in blocks of whole records, the blocks are converted by
+worker processes (-t) and written in the original order, so the memory used
+does not depend on the size of the database. The input may be compressed
+(.gz, .zst).
+
+RDP input can be the SINTAX file of the RDP training set (<id>;tax=...) or
+the training set of the RDP classifier (<id> Root;Bacteria;...). With -d only
+the sequences of the given domains (kingdoms for UNITE) are kept; SILVA keeps
+Archaea and Bacteria by default.
 '''
 
+TYPE_SILVA = 'silva'
+TYPE_RDP = 'rdp'
+TYPE_UNITE = 'unite'
+TYPES = [TYPE_SILVA, TYPE_RDP, TYPE_UNITE]
+
+# Default domains kept of every database (None: all)
+DOMAINS = {TYPE_SILVA: ['Archaea', 'Bacteria'],
+           TYPE_RDP: None,
+           TYPE_UNITE: None}
+
+RANK_PREFIXES = ('d:', 'p:', 'c:', 'o:', 'f:', 'g:', 's:')
+UNITE_PREFIXES = ('k__', 'p__', 'c__', 'o__', 'f__', 'g__', 's__')
+
+BLOCK_SIZE = 1024 * 1024 * 4
+WIDTH = 60
+
 def format_lineage(lineage):
-    lineage_format = 'tax='
-    for index, tax in enumerate(lineage):
-        index = 7 - index
-        tax = tax.replace(' ', '_')
-        if index == 7:
-            tax = 'd:%s,' % tax
-        elif index == 6:
-            tax = 'p:%s,' % tax
-        elif index == 5:
-            tax = 'c:%s,' % tax
-        elif index == 4:
-            tax = 'o:%s,' % tax
-        elif index == 3:
-            tax = 'f:%s,' % tax
-        elif index == 2:
-            tax = 'g:%s,' % tax
-        elif index == 1:
-            tax = tax.replace(',', '.')
-            tax = 's:%s,' % tax
-        lineage_format += tax
+    # The first seven ranks get their prefix, the species without commas; deeper ranks are appended as they are
+    taxa = [tax.replace(' ', '_') for tax in lineage]
+    if len(taxa) >= len(RANK_PREFIXES):
+        taxa[len(RANK_PREFIXES) - 1] = taxa[len(RANK_PREFIXES) - 1].replace(',', '.')
 
+    lineage_format = 'tax=' + ''.join(['%s%s,' % (prefix, tax) for prefix, tax in zip(RANK_PREFIXES, taxa)]) + ''.join(taxa[len(RANK_PREFIXES):])
     if lineage_format[-1] == ',':
-        lineage_format = lineage_format[0:len(lineage_format) - 1]
+        lineage_format = lineage_format[:-1]
 
     return lineage_format
 
-def edit_database_fasta(fasta_file, db_type = 'silva'):
-    records = []
-    for record in SeqIO.parse(fasta_file, 'fasta'):
-        _id = record.id
-        _desc = record.description
+@lru_cache(maxsize = 65536)
+def format_lineage_text(text, separator = ';'):
+    # The same lineage is shared by many sequences of a database
+    return format_lineage(text.split(separator))
+
+def strip_unite_prefixes(lineage):
+    for prefix in UNITE_PREFIXES:
+        lineage = lineage.replace(prefix, '')
+    return lineage
+
+def get_domain(lineage, separator = ';'):
+    return lineage.split(separator, 1)[0].strip().lower()
+
+def rename_header(header, db_type = TYPE_SILVA, domains = None):
+    # New header, or None if the sequence is not kept
+    _desc = header.decode('latin-1')
+    _id = _desc.split(None, 1)[0] if _desc.strip() else ''
+
+    if db_type == TYPE_SILVA:
         _desc = _desc.replace(_id, '').strip()
+        if ';' not in _desc or (domains is not None and get_domain(_desc) not in domains):
+            return None
+        _id = '%s;%s;' % (_id, format_lineage_text(_desc))
+    elif db_type == TYPE_UNITE:
+        id_seq = _id.split('|k__')[0].strip()
+        id_seq = id_seq.split('|')
+        _id_seq = '|'.join(id_seq[0:3])
 
-        if db_type == 'silva':
-            if _desc.startswith('Archaea;') or _desc.startswith('Bacteria;'):
-                lineage = _desc.split(';')
-                _lineage_format = format_lineage(lineage)
-                _id = '%s;%s;' % (_id, _lineage_format)
-
-                rec = SeqRecord(Seq(str(record.seq)), id = _id, description = '')
-                records.append(rec)
-        elif db_type == 'unite':
-            id_seq = _id.split('|k__')[0].strip()
-            id_seq = id_seq.split('|')
-            _id_seq = '|'.join(id_seq[0:3])
-            _id_alpha = id_seq[1]
-
-            lineage = _id.split('|k__')[1].strip()
-            lineage = 'k__%s' % lineage
-            lineage = lineage.replace('k__', '').replace('p__', '').replace('c__', '').replace('o__', '').replace('f__', '').replace('g__', '').replace('s__', '')
-            lineage = lineage.split(';')
-            _lineage_format = format_lineage(lineage)
-            # _lineage_format = _lineage_format.replace(':unidentified,', ':unidentified_%s,' % _id_alpha).replace(':unidentified;', ':unidentified_%s;' % _id_alpha)
-            _id = '%s;%s;' % (_id_seq, _lineage_format)
-
-            rec = SeqRecord(Seq(str(record.seq)), id = _id, description = '')
-            records.append(rec)
+        lineage = strip_unite_prefixes(_id.split('|k__')[1].strip())
+        if domains is not None and get_domain(lineage) not in domains:
+            return None
+        _id = '%s;%s;' % (_id_seq, format_lineage_text(lineage))
+    elif db_type == TYPE_RDP:
+        if 'tax=' in _desc:
+            # Already in SINTAX format
+            _id = _desc.split(';', 1)[0].split(None, 1)[0]
+            lineage = _desc.split('tax=', 1)[1].strip().rstrip(';')
+            if domains is not None and get_domain(lineage.split(':', 1)[-1], ',') not in domains:
+                return None
+            _id = '%s;tax=%s;' % (_id, lineage)
+        else:
+            # RDP classifier training set: <id> Root;Domain;Phylum;...
+            lineage = _desc.replace(_id, '', 1).strip().rstrip(';')
+            if lineage.lower().startswith('root;'):
+                lineage = lineage[5:]
+            if not lineage or (domains is not None and get_domain(lineage) not in domains):
+                return None
+            _id = '%s;%s;' % (_id, format_lineage_text(lineage))
+    else:
+        raise ValueError("Unknown database type '%s'" % db_type)
+
+    return _id.encode('latin-1')
+
+def convert_block(block, db_type = TYPE_SILVA, domains = None, width = WIDTH):
+    # Block of whole FASTA records -> (converted block, records read, records written)
+    output = []
+    n_read = 0
+    for header, sequence in fastx.parse_fasta(block.splitlines(True)):
+        n_read += 1
+        header = rename_header(header, db_type, domains)
+        if header is not None:
+            output.append(fastx.format_fasta(header, sequence, width))
+
+    return b''.join(output), n_read, len(output)
+
+def read_blocks(fasta_file, block_size = BLOCK_SIZE):
+    # Blocks of the file that end at the start of a record
+    remainder = b''
+    with fastx.open_file(fasta_file) as fr:
+        for data in iter(lambda: fr.read(block_size), b''):
+            data = remainder + data
+            end = data.rfind(b'\n>')
+            if end < 0:
+                remainder = data
+                continue
+            yield data[:end + 1]
+            remainder = data[end + 1:]
+    fr.close()
 
+    if remainder:
+        yield remainder
+
+def get_output_file(fasta_file):
     _path = os.path.dirname(fasta_file)
-    _prefix, _ = os.path.splitext(os.path.basename(fasta_file))
-    output_file = '%s_for_asv.fasta' % _prefix
-    output_file = os.path.join(_path, output_file)
+    _prefix, _ = os.path.splitext(os.path.basename(fastx.strip_compression(fasta_file)))
+    return os.path.join(_path, '%s_for_asv.fasta' % _prefix)
+
+def edit_database_fasta(fasta_file, db_type = TYPE_SILVA, output_file = None, threads = 1, domains = None):
+    if output_file is None:
+        output_file = get_output_file(fasta_file)
+    if domains is None:
+        domains = DOMAINS[db_type]
+    if domains is not None:
+        domains = set([domain.strip().lower() for domain in domains])
 
-    SeqIO.write(records, output_file, 'fasta')
+    n_read = 0
+    n_written = 0
+    with fastx.open_file(output_file, 'w') as fw:
+        if threads <= 1:
+            for block in read_blocks(fasta_file):
+                output, _read, _written = convert_block(block, db_type, domains)
+                fw.write(output)
+                n_read += _read
+                n_written += _written
+        else:
+            # At most two blocks per worker are pending, the output keeps the order of the input
+            with multiprocessing.Pool(threads) as workers:
+                pending = deque()
+                for block in read_blocks(fasta_file):
+                    pending.append(workers.apply_async(convert_block, (block, db_type, domains)))
+                    while len(pending) >= threads * 2 or (pending and pending[0].ready()):
+                        output, _read, _written = pending.popleft().get()
+                        fw.write(output)
+                        n_read += _read
+                        n_written += _written
+                while pending:
+                    output, _read, _written = pending.popleft().get()
+                    fw.write(output)
+                    n_read += _read
+                    n_written += _written
+    fw.close()
+
+    return output_file, n_read, n_written
 
 def main(args):
-    if len(args) <= 2:
-        message = 'Two arguments needed: <silva|unite> database.fasta\n'
-        print(message)
-    else:
-        database_type = args[1]
-        database_fasta = args[2]
+    parser = argparse.ArgumentParser(description = "Rename the headers of a reference database for SINTAX")
+    parser.add_argument("type", choices = TYPES, help = "Type of database")
+    parser.add_argument("fasta", help = "FASTA file of the database")
+    parser.add_argument("-o", "--output", help = "Output file (default: <fasta>_for_asv.fasta)")
+    parser.add_argument("-t", "--threads", type = int, default = 1, help = "Worker processes (default: 1)")
+    parser.add_argument("-d", "--domains", help = "Comma-separated domains to keep (default: Archaea,Bacteria for silva, all for rdp and unite)")
+    args = parser.parse_args(args[1:])
 
-        asvs = edit_database_fasta(database_fasta, database_type)
+    domains = args.domains.split(',') if args.domains else None
+    output_file, n_read, n_written = edit_database_fasta(args.fasta, args.type, args.output, args.threads, domains)
+    print('%s of %s sequences written to %s' % (n_written, n_read, output_file))
 
 if __name__ == '__main__':
     main(sys.argv)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+'''
+Dependency-graph scheduler for the stages of the pipeline.
+
+Each stage declares the files it reads (inputs) and writes (outputs). A stage
+starts as soon as all of its inputs exist, as long as its threads fit in the
+global CPU budget (and its memory in the memory budget, when there is one).
+'''
+
+class Stage:
+
+    def __init__(self, name, actions, inputs = None, outputs = None, threads = 1, priority = 0, memory = 0):
+        self.name = name
+        self.actions = list(actions) if isinstance(actions, (list, tuple)) else [actions]
+        self.inputs = list(inputs) if inputs else []
+        self.outputs = list(outputs) if outputs else []
+        self.threads = max(1, int(threads))
+        self.priority = priority
+        self.memory = max(0, memory)
+
+    def run(self):
+        for action in self.actions:
+            action()
+
+class Scheduler:
+
+    def __init__(self, cpu_budget, runner = None, memory_budget = None):
+        self.cpu_budget = max(1, int(cpu_budget))
+        self.memory_budget = memory_budget
+        self.runner = runner
+        self.stages = []
+        self.producers = {}
+
+    def add(self, stage):
+        for output in stage.outputs:
+            if output in self.producers:
+                raise ValueError("File '%s' is written by both '%s' and '%s'" % (output, self.producers[output].name, stage.name))
+            self.producers[output] = stage
+
+        stage.threads = min(stage.threads, self.cpu_budget)
+        self.stages.append(stage)
+
+        return stage
+
+    def check(self, existing = ()):
+        # Inputs that no stage writes must already exist (or be in existing, files that will be there before the stages run)
+        for stage in self.stages:
+            for input_file in stage.inputs:
+                if input_file not in self.producers and input_file not in existing and not os.path.exists(input_file):
+                    raise ValueError("Input '%s' of stage '%s' doesn't exist and no stage writes it" % (input_file, stage.name))
+
+        # The graph must not have cycles
+        if len(self.get_order()) != len(self.stages):
+            raise ValueError("The stages have circular dependencies")
+
+    def get_order(self):
+        # Stages after the ones that write their inputs, in the order they were added (without the ones of a cycle)
+        n_dependencies = {}
+        dependents = {}
+        for stage in self.stages:
+            parents = set([self.producers[input_file] for input_file in stage.inputs if input_file in self.producers])
+            n_dependencies[stage] = len(parents)
+            for parent in parents:
+                dependents.setdefault(parent, []).append(stage)
+
+        queue = [stage for stage in self.stages if n_dependencies[stage] == 0]
+        order = []
+        while queue:
+            stage = queue.pop(0)
+            order.append(stage)
+            for child in dependents.get(stage, []):
+                n_dependencies[child] -= 1
+                if n_dependencies[child] == 0:
+                    queue.append(child)
+
+        return order
+
+    def fits(self, stage, used, used_memory):
+        # Threads and memory of the stage next to the running ones (a stage alone always fits)
+        if used + stage.threads > self.cpu_budget:
+            return False
+        return self.memory_budget is None or used_memory + stage.memory <= self.memory_budget
+
+    def is_ready(self, stage, available):
+        for input_file in stage.inputs:
+            if input_file in self.producers:
+                if input_file not in available:
+                    return False
+            elif not os.path.exists(input_file):
+                return False
+        return True
+
+    def execute(self, stage):
+        if self.runner is not None:
+            self.runner(stage)
+        else:
+            stage.run()
+
+    def run(self):
+        self.check()
+
+        pending = list(self.stages)
+        available = set()
+        running = {}
+        used = 0
+        used_memory = 0
+        error = None
+
+        executor = ThreadPoolExecutor(max_workers = self.cpu_budget)
+        try:
+            while pending or running:
+                if error is None:
+                    # Highest priority first; a stage that doesn't fit blocks the ones behind it
+                    ready = [stage for stage in pending if self.is_ready(stage, available)]
+                    ready.sort(key = lambda stage: stage.priority, reverse = True)
+                    for stage in ready:
+                        if running and not self.fits(stage, used, used_memory):
+                            break
+                        pending.remove(stage)
+                        used += stage.threads
+                        used_memory += stage.memory
+                        running[executor.submit(self.execute, stage)] = stage
+
+                if not running:
+                    break
+
+                finished, _ = wait(list(running), return_when = FIRST_COMPLETED)
+                for future in finished:
+                    stage = running.pop(future)
+                    used -= stage.threads
+                    used_memory -= stage.memory
+                    try:
+                        future.result()
+                    except BaseException as e:
+                        if error is None:
+                            error = e
+                        continue
+                    available.update(stage.outputs)
+        finally:
+            executor.shutdown(wait = True)
+
+        if error is not None:
+            raise error
+
+        if pending:
+            raise RuntimeError("Stages that could not be started: %s" % ", ".join([stage.name for stage in pending]))
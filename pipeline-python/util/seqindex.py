@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import fastx
+from files import write_json
+
+'''
+Sidecar index of FASTA/FASTQ files.
+
+python3 seqindex.py all.fa all.dereplicated.fa
+
+For <file> the index is written to <file>.fxi (JSON) with the number of
+records, the total number of bases, the histogram of lengths and the byte
+offset of every STEP-th record. The index keeps the size and modification
+time of the file it describes and is ignored once the file changes.
+
+Files written from Python get their index while they are written
+(IndexingWriter); files written by other programs get it the first time
+they are counted (one pass), and pooled files get it from the indexes of
+their parts without reading them.
+
+The offsets split large files in shards of about the same number of
+records without reading them (get_shard_ranges, used by shards.py). For
+compressed files (.gz, .zst) the offsets are positions in the decompressed
+data, so they can't be used to read byte ranges.
+'''
+
+VERSION = 1
+EXTENSION = '.fxi'
+STEP = 100000
+
+def get_index_file(path):
+    return '%s%s' % (path, EXTENSION)
+
+class Index:
+
+    def __init__(self, fmt, step = STEP):
+        self.fmt = fmt
+        self.step = step
+        self.records = 0
+        self.bases = 0
+        self.lengths = {}
+        self.offsets = []
+        self.size = 0
+
+    def add(self, offset, length):
+        if self.records % self.step == 0:
+            self.offsets.append([self.records, offset])
+        self.records += 1
+        self.bases += length
+        self.lengths[length] = self.lengths.get(length, 0) + 1
+
+    def extend(self, other, offset):
+        # Append the records of another file written right after the current end
+        for record, _offset in other.offsets:
+            self.offsets.append([self.records + record, offset + _offset])
+        self.records += other.records
+        self.bases += other.bases
+        for length, n in other.lengths.items():
+            self.lengths[length] = self.lengths.get(length, 0) + n
+
+    def to_dict(self, path):
+        stat = os.stat(path)
+        return {'version': VERSION,
+                'format': self.fmt,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'records': self.records,
+                'bases': self.bases,
+                'lengths': dict([(str(length), n) for length, n in sorted(self.lengths.items())]),
+                'step': self.step,
+                'offsets': self.offsets}
+
+    @classmethod
+    def from_dict(cls, data):
+        index = cls(data['format'], data['step'])
+        index.records = data['records']
+        index.bases = data['bases']
+        index.lengths = dict([(int(length), n) for length, n in data['lengths'].items()])
+        index.offsets = data['offsets']
+        index.size = data['size']
+        return index
+
+    def save(self, path):
+        write_json(self.to_dict(path), get_index_file(path), indent = None, sort_keys = False)
+
+def load_index(path):
+    index_file = get_index_file(path)
+    if not os.path.isfile(index_file) or not os.path.isfile(path):
+        return None
+
+    try:
+        with open(index_file, 'r', encoding = 'utf-8') as fr:
+            data = json.load(fr)
+        fr.close()
+    except ValueError:
+        return None
+
+    stat = os.stat(path)
+    if data.get('version') != VERSION or data['size'] != stat.st_size or data['mtime'] != stat.st_mtime_ns:
+        return None
+
+    return Index.from_dict(data)
+
+def line_length(line):
+    if line[-2:] == b'\r\n':
+        return len(line) - 2
+    elif line[-1:] == b'\n':
+        return len(line) - 1
+    return len(line)
+
+def build_index(path, fmt = None, step = STEP):
+    if fmt is None:
+        fmt = fastx.guess_format(path)
+
+    index = Index(fmt, step)
+    offset = 0
+    with fastx.open_file(path) as fr:
+        if fmt == fastx.FORMAT_FASTQ:
+            for header, sequence, separator, quality in zip(fr, fr, fr, fr):
+                index.add(offset, line_length(sequence))
+                offset += len(header) + len(sequence) + len(separator) + len(quality)
+        else:
+            length = None
+            for line in fr:
+                if line[:1] == b'>':
+                    if length is not None:
+                        index.lengths[length] = index.lengths.get(length, 0) + 1
+                        index.bases += length
+                    if index.records % index.step == 0:
+                        index.offsets.append([index.records, offset])
+                    index.records += 1
+                    length = 0
+                elif length is not None:
+                    length += line_length(line)
+                offset += len(line)
+
+            if length is not None:
+                index.lengths[length] = index.lengths.get(length, 0) + 1
+                index.bases += length
+    fr.close()
+
+    index.save(path)
+
+    return index
+
+def get_index(path, fmt = None):
+    index = load_index(path)
+    if index is None:
+        index = build_index(path, fmt)
+    return index
+
+def count_records(path, fmt = None):
+    return get_index(path, fmt).records
+
+def pool_indexes(files):
+    # Index of the concatenation of the files, only if all of them have an index
+    arr_indexes = []
+    for file in files:
+        if fastx.get_compression(file) is not None:
+            return None
+        index = load_index(file)
+        if index is None:
+            return None
+        arr_indexes.append(index)
+
+    if not arr_indexes:
+        return None
+
+    pooled = Index(arr_indexes[0].fmt, arr_indexes[0].step)
+    for index in arr_indexes:
+        pooled.extend(index, pooled.size)
+        pooled.size += index.size
+
+    return pooled
+
+def concat_indexes(files, output_file):
+    pooled = pool_indexes(files)
+    if pooled is None or os.path.getsize(output_file) != pooled.size:
+        return None
+
+    pooled.save(output_file)
+
+    return pooled
+
+def get_shard_ranges(path, n_shards, fmt = None):
+    # Byte ranges that start on a record boundary, with about the same number of records each
+    if fastx.get_compression(path) is not None:
+        raise ValueError("File '%s' is compressed, it can't be split in byte ranges" % path)
+
+    index = get_index(path, fmt)
+    size = os.path.getsize(path)
+    if index.records == 0:
+        return []
+
+    n_shards = max(1, min(int(n_shards), len(index.offsets)))
+    per_shard = len(index.offsets) / float(n_shards)
+
+    ranges = []
+    for shard in range(n_shards):
+        start = index.offsets[int(round(shard * per_shard))][1]
+        if shard == n_shards - 1:
+            end = size
+        else:
+            end = index.offsets[int(round((shard + 1) * per_shard))][1]
+        if end > start:
+            ranges.append((start, end))
+
+    return ranges
+
+class IndexingWriter(fastx.Writer):
+
+    def __init__(self, path, fmt = None, width = 0, step = STEP):
+        fastx.Writer.__init__(self, path, fmt, width)
+        self.index = Index(self.fmt, step)
+        self.offset = 0
+
+    def write(self, record):
+        data = self.format(record)
+        self.handle.write(data)
+        self.index.add(self.offset, len(record[1]))
+        self.offset += len(data)
+        self.count += 1
+
+    def close(self):
+        if self.handle is not None:
+            fastx.Writer.close(self)
+            self.index.save(self.path)
+
+def main(args):
+    if len(args) <= 1:
+        message = 'Use:\n  python3 seqindex.py <FILE> [<FILE> ...]\n'
+        print(message)
+    else:
+        for file in args[1:]:
+            index = get_index(file)
+            print('%s\t%s records\t%s bases' % (file, index.records, index.bases))
+
+if __name__ == '__main__':
+    main(sys.argv)
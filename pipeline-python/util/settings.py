@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import configparser
+
+'''
+Parameters of a configuration file (config.txt), read once.
+
+python3 settings.py config.txt [key=value ...]   # parameters with the changes
+
+The file is parsed when the object is created and every parameter is kept as
+its text, so the pipeline and the batch (amplicon_batch.py) read it once
+instead of once per parameter. The changes (key=value, as in --set) replace
+the values of the file. The values are read as text (get), as numbers
+(get_int, get_float) or as yes/no (get_bool); a missing or empty parameter
+gives the default, a value that isn't of the type raises ValueError.
+'''
+
+SECTION = 'PARAMETERS'
+
+YES = ['yes', 'true', '1']
+NO = ['no', 'false', '0']
+
+def parse_changes(items):
+    # {key: value} of key=value items
+    changes = {}
+    for item in items or []:
+        key, separator, value = item.partition('=')
+        if not separator or not key.strip():
+            raise ValueError("'%s' is not key=value" % item)
+        changes[key.strip().lower()] = value.strip()
+    return changes
+
+class Settings:
+
+    def __init__(self, file, section = SECTION, changes = None):
+        self.file = file
+        self.section = section
+        self.values = {}
+
+        config = configparser.ConfigParser()
+        config.read(file)
+        if config.has_section(section):
+            for key in config.options(section):
+                try:
+                    self.values[key.lower()] = config.get(section, key)
+                except configparser.Error:
+                    self.values[key.lower()] = ''
+        self.values.update(changes or {})
+
+    def get(self, key, default = ''):
+        value = self.values.get(key.lower(), '')
+        return value if value != '' else default
+
+    def set(self, key, value):
+        self.values[key.lower()] = value
+
+    def get_int(self, key, default = None):
+        value = self.get(key)
+        if value == '':
+            return default
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError("Value '%s' of parameter '%s' is not an integer" % (value, key.lower()))
+
+    def get_float(self, key, default = None):
+        value = self.get(key)
+        if value == '':
+            return default
+        try:
+            return float(value)
+        except ValueError:
+            raise ValueError("Value '%s' of parameter '%s' is not a number" % (value, key.lower()))
+
+    def get_bool(self, key, default = None):
+        value = self.get(key).lower()
+        if value == '':
+            return default
+        if value in YES:
+            return True
+        if value in NO:
+            return False
+        raise ValueError("Value '%s' of parameter '%s' must be yes or no" % (value, key.lower()))
+
+    def get_path(self, key, default = None):
+        # Absolute path (relative to the working folder, as the pipeline uses it)
+        value = self.get(key)
+        return os.path.abspath(value) if value else default
+
+def main(args):
+    if len(args) <= 1:
+        message = 'Use:\n  python3 settings.py <config.txt> [key=value ...]\n'
+        print(message)
+    else:
+        settings = Settings(args[1], changes = parse_changes(args[2:]))
+        for key, value in sorted(settings.values.items()):
+            print('%s = %s' % (key, value))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from files import write_json, read_json, get_checksum
+import fastx
+import pool
+import seqindex
+
+'''
+Sharded runs of a program over the records of a FASTA file.
+
+The query file is split in shards of consecutive records, a worker runs the
+program on every shard (several at the same time, each one with its own
+threads) and the outputs are concatenated in the order of the shards, so the
+merged output follows the order of the queries. Programs that write the
+results of a shard in the order their threads finish them (SINTAX) get their
+lines sorted back into the order of the shard (ordered = True).
+
+Every shard is written to a temporary file and moved into place when the
+program finishes, and the finished shards are recorded in a state file. A
+run that is stopped half way goes on with the missing shards, as long as the
+query and the key (command, program version) didn't change.
+'''
+
+STATE = 'state.json'
+
+# Shards per worker, so a slow shard doesn't keep the others waiting and a stopped run loses little
+SHARDS_PER_WORKER = 4
+MIN_RECORDS = 50
+
+# Part of the available memory that the workers may use
+MEMORY_FRACTION = 0.8
+
+def get_available_memory():
+    # Bytes of memory available (GNU/Linux), None if it's unknown
+    try:
+        with open('/proc/meminfo', 'r') as fr:
+            for line in fr:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+        fr.close()
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+def get_workers(threads, threads_per_worker = 1, memory_per_worker = None):
+    # Concurrent workers and threads of each one, within the threads and the available memory
+    threads = max(1, int(threads))
+    workers = max(1, threads // max(1, int(threads_per_worker)))
+
+    if memory_per_worker:
+        available = get_available_memory()
+        if available is not None:
+            workers = max(1, min(workers, int(available * MEMORY_FRACTION // memory_per_worker)))
+
+    return workers, max(1, threads // workers)
+
+def get_n_shards(n_records, workers, min_records = MIN_RECORDS):
+    if n_records == 0:
+        return 0
+    n_shards = max(workers, min(workers * SHARDS_PER_WORKER, n_records // max(1, min_records)))
+    return max(1, min(n_shards, n_records))
+
+def sort_lines(file, query_file):
+    # Lines of the output in the order of the queries (first column: label or id of the query)
+    ranks = {}
+    for rank, (header, _) in enumerate(fastx.read_fasta(query_file)):
+        ranks.setdefault(header, rank)
+        ranks.setdefault(header.split(None, 1)[0] if header.strip() else header, rank)
+
+    with open(file, 'rb') as fr:
+        lines = fr.readlines()
+    fr.close()
+
+    n_queries = len(ranks)
+    lines.sort(key = lambda line: ranks.get(line.split(b'\t', 1)[0].rstrip(b'\r\n'), n_queries))
+
+    with open(file, 'wb') as fw:
+        fw.writelines(lines)
+    fw.close()
+
+class Shard:
+
+    def __init__(self, index, path):
+        self.index = index
+        self.query = os.path.join(path, 'shard_%04d.fa' % index)
+        self.output = os.path.join(path, 'shard_%04d.out' % index)
+        self.tmp_output = '%s.tmp' % self.output
+
+class ShardRun:
+
+    def __init__(self, query_file, output_file, key = '', ordered = False, get_digest = None):
+        self.query_file = query_file
+        self.output_file = output_file
+        self.key = key
+        self.ordered = ordered
+        # Digest of the query: the one of the checkpoints (cached by size and modification time) when there are any
+        self.get_digest = get_digest or get_checksum
+        self.path = '%s.shards' % output_file
+        self.state_file = os.path.join(self.path, STATE)
+        self.state = None
+        self.lock = threading.Lock()
+
+    def prepare(self, workers, resume = True, min_records = MIN_RECORDS):
+        # Shards of the query; the ones already finished are reused when resuming
+        digest = self.get_digest(self.query_file)
+        state = read_json(self.state_file) if resume else None
+        if state is not None and state.get('query') == digest and state.get('key') == self.key:
+            self.state = state
+        else:
+            if os.path.isdir(self.path):
+                shutil.rmtree(self.path)
+            os.makedirs(self.path)
+
+            n_records = seqindex.count_records(self.query_file)
+            n_shards = self.split(n_records, get_n_shards(n_records, workers, min_records))
+            self.state = {'query': digest, 'key': self.key, 'shards': n_shards, 'done': []}
+            write_json(self.state, self.state_file)
+
+        return self.get_shards()
+
+    def split(self, n_records, n_shards):
+        # Shards of the query; returns how many were written
+        if n_shards == 0:
+            return 0
+
+        ranges = self.get_ranges(n_shards)
+        if ranges:
+            # Byte ranges of the sidecar index, copied without reading the records
+            fd_in = os.open(self.query_file, os.O_RDONLY)
+            try:
+                for shard, (start, end) in enumerate(ranges):
+                    os.lseek(fd_in, start, os.SEEK_SET)
+                    with open(Shard(shard, self.path).query, 'wb') as fw:
+                        n_bytes = pool.copy_fd(fd_in, fw.fileno(), end - start)
+                    fw.close()
+                    if n_bytes < end - start:
+                        raise IOError("Only %s of the %s bytes of shard %s of '%s' were copied" % (n_bytes, end - start, shard, self.query_file))
+            finally:
+                os.close(fd_in)
+            return len(ranges)
+
+        per_shard = n_records / float(n_shards)
+        shard = 0
+        end = int(round(per_shard))
+        fw = fastx.Writer(Shard(shard, self.path).query)
+        for index, record in enumerate(fastx.read_fasta(self.query_file)):
+            if index >= end and shard < n_shards - 1:
+                fw.close()
+                shard += 1
+                end = int(round((shard + 1) * per_shard))
+                fw = fastx.Writer(Shard(shard, self.path).query)
+            fw.write(record)
+        fw.close()
+
+        return n_shards
+
+    def get_ranges(self, n_shards):
+        # Byte ranges of the shards when the index of the query has an offset for each one (uncompressed files), None otherwise
+        if fastx.get_compression(self.query_file) is not None:
+            return None
+        index = seqindex.load_index(self.query_file)
+        if index is None or len(index.offsets) < n_shards:
+            return None
+        return seqindex.get_shard_ranges(self.query_file, n_shards, index.fmt)
+
+    def get_shards(self):
+        return [Shard(index, self.path) for index in range(self.state['shards'])]
+
+    def is_done(self, shard):
+        return shard.index in self.state['done'] and os.path.isfile(shard.output)
+
+    def finish(self, shard):
+        if self.ordered:
+            sort_lines(shard.tmp_output, shard.query)
+        os.replace(shard.tmp_output, shard.output)
+
+        with self.lock:
+            self.state['done'] = sorted(set(self.state['done'] + [shard.index]))
+            write_json(self.state, self.state_file)
+
+    def run(self, worker, workers, resume = True):
+        # worker(shard) writes shard.tmp_output; returns the shards that were run (not reused)
+        shards = self.prepare(workers, resume)
+        pending = [shard for shard in shards if not self.is_done(shard)]
+
+        def run_shard(shard):
+            if os.path.exists(shard.tmp_output):
+                os.remove(shard.tmp_output)
+            worker(shard)
+            if not os.path.isfile(shard.tmp_output):
+                raise RuntimeError("Shard %s of '%s' didn't write its output" % (shard.index, self.query_file))
+            self.finish(shard)
+
+        if pending:
+            with ThreadPoolExecutor(max_workers = max(1, min(workers, len(pending)))) as executor:
+                # The first error is raised once the other shards finish, they are kept for the next run
+                futures = [executor.submit(run_shard, shard) for shard in pending]
+            for future in futures:
+                future.result()
+
+        self.merge(shards)
+
+        return pending
+
+    def merge(self, shards):
+        tmp_file = '%s.tmp' % self.output_file
+        if shards:
+            pool.concat_files([shard.output for shard in shards], tmp_file)
+        else:
+            open(tmp_file, 'wb').close()
+        os.replace(tmp_file, self.output_file)
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors = True)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import sys
+import math
+import random
+import argparse
+import itertools
+import fastx
+import seqindex
+
+'''
+Single-pass reservoir subsampling of FASTA/FASTQ files.
+
+python3 subsample.py -n 1000 -o subset.fq sample1.merged.fq sample2.merged.fq
+python3 subsample.py -n 1000 -o subset.fq --mode stratified --seed 7 *.merged.fq
+
+Each file is read once and only the chosen records are kept in memory. With
+the proportional mode every read of every file has the same chance of being
+chosen; with the stratified mode each file contributes the same number of
+reads. The records are written in the order they appear in the input files.
+'''
+
+MODE_PROPORTIONAL = 'proportional'
+MODE_STRATIFIED = 'stratified'
+
+def reservoir_sample(records, k, rnd, start = 0):
+    # Algorithm L (Li, 1994): random skips instead of one random number per record
+    reservoir = []
+    if k <= 0:
+        return reservoir
+
+    iterator = iter(records)
+    index = start - 1
+    for record in iterator:
+        index += 1
+        reservoir.append((index, record))
+        if len(reservoir) == k:
+            break
+    else:
+        return reservoir
+
+    w = math.exp(math.log(1.0 - rnd.random()) / k)
+    while True:
+        skip = int(math.log(1.0 - rnd.random()) / math.log(1.0 - w))
+        record = next(itertools.islice(iterator, skip, skip + 1), None)
+        if record is None:
+            break
+        index += skip + 1
+        reservoir[rnd.randrange(k)] = (index, record)
+        w *= math.exp(math.log(1.0 - rnd.random()) / k)
+
+    return reservoir
+
+def subsample_files(files, output_file, sample_size, seed = 1, mode = MODE_PROPORTIONAL, fmt = None):
+    if isinstance(files, str):
+        files = [files]
+
+    rnd = random.Random(seed)
+
+    chosen = []
+    if mode == MODE_STRATIFIED:
+        # Same share for every file, the remainder goes to the first ones
+        share, remainder = divmod(int(sample_size), len(files))
+        for index, file in enumerate(files):
+            k = share + (1 if index < remainder else 0)
+            for position, record in reservoir_sample(fastx.read(file, fmt), k, rnd):
+                chosen.append(((index, position), record))
+    elif mode == MODE_PROPORTIONAL:
+        def records():
+            for index, file in enumerate(files):
+                for record in fastx.read(file, fmt):
+                    yield index, record
+
+        for position, (index, record) in reservoir_sample(records(), int(sample_size), rnd):
+            chosen.append(((index, position), record))
+    else:
+        raise ValueError("Unknown subsampling mode '%s'" % mode)
+
+    chosen.sort(key = lambda item: item[0])
+
+    if fmt is None:
+        fmt = fastx.guess_format(files[0])
+
+    with seqindex.IndexingWriter(output_file, fmt = fmt) as fw:
+        for _, record in chosen:
+            fw.write(record)
+    fw.close()
+
+    return fw.count
+
+def main(args):
+    parser = argparse.ArgumentParser(description = "Single-pass reservoir subsampling of FASTA/FASTQ files")
+    parser.add_argument("-n", "--sample_size", type = int, required = True, help = "Number of records to keep")
+    parser.add_argument("-o", "--output", metavar = "FILE", required = True, help = "Output file")
+    parser.add_argument("-s", "--seed", type = int, default = 1, help = "Seed of the random generator (default: 1)")
+    parser.add_argument("-m", "--mode", choices = [MODE_PROPORTIONAL, MODE_STRATIFIED], default = MODE_PROPORTIONAL, help = "proportional: every read has the same chance | stratified: same number of reads per file (default: proportional)")
+    parser.add_argument("files", metavar = "FILE", nargs = "+", help = "Input FASTA/FASTQ files")
+    args = parser.parse_args(args[1:])
+
+    n = subsample_files(args.files, args.output, args.sample_size, args.seed, args.mode)
+    print('Subsampled %s records into %s' % (n, args.output))
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from files import write_json, read_json, get_checksum
+
+'''
+Programs of the pipeline: the bundles of bin (common.zip, gnulinux.zip and
+win.zip) and the versions of the programs.
+
+python3 tools.py bin         # bundles extracted in a folder of programs
+python3 tools.py versions    # cached versions of the programs
+
+Every bundle is extracted once and recorded in a manifest (bin/bundles.json):
+the checksum of the zip and the size of every file it extracted. A run only
+stats the files: the checksum of a zip is computed again when its size or
+modification time changed, and the bundle is extracted again when the
+checksum is another one (a new release of the pipeline) or one of its files
+is missing or has another size.
+
+The versions (<program> --version) are probed at the same time, one process
+per program, and cached (versions.json in the cache folder of the user) by
+the command and the path, size and modification time of the program, so a
+program is only run again when it was replaced. The programs of the PATH are
+keyed by the file the PATH gives. Failed probes are not cached.
+'''
+
+BUNDLE_MANIFEST = 'bundles.json'
+
+CACHE_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache'), 'amplicon_pipeline')
+VERSIONS = 'versions.json'
+
+def is_extracted(record, path):
+    for name, size in record['files'].items():
+        file = os.path.join(path, name)
+        if not os.path.isfile(file) or os.path.getsize(file) != size:
+            return False
+    return True
+
+def check_bundle(zip_file, path):
+    # Extracts the bundle into path unless the manifest says it's there; True if it was extracted
+    if not os.path.isfile(zip_file):
+        return False
+
+    manifest_file = os.path.join(path, BUNDLE_MANIFEST)
+    manifest = read_json(manifest_file, {})
+    name = os.path.basename(zip_file)
+    stat = os.stat(zip_file)
+
+    record = manifest.get(name)
+    if record is not None and record['size'] == stat.st_size and record['mtime'] == stat.st_mtime_ns:
+        if is_extracted(record, path):
+            return False
+        checksum = record['checksum']
+    else:
+        checksum = get_checksum(zip_file)
+        if record is not None and record['checksum'] == checksum and is_extracted(record, path):
+            # Same zip, another modification time (a new copy of the pipeline)
+            record.update({'size': stat.st_size, 'mtime': stat.st_mtime_ns})
+            write_json(manifest, manifest_file)
+            return False
+
+    import zipfile
+    files = {}
+    with zipfile.ZipFile(zip_file, 'r') as fzip:
+        fzip.extractall(path)
+        for info in fzip.infolist():
+            if not info.is_dir():
+                files[info.filename] = info.file_size
+    fzip.close()
+
+    manifest = read_json(manifest_file, {})
+    manifest[name] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'checksum': checksum, 'files': files}
+    write_json(manifest, manifest_file)
+
+    return True
+
+def get_key(command, files):
+    # Key of a probe: the command and the path, size and modification time of its files (None if one is missing)
+    stats = []
+    for file in files:
+        path = file if file and os.path.isfile(file) else (shutil.which(file) if file else None)
+        if path is None:
+            return None
+        stat = os.stat(path)
+        stats.append([os.path.realpath(path), stat.st_size, stat.st_mtime_ns])
+    return json.dumps([command, stats])
+
+def run_probe(command):
+    p = subprocess.Popen(command, shell = True, stdin = None, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    (stdout, _) = p.communicate()
+    return stdout.decode('utf-8', 'replace').strip()
+
+def probe_versions(probes, cache_path = CACHE_PATH):
+    # probes: {program: (command, files)}; the output of every command, from the cache or run at the same time
+    cache_file = os.path.join(cache_path, VERSIONS) if cache_path else None
+    cache = read_json(cache_file, {}) if cache_file else {}
+
+    outputs = {}
+    pending = {}
+    for program, (command, files) in probes.items():
+        key = get_key(command, files)
+        if key is not None and cache.get(key):
+            outputs[program] = cache[key]
+        else:
+            pending[program] = (command, key)
+
+    if not pending:
+        return outputs
+
+    with ThreadPoolExecutor(max_workers = len(pending)) as executor:
+        futures = dict([(program, executor.submit(run_probe, command)) for program, (command, _) in pending.items()])
+    for program, future in futures.items():
+        outputs[program] = future.result()
+        key = pending[program][1]
+        if key is not None and outputs[program]:
+            cache[key] = outputs[program]
+
+    if cache_file:
+        try:
+            if not os.path.isdir(cache_path):
+                os.makedirs(cache_path)
+            write_json(cache, cache_file)
+        except (IOError, OSError):
+            # A folder that can't be written only means the programs are probed every time
+            pass
+
+    return outputs
+
+def main(args):
+    if len(args) <= 1:
+        message = 'Use:\n  python3 tools.py <folder of the programs (bin)>\n  python3 tools.py versions\n'
+        print(message)
+    elif args[1] == 'versions':
+        cache = read_json(os.path.join(CACHE_PATH, VERSIONS), {})
+        for key, output in sorted(cache.items()):
+            command, stats = json.loads(key)
+            print('%s\n  %s\n  %s' % (command, ', '.join([stat[0] for stat in stats]), output.splitlines()[0] if output else ''))
+    else:
+        path = args[1]
+        manifest = read_json(os.path.join(path, BUNDLE_MANIFEST), {})
+        for name in sorted(manifest):
+            record = manifest[name]
+            print('%s: %s files, checksum %s, %s' % (name, len(record['files']), record['checksum'], 'ok' if is_extracted(record, path) else 'incomplete'))
+
+if __name__ == '__main__':
+    main(sys.argv)